@@ -0,0 +1,99 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains codecs used to compress message payloads"""
+
+import time
+import zlib
+import six
+
+__all__ = ["ZlibCodec", "cpu_time"]
+
+GZIP = "gzip"
+DEFLATE = "deflate"
+
+# Window size arguments that tell zlib to use a zlib header or a gzip header and trailer
+_ZLIB_WBITS = zlib.MAX_WBITS
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+if hasattr(time, "thread_time"):
+    cpu_time = time.thread_time
+elif hasattr(time, "process_time"):
+    cpu_time = time.process_time
+else:
+    cpu_time = time.clock
+
+
+class ZlibCodec(object):
+    """
+    A codec which compresses payloads with zlib, producing either zlib ("deflate") or gzip
+    streams.
+
+    Small payloads compress poorly because the compressor hasn't seen any of their content
+    before.  A preset dictionary (zdict) containing strings which are common in the payloads,
+    such as JSON property names, lets even tiny payloads compress well.  Whoever decompresses
+    the payloads must use the same dictionary.
+
+    :ivar content_encoding: The value to put in the content_encoding of compressed messages, and
+      which identifies incoming messages that this codec can decompress.
+    :type content_encoding: str
+    """
+
+    def __init__(self, level=6, zdict=None, use_gzip=False, content_encoding=None):
+        """
+        Initializer for ZlibCodec objects.
+
+        :param int level: The zlib compression level, from 1 (fastest) to 9 (smallest).
+        :param bytes zdict: Optional preset dictionary.  Only supported with zlib streams, and only
+          on Python 3.3 or later.
+        :param bool use_gzip: If True, produce gzip streams instead of zlib streams.
+        :param str content_encoding: Optional content encoding to use instead of "gzip" or "deflate".
+
+        :raises: ValueError if a preset dictionary is given for gzip streams or on Python 2.
+        """
+        if zdict is not None and use_gzip:
+            raise ValueError("Preset dictionaries can't be used with gzip streams")
+        if zdict is not None and six.PY2:
+            raise ValueError("Preset dictionaries require Python 3.3 or later")
+
+        self.level = level
+        self.zdict = zdict
+        self._wbits = _GZIP_WBITS if use_gzip else _ZLIB_WBITS
+        if content_encoding:
+            self.content_encoding = content_encoding
+        else:
+            self.content_encoding = GZIP if use_gzip else DEFLATE
+
+    def compress(self, data):
+        """
+        Compress a payload.
+
+        :param bytes data: The payload to compress.
+        :returns: The compressed payload.
+        """
+        if self.zdict is None and self._wbits == _ZLIB_WBITS:
+            return zlib.compress(data, self.level)
+        if self.zdict is None:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, self._wbits)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, self._wbits, zdict=self.zdict)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        """
+        Decompress a payload produced by this codec.
+
+        :param bytes data: The compressed payload.
+        :returns: The original payload.
+        :raises: ValueError if the payload is not a valid stream for this codec.
+        """
+        if self.zdict is None:
+            decompressor = zlib.decompressobj(self._wbits)
+        else:
+            decompressor = zlib.decompressobj(self._wbits, zdict=self.zdict)
+        try:
+            return decompressor.decompress(data) + decompressor.flush()
+        except zlib.error as e:
+            raise ValueError("Unable to decompress payload: {}".format(e))
@@ -0,0 +1,215 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains codecs used to encode and decode payloads, and a registry which
+selects a codec based on the content type of a payload"""
+
+import json
+import logging
+import six
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "CodecRegistry",
+    "JsonCodec",
+    "CborCodec",
+    "MsgPackCodec",
+    "RawCodec",
+    "default_registry",
+]
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_CBOR = "application/cbor"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+CONTENT_TYPE_OCTET_STREAM = "application/octet-stream"
+
+
+class JsonCodec(object):
+    """
+    A codec for JSON payloads.  If orjson is installed, it is used to encode and decode
+    payloads, and the json module is used for values that orjson doesn't support (such as
+    dicts with keys that aren't strings).  Payloads are always encoded to utf-8 bytes, whichever
+    module encodes them.
+
+    :ivar backend: The name of the module used to encode and decode payloads.
+    :type backend: str
+    """
+
+    def __init__(self, use_fast_backend=True):
+        """
+        Initializer for JsonCodec objects.
+
+        :param bool use_fast_backend: If False, always use the json module.
+        """
+        self._orjson = orjson if use_fast_backend else None
+        self.backend = "orjson" if self._orjson else "json"
+
+    def encode(self, value):
+        if self._orjson:
+            try:
+                return self._orjson.dumps(value)
+            except TypeError:
+                pass
+        return json.dumps(value).encode("utf-8")
+
+    def decode(self, data):
+        if self._orjson:
+            return self._orjson.loads(data)
+        if isinstance(data, six.binary_type) and not six.PY2:
+            data = data.decode("utf-8")
+        return json.loads(data)
+
+
+class CborCodec(object):
+    """
+    A codec for CBOR payloads.  Requires the cbor2 package.
+    """
+
+    def __init__(self):
+        """
+        Initializer for CborCodec objects.
+
+        :raises: ImportError if cbor2 is not installed.
+        """
+        if cbor2 is None:
+            raise ImportError("The cbor2 package is required to encode CBOR payloads")
+
+    def encode(self, value):
+        return cbor2.dumps(value)
+
+    def decode(self, data):
+        return cbor2.loads(data)
+
+
+class MsgPackCodec(object):
+    """
+    A codec for MessagePack payloads.  Requires the msgpack package.
+    """
+
+    def __init__(self):
+        """
+        Initializer for MsgPackCodec objects.
+
+        :raises: ImportError if msgpack is not installed.
+        """
+        if msgpack is None:
+            raise ImportError("The msgpack package is required to encode MessagePack payloads")
+
+    def encode(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class RawCodec(object):
+    """
+    A codec for payloads which are already bytes.  Text is encoded as utf-8.
+    """
+
+    def encode(self, value):
+        if isinstance(value, six.text_type):
+            return value.encode("utf-8")
+        if isinstance(value, (six.binary_type, bytearray)):
+            return bytes(value)
+        raise TypeError("Raw payloads must be bytes or text, not {}".format(type(value).__name__))
+
+    def decode(self, data):
+        return data
+
+
+class CodecRegistry(object):
+    """
+    A collection of codecs, keyed by the content type of the payloads they handle.  Content
+    types are matched without case and without parameters, so "Application/JSON; charset=utf-8"
+    uses the codec registered for "application/json".
+    """
+
+    def __init__(self):
+        self._codecs = {}
+
+    def register(self, content_type, codec):
+        """
+        Register the codec for a content type, replacing any codec already registered for it.
+
+        :param str content_type: The content type, such as "application/json".
+        :param codec: An object with encode(value) and decode(data) functions.
+        """
+        self._codecs[_normalize(content_type)] = codec
+
+    def get(self, content_type):
+        """
+        Return the codec registered for a content type.
+
+        :raises: ValueError if no codec is registered for the content type.
+        """
+        try:
+            return self._codecs[_normalize(content_type)]
+        except KeyError:
+            raise ValueError("No codec is registered for content type {}".format(content_type))
+
+    def encode(self, content_type, value):
+        """
+        Encode a value with the codec registered for the content type.
+        """
+        return self.get(content_type).encode(value)
+
+    def decode(self, content_type, data):
+        """
+        Decode a payload with the codec registered for the content type.
+        """
+        return self.get(content_type).decode(data)
+
+    def encode_message_data(self, message):
+        """
+        Return the payload to send for a Message, and its content type.  Text and bytes are
+        sent as they are.  Any other value is encoded with the codec for the message's
+        content_type, or as JSON if the message doesn't have a content_type.
+
+        :returns: A tuple of (payload, content_type).
+        """
+        data = message.data
+        if isinstance(data, (six.text_type, six.binary_type)):
+            return (data, message.content_type)
+        content_type = message.content_type or CONTENT_TYPE_JSON
+        return (self.encode(content_type, data), content_type)
+
+
+def _normalize(content_type):
+    return content_type.split(";", 1)[0].strip().lower()
+
+
+def _create_default_registry():
+    registry = CodecRegistry()
+    registry.register(CONTENT_TYPE_JSON, JsonCodec())
+    registry.register(CONTENT_TYPE_OCTET_STREAM, RawCodec())
+    if cbor2 is not None:
+        registry.register(CONTENT_TYPE_CBOR, CborCodec())
+    if msgpack is not None:
+        msgpack_codec = MsgPackCodec()
+        registry.register(CONTENT_TYPE_MSGPACK, msgpack_codec)
+        registry.register("application/x-msgpack", msgpack_codec)
+    return registry
+
+
+# The registry used by the pipeline unless it is given a different one.  Applications can
+# register codecs for other content types here.
+default_registry = _create_default_registry()
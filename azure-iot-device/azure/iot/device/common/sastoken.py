@@ -11,7 +11,7 @@ import hashlib
 import time
 import six.moves.urllib as urllib
 
-__all__ = ["SasToken", "SasTokenError"]
+__all__ = ["SasToken", "SasTokenError", "SigningEngine"]
 
 
 class SasTokenError(Exception):
@@ -27,6 +27,80 @@ class SasTokenError(Exception):
         self.cause = cause
 
 
+class SigningEngine(object):
+    """Signs the strings in Shared Access Signature Tokens with one Shared Access Key
+
+    The key is decoded and an HMAC-SHA256 is keyed with it once, when the engine is created.
+    Each signature then only copies that keyed HMAC, so an identity that renews its tokens
+    regularly (or a host with many identities, each with its own engine) doesn't pay for
+    decoding the key and keying the HMAC on every token.
+
+    Parameters:
+    key (str): Shared Access Key (base64 encoded)
+
+    Data Attributes:
+    key (str): Shared Access Key (base64 encoded)
+
+    Raises:
+    SasTokenError if the key is not valid base64
+    """
+
+    _encoding_type = "utf-8"
+
+    def __init__(self, key):
+        self.key = key
+        try:
+            signing_key = base64.b64decode(key.encode(self._encoding_type))
+        except (TypeError, base64.binascii.Error) as e:
+            raise SasTokenError("Unable to build SasToken from given values", e)
+        self._keyed_hmac = hmac.HMAC(signing_key, digestmod=hashlib.sha256)
+
+    def sign(self, quoted_uri, expiry):
+        """Sign a resource URI and expiry time
+
+        Parameters:
+        quoted_uri (str): URI of the resource, already URI-encoded
+        expiry (int): Time that the token will expire (in UTC, since epoch)
+
+        Returns:
+        The signature (URI-encoded), for the sig field of a token
+        """
+        return urllib.parse.quote(self.sign_string(quoted_uri + "\n" + str(expiry)))
+
+    def sign_string(self, string):
+        """Sign any string with the key
+
+        Parameters:
+        string (str): The string to sign
+
+        Returns:
+        The HMAC-SHA256 of the string (base64 encoded, but not URI-encoded)
+        """
+        signed_hmac = self._keyed_hmac.copy()
+        signed_hmac.update(string.encode(self._encoding_type))
+        return base64.b64encode(signed_hmac.digest()).decode(self._encoding_type)
+
+    def sign_many(self, pairs):
+        """Sign many resource URIs and expiry times
+
+        Parameters:
+        pairs: Iterable of (quoted_uri, expiry) tuples, as taken by sign
+
+        Returns:
+        List of signatures, in the same order as pairs
+        """
+        copy_hmac = self._keyed_hmac.copy
+        b64encode = base64.b64encode
+        quote = urllib.parse.quote
+        encoding = self._encoding_type
+        signatures = []
+        for (quoted_uri, expiry) in pairs:
+            signed_hmac = copy_hmac()
+            signed_hmac.update((quoted_uri + "\n" + str(expiry)).encode(encoding))
+            signatures.append(quote(b64encode(signed_hmac.digest())))
+        return signatures
+
+
 class SasToken(object):
     """Shared Access Signature Token used to authenticate a request
 
@@ -52,6 +126,7 @@ class SasToken(object):
         self._uri = urllib.parse.quote_plus(uri)
         self._key = key
         self._key_name = key_name
+        self._signing_engine = SigningEngine(key)
         self.ttl = ttl
         self.refresh()
 
@@ -71,13 +146,7 @@ class SasToken(object):
         Returns:
         String representation of the token
         """
-        try:
-            message = (self._uri + "\n" + str(self.expiry_time)).encode(self._encoding_type)
-            signing_key = base64.b64decode(self._key.encode(self._encoding_type))
-            signed_hmac = hmac.HMAC(signing_key, message, hashlib.sha256)
-            signature = urllib.parse.quote(base64.b64encode(signed_hmac.digest()))
-        except (TypeError, base64.binascii.Error) as e:
-            raise SasTokenError("Unable to build SasToken from given values", e)
+        signature = self._signing_engine.sign(self._uri, self.expiry_time)
         if self._key_name:
             token = self._service_token_format.format(
                 self._uri, signature, str(self.expiry_time), self._key_name
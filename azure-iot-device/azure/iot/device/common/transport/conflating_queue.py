@@ -0,0 +1,116 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a queue in which newer operations replace older ones with the same key"""
+
+import collections
+import heapq
+import itertools
+import threading
+from six.moves import queue
+
+
+class ConflatingQueue(object):
+    """
+    A first-in, first-out queue of PipelineOperation objects, for stages that hold operations
+    while the transport is unavailable.  It has the same put_nowait, get_nowait, empty and qsize
+    functions as queue.Queue.
+
+    Each operation is given a conflation key by key_function.  When an operation is added
+    while an operation with the same key is still queued, the older one is removed and the
+    newer one goes to the back of the queue ("latest value wins").  Both take O(1) time, so
+    the number of keyed operations in the queue is bounded by the number of distinct keys
+    rather than by how long the transport has been unavailable.  Operations whose key is None
+    are never replaced.
+
+    If expiry_function is given, the queue also keeps a heap of queued operations ordered by
+    the time they expire, so pop_expired can remove every expired operation without looking at
+    the ones that haven't expired.
+    """
+
+    def __init__(self, key_function=None, expiry_function=None):
+        """
+        Initializer for ConflatingQueue objects.
+
+        :param Function key_function: Function which takes an operation and returns its
+          conflation key (any hashable value), or None if the operation shouldn't be replaced.
+          If not given, operations are never replaced.
+        :param Function expiry_function: Function which takes an operation and returns the time
+          (in seconds since the epoch) at which it expires, or None if it doesn't expire.
+        """
+        self.key_function = key_function
+        self.expiry_function = expiry_function
+        self._ops = collections.OrderedDict()
+        self._unkeyed = itertools.count()
+        # Heap of (expiry, sequence, queue key, op).  Entries for ops that have already left
+        # the queue are skipped when they reach the top.
+        self._expiry_heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def put_nowait(self, op):
+        """
+        Add an operation to the back of the queue.
+
+        :returns: The queued operation that op replaced, or None.  The caller is responsible for
+          completing it.
+        """
+        key = self.key_function(op) if self.key_function else None
+        expiry = self.expiry_function(op) if self.expiry_function else None
+        with self._lock:
+            if key is None:
+                queue_key = (False, next(self._unkeyed))
+                superseded = None
+            else:
+                queue_key = (True, key)
+                superseded = self._ops.pop(queue_key, None)
+            self._ops[queue_key] = op
+            if expiry is not None:
+                heapq.heappush(self._expiry_heap, (expiry, next(self._sequence), queue_key, op))
+                if len(self._expiry_heap) > 2 * len(self._ops) + 16:
+                    self._compact_heap()
+            return superseded
+
+    def get_nowait(self):
+        """
+        Remove and return the operation at the front of the queue.
+
+        :raises: queue.Empty if the queue is empty.
+        """
+        with self._lock:
+            if not self._ops:
+                raise queue.Empty
+            return self._ops.popitem(last=False)[1]
+
+    def pop_expired(self, now):
+        """
+        Remove and return every queued operation that expires at or before now, in the order
+        they expire.
+        """
+        expired = []
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                (_, _, queue_key, op) = heapq.heappop(heap)
+                if self._ops.get(queue_key) is op:
+                    del self._ops[queue_key]
+                    expired.append(op)
+        return expired
+
+    def _compact_heap(self):
+        """
+        Drop heap entries for operations that have left the queue.  Must be called with the
+        lock held.
+        """
+        self._expiry_heap = [
+            entry for entry in self._expiry_heap if self._ops.get(entry[2]) is entry[3]
+        ]
+        heapq.heapify(self._expiry_heap)
+
+    def empty(self):
+        return not self._ops
+
+    def qsize(self):
+        return len(self._ops)
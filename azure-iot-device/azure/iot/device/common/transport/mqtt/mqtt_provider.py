@@ -8,10 +8,26 @@ import paho.mqtt.client as mqtt
 import logging
 import ssl
 import traceback
+from .operation_tracker import OperationTracker
 
 logger = logging.getLogger(__name__)
 
 
+class PublishError(Exception):
+    """
+    Raised when paho refuses a publish that it will not send later, such as a QoS 0 publish made
+    while there is no connection.
+
+    :ivar int rc: The paho result code.
+    """
+
+    def __init__(self, rc):
+        super(PublishError, self).__init__(
+            "Publish failed with result code {}: {}".format(rc, mqtt.error_string(rc))
+        )
+        self.rc = rc
+
+
 class MQTTProvider(object):
     """
     A wrapper class that provides an implementation-agnostic MQTT message broker interface.
@@ -42,15 +58,14 @@ class MQTTProvider(object):
         self.on_mqtt_disconnected = None
         self.on_mqtt_message_received = None
 
-        # Maps mid->callback for operations where a control packet has been sent
-        # but the reponse has not yet been received
-        self._pending_operation_callbacks = {}
+        # Callback for the connection started by reconnect.  Only touched while paho's network
+        # thread is stopped, or from that thread.
+        self._reconnect_callback = None
 
-        # Maps mid->mid for responses received that are in the _pending_operation_callbacks dict.
-        # Necessary because sometimes an operation will complete with a response before the
-        # Paho call returns.
-        # TODO: make this map mid to something more useful (result code?)
-        self._unknown_operation_responses = {}
+        # Tracks callbacks for operations where a control packet has been sent but the
+        # response has not yet been received.  Also remembers responses that arrive before
+        # the Paho call that sent the request returns.
+        self._operation_tracker = OperationTracker()
 
         self._create_mqtt_client()
 
@@ -77,6 +92,15 @@ class MQTTProvider(object):
             else:
                 logger.info("No event handler callback set for on_mqtt_connected")
 
+            callback = self._reconnect_callback
+            self._reconnect_callback = None
+            if callback:
+                try:
+                    callback()
+                except:  # noqa: E722 do not use bare 'except'
+                    logger.error("Unexpected error calling reconnect callback")
+                    logger.error(traceback.format_exc())
+
         def on_disconnect(client, userdata, rc):
             logger.info("disconnected with result code: {}".format(rc))
             # MUST do LBYL here to avoid confusion with errors thrown in calling callback
@@ -152,17 +176,32 @@ class MQTTProvider(object):
         self._mqtt_client.connect(host=self._hostname, port=8883)
         self._mqtt_client.loop_start()
 
-    def reconnect(self, password):
+    def reconnect(self, password, callback=None):
         """
         Reconnect to the MQTT broker, using username set at instantiation.
 
         Connect should have previously been called in order to use this function.
 
+        paho's network thread reconnects on its own after an unexpected disconnection.  So that
+        it can't start a connection while this one is in progress, the thread is stopped before
+        reconnecting, and is only started again once this reconnect has been sent.  If the
+        reconnect fails, the thread stays stopped and it is up to the caller to try again.
+
         :param str password: The password for reconnecting with the MQTT broker.
+        :param callback: A callback to be triggered once this connection is established
+          (Optional).  A connection that paho started on its own before this call doesn't
+          trigger it.
         """
         logger.info("reconnecting transport")
+        self._mqtt_client.loop_stop()
+        self._reconnect_callback = callback
         self._mqtt_client.username_pw_set(username=self._username, password=password)
-        self._mqtt_client.reconnect()
+        try:
+            self._mqtt_client.reconnect()
+        except:  # noqa: E722 do not use bare 'except'
+            self._reconnect_callback = None
+            raise
+        self._mqtt_client.loop_start()
 
     def disconnect(self):
         """
@@ -180,13 +219,14 @@ class MQTTProvider(object):
         :param int qos: the desired quality of service level for the subscription. Defaults to 1.
         :param callback: A callback to be triggered upon completion (Optional).
 
-        :return: message ID for the subscribe request
+        :return: A (mid, generation) tuple identifying the subscribe request (see
+          discard_operation)
         :raises: ValueError if qos is not 0, 1 or 2
         :raises: ValueError if topic is None or has zero string length
         """
         logger.info("subscribing to {} with qos {}".format(topic, qos))
         (result, mid) = self._mqtt_client.subscribe(topic, qos=qos)
-        self._set_operation_callback(mid, callback)
+        return (mid, self._set_operation_callback(mid, callback))
 
     def unsubscribe(self, topic, callback=None):
         """
@@ -195,11 +235,13 @@ class MQTTProvider(object):
         :param str topic: a single string which is the subscription topic to unsubscribe from.
         :param callback: A callback to be triggered upon completion (Optional).
 
+        :return: A (mid, generation) tuple identifying the unsubscribe request (see
+          discard_operation)
         :raises: ValueError if topic is None or has zero string length
         """
         logger.info("unsubscribing from {}".format(topic))
         (result, mid) = self._mqtt_client.unsubscribe(topic)
-        self._set_operation_callback(mid, callback)
+        return (mid, self._set_operation_callback(mid, callback))
 
     def publish(self, topic, payload, qos=1, callback=None):
         """
@@ -208,22 +250,58 @@ class MQTTProvider(object):
         :param str topic: topic: The topic that the message should be published on.
         :param str payload: The actual message to send.
         :param int qos: the desired quality of service level for the subscription. Defaults to 1.
+          A QoS 0 publish is never acknowledged by the broker.  Its callback is triggered when
+          paho reports that the message has been written to the network.
         :param callback: A callback to be triggered upon completion (Optional).
 
+        :return: A (mid, generation) tuple identifying the publish request (see
+          discard_operation)
         :raises: ValueError if qos is not 0, 1 or 2
         :raises: ValueError if topic is None or has zero string length
         :raises: ValueError if topic contains a wildcard ("+")
         :raises: ValueError if the length of the payload is greater than 268435455 bytes
+        :raises: PublishError if paho refused a QoS 0 publish.  (paho queues QoS 1 and 2
+          publishes that it can't send yet, but drops QoS 0 ones, so they never complete.)
         """
         logger.info("sending")
         message_info = self._mqtt_client.publish(topic=topic, payload=payload, qos=qos)
-        self._set_operation_callback(message_info.mid, callback)
+        if qos == 0 and message_info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise PublishError(message_info.rc)
+        if qos == 0 and not callback:
+            # Nobody is waiting on this publish, so there is no callback to keep
+            generation = self._operation_tracker.ignore_response(message_info.mid)
+        else:
+            generation = self._set_operation_callback(message_info.mid, callback)
+        return (message_info.mid, generation)
+
+    def discard_operation(self, mid, generation=None):
+        """
+        Forget the callback for an operation whose response is no longer wanted, such as an
+        operation that has timed out.  The callback is not called.
+
+        :param int mid: The message ID returned when the operation was started.
+        :param int generation: The generation returned when the operation was started.  If
+          given, nothing is discarded if another operation has been started on the same message
+          ID since.
+        :return: True if a callback was waiting on that message ID
+        """
+        if self._operation_tracker.evict(mid, generation):
+            logger.info("Discarded pending callback for MID: {}".format(mid))
+            return True
+        return False
+
+    def get_operation_stats(self):
+        """
+        Return a dict of counters describing the operations that have been sent, such as the
+        number still waiting on a response and the number of responses that matched no operation.
+        """
+        return self._operation_tracker.get_stats()
 
     def _set_operation_callback(self, mid, callback):
-        if mid in self._unknown_operation_responses:
+        (generation, completed) = self._operation_tracker.register(mid, callback)
+        if completed:
             # If response already came back, trigger the callback
             logger.info("Response for MID: {} was received early - triggering callback".format(mid))
-            del self._unknown_operation_responses[mid]
             # MUST do LBYL here to avoid confusion with errors thrown in calling callback
             if callback:
                 try:
@@ -234,18 +312,17 @@ class MQTTProvider(object):
             else:
                 logger.info("No callback for MID: {}".format(mid))
         else:
-            # Otherwise, set the callback to use later
+            # Otherwise, the tracker holds on to the callback to use later
             logger.info("Waiting for response on MID: {}".format(mid))
-            self._pending_operation_callbacks[mid] = callback
+        return generation
 
     def _resolve_pending_callback(self, mid):
-        if mid in self._pending_operation_callbacks:
+        (found, callback) = self._operation_tracker.resolve(mid)
+        if found:
             # If mid is known, trigger it's associated callback
             logger.info(
                 "Response received for recognized MID: {} - triggering callback".format(mid)
             )
-            callback = self._pending_operation_callbacks[mid]
-            del self._pending_operation_callbacks[mid]
             # MUST do LBYL here to avoid confusion with errors thrown in calling callback
             if callback:
                 try:
@@ -255,7 +332,4 @@ class MQTTProvider(object):
                     logger.error(traceback.format_exc())
             else:
                 logger.info("No callback set for MID: {}".format(mid))
-        else:
-            # Otherwise, store the mid as an unknown response
-            logger.warning("Response received for unknown MID: {}".format(mid))
-            self._unknown_operation_responses[mid] = mid  # TODO: set something more useful here
+        # Otherwise, the tracker has stored the mid as an early or orphaned response
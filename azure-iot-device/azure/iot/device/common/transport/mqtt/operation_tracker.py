@@ -0,0 +1,280 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a tracker for MQTT operations that are waiting on a response"""
+
+import array
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# MQTT message IDs are 16 bit, and paho never hands out 0
+MID_CAPACITY = 65536
+
+EMPTY = 0
+# A request has been sent for this MID and we are waiting for the response
+PENDING = 1
+# A response arrived before the request was registered (paho can call back before the call
+# that sent the request has returned)
+EARLY = 2
+# The request was discarded (for example, it timed out).  A response may still show up.
+EVICTED = 3
+# A request that nobody waits on (such as a QoS 0 publish) was sent for this MID.  paho may still
+# report it, and that report is dropped.
+UNTRACKED = 4
+
+
+class OperationTracker(object):
+    """
+    Tracks callbacks for MQTT operations that have been sent but not acknowledged.
+
+    State is kept in fixed-size arrays indexed by MID, so memory use doesn't grow no matter how
+    long the connection has been up or how many responses go unmatched.  Each slot has a
+    generation counter which is bumped every time a request is sent on the slot, so that a
+    caller holding on to an old (mid, generation) pair can't evict a newer operation that
+    happens to reuse the same MID.
+
+    Responses that arrive before their operation is registered, and responses for operations
+    that were evicted or untracked, are only kept for max_response_age seconds.  After that they
+    are counted as orphaned and forgotten, so that a stale response can't complete an unrelated
+    operation once paho wraps around and reuses the MID.  The MIDs waiting to be forgotten are
+    kept in the order they became unmatched, so forgetting them only looks at those MIDs.
+
+    All methods are safe to call from both the network thread and caller threads.  Callbacks
+    are never called by the tracker; they are returned to the caller so that they can be
+    called without holding the lock.
+    """
+
+    def __init__(self, max_response_age=30, clock=time.time):
+        """
+        Initializer for OperationTracker objects.
+
+        :param float max_response_age: Number of seconds to keep an unmatched response before
+          it is considered orphaned.
+        :param Function clock: Function returning the current time in seconds.
+        """
+        self.max_response_age = max_response_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._states = array.array("B", [EMPTY]) * MID_CAPACITY
+        self._generations = array.array("L", [0]) * MID_CAPACITY
+        self._timestamps = array.array("d", [0.0]) * MID_CAPACITY
+        self._callbacks = [None] * MID_CAPACITY
+
+        self._outstanding = 0
+        self._unmatched = 0
+        # (timestamp, mid) for every MID that became unmatched, oldest first.  Entries whose MID
+        # has since been matched or reused are skipped when they come up.
+        self._unmatched_queue = collections.deque()
+
+        self.completed_count = 0
+        self.early_response_count = 0
+        self.evicted_count = 0
+        self.orphaned_response_count = 0
+        self.replaced_count = 0
+        self.untracked_count = 0
+
+    def register(self, mid, callback):
+        """
+        Register the callback for an operation that has just been sent.
+
+        :param int mid: The message ID of the operation.
+        :param Function callback: The callback to return when the response arrives.
+
+        :returns: A tuple of (generation, completed).  If completed is True, the response had
+          already arrived and the caller should call the callback itself.
+        """
+        _check_mid(mid)
+        with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            state = self._states[mid]
+            self._generations[mid] = (self._generations[mid] + 1) & 0xFFFFFFFF
+            generation = self._generations[mid]
+
+            if state == EARLY:
+                self._unmatched -= 1
+                if now - self._timestamps[mid] <= self.max_response_age:
+                    logger.info("Response for MID: {} was received early".format(mid))
+                    self._states[mid] = EMPTY
+                    self.completed_count += 1
+                    return generation, True
+                logger.warning("Discarding stale response for MID: {}".format(mid))
+                self.orphaned_response_count += 1
+            elif state == EVICTED or state == UNTRACKED:
+                self._unmatched -= 1
+            elif state == PENDING:
+                logger.warning("MID: {} reused while still pending.  Replacing.".format(mid))
+                self.replaced_count += 1
+                self._outstanding -= 1
+
+            self._states[mid] = PENDING
+            self._callbacks[mid] = callback
+            self._timestamps[mid] = now
+            self._outstanding += 1
+            return generation, False
+
+    def resolve(self, mid):
+        """
+        Match a response from the service to its operation.
+
+        :param int mid: The message ID of the response.
+
+        :returns: A tuple of (found, callback).  found is True if an operation was waiting on
+          this response, in which case the operation is no longer tracked and the caller should
+          call the callback (which may be None).
+        """
+        _check_mid(mid)
+        with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            state = self._states[mid]
+
+            if state == PENDING:
+                callback = self._callbacks[mid]
+                self._callbacks[mid] = None
+                self._states[mid] = EMPTY
+                self._outstanding -= 1
+                self.completed_count += 1
+                return True, callback
+            elif state == UNTRACKED:
+                self._states[mid] = EMPTY
+                self._unmatched -= 1
+            elif state == EVICTED:
+                logger.info("Response received for discarded MID: {}".format(mid))
+                self._states[mid] = EMPTY
+                self._unmatched -= 1
+                self.orphaned_response_count += 1
+            elif state == EARLY:
+                logger.warning("Duplicate response received for unknown MID: {}".format(mid))
+                self.orphaned_response_count += 1
+                self._mark_unmatched(mid, EARLY, now)
+            else:
+                logger.info("Response received for unknown MID: {}".format(mid))
+                self._mark_unmatched(mid, EARLY, now)
+                self._unmatched += 1
+                self.early_response_count += 1
+            return False, None
+
+    def ignore_response(self, mid):
+        """
+        Record that a request nobody waits on (such as a QoS 0 publish) was sent on this MID,
+        so that a response reported for it is dropped quietly instead of being treated as an
+        early response.  Nothing is stored apart from the state of the MID.
+
+        :param int mid: The message ID of the request.
+
+        :returns: The generation of the request (see evict).
+        """
+        _check_mid(mid)
+        with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            state = self._states[mid]
+            self._generations[mid] = (self._generations[mid] + 1) & 0xFFFFFFFF
+            generation = self._generations[mid]
+            self.untracked_count += 1
+
+            if state == EARLY:
+                # paho reported the request before this call, so there is nothing left to drop
+                self._states[mid] = EMPTY
+                self._unmatched -= 1
+                return generation
+            elif state == PENDING:
+                logger.warning("MID: {} reused while still pending.  Replacing.".format(mid))
+                self.replaced_count += 1
+                self._callbacks[mid] = None
+                self._outstanding -= 1
+                self._unmatched += 1
+            elif state == EMPTY:
+                self._unmatched += 1
+
+            self._mark_unmatched(mid, UNTRACKED, now)
+            return generation
+
+    def evict(self, mid, generation=None):
+        """
+        Stop tracking an operation whose response is no longer wanted.  Its callback will
+        never be returned.
+
+        :param int mid: The message ID of the operation.
+        :param int generation: The generation returned by register.  If given, the operation
+          is only evicted if no other request has been sent on the MID since.
+
+        :returns: True if the operation was pending and has been evicted.
+        """
+        _check_mid(mid)
+        with self._lock:
+            if self._states[mid] != PENDING:
+                return False
+            if generation is not None and generation != self._generations[mid]:
+                return False
+            self._mark_unmatched(mid, EVICTED, self._clock())
+            self._callbacks[mid] = None
+            self._outstanding -= 1
+            self._unmatched += 1
+            self.evicted_count += 1
+            return True
+
+    def get_state(self, mid):
+        """
+        Return the state (EMPTY, PENDING, EARLY, EVICTED or UNTRACKED) of the given MID.
+        """
+        _check_mid(mid)
+        return self._states[mid]
+
+    def get_stats(self):
+        """
+        Return a dict of counters describing the operations in this tracker.
+        """
+        with self._lock:
+            self._sweep(self._clock())
+            return {
+                "outstanding": self._outstanding,
+                "unmatched": self._unmatched,
+                "completed": self.completed_count,
+                "early_responses": self.early_response_count,
+                "evicted": self.evicted_count,
+                "orphaned_responses": self.orphaned_response_count,
+                "replaced": self.replaced_count,
+                "untracked": self.untracked_count,
+            }
+
+    def _mark_unmatched(self, mid, state, now):
+        # Must be called with the lock held
+        self._states[mid] = state
+        self._timestamps[mid] = now
+        self._unmatched_queue.append((now, mid))
+
+    def _sweep(self, now):
+        # Forget the unmatched MIDs that are older than max_response_age.  Must be called with
+        # the lock held.
+        queue = self._unmatched_queue
+        cutoff = now - self.max_response_age
+        states = self._states
+        timestamps = self._timestamps
+        while queue and queue[0][0] < cutoff:
+            (timestamp, mid) = queue.popleft()
+            if timestamps[mid] != timestamp:
+                # The MID was reused (or its early response repeated) after this entry was added
+                continue
+            state = states[mid]
+            if state == EARLY:
+                # The operation for this response never showed up
+                states[mid] = EMPTY
+                self._unmatched -= 1
+                self.orphaned_response_count += 1
+            elif state == EVICTED or state == UNTRACKED:
+                # The response for this discarded or untracked operation never showed up
+                states[mid] = EMPTY
+                self._unmatched -= 1
+
+
+def _check_mid(mid):
+    if not 0 <= mid < MID_CAPACITY:
+        raise ValueError("MID {} is out of range".format(mid))
@@ -11,6 +11,8 @@ class IncomingMessage(PipelineEvent):
     A PipelineEvent object which represents an incoming Mqtt message on some Mqtt topic
     """
 
+    __slots__ = ("topic", "payload")
+
     def __init__(self, topic, payload):
         """
         Initializer for IncomingMessage objects.
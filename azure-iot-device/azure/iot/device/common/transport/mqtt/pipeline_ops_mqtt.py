@@ -13,6 +13,8 @@ class SetConnectionArgs(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
+    __slots__ = ("client_id", "hostname", "username", "ca_cert")
+
     def __init__(self, client_id, hostname, username, ca_cert=None, callback=None):
         """
         Initializer for SetConnectionArgs objects.
@@ -42,7 +44,9 @@ class Publish(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
-    def __init__(self, topic, payload, callback=None):
+    __slots__ = ("topic", "payload", "qos")
+
+    def __init__(self, topic, payload, callback=None, qos=1):
         """
         Initializer for Publish objects.
 
@@ -51,10 +55,13 @@ class Publish(PipelineOperation):
         :param Function callback: The function that gets called when this operation is complete or has failed.
           The callback function must accept A PipelineOperation object which indicates the specific operation which
           has completed or failed.
+        :param int qos: The MQTT quality of service level to publish with.  A QoS 0 publish completes once the MQTT
+          client has written it to the network, without waiting for an acknowledgement.
         """
         super(Publish, self).__init__(callback=callback)
         self.topic = topic
         self.payload = payload
+        self.qos = qos
 
 
 class Subscribe(PipelineOperation):
@@ -64,6 +71,8 @@ class Subscribe(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
+    __slots__ = ("topic",)
+
     def __init__(self, topic, callback=None):
         """
         Initializer for Subscribe objects.
@@ -84,6 +93,8 @@ class Unsubscribe(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
+    __slots__ = ("topic",)
+
     def __init__(self, topic, callback=None):
         """
         Initializer for Unsubscribe objects.
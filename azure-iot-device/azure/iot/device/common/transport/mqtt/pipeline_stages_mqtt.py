@@ -60,6 +60,18 @@ class Provider(PipelineStage):
             self.provider.on_mqtt_connected = on_connected
             self.provider.connect(self.sas_token)
 
+        elif isinstance(op, pipeline_ops_base.Reconnect):
+            logger.info("{}({}): reconnecting".format(self.name, op.name))
+
+            # The provider reports the connection to self.on_connected like any other, and
+            # only calls this for the connection that this reconnect started (and not, say,
+            # for one that the protocol library started on its own).
+            def on_reconnected():
+                logger.info("{}({}): on_connected.  completing op.".format(self.name, op.name))
+                self.complete_op(op)
+
+            self.provider.reconnect(self.sas_token, callback=on_reconnected)
+
         elif isinstance(op, pipeline_ops_base.Disconnect):
             logger.info("{}({}): disconneting".format(self.name, op.name))
 
@@ -74,34 +86,86 @@ class Provider(PipelineStage):
 
         elif isinstance(op, pipeline_ops_mqtt.Publish):
             logger.info("{}({}): publishing on {}".format(self.name, op.name, op.topic))
+            # The op may already have been completed and released to the pool by the time
+            # the provider call returns, so anything needed afterwards is read now.
+            (name, deadline) = (op.name, op.deadline)
+            eviction = []
 
             def on_published():
                 logger.info("{}({}): PUBACK received. completing op.".format(self.name, op.name))
+                self._cancel_eviction(eviction)
                 self.complete_op(op)
 
-            self.provider.publish(topic=op.topic, payload=op.payload, callback=on_published)
+            operation = self.provider.publish(
+                topic=op.topic, payload=op.payload, qos=op.qos, callback=on_published
+            )
+            self._schedule_eviction(name, deadline, operation, eviction)
 
         elif isinstance(op, pipeline_ops_mqtt.Subscribe):
             logger.info("{}({}): subscribing to {}".format(self.name, op.name, op.topic))
+            (name, deadline) = (op.name, op.deadline)
+            eviction = []
 
             def on_subscribed():
                 logger.info("{}({}): SUBACK received. completing op.".format(self.name, op.name))
+                self._cancel_eviction(eviction)
                 self.complete_op(op)
 
-            self.provider.subscribe(topic=op.topic, callback=on_subscribed)
+            operation = self.provider.subscribe(topic=op.topic, callback=on_subscribed)
+            self._schedule_eviction(name, deadline, operation, eviction)
 
         elif isinstance(op, pipeline_ops_mqtt.Unsubscribe):
             logger.info("{}({}): unsubscribing from {}".format(self.name, op.name, op.topic))
+            (name, deadline) = (op.name, op.deadline)
+            eviction = []
 
             def on_unsubscribed():
                 logger.info("{}({}): UNSUBACK received.  completing op.".format(self.name, op.name))
+                self._cancel_eviction(eviction)
                 self.complete_op(op)
 
-            self.provider.unsubscribe(topic=op.topic, callback=on_unsubscribed)
+            operation = self.provider.unsubscribe(topic=op.topic, callback=on_unsubscribed)
+            self._schedule_eviction(name, deadline, operation, eviction)
 
         else:
             self.continue_op(op)
 
+    def _schedule_eviction(self, name, deadline, operation, eviction):
+        """
+        If the op has a deadline, arrange for the provider to forget the op's callback at that
+        deadline so that responses which never arrive don't leave entries behind.  name and
+        deadline are the op's, read before the provider call, since the op itself may have been
+        completed and reused by the time this is called.  operation is the (mid, generation)
+        tuple returned by the provider, so that an eviction that fires after the MID has been
+        reused can't discard the newer operation.  The timer is stored in the eviction list so
+        that the completion callback can cancel it.  (The list may still be empty when the
+        completion runs if the response arrived before the provider call returned, in which case
+        there is nothing to evict anyway.)
+        """
+        if deadline is None:
+            return
+        (mid, generation) = operation
+
+        def evict():
+            logger.info("{}({}): deadline expired.  discarding MID {}".format(self.name, name, mid))
+            self.provider.discard_operation(mid, generation)
+
+        if not eviction:
+            eviction.append(self.pipeline_root.timer_wheel.schedule(deadline, evict))
+
+    def _cancel_eviction(self, eviction):
+        # Marking the list stops _schedule_eviction from arming a timer for an op that is
+        # already complete.
+        if eviction:
+            self.pipeline_root.timer_wheel.cancel(eviction[0])
+        eviction.append(None)
+
+    def get_stats(self):
+        provider = getattr(self, "provider", None)
+        if not provider:
+            return {}
+        return provider.get_operation_stats()
+
     def _on_message_received(self, topic, payload):
         """
         Handler that gets called by the protocol library when an incoming message arrives.
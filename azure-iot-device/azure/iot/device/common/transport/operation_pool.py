@@ -0,0 +1,109 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a free list used to recycle PipelineOperation objects"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class OperationPool(object):
+    """
+    A free list of PipelineOperation objects for the operation types that are created for
+    every message that is sent.  Recycling these objects means that sending a message
+    doesn't have to allocate them (or leave them for the garbage collector to clean up).
+
+    Operations are only returned to the pool by the code that owns them, once they have
+    completed successfully and nothing else refers to them.  Operations that fail are never
+    returned to the pool, since a stage may still be holding on to them (for example, an
+    operation that timed out while a lower stage was still waiting for its response).
+
+    :ivar max_size: The maximum number of free objects kept for each operation type.
+    :type max_size: int
+    """
+
+    def __init__(self, op_classes, max_size=256):
+        """
+        Initializer for OperationPool objects.
+
+        :param op_classes: The PipelineOperation classes to recycle.  Objects of any other class
+          are never added to the pool.
+        :param int max_size: The maximum number of free objects kept for each class.
+        """
+        self.max_size = max_size
+        self._free = dict((op_class, []) for op_class in op_classes)
+        self._slot_names = dict((op_class, _get_slot_names(op_class)) for op_class in op_classes)
+        self._lock = threading.Lock()
+        self.created_count = 0
+        self.reused_count = 0
+        self.released_count = 0
+
+    def acquire(self, op_class, *args, **kwargs):
+        """
+        Return an initialized operation of the given class, reusing a free one if there is one.
+        The arguments are the same as the arguments to the class's initializer.
+        """
+        op = None
+        free = self._free.get(op_class)
+        with self._lock:
+            if free:
+                op = free.pop()
+                self.reused_count += 1
+            else:
+                self.created_count += 1
+
+        if op is None:
+            return op_class(*args, **kwargs)
+        op.__init__(*args, **kwargs)
+        return op
+
+    def release(self, op):
+        """
+        Return an operation to the pool.  The caller must own the operation, and must not use
+        it after this call.  Every attribute of the operation is cleared so that the pool
+        doesn't keep payloads or callbacks alive.
+
+        :returns: True if the operation was added to the pool.
+        """
+        free = self._free.get(type(op))
+        if free is None:
+            return False
+
+        with self._lock:
+            # A cleared op has no name, which protects against releasing the same op twice.  The
+            # check and the clearing happen under the lock so that two threads releasing the
+            # same op can't both add it to the pool.
+            if op.name is None:
+                return False
+            for slot_name in self._slot_names[type(op)]:
+                setattr(op, slot_name, None)
+            if len(free) >= self.max_size:
+                return False
+            free.append(op)
+            self.released_count += 1
+        return True
+
+    def get_stats(self):
+        """
+        Return a dict of counters describing how often operations were recycled.
+        """
+        with self._lock:
+            return {
+                "created": self.created_count,
+                "reused": self.reused_count,
+                "released": self.released_count,
+                "free": sum(len(free) for free in self._free.values()),
+            }
+
+
+def _get_slot_names(op_class):
+    names = []
+    for klass in op_class.__mro__:
+        for name in getattr(klass, "__slots__", ()):
+            if name not in names:
+                names.append(name)
+    return names
@@ -22,6 +22,8 @@ class PipelineEvent(object):
     :type name: str
     """
 
+    __slots__ = ("name",)
+
     def __init__(self):
         """
         Initializer for PipelineEvent objects.
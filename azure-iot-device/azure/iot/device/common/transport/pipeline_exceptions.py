@@ -0,0 +1,31 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module defines errors that the pipeline may set on a PipelineOperation when it fails"""
+
+
+class PipelineError(Exception):
+    """
+    Base class for errors raised by the pipeline itself, as opposed to errors raised by the
+    protocol library or by the service.
+    """
+
+    pass
+
+
+class PipelineTimeoutError(PipelineError):
+    """
+    Error set on an operation that did not complete before its deadline.
+    """
+
+    pass
+
+
+class MessageExpiredError(PipelineError):
+    """
+    Error set on an operation whose message expired before it could be sent.
+    """
+
+    pass
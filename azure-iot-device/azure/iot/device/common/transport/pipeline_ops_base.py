@@ -4,6 +4,13 @@
 # license information.
 # --------------------------------------------------------------------------
 
+# Priority classes for operations, from most to least urgent.  The PriorityScheduler stage
+# uses these to decide which queued operation to send next.
+PRIORITY_CONTROL = 0
+PRIORITY_METHOD_RESPONSE = 1
+PRIORITY_HIGH = 2
+PRIORITY_BULK = 3
+
 
 class PipelineOperation(object):
     """
@@ -28,8 +35,17 @@ class PipelineOperation(object):
     :ivar error: The presence of a value in the error attribute indicates that the operation failed,
       absense of this value indicates that the operation either succeeded or hasn't been handled yet.
     :type error: Error
+    :ivar deadline: Optional absolute time (in seconds since the epoch) by which the operation must
+      complete.  If the operation is still pending at that time, the EnforceDeadlines stage fails it
+      with a PipelineTimeoutError.  None means the operation never times out.
+    :type deadline: float
+    :ivar priority: The priority class of the operation (one of the PRIORITY_* values in this
+      module).  Operations default to PRIORITY_CONTROL, which the PriorityScheduler stage never holds back.
+    :type priority: int
     """
 
+    __slots__ = ("name", "callback", "needs_connection", "error", "deadline", "priority")
+
     def __init__(self, callback=None):
         """
         Initializer for PipelineOperation objects.
@@ -42,6 +58,8 @@ class PipelineOperation(object):
         self.callback = callback
         self.needs_connection = False
         self.error = None
+        self.deadline = None
+        self.priority = PRIORITY_CONTROL
 
 
 class Connect(PipelineOperation):
@@ -53,7 +71,7 @@ class Connect(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IotHub or Mqtt stage).
     """
 
-    pass
+    __slots__ = ()
 
 
 class Reconnect(PipelineOperation):
@@ -68,7 +86,7 @@ class Reconnect(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IotHub or Mqtt stage).
     """
 
-    pass
+    __slots__ = ()
 
 
 class Disconnect(PipelineOperation):
@@ -80,7 +98,7 @@ class Disconnect(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IotHub or Mqtt stage).
     """
 
-    pass
+    __slots__ = ()
 
 
 class EnableFeature(PipelineOperation):
@@ -97,6 +115,8 @@ class EnableFeature(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IotHub or Mqtt stage).
     """
 
+    __slots__ = ("feature_name",)
+
     def __init__(self, feature_name, callback=None):
         """
         Initializer for EnableFeature objects.
@@ -125,6 +145,8 @@ class DisableFeature(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IotHub or Mqtt stage).
     """
 
+    __slots__ = ("feature_name",)
+
     def __init__(self, feature_name, callback=None):
         """
         Initializer for DisableFeature objects.
@@ -150,6 +172,8 @@ class SetSasToken(PipelineOperation):
     (such as IotHub or Mqtt stages).
     """
 
+    __slots__ = ("sas_token",)
+
     def __init__(self, sas_token, callback=None):
         """
         Initializer for SetSasToken objects.
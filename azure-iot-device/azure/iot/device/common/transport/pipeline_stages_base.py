@@ -8,11 +8,48 @@ import logging
 import abc
 import six
 import sys
+import random
+import threading
+import time
+import collections
 from six.moves import queue
 from . import pipeline_ops_base
+from .pipeline_exceptions import PipelineTimeoutError, MessageExpiredError
+from .timer_wheel import TimerWheel
+from .conflating_queue import ConflatingQueue
 
 logger = logging.getLogger(__name__)
 
+# Per-thread queue of pending pipeline work.  See _run_on_trampoline.
+_trampoline = threading.local()
+
+
+def _run_on_trampoline(fn, *args):
+    """
+    Call fn(*args) without growing the stack.
+
+    Passing an op to the next stage and calling an op's callback both go through this function.
+    The first call on a thread runs the function and then keeps running any work that was
+    queued while it ran, until the queue is empty.  Calls made while that is going on (which
+    would otherwise recurse) are only added to the queue.  Stack depth therefore stays the same
+    no matter how many stages an op passes through, how many callbacks are chained, or how many
+    queued ops a stage releases at once.  All work still runs on the calling thread before the
+    outermost call returns, in the order it was queued.
+    """
+    work = getattr(_trampoline, "work", None)
+    if work is not None:
+        work.append((fn, args))
+        return
+
+    work = collections.deque([(fn, args)])
+    _trampoline.work = work
+    try:
+        while work:
+            (fn, args) = work.popleft()
+            fn(*args)
+    finally:
+        _trampoline.work = None
+
 
 @six.add_metaclass(abc.ABCMeta)
 class PipelineStage(object):
@@ -286,6 +323,9 @@ class PipelineStage(object):
         pipeline.  If the operation is already in an error state, this function will
         complete the operation in order to return that error to the caller.
 
+        If this is called while the pipeline is already running an op or a callback on this thread,
+        the next stage runs the op once that work returns, rather than in a nested call.
+
         :param PipelineOperation op: Operation which is being "continued"
         """
         if op.error:
@@ -299,7 +339,7 @@ class PipelineStage(object):
             self.complete_op(op)
         else:
             logger.info("{}({}): passing to next stage.".format(self.name, op.name))
-            self.next.run_op(op)
+            _run_on_trampoline(self.next.run_op, op)
 
     def complete_op(self, op):
         """
@@ -307,14 +347,20 @@ class PipelineStage(object):
         returning the result of the operation back up the pipeline.  This is perferred to
         calling the operation's callback directly as it provides several layers of protection
         (such as a try/except wrapper) which are strongly advised.
+
+        As with continue_op, if this is called while the pipeline is already running an op or a
+        callback on this thread, the callback is called once that work returns.
         """
         logger.info(
             "{}({}): completing {} error".format(
                 self.name, op.name, "with" if op.error else "without"
             )
         )
+        _run_on_trampoline(self._call_op_callback, op)
+
+    def _call_op_callback(self, op, callback=None):
         try:
-            op.callback(op)
+            (callback or op.callback)(op)
         except:  # noqa: E722 do not use bare 'except'
             _, e, _ = sys.exc_info()
             logger.error(
@@ -355,7 +401,10 @@ class PipelineStage(object):
         :param PipelineOperation new_op: Operation that is being passed down the pipeline
           to effectively continue the work represented by original_op.  This is most likely
           a different type of operation that is able to accomplish the intention of the
-          original_op in a way that is more specific than the original_op.
+          original_op in a way that is more specific than the original_op.  If new_op doesn't
+          have a deadline of its own, it inherits the deadline of original_op.  new_op is
+          owned by the pipeline once it is passed to this function.  If it completes
+          successfully, it is returned to the pipeline's op pool (if there is one).
         """
 
         logger.info(
@@ -370,10 +419,41 @@ class PipelineStage(object):
             )
             original_op.error = new_op.error
             self.complete_op(original_op)
+            if not op.error:
+                self._release_op(op)
 
+        if new_op.deadline is None:
+            new_op.deadline = original_op.deadline
         new_op.callback = new_op_complete
         self.continue_op(new_op)
 
+    def _acquire_op(self, op_class, *args, **kwargs):
+        """
+        Create an operation, reusing one from the pipeline's op pool if there is one.  The
+        arguments are the same as the arguments to the operation's initializer.
+        """
+        op_pool = getattr(self.pipeline_root, "op_pool", None)
+        if op_pool:
+            return op_pool.acquire(op_class, *args, **kwargs)
+        else:
+            return op_class(*args, **kwargs)
+
+    def _release_op(self, op):
+        """
+        Return an operation which this stage owns to the pipeline's op pool, if there is one.
+        The operation must not be used after this call.
+        """
+        op_pool = getattr(self.pipeline_root, "op_pool", None)
+        if op_pool:
+            op_pool.release(op)
+
+    def get_stats(self):
+        """
+        Return a dict of counters describing the work done by this stage.  Stages that keep
+        counters override this function.  Stages that don't keep any return an empty dict.
+        """
+        return {}
+
     def on_connected(self):
         """
         Called by lower layers when the transport connects
@@ -400,11 +480,19 @@ class PipelineRoot(PipelineStage):
       events from the pipeline (such as C2D messages).  This function is called with
       a PipelineEvent object every time any such event occurs.
     :type on_pipeline_event: Function
+    :ivar timer_wheel: Timer wheel shared by every stage in the pipeline that needs to run
+      something at a later time, such as expiring operations that have a deadline.
+    :type timer_wheel: TimerWheel
+    :ivar op_pool: Optional pool used to recycle the operations that are created for every
+      message sent through the pipeline.  If this is None, operations are never recycled.
+    :type op_pool: OperationPool
     """
 
     def __init__(self):
         super(PipelineRoot, self).__init__()
         self.on_pipeline_event = None
+        self.timer_wheel = TimerWheel()
+        self.op_pool = None
 
     def _run_op(self, op):
         """
@@ -415,6 +503,20 @@ class PipelineRoot(PipelineStage):
         """
         self.continue_op(op)
 
+    def acquire_op(self, op_class, *args, **kwargs):
+        """
+        Create an operation to run on this pipeline, reusing one from op_pool if possible.
+        The arguments are the same as the arguments to the operation's initializer.
+        """
+        return self._acquire_op(op_class, *args, **kwargs)
+
+    def release_op(self, op):
+        """
+        Return an operation created with acquire_op to op_pool once it has completed
+        successfully.  The operation must not be used after this call.
+        """
+        self._release_op(op)
+
     def append_stage(self, new_next_stage):
         """
         Add the next stage to the end of the pipeline.  This is the function that callers
@@ -432,6 +534,25 @@ class PipelineRoot(PipelineStage):
         new_next_stage.pipeline_root = self
         return self
 
+    def get_pipeline_stats(self):
+        """
+        Collect the counters from every stage in the pipeline.
+
+        :returns: A dict mapping the name of each stage that keeps counters to the dict
+          returned by that stage's get_stats function.  The counters for the pipeline's
+          timer wheel and op pool are returned under the "TimerWheel" and "OperationPool" keys.
+        """
+        stats = {"TimerWheel": self.timer_wheel.get_stats()}
+        if self.op_pool:
+            stats["OperationPool"] = self.op_pool.get_stats()
+        stage = self.next
+        while stage:
+            stage_stats = stage.get_stats()
+            if stage_stats:
+                stats[stage.name] = stage_stats
+            stage = stage.next
+        return stats
+
     def unhandled_error_handler(self, error):
         """
         Handler for errors that happen which cannot be tied to a specific operation.
@@ -458,7 +579,158 @@ class PipelineRoot(PipelineStage):
             logger.warning("incoming pipeline event with no handler.  dropping.")
 
 
-class EnsureConnection(PipelineStage):
+class EnforceDeadlines(PipelineStage):
+    """
+    This stage is responsible for failing operations that don't complete before their deadline.
+
+    When an operation with a deadline passes through this stage, a timer for that deadline is
+    added to the pipeline's timer wheel.  If the operation completes first, the timer is
+    cancelled.  If the timer fires first, the operation is completed with a PipelineTimeoutError.
+    Any completion that arrives after that (for example, a PUBACK that shows up late) is dropped.
+
+    A timed-out operation is completed by calling the callback it had when it reached this stage,
+    not its current callback, so the stages below (which may have wrapped the callback) only see
+    the operation complete once, when it really completes.  Queueing stages drop operations that
+    failed while queued instead of sending them (see _QueueingStage).
+
+    This stage should be near the top of the pipeline so that operations sitting in queues in
+    lower stages (such as EnsureConnection) also time out.
+
+    Operations Handled:
+    * all operations with a deadline (fails them if they are still pending at the deadline)
+
+    Operations Produced:
+    * None
+    """
+
+    _PENDING = 0
+    _TIMED_OUT = 1
+    _DONE = 2
+
+    def __init__(self):
+        super(EnforceDeadlines, self).__init__()
+        self.timeout_count = 0
+        self.late_completion_count = 0
+        # The deadline fires on the timer wheel's thread and completions arrive on the network
+        # thread, so each op's state is only changed with this lock held.
+        self._lock = threading.Lock()
+
+    def _run_op(self, op):
+        if op.deadline is None:
+            self.continue_op(op)
+            return
+
+        original_callback = op.callback
+        state = [self._PENDING]
+
+        def on_deadline():
+            with self._lock:
+                if state[0] != self._PENDING:
+                    return
+                state[0] = self._TIMED_OUT
+                self.timeout_count += 1
+            logger.info("{}({}): deadline expired.  failing op".format(self.name, op.name))
+            op.error = PipelineTimeoutError(
+                "{} did not complete before its deadline".format(op.name)
+            )
+            _run_on_trampoline(self._call_op_callback, op, original_callback)
+
+        def on_complete(op):
+            with self._lock:
+                previous_state = state[0]
+                state[0] = self._DONE
+                if previous_state != self._PENDING:
+                    self.late_completion_count += 1
+            if previous_state != self._PENDING:
+                logger.info(
+                    "{}({}): completed after its deadline.  dropping".format(self.name, op.name)
+                )
+                return
+            self.pipeline_root.timer_wheel.cancel(timer)
+            original_callback(op)
+
+        op.callback = on_complete
+        timer = self.pipeline_root.timer_wheel.schedule(op.deadline, on_deadline)
+        self.continue_op(op)
+
+    def get_stats(self):
+        return {"timeouts": self.timeout_count, "late_completions": self.late_completion_count}
+
+
+class _QueueingStage(PipelineStage):
+    """
+    Base class for stages which hold operations in a queue while the transport is unavailable.
+
+    If conflation_key is given, queued operations are kept in a ConflatingQueue, so an operation
+    replaces any queued operation with the same key.  The replaced operation is completed
+    without an error.  If expiry is given, queued operations which expire are completed with a
+    MessageExpiredError, in bulk, whenever an operation is queued and before the queue is
+    released.
+    """
+
+    def __init__(self, conflation_key=None, expiry=None):
+        """
+        :param Function conflation_key: Optional function which returns the conflation key of
+          an operation (see ConflatingQueue).
+        :param Function expiry: Optional function which returns the time (in seconds since the
+          epoch) at which an operation expires, or None if it doesn't.
+        """
+        super(_QueueingStage, self).__init__()
+        if conflation_key or expiry:
+            self.queue = ConflatingQueue(key_function=conflation_key, expiry_function=expiry)
+        else:
+            self.queue = queue.Queue()
+        self.expiry = expiry
+        self.conflated_count = 0
+        self.expired_count = 0
+
+    def _enqueue(self, op):
+        superseded = self.queue.put_nowait(op)
+        if superseded:
+            logger.info(
+                "{}({}): replaced by newer {} op.  completing.".format(
+                    self.name, superseded.name, op.name
+                )
+            )
+            self.conflated_count += 1
+            self.complete_op(superseded)
+        self._drop_expired()
+
+    def _get_queued_op(self):
+        """
+        Remove and return the next queued operation to release, or None if the queue is empty.
+        Operations that failed while they were queued (for example, because EnforceDeadlines
+        timed them out) have already been completed, so they are dropped instead.
+        """
+        while not self.queue.empty():
+            op = self.queue.get_nowait()
+            if op.error is None:
+                return op
+            logger.info("{}({}): failed while queued.  dropping.".format(self.name, op.name))
+        return None
+
+    def _drop_expired(self):
+        if not self.expiry:
+            return
+        for expired_op in self.queue.pop_expired(time.time()):
+            logger.info(
+                "{}({}): expired while queued.  failing.".format(self.name, expired_op.name)
+            )
+            self.expired_count += 1
+            expired_op.error = MessageExpiredError(
+                "{} expired before it could be sent".format(expired_op.name)
+            )
+            self.complete_op(expired_op)
+
+    def get_stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "conflated": self.conflated_count,
+            "expired": self.expired_count,
+        }
+
+
+class EnsureConnection(_QueueingStage):
     # TODO: additional documentation and tests for this class are not being implemented because a significant rewriting to support more scenarios is pending
     """
     This stage is responsible for ensuring that the transport is connected when
@@ -474,16 +746,25 @@ class EnsureConnection(PipelineStage):
     Operations Produced:
     * Connect
 
+    Queued operations can be conflated and expired (see _QueueingStage).
+
     Note: this stage will likely be replaced by a more full-featured stage to handle
     other "block while we're setting something up" operations, such as subscribing to
     twin responses.  That is another example where we want to ensure some state and block
     requests until that state is achieved.
     """
 
-    def __init__(self):
-        super(EnsureConnection, self).__init__()
+    def __init__(self, conflation_key=None, expiry=None):
+        """
+        Initializer for EnsureConnection objects.
+
+        :param Function conflation_key: Optional function which returns the conflation key of
+          an operation (see ConflatingQueue).
+        :param Function expiry: Optional function which returns the time (in seconds since the
+          epoch) at which an operation expires, or None if it doesn't.
+        """
+        super(EnsureConnection, self).__init__(conflation_key=conflation_key, expiry=expiry)
         self.connected = False
-        self.queue = queue.Queue()
         self.blocked = False
 
     def _run_op(self, op):
@@ -495,7 +776,7 @@ class EnsureConnection(PipelineStage):
                     self.name, op.name
                 )
             )
-            self.queue.put_nowait(op)
+            self._enqueue(op)
 
         # If we get a request to connect, we either complete immediately (if we're already
         # connected) or we do the connect operation, which is pulled out into a helper
@@ -550,12 +831,15 @@ class EnsureConnection(PipelineStage):
         """
         logger.info("{}({}): disabling block and releasing queued ops.".format(self.name, op.name))
         self.blocked = False
+        self._drop_expired()
         logger.info(
             "{}({}): processing {} items in queue".format(self.name, op.name, self.queue.qsize())
         )
         # loop through our queue and release all the blocked operations
-        while not self.queue.empty():
-            op_to_release = self.queue.get_nowait()
+        while True:
+            op_to_release = self._get_queued_op()
+            if op_to_release is None:
+                break
             if error:
                 # if we're unblocking the queue because something (like a connect operation) failed,
                 # then we fail all of the blocked operations with the same error.
@@ -585,7 +869,7 @@ class EnsureConnection(PipelineStage):
         # that operation to run after the connection is complete.
         if not isinstance(op, pipeline_ops_base.Connect):
             logger.info("{}({}): queueing until connection complete".format(self.name, op.name))
-            self.queue.put_nowait(op)
+            self._enqueue(op)
 
         # function that gets called after we're connected.
         def on_connected(op_connect):
@@ -611,3 +895,683 @@ class EnsureConnection(PipelineStage):
     def on_disconnected(self):
         self.connected = False
         PipelineStage.on_disconnected(self)
+
+
+class AutoReconnect(_QueueingStage):
+    """
+    This stage is responsible for re-establishing the connection when the transport drops
+    unexpectedly.  A disconnection is "unexpected" if the layers above this stage asked for
+    the connection (by sending a Connect operation, or any operation that caused a connection)
+    and have not since asked for it to be torn down with a Disconnect operation.
+
+    When an unexpected disconnection happens, this stage blocks, queueing all operations,
+    and schedules a Reconnect operation on the pipeline's timer wheel after a jittered
+    exponential backoff.  If the reconnect fails, or doesn't complete within reconnect_timeout,
+    another attempt is scheduled with a longer backoff.  Once the transport is connected again,
+    every feature that was enabled before the drop is re-enabled in a single batch (all
+    EnableFeature operations are sent down together rather than one at a time).  When the last
+    of them completes, the stage unblocks and releases the queued operations in the order they
+    arrived.
+
+    If the protocol library re-establishes the connection on its own before the backoff
+    expires, the pending attempt is cancelled and the stage goes straight to restoring
+    the subscriptions.
+
+    Queued operations can be conflated and expired (see _QueueingStage).
+
+    Operations Handled:
+    * Connect (records that a connection is wanted)
+    * Disconnect (records that a connection is no longer wanted)
+    * EnableFeature and DisableFeature (records which features to restore)
+    * all operations (queues while reconnecting)
+
+    Operations Produced:
+    * Reconnect
+    * EnableFeature
+
+    :ivar initial_backoff: Upper bound, in seconds, of the delay before the first reconnect attempt.
+    :type initial_backoff: float
+    :ivar max_backoff: Upper bound, in seconds, of the delay between any two reconnect attempts.
+    :type max_backoff: float
+    :ivar reconnect_timeout: Number of seconds a reconnect attempt may take before it is
+      abandoned and another attempt is scheduled.
+    :type reconnect_timeout: float
+    """
+
+    def __init__(
+        self,
+        initial_backoff=1,
+        max_backoff=60,
+        reconnect_timeout=60,
+        conflation_key=None,
+        expiry=None,
+    ):
+        """
+        Initializer for AutoReconnect objects.
+
+        :param float initial_backoff: Upper bound, in seconds, of the delay before the first
+          reconnect attempt.
+        :param float max_backoff: Upper bound, in seconds, of the delay between any two
+          reconnect attempts.
+        :param float reconnect_timeout: Number of seconds a reconnect attempt may take before it
+          is abandoned and another attempt is scheduled.
+        :param Function conflation_key: Optional function which returns the conflation key of
+          an operation (see ConflatingQueue).
+        :param Function expiry: Optional function which returns the time (in seconds since the
+          epoch) at which an operation expires, or None if it doesn't.
+        """
+        super(AutoReconnect, self).__init__(conflation_key=conflation_key, expiry=expiry)
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.reconnect_timeout = reconnect_timeout
+        self.connection_wanted = False
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+        self.enabled_features = []
+        self._reconnect_timer = None
+        self._reconnect_op_in_flight = False
+        self._restoring_features = False
+        # Reconnect attempts are started and timed out on the timer wheel's thread, while
+        # completions and connection events arrive on the network thread, so the reconnect state
+        # is only changed with this lock held.  It is reentrant because completing a queued op
+        # (for example, one that was conflated) can send another op through this stage.
+        self._lock = threading.RLock()
+
+    def _run_op(self, op):
+        if isinstance(op, pipeline_ops_base.Disconnect):
+            # The caller no longer wants a connection, so there is nothing to re-establish.
+            # Ops that were waiting for the reconnect are released ahead of the Disconnect
+            # because they were submitted before it.
+            with self._lock:
+                self.connection_wanted = False
+                was_reconnecting = self.reconnecting
+                if was_reconnecting:
+                    self._cancel_reconnect_timer()
+            if was_reconnecting:
+                logger.info(
+                    "{}({}): cancelling reconnect because of disconnect".format(self.name, op.name)
+                )
+                self._unblock()
+            self.continue_op(op)
+            return
+
+        with self._lock:
+            if self.reconnecting:
+                logger.info(
+                    "{}({}): pipeline is blocked waiting for reconnect.  queueing.".format(
+                        self.name, op.name
+                    )
+                )
+                self._enqueue(op)
+                return
+            if isinstance(op, pipeline_ops_base.Connect) or op.needs_connection:
+                self.connection_wanted = True
+            elif isinstance(op, pipeline_ops_base.EnableFeature):
+                if op.feature_name not in self.enabled_features:
+                    self.enabled_features.append(op.feature_name)
+            elif isinstance(op, pipeline_ops_base.DisableFeature):
+                if op.feature_name in self.enabled_features:
+                    self.enabled_features.remove(op.feature_name)
+        self.continue_op(op)
+
+    def _get_backoff(self):
+        """
+        Return the number of seconds to wait before the next reconnect attempt.  The ceiling
+        doubles with every failed attempt (up to max_backoff) and the actual delay is picked
+        at random from the upper half of that ceiling so that a fleet of devices dropped by
+        the same outage doesn't reconnect in lockstep.
+        """
+        ceiling = min(self.max_backoff, self.initial_backoff * (2 ** self.reconnect_attempts))
+        return ceiling / 2.0 + random.uniform(0, ceiling / 2.0)
+
+    def _schedule_reconnect(self):
+        """
+        Schedule the next reconnect attempt on the timer wheel.  Must be called with the lock held.
+        """
+        delay = self._get_backoff()
+        logger.info(
+            "{}: scheduling reconnect attempt {} in {:.2f} seconds".format(
+                self.name, self.reconnect_attempts + 1, delay
+            )
+        )
+        self._reconnect_timer = self.pipeline_root.timer_wheel.schedule(
+            time.time() + delay, self._reconnect
+        )
+
+    def _cancel_reconnect_timer(self):
+        """
+        Cancel the scheduled reconnect attempt, if there is one.  Must be called with the lock held.
+        """
+        timer = self._reconnect_timer
+        self._reconnect_timer = None
+        if timer:
+            self.pipeline_root.timer_wheel.cancel(timer)
+
+    def _reconnect(self):
+        """
+        Send a Reconnect operation down the pipeline.  Called when the backoff timer expires.
+        """
+        with self._lock:
+            self._reconnect_timer = None
+            if not self.reconnecting or self._reconnect_op_in_flight:
+                return
+            self.reconnect_attempts += 1
+            self._reconnect_op_in_flight = True
+
+        # Set by whichever of the completion and the deadline comes first.  The other is ignored.
+        finished = [False]
+
+        def finish_attempt():
+            """
+            Mark the attempt as finished.  Returns True if it wasn't already finished and the
+            stage is still reconnecting.  Must be called with the lock held.
+            """
+            if finished[0]:
+                return False
+            finished[0] = True
+            self._reconnect_op_in_flight = False
+            return self.reconnecting
+
+        def on_reconnect_timeout():
+            with self._lock:
+                if not finish_attempt():
+                    return
+                logger.info(
+                    "{}: reconnect attempt {} timed out".format(self.name, self.reconnect_attempts)
+                )
+                self._schedule_reconnect()
+
+        def on_reconnect_complete(op):
+            self.pipeline_root.timer_wheel.cancel(timeout_timer)
+            with self._lock:
+                if not finish_attempt():
+                    return
+                if op.error:
+                    logger.info(
+                        "{}({}): reconnect attempt {} failed: {}".format(
+                            self.name, op.name, self.reconnect_attempts, op.error
+                        )
+                    )
+                    self._schedule_reconnect()
+                    return
+            logger.info("{}({}): reconnect succeeded".format(self.name, op.name))
+            self._restore_features()
+
+        reconnect_op = pipeline_ops_base.Reconnect(callback=on_reconnect_complete)
+        reconnect_op.deadline = time.time() + self.reconnect_timeout
+        timeout_timer = self.pipeline_root.timer_wheel.schedule(
+            reconnect_op.deadline, on_reconnect_timeout
+        )
+        logger.info("{}: reconnecting".format(self.name))
+        self.continue_op(reconnect_op)
+
+    def _restore_features(self):
+        """
+        Re-enable every feature that was enabled before the connection dropped, then
+        unblock the stage.  The EnableFeature ops are all sent down at once so that the
+        subscriptions go out together rather than waiting on each other's acknowledgements.
+        """
+        with self._lock:
+            if self._restoring_features:
+                return
+            features = list(self.enabled_features)
+            self._restoring_features = bool(features)
+        if not features:
+            self._unblock()
+            return
+
+        logger.info("{}: restoring {} feature(s)".format(self.name, len(features)))
+        remaining = [len(features)]
+
+        def on_feature_enabled(op):
+            if op.error:
+                logger.error(
+                    "{}({}): failed to restore {}".format(self.name, op.name, op.feature_name)
+                )
+                self.pipeline_root.unhandled_error_handler(op.error)
+            with self._lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+                if done:
+                    self._restoring_features = False
+            if done:
+                self._unblock()
+
+        for feature_name in features:
+            self.continue_op(
+                pipeline_ops_base.EnableFeature(
+                    feature_name=feature_name, callback=on_feature_enabled
+                )
+            )
+
+    def _unblock(self):
+        """
+        Stop reconnecting and release all of the operations that were queued while we were
+        waiting for the connection to come back.
+        """
+        with self._lock:
+            logger.info(
+                "{}: disabling block and releasing {} queued ops.".format(
+                    self.name, self.queue.qsize()
+                )
+            )
+            self.reconnecting = False
+            self.reconnect_attempts = 0
+            self._drop_expired()
+            released = []
+            while True:
+                op = self._get_queued_op()
+                if op is None:
+                    break
+                released.append(op)
+        for op in released:
+            self.run_op(op)
+
+    def get_stats(self):
+        stats = _QueueingStage.get_stats(self)
+        stats["reconnect_attempts"] = self.reconnect_attempts
+        return stats
+
+    def on_connected(self):
+        with self._lock:
+            restored_externally = self.reconnecting and not self._reconnect_op_in_flight
+            if restored_externally:
+                self._cancel_reconnect_timer()
+        if restored_externally:
+            # The protocol library got the connection back on its own.  We don't need our
+            # own attempt any more, but the subscriptions still need to be restored.
+            logger.info("{}: connection restored before reconnect attempt".format(self.name))
+            self._restore_features()
+        PipelineStage.on_connected(self)
+
+    def on_disconnected(self):
+        with self._lock:
+            unexpected = self.connection_wanted and not self.reconnecting
+            if unexpected:
+                logger.info("{}: unexpected disconnection.  starting reconnect".format(self.name))
+                self.reconnecting = True
+                self._schedule_reconnect()
+        PipelineStage.on_disconnected(self)
+
+
+# Lane names for the priority classes that PriorityScheduler queues, most urgent first
+_SCHEDULED_LANES = collections.OrderedDict(
+    [
+        (pipeline_ops_base.PRIORITY_METHOD_RESPONSE, "method_response"),
+        (pipeline_ops_base.PRIORITY_HIGH, "high"),
+        (pipeline_ops_base.PRIORITY_BULK, "bulk"),
+    ]
+)
+
+
+class PriorityScheduler(PipelineStage):
+    """
+    This stage is responsible for deciding the order in which operations are sent, so that urgent
+    operations (such as method responses) don't wait behind a backlog of telemetry.
+
+    Operations are queued in a lane based on their priority class.  At most max_in_flight
+    operations are allowed below this stage at any time.  When one of them completes, the next
+    operation is taken from the most urgent lane that has something in it.  So that less urgent
+    lanes don't starve, every starvation_limit-th pick (while more than one lane is waiting) is
+    taken from whichever lane has the operation that has been waiting the longest.
+
+    Operations with PRIORITY_CONTROL (connect, subscribe, etc.) are passed down immediately and
+    don't count against max_in_flight.  Queued operations whose deadline passes before they are
+    released are failed with a PipelineTimeoutError instead of being sent.  An operation that is
+    still pending below this stage at its deadline gives up its slot then, since an operation that
+    timed out may never be completed by the stages below (see EnforceDeadlines).
+
+    Operations Handled:
+    * all operations with a priority other than PRIORITY_CONTROL (queues them and releases them by priority)
+
+    Operations Produced:
+    * None
+    """
+
+    def __init__(self, max_in_flight=16, starvation_limit=8):
+        """
+        Initializer for PriorityScheduler objects.
+
+        :param int max_in_flight: The number of queued operations which can be pending below this
+          stage at the same time.
+        :param int starvation_limit: How often (in picks) the longest-waiting lane gets to go
+          first, regardless of priority.
+        """
+        super(PriorityScheduler, self).__init__()
+        self.max_in_flight = max_in_flight
+        self.starvation_limit = starvation_limit
+        self.lanes = dict((priority, collections.deque()) for priority in _SCHEDULED_LANES)
+        self.in_flight = 0
+        self._picks_since_fair_pick = 0
+        self._dispatching = False
+        self._lock = threading.Lock()
+        self._dispatched_count = dict((priority, 0) for priority in _SCHEDULED_LANES)
+        self._total_wait = dict((priority, 0.0) for priority in _SCHEDULED_LANES)
+        self._max_wait = dict((priority, 0.0) for priority in _SCHEDULED_LANES)
+
+    def _run_op(self, op):
+        if op.priority == pipeline_ops_base.PRIORITY_CONTROL:
+            self.continue_op(op)
+            return
+
+        lane = op.priority if op.priority in self.lanes else pipeline_ops_base.PRIORITY_BULK
+        with self._lock:
+            self.lanes[lane].append((time.time(), op))
+        self._dispatch()
+
+    def _pick(self):
+        """
+        Remove and return the next (lane, (enqueue_time, op)) to send, or None if all lanes are
+        empty.  Must be called with the lock held.
+        """
+        waiting = [priority for priority in _SCHEDULED_LANES if self.lanes[priority]]
+        if not waiting:
+            return None
+
+        lane = waiting[0]
+        if len(waiting) > 1:
+            self._picks_since_fair_pick += 1
+            if self._picks_since_fair_pick >= self.starvation_limit:
+                self._picks_since_fair_pick = 0
+                lane = min(waiting, key=lambda priority: self.lanes[priority][0][0])
+        else:
+            self._picks_since_fair_pick = 0
+        return (lane, self.lanes[lane].popleft())
+
+    def _dispatch(self):
+        # Only one thread sends queued ops at a time.  Completions that happen while that thread is
+        # busy (including ones that happen synchronously inside continue_op) only free up a slot,
+        # and the running loop fills it, so the stack doesn't grow with the size of the backlog.
+        with self._lock:
+            if self._dispatching:
+                return
+            self._dispatching = True
+
+        while True:
+            with self._lock:
+                picked = None
+                if self.in_flight < self.max_in_flight:
+                    picked = self._pick()
+                if not picked:
+                    self._dispatching = False
+                    return
+                (lane, (enqueue_time, op)) = picked
+                self.in_flight += 1
+                wait = time.time() - enqueue_time
+                self._dispatched_count[lane] += 1
+                self._total_wait[lane] += wait
+                self._max_wait[lane] = max(self._max_wait[lane], wait)
+            self._send(op)
+
+    def _send(self, op):
+        original_callback = op.callback
+        # Read before the op is sent, since it can complete (and be reused) before continue_op
+        # returns
+        (name, deadline) = (op.name, op.deadline)
+        completed = [False]
+
+        def release_slot():
+            # Only the first completion (or deadline) of an op frees its slot
+            with self._lock:
+                if completed[0]:
+                    return False
+                completed[0] = True
+                self.in_flight -= 1
+            return True
+
+        def on_deadline():
+            # An op that times out is failed by EnforceDeadlines through the callback it had
+            # above this stage, and the lower stages may forget it altogether, so on_complete
+            # might never be called.  Its slot is freed here instead.
+            if release_slot():
+                logger.info("{}({}): deadline expired.  freeing its slot".format(self.name, name))
+                self._dispatch()
+
+        def on_complete(op):
+            if timer:
+                self.pipeline_root.timer_wheel.cancel(timer)
+            first_completion = release_slot()
+            original_callback(op)
+            if first_completion:
+                self._dispatch()
+
+        op.callback = on_complete
+        timer = None
+        if deadline is not None and deadline <= time.time():
+            logger.info(
+                "{}({}): deadline passed while queued.  not sending".format(self.name, op.name)
+            )
+            op.error = PipelineTimeoutError(
+                "{} did not complete before its deadline".format(op.name)
+            )
+            self.complete_op(op)
+            return
+        if deadline is not None:
+            timer = self.pipeline_root.timer_wheel.schedule(deadline, on_deadline)
+        self.continue_op(op)
+
+    def get_stats(self):
+        with self._lock:
+            stats = {"in_flight": self.in_flight}
+            for priority, lane_name in _SCHEDULED_LANES.items():
+                dispatched = self._dispatched_count[priority]
+                stats[lane_name] = {
+                    "depth": len(self.lanes[priority]),
+                    "dispatched": dispatched,
+                    "mean_wait": self._total_wait[priority] / dispatched if dispatched else 0.0,
+                    "max_wait": self._max_wait[priority],
+                }
+            return stats
+
+
+class RateLimit(PipelineStage):
+    """
+    This stage is responsible for pacing operations so that they stay under a rate limit (such as
+    a service's throttling quota) instead of going out in bursts that get the client throttled.
+
+    Each limited operation class has a TokenBucket (several classes can share one), and each
+    operation takes cost(op) tokens from its bucket.  If there aren't enough tokens, the operation
+    waits in a first-in, first-out queue for its bucket, and a timer on the pipeline's timer wheel
+    releases it once the bucket has refilled.  Operations are never failed for going over the
+    limit, but queued operations whose deadline passes before they are released are failed with a
+    PipelineTimeoutError instead of being sent.
+
+    Operations Handled:
+    * all operations whose class has a bucket (queues them until their bucket has enough tokens)
+
+    Operations Produced:
+    * None
+    """
+
+    def __init__(self, limits, cost=None, clock=time.time):
+        """
+        Initializer for RateLimit objects.
+
+        :param dict limits: Maps operation classes to the TokenBucket they take tokens from.
+          Operations of any other class are passed down immediately.
+        :param Function cost: Optional function which returns the number of tokens an operation
+          takes.  Defaults to 1 token per operation.
+        :param Function clock: Function returning the current time in seconds.  This should be
+          the clock used by the buckets and the pipeline's timer wheel.
+        """
+        super(RateLimit, self).__init__()
+        self.limits = dict(limits)
+        self.cost = cost
+        self.clock = clock
+        self._waiting = dict(
+            (bucket, collections.deque()) for bucket in six.itervalues(self.limits)
+        )
+        self._timers = {}
+        self._lock = threading.Lock()
+        self.delayed_count = 0
+        self.passed_count = 0
+
+    def _run_op(self, op):
+        bucket = self.limits.get(type(op))
+        if bucket is None:
+            self.continue_op(op)
+            return
+
+        cost = self.cost(op) if self.cost else 1
+        with self._lock:
+            waiting = self._waiting[bucket]
+            # Ops already waiting for this bucket go first, so the order of ops is kept.  There
+            # is always a release timer scheduled while any ops are waiting.
+            if waiting:
+                send = False
+            else:
+                wait = bucket.try_take(cost)
+                send = not wait
+            if send:
+                self.passed_count += 1
+            else:
+                logger.debug("{}({}): over the rate limit.  queueing".format(self.name, op.name))
+                waiting.append((cost, op))
+                self.delayed_count += 1
+                if bucket not in self._timers:
+                    self._schedule_release(bucket, wait)
+        if send:
+            self.continue_op(op)
+
+    def _schedule_release(self, bucket, wait):
+        """
+        Schedule the ops waiting for a bucket to be released in wait seconds.  Must be called
+        with the lock held.
+        """
+
+        def on_timer():
+            self._release(bucket)
+
+        self._timers[bucket] = self.pipeline_root.timer_wheel.schedule(
+            self.clock() + wait, on_timer
+        )
+
+    def _release(self, bucket):
+        released = []
+        timed_out = []
+        with self._lock:
+            del self._timers[bucket]
+            waiting = self._waiting[bucket]
+            now = self.clock()
+            while waiting:
+                (cost, op) = waiting[0]
+                if op.deadline is not None and op.deadline <= now:
+                    timed_out.append(waiting.popleft()[1])
+                    continue
+                wait = bucket.try_take(cost)
+                if wait:
+                    self._schedule_release(bucket, wait)
+                    break
+                released.append(waiting.popleft()[1])
+            self.passed_count += len(released)
+
+        for op in timed_out:
+            logger.info(
+                "{}({}): deadline passed while queued.  not sending".format(self.name, op.name)
+            )
+            op.error = PipelineTimeoutError(
+                "{} did not complete before its deadline".format(op.name)
+            )
+            self.complete_op(op)
+        for op in released:
+            self.continue_op(op)
+
+    def get_stats(self):
+        with self._lock:
+            stats = {"delayed": self.delayed_count, "passed": self.passed_count}
+            for op_class, bucket in six.iteritems(self.limits):
+                stats[op_class.__name__] = {
+                    "fill_level": bucket.fill_level,
+                    "queued": len(self._waiting[bucket]),
+                }
+            return stats
+
+
+class MeasureLatency(PipelineStage):
+    """
+    This stage measures how long operations take to complete, from the time they reach this stage
+    to the time their callback is called.
+
+    Latencies are kept for each of the given operation classes, and reported by get_stats under
+    the class name: the number of operations that completed, the latency of the first one (for
+    example, the time the first publish took), the latency of the most recent one, and the mean
+    and maximum latency.
+    Operations that fail are counted too.
+
+    Where the stage is placed decides what is measured.  Above EnsureConnection, the time an
+    operation spends waiting for the connection is included.  Directly below it, the Connect
+    operations that EnsureConnection starts are measured too, and other operations are timed from
+    when they are sent, so their latency is the round trip to the server.
+
+    Operations Handled:
+    * all operations of the measured classes (times them)
+
+    Operations Produced:
+    * None
+    """
+
+    def __init__(self, op_classes, clock=time.time):
+        """
+        Initializer for MeasureLatency objects.
+
+        :param list op_classes: The operation classes to measure.  Operations of any other class
+          are passed down without being timed.
+        :param Function clock: Function returning the current time in seconds.
+        """
+        super(MeasureLatency, self).__init__()
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._latencies = dict((op_class, _LatencyStats()) for op_class in op_classes)
+
+    def _run_op(self, op):
+        latencies = self._latencies.get(type(op))
+        if latencies is None:
+            self.continue_op(op)
+            return
+
+        original_callback = op.callback
+        start = self.clock()
+
+        def on_complete(op):
+            latency = self.clock() - start
+            with self._lock:
+                latencies.add(latency)
+            original_callback(op)
+
+        op.callback = on_complete
+        self.continue_op(op)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(
+                (op_class.__name__, latencies.get_stats())
+                for op_class, latencies in six.iteritems(self._latencies)
+            )
+
+
+class _LatencyStats(object):
+    __slots__ = ("count", "first", "last", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        if self.first is None:
+            self.first = latency
+        self.count += 1
+        self.last = latency
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def get_stats(self):
+        return {
+            "count": self.count,
+            "first": self.first,
+            "last": self.last,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
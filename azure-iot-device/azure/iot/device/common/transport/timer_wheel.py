@@ -0,0 +1,166 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a hashed timer wheel used to expire pipeline operations"""
+
+import logging
+import math
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class _WheelTimer(object):
+    """
+    Handle for a single timer in a TimerWheel.  Returned by TimerWheel.schedule and
+    accepted by TimerWheel.cancel.
+    """
+
+    __slots__ = ("tick", "callback", "slot")
+
+    def __init__(self, tick, callback, slot):
+        self.tick = tick
+        self.callback = callback
+        self.slot = slot
+
+
+class TimerWheel(object):
+    """
+    A hashed timer wheel.  Timers are hashed into a fixed number of slots by the tick in which
+    they expire, so scheduling and cancelling a timer are O(1) and advancing the wheel only
+    looks at the slots for the ticks that have passed, no matter how many timers are pending.
+
+    All timers in a wheel are serviced by a single daemon thread, which only runs while there
+    are timers pending.  The thread wakes once per tick, so timers fire up to one tick late.
+
+    :ivar tick_interval: The resolution of the wheel, in seconds.
+    :type tick_interval: float
+    :ivar wheel_size: The number of slots in the wheel.
+    :type wheel_size: int
+    """
+
+    def __init__(self, tick_interval=0.1, wheel_size=512, clock=time.time):
+        """
+        Initializer for TimerWheel objects.
+
+        :param float tick_interval: The resolution of the wheel, in seconds.
+        :param int wheel_size: The number of slots in the wheel.  Timers that are more than
+          wheel_size ticks in the future share a slot with nearer timers and are skipped
+          over until their tick comes around.
+        :param Function clock: Function returning the current time in seconds.  Deadlines passed
+          to schedule are measured against this clock.
+        """
+        self.tick_interval = tick_interval
+        self.wheel_size = wheel_size
+        self._clock = clock
+        self._slots = [set() for _ in range(wheel_size)]
+        self._lock = threading.Lock()
+        self._current_tick = self._tick_for(clock())
+        self._pending = 0
+        self._thread = None
+        self.scheduled_count = 0
+        self.expired_count = 0
+        self.cancelled_count = 0
+
+    def _tick_for(self, t):
+        return int(math.floor(t / self.tick_interval))
+
+    def schedule(self, deadline, callback):
+        """
+        Schedule callback to be called (with no arguments) once the clock passes deadline.
+
+        :param float deadline: The absolute time, as returned by the wheel's clock, at which
+          the timer expires.
+        :param Function callback: The function to call when the timer expires.  It is called on
+          the wheel thread.
+
+        :returns: A handle which can be passed to cancel.
+        """
+        with self._lock:
+            tick = max(int(math.ceil(deadline / self.tick_interval)), self._current_tick + 1)
+            slot = self._slots[tick % self.wheel_size]
+            timer = _WheelTimer(tick, callback, slot)
+            slot.add(timer)
+            self._pending += 1
+            self.scheduled_count += 1
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return timer
+
+    def cancel(self, timer):
+        """
+        Cancel a timer that was returned by schedule.  Cancelling a timer that has already
+        expired or been cancelled does nothing.
+
+        :returns: True if the timer was pending and is now cancelled.
+        """
+        with self._lock:
+            if timer.slot is None or timer not in timer.slot:
+                return False
+            timer.slot.discard(timer)
+            timer.slot = None
+            self._pending -= 1
+            self.cancelled_count += 1
+        return True
+
+    def advance(self, now=None):
+        """
+        Move the wheel forward to the given time, calling the callback of every timer that
+        has expired.  This is called by the wheel thread once per tick, but it can also be
+        called directly.
+
+        :param float now: The time to advance to.  Defaults to the current time on the wheel's clock.
+        """
+        if now is None:
+            now = self._clock()
+        expired = []
+        with self._lock:
+            target_tick = self._tick_for(now)
+            if target_tick <= self._current_tick:
+                return
+            # If more than a full turn of the wheel has passed, every slot is due, so there
+            # is no point visiting any slot more than once.
+            first_tick = max(self._current_tick + 1, target_tick - self.wheel_size + 1)
+            for tick in range(first_tick, target_tick + 1):
+                slot = self._slots[tick % self.wheel_size]
+                due = [timer for timer in slot if timer.tick <= target_tick]
+                for timer in due:
+                    slot.discard(timer)
+                    timer.slot = None
+                expired.extend(due)
+            self._current_tick = target_tick
+            self._pending -= len(expired)
+            self.expired_count += len(expired)
+
+        for timer in expired:
+            try:
+                timer.callback()
+            except:  # noqa: E722 do not use bare 'except'
+                logger.error("Unexpected error calling timer wheel callback")
+                logger.error(traceback.format_exc())
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick_interval)
+            self.advance()
+            with self._lock:
+                if self._pending == 0:
+                    self._thread = None
+                    return
+
+    def get_stats(self):
+        """
+        Return a dict of counters describing the timers in this wheel.
+        """
+        return {
+            "pending": self._pending,
+            "scheduled": self.scheduled_count,
+            "expired": self.expired_count,
+            "cancelled": self.cancelled_count,
+        }
@@ -0,0 +1,81 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a token bucket used to limit the rate at which operations are sent"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    A token bucket.  Tokens are added at a steady rate, up to the capacity of the bucket, and
+    each operation takes some number of tokens out.  Bursts of up to capacity tokens can go out
+    at once, but over time no more than rate tokens are taken per second.
+
+    An operation that costs more than the whole capacity is allowed through once the bucket is
+    full, and leaves the bucket in debt, so that large operations are slowed down rather than
+    blocked forever.
+
+    :ivar rate: The number of tokens added per second.
+    :type rate: float
+    :ivar capacity: The largest number of tokens the bucket can hold.
+    :type capacity: float
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.time):
+        """
+        Initializer for TokenBucket objects.  The bucket starts full.
+
+        :param float rate: The number of tokens added per second.
+        :param float capacity: The largest number of tokens the bucket can hold.  Defaults to
+          rate (one second's worth of tokens).
+        :param Function clock: Function returning the current time in seconds.
+
+        :raises: ValueError if rate or capacity isn't positive.
+        """
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+        if capacity is None:
+            capacity = rate
+        if capacity <= 0:
+            raise ValueError("capacity must be greater than 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._last_fill = clock()
+        self._lock = threading.Lock()
+
+    def _fill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_fill) * self.rate)
+        self._last_fill = now
+
+    def try_take(self, tokens=1):
+        """
+        Take tokens out of the bucket if there are enough of them.
+
+        :param float tokens: The number of tokens to take.
+        :returns: 0 if the tokens were taken, otherwise the number of seconds until there will
+          be enough tokens.
+        """
+        with self._lock:
+            self._fill()
+            needed = min(tokens, self.capacity)
+            if self._tokens >= needed:
+                self._tokens -= tokens
+                return 0
+            return (needed - self._tokens) / self.rate
+
+    @property
+    def fill_level(self):
+        """
+        The number of tokens in the bucket right now.  This is negative while the bucket is in
+        debt.
+        """
+        with self._lock:
+            self._fill()
+            return self._tokens
@@ -15,6 +15,7 @@ from azure.iot.device.iothub.abstract_clients import (
     AbstractIoTHubModuleClient,
 )
 from azure.iot.device.iothub.models import Message
+from azure.iot.device.iothub import columnar
 from azure.iot.device.iothub.transport import constant
 from azure.iot.device.iothub.inbox_manager import InboxManager
 from .async_inbox import AsyncClientInbox
@@ -86,7 +87,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         await disconnect_async(callback=callback)
         await callback.completion()
 
-    async def send_event(self, message):
+    async def send_event(self, message, timeout=None, high_priority=False, fire_and_forget=False):
         """Sends a message to the default events endpoint on the Azure IoT Hub or Azure IoT Edge Hub instance.
 
         If the connection to the service has not previously been opened by a call to connect, this
@@ -94,6 +95,15 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         :param message: The actual message to send. Anything passed that is not an instance of the
         Message class will be converted to Message object.
+        :param float timeout: Optionally provide a number of seconds to wait for the service to
+        acknowledge the event.
+        :param bool high_priority: If True, the message is sent ahead of other messages that are
+        waiting to be sent.
+        :param bool fire_and_forget: If True, the message is sent without waiting for the service to
+        acknowledge it.  This is faster, but the message may be lost.
+
+        :raises: PipelineTimeoutError if the event is not acknowledged before the timeout.
+        :raises: MessageExpiredError if the message expires before it can be sent.
         """
         if not isinstance(message, Message):
             message = Message(message)
@@ -101,13 +111,63 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         logger.info("Sending message to Hub...")
         send_event_async = async_adapter.emulate_async(self._transport.send_event)
 
-        def sync_callback():
-            logger.info("Successfully sent message to Hub")
+        def sync_callback(error=None):
+            return error
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
-        await send_event_async(message, callback=callback)
-        await callback.completion()
+        await send_event_async(
+            message,
+            callback=callback,
+            timeout=timeout,
+            high_priority=high_priority,
+            fire_and_forget=fire_and_forget,
+        )
+        error = await callback.completion()
+        if error:
+            raise error
+        logger.info("Successfully sent message to Hub")
+
+    async def send_event_columns(self, timestamps, columns, timeout=None, encoding=None):
+        """Sends a window of readings to the default events endpoint as columnar messages.
+
+        The readings are packed into as few messages as possible, splitting the rows across
+        messages at the IoT Hub message size limit.  See azure.iot.device.iothub.columnar for
+        the payload format.  All of the messages are sent at once.
+
+        :param timestamps: A sequence (or NumPy array) with the time of each row.
+        :param dict columns: A dict mapping each column name to a sequence (or NumPy array) of
+        readings, with one reading per timestamp.
+        :param float timeout: Optionally provide a number of seconds to wait for the service to
+        acknowledge each message.
+        :param str encoding: "binary" or "json".  Binary payloads require NumPy.  By default,
+        binary is used if NumPy is installed and JSON otherwise.
+
+        :raises: ValueError if the columns can't be packed.
+        :raises: PipelineTimeoutError if a message is not acknowledged before the timeout.
+        :raises: MessageExpiredError if a message expires before it can be sent.
+        """
+        messages = columnar.pack_columns(timestamps, columns, encoding=encoding)
+
+        logger.info("Sending {} columnar messages to Hub...".format(len(messages)))
+        send_event_async = async_adapter.emulate_async(self._transport.send_event)
+
+        def sync_callback(error=None):
+            return error
+
+        callbacks = []
+        for message in messages:
+            callback = async_adapter.AwaitableCallback(sync_callback)
+            callbacks.append(callback)
+            await send_event_async(message, callback=callback, timeout=timeout)
+        errors = []
+        for callback in callbacks:
+            error = await callback.completion()
+            if error:
+                errors.append(error)
+        if errors:
+            raise errors[0]
+        logger.info("Successfully sent columnar messages to Hub")
 
     async def receive_method_request(self, method_name=None):
         """Receive a method request via the Azure IoT Hub or Azure IoT Edge Hub.
@@ -130,27 +190,34 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         logger.info("Received method request")
         return method_request
 
-    async def send_method_response(self, method_response):
+    async def send_method_response(self, method_response, timeout=None):
         """Send a response to a method request via the Azure IoT Hub or Azure IoT Edge Hub.
 
         If the connection to the service has not previously been opened by a call to connect, this
         function will open the connection before sending the event.
 
         :param method_response: The MethodResponse to send
+        :param float timeout: Optionally provide a number of seconds to wait for the service to
+        acknowledge the response.
+
+        :raises: PipelineTimeoutError if the response is not acknowledged before the timeout.
         """
         logger.info("Sending method response to Hub...")
         send_method_response_async = async_adapter.emulate_async(
             self._transport.send_method_response
         )
 
-        def sync_callback():
-            logger.info("Successfully sent method response to Hub")
+        def sync_callback(error=None):
+            return error
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
         # TODO: maybe consolidate method_request, result and status into a new object
-        await send_method_response_async(method_response, callback=callback)
-        await callback.completion()
+        await send_method_response_async(method_response, callback=callback, timeout=timeout)
+        error = await callback.completion()
+        if error:
+            raise error
+        logger.info("Successfully sent method response to Hub")
 
     async def _enable_feature(self, feature_name):
         """Enable an Azure IoT Hub feature in the transport
@@ -208,7 +275,9 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
             self._inbox_manager.route_input_message
         )
 
-    async def send_to_output(self, message, output_name):
+    async def send_to_output(
+        self, message, output_name, timeout=None, high_priority=False, fire_and_forget=False
+    ):
         """Sends an event/message to the given module output.
 
         These are outgoing events and are meant to be "output events"
@@ -219,6 +288,15 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
         :param message: message to send to the given output. Anything passed that is not an instance of the
         Message class will be converted to Message object.
         :param output_name: Name of the output to send the event to.
+        :param float timeout: Optionally provide a number of seconds to wait for the service to
+        acknowledge the event.
+        :param bool high_priority: If True, the message is sent ahead of other messages that are
+        waiting to be sent.
+        :param bool fire_and_forget: If True, the message is sent without waiting for the service to
+        acknowledge it.  This is faster, but the message may be lost.
+
+        :raises: PipelineTimeoutError if the event is not acknowledged before the timeout.
+        :raises: MessageExpiredError if the message expires before it can be sent.
         """
         if not isinstance(message, Message):
             message = Message(message)
@@ -228,13 +306,22 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
         logger.info("Sending message to output:" + output_name + "...")
         send_output_event_async = async_adapter.emulate_async(self._transport.send_output_event)
 
-        def sync_callback():
-            logger.info("Successfully sent message to output: " + output_name)
+        def sync_callback(error=None):
+            return error
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
-        await send_output_event_async(message, callback)
-        await callback.completion()
+        await send_output_event_async(
+            message,
+            callback,
+            timeout=timeout,
+            high_priority=high_priority,
+            fire_and_forget=fire_and_forget,
+        )
+        error = await callback.completion()
+        if error:
+            raise error
+        logger.info("Successfully sent message to output: " + output_name)
 
     async def receive_input_message(self, input_name):
         """Receive an input message that has been sent from another Module to a specific input.
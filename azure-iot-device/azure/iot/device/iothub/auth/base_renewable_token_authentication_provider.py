@@ -57,6 +57,8 @@ class BaseRenewableTokenAuthenticationProvider(AuthenticationProvider):
         self.shared_access_key_name = None
         self.sas_token_str = None
         self.token_update_callback = None
+        # The last resource URI a token was generated for, and its URI-encoded form
+        self._quoted_resource_uri_cache = (None, None)
 
     def disconnect(self):
         """Cancel updates to the SAS Token"""
@@ -118,7 +120,10 @@ class BaseRenewableTokenAuthenticationProvider(AuthenticationProvider):
         resource_uri = self.hostname + "/devices/" + self.device_id
         if self.module_id:
             resource_uri += "/modules/" + self.module_id
-        quoted_resource_uri = urllib.parse.quote_plus(resource_uri)
+        (cached_resource_uri, quoted_resource_uri) = self._quoted_resource_uri_cache
+        if resource_uri != cached_resource_uri:
+            quoted_resource_uri = urllib.parse.quote_plus(resource_uri)
+            self._quoted_resource_uri_cache = (resource_uri, quoted_resource_uri)
 
         signature = self._sign(quoted_resource_uri, expiry)
 
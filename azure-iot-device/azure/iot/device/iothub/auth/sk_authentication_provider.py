@@ -4,11 +4,8 @@
 # license information.
 # --------------------------------------------------------------------------
 
-import base64
-import hmac
-import hashlib
 import logging
-import six.moves.urllib as urllib
+from azure.iot.device.common.sastoken import SigningEngine, SasTokenError
 from .base_renewable_token_authentication_provider import BaseRenewableTokenAuthenticationProvider
 
 logger = logging.getLogger(__name__)
@@ -63,6 +60,7 @@ class SymmetricKeyAuthenticationProvider(BaseRenewableTokenAuthenticationProvide
         self.shared_access_key_name = shared_access_key_name
         self.gateway_hostname = gateway_hostname
         self.ca_cert = None
+        self._signing_engine = None
 
     @staticmethod
     def parse(connection_string):
@@ -107,14 +105,18 @@ class SymmetricKeyAuthenticationProvider(BaseRenewableTokenAuthenticationProvide
         :param expiry: an integer value representing the number of seconds since the epoch 00:00:00 UTC on 1 January 1970 at which the token will expire.
         :return: The signature portion of the Sas Token.
         """
-        try:
-            message = (quoted_resource_uri + "\n" + str(expiry)).encode("utf-8")
-            signing_key = base64.b64decode(self.shared_access_key.encode("utf-8"))
-            signed_hmac = hmac.HMAC(signing_key, message, hashlib.sha256)
-            signature = urllib.parse.quote(base64.b64encode(signed_hmac.digest()))
-        except (TypeError, base64.binascii.Error) as e:
-            raise TypeError("Unable to build shared access signature from given values", e)
-        return signature
+        # The signing engine holds the decoded key and keyed HMAC, so they are only rebuilt when
+        # the key changes rather than for every token
+        engine = self._signing_engine
+        if engine is None or engine.key != self.shared_access_key:
+            try:
+                engine = SigningEngine(self.shared_access_key)
+            except SasTokenError as e:
+                raise TypeError(
+                    "Unable to build shared access signature from given values", e.cause
+                )
+            self._signing_engine = engine
+        return engine.sign(quoted_resource_uri, expiry)
 
 
 def _validate_keys(d):
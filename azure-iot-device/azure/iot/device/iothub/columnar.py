@@ -0,0 +1,153 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module packs windows of sensor readings into columnar telemetry messages.
+
+Binary payloads (content type application/x-iot-columnar) are laid out as:
+
+* the 4 byte magic number b"IOTC"
+* a 1 byte format version (1)
+* the length of the header, as a 4 byte little-endian unsigned integer
+* the header, which is utf-8 JSON of the form
+  {"rows": 3, "columns": [{"name": "timestamp", "dtype": "<f8"}, ...]}
+* the data for each column in header order, as contiguous little-endian arrays
+
+The first column is always the timestamps.  JSON payloads (content type application/json) are
+objects mapping "timestamp" and each column name to a list of values.
+"""
+
+import json
+import struct
+from azure.iot.device.common.payload_codecs import CONTENT_TYPE_JSON
+from .models import Message
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ["pack_columns", "ENCODING_BINARY", "ENCODING_JSON"]
+
+ENCODING_BINARY = "binary"
+ENCODING_JSON = "json"
+
+CONTENT_TYPE_COLUMNAR = "application/x-iot-columnar"
+
+MAGIC = b"IOTC"
+FORMAT_VERSION = 1
+TIMESTAMP_COLUMN = "timestamp"
+
+# IoT Hub rejects device to cloud messages larger than 256KB.  Some of that is used by the
+# message properties, so payloads are kept a little under the limit by default.
+DEFAULT_MAX_PAYLOAD_SIZE = 255 * 1024
+
+_PREFIX = struct.Struct("<4sBI")
+
+
+def pack_columns(timestamps, columns, encoding=None, max_payload_size=None):
+    """
+    Pack a window of readings into as few messages as possible, splitting the rows across
+    messages so that no payload is larger than max_payload_size.
+
+    :param timestamps: A sequence (or NumPy array) with the time of each row.
+    :param dict columns: A dict mapping each column name to a sequence (or NumPy array) of
+      readings, with one reading per timestamp.
+    :param str encoding: ENCODING_BINARY or ENCODING_JSON.  Binary payloads require NumPy.  By
+      default, binary is used if NumPy is installed and JSON otherwise.
+    :param int max_payload_size: The largest payload, in bytes, to put in one message.  Defaults
+      to DEFAULT_MAX_PAYLOAD_SIZE.
+
+    :returns: A list of Message objects.
+    :raises: ValueError if the columns don't all have one value per timestamp, if a single
+      row doesn't fit in max_payload_size, or if the encoding isn't supported.
+    """
+    if max_payload_size is None:
+        max_payload_size = DEFAULT_MAX_PAYLOAD_SIZE
+    if encoding is None:
+        encoding = ENCODING_BINARY if numpy is not None else ENCODING_JSON
+    if TIMESTAMP_COLUMN in columns:
+        raise ValueError("'{}' can't be used as a column name".format(TIMESTAMP_COLUMN))
+
+    names = [TIMESTAMP_COLUMN] + sorted(columns)
+    values = [timestamps] + [columns[name] for name in names[1:]]
+    row_count = len(timestamps)
+    for (name, column) in zip(names, values):
+        if len(column) != row_count:
+            raise ValueError(
+                "Column '{}' has {} values but there are {} timestamps".format(
+                    name, len(column), row_count
+                )
+            )
+
+    if encoding == ENCODING_BINARY:
+        if numpy is None:
+            raise ValueError("NumPy is required for binary columnar payloads")
+        return _pack_binary(names, values, row_count, max_payload_size)
+    elif encoding == ENCODING_JSON:
+        return _pack_json(names, values, 0, row_count, max_payload_size)
+    else:
+        raise ValueError("Unsupported columnar encoding: {}".format(encoding))
+
+
+def _pack_binary(names, values, row_count, max_payload_size):
+    arrays = []
+    for column in values:
+        array = numpy.asarray(column)
+        if array.dtype.hasobject or array.ndim != 1:
+            raise ValueError("Binary columns must be 1 dimensional arrays of numbers")
+        arrays.append(array.astype(array.dtype.newbyteorder("<"), copy=False))
+
+    row_size = sum(array.dtype.itemsize for array in arrays)
+    messages = []
+    start = 0
+    while start < row_count or not messages:
+        header = _binary_header(names, arrays, 0)
+        # The row count is the only part of the header that changes size, so reserve room for
+        # the largest one it could be.
+        overhead = _PREFIX.size + len(header) + len(str(row_count))
+        rows_per_message = (max_payload_size - overhead) // row_size if row_size else row_count
+        if rows_per_message < 1:
+            raise ValueError("A single row doesn't fit in {} bytes".format(max_payload_size))
+        end = min(row_count, start + rows_per_message)
+        header = _binary_header(names, arrays, end - start)
+        payload = b"".join(
+            [_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)), header]
+            + [array[start:end].tobytes() for array in arrays]
+        )
+        messages.append(Message(payload, content_type=CONTENT_TYPE_COLUMNAR))
+        start = end
+    return messages
+
+
+def _binary_header(names, arrays, rows):
+    header = {
+        "rows": rows,
+        "columns": [
+            {"name": name, "dtype": array.dtype.str} for (name, array) in zip(names, arrays)
+        ],
+    }
+    return json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+
+def _pack_json(names, values, start, end, max_payload_size):
+    payload = json.dumps(
+        dict((name, _to_list(column[start:end])) for (name, column) in zip(names, values)),
+        separators=(",", ":"),
+    )
+    if len(payload) <= max_payload_size:
+        return [Message(payload, content_type=CONTENT_TYPE_JSON, content_encoding="utf-8")]
+    if end - start <= 1:
+        raise ValueError("A single row doesn't fit in {} bytes".format(max_payload_size))
+    # JSON values vary in length, so split the rows in half until each half fits
+    middle = (start + end) // 2
+    return _pack_json(names, values, start, middle, max_payload_size) + _pack_json(
+        names, values, middle, end, max_payload_size
+    )
+
+
+def _to_list(column):
+    if numpy is not None and isinstance(column, numpy.ndarray):
+        return column.tolist()
+    return list(column)
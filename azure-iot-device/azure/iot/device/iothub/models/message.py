@@ -14,7 +14,7 @@ logger = logging.getLogger(__name__)
 class Message(object):
     """Represents a message to or from IoTHub
 
-    :ivar data: The data that constitutes the payload
+    :ivar data: The data that constitutes the payload.  When sending, values other than text and bytes are encoded with the codec for content_type (JSON if content_type is not set)
     :ivar custom_properties: Dictionary of custom message properties
     :ivar lock_token: Used by receiver to abandon, reject or complete the message
     :ivar message id: A user-settlable identifier for the message used for request-reply patterns. Format: A case-sensitive string (up to 128 characters long) of ASCII 7-bit alphanumeric characters + {'-', ':', '.', '+', '%', '_', '#', '*', '?', '!', '(', ')', ',', '=', '@', ';', '$', '''}
@@ -29,6 +29,23 @@ class Message(object):
     :ivar content_type: Content type property used to route messages with the message-body. Can be 'application/json'
     """
 
+    __slots__ = (
+        "data",
+        "custom_properties",
+        "lock_token",
+        "message_id",
+        "sequence_number",
+        "to",
+        "expiry_time_utc",
+        "enqueued_time",
+        "correlation_id",
+        "user_id",
+        "ack",
+        "content_encoding",
+        "content_type",
+        "output_name",
+    )
+
     def __init__(self, data, message_id=None, content_encoding=None, content_type=None):
         """
         Initializer for Message
@@ -8,13 +8,14 @@ Azure IoTHub Device SDK for Python.
 """
 
 import logging
-from threading import Event
+from threading import Event, Lock
 from .abstract_clients import (
     AbstractIoTHubClient,
     AbstractIoTHubDeviceClient,
     AbstractIoTHubModuleClient,
 )
 from .models import Message
+from . import columnar
 from .inbox_manager import InboxManager
 from .sync_inbox import SyncClientInbox
 from azure.iot.device.iothub.transport import constant
@@ -92,7 +93,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         self._transport.disconnect(callback=callback)
         disconnect_complete.wait()
 
-    def send_event(self, message):
+    def send_event(self, message, timeout=None, high_priority=False, fire_and_forget=False):
         """Sends a message to the default events endpoint on the Azure IoT Hub or Azure IoT Edge Hub instance.
 
         This is a synchronous event, meaning that this function will not return until the event
@@ -103,19 +104,82 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         :param message: The actual message to send. Anything passed that is not an instance of the
         Message class will be converted to Message object.
+        :param float timeout: Optionally provide a number of seconds to wait for the service to
+        acknowledge the event.
+        :param bool high_priority: If True, the message is sent ahead of other messages that are
+        waiting to be sent.
+        :param bool fire_and_forget: If True, the message is sent without waiting for the service to
+        acknowledge it.  This is faster, but the message may be lost.
+
+        :raises: PipelineTimeoutError if the event is not acknowledged before the timeout.
+        :raises: MessageExpiredError if the message expires before it can be sent.
         """
         if not isinstance(message, Message):
             message = Message(message)
 
         logger.info("Sending message to Hub...")
         send_complete = Event()
+        send_error = []
 
-        def callback():
+        def callback(error=None):
+            if error:
+                send_error.append(error)
             send_complete.set()
-            logger.info("Successfully sent message to Hub")
 
-        self._transport.send_event(message, callback=callback)
+        self._transport.send_event(
+            message,
+            callback=callback,
+            timeout=timeout,
+            high_priority=high_priority,
+            fire_and_forget=fire_and_forget,
+        )
+        send_complete.wait()
+        if send_error:
+            raise send_error[0]
+        logger.info("Successfully sent message to Hub")
+
+    def send_event_columns(self, timestamps, columns, timeout=None, encoding=None):
+        """Sends a window of readings to the default events endpoint as columnar messages.
+
+        The readings are packed into as few messages as possible, splitting the rows across
+        messages at the IoT Hub message size limit.  See azure.iot.device.iothub.columnar for
+        the payload format.  All of the messages are sent at once, and this function will not
+        return until the service has acknowledged all of them.
+
+        :param timestamps: A sequence (or NumPy array) with the time of each row.
+        :param dict columns: A dict mapping each column name to a sequence (or NumPy array) of
+        readings, with one reading per timestamp.
+        :param float timeout: Optionally provide a number of seconds to wait for the service to
+        acknowledge each message.
+        :param str encoding: "binary" or "json".  Binary payloads require NumPy.  By default,
+        binary is used if NumPy is installed and JSON otherwise.
+
+        :raises: ValueError if the columns can't be packed.
+        :raises: PipelineTimeoutError if a message is not acknowledged before the timeout.
+        :raises: MessageExpiredError if a message expires before it can be sent.
+        """
+        messages = columnar.pack_columns(timestamps, columns, encoding=encoding)
+
+        logger.info("Sending {} columnar messages to Hub...".format(len(messages)))
+        send_complete = Event()
+        send_error = []
+        remaining = [len(messages)]
+        lock = Lock()
+
+        def callback(error=None):
+            with lock:
+                if error:
+                    send_error.append(error)
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    send_complete.set()
+
+        for message in messages:
+            self._transport.send_event(message, callback=callback, timeout=timeout)
         send_complete.wait()
+        if send_error:
+            raise send_error[0]
+        logger.info("Successfully sent columnar messages to Hub")
 
     def receive_method_request(self, method_name=None, block=True, timeout=None):
         """Receive a method request via the Azure IoT Hub or Azure IoT Edge Hub.
@@ -142,7 +206,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         logger.info("Received method request")
         return method_request
 
-    def send_method_response(self, method_response):
+    def send_method_response(self, method_response, timeout=None):
         """Send a response to a method request via the Azure IoT Hub or Azure IoT Edge Hub.
 
         This is a synchronous event, meaning that this function will not return until the event
@@ -153,16 +217,25 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         :param method_response: The MethodResponse to send.
         :type method_response: MethodResponse
+        :param float timeout: Optionally provide a number of seconds to wait for the service to
+        acknowledge the response.
+
+        :raises: PipelineTimeoutError if the response is not acknowledged before the timeout.
         """
         logger.info("Sending method response to Hub...")
         send_complete = Event()
+        send_error = []
 
-        def callback():
+        def callback(error=None):
+            if error:
+                send_error.append(error)
             send_complete.set()
-            logger.info("Successfully sent method response to Hub")
 
-        self._transport.send_method_response(method_response, callback=callback)
+        self._transport.send_method_response(method_response, callback=callback, timeout=timeout)
         send_complete.wait()
+        if send_error:
+            raise send_error[0]
+        logger.info("Successfully sent method response to Hub")
 
     def _enable_feature(self, feature_name):
         """Enable an Azure IoT Hub feature in the transport.
@@ -242,7 +315,9 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
             self._inbox_manager.route_input_message
         )
 
-    def send_to_output(self, message, output_name):
+    def send_to_output(
+        self, message, output_name, timeout=None, high_priority=False, fire_and_forget=False
+    ):
         """Sends an event/message to the given module output.
 
         These are outgoing events and are meant to be "output events".
@@ -256,6 +331,15 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
         :param message: message to send to the given output. Anything passed that is not an instance of the
         Message class will be converted to Message object.
         :param output_name: Name of the output to send the event to.
+        :param float timeout: Optionally provide a number of seconds to wait for the service to
+        acknowledge the event.
+        :param bool high_priority: If True, the message is sent ahead of other messages that are
+        waiting to be sent.
+        :param bool fire_and_forget: If True, the message is sent without waiting for the service to
+        acknowledge it.  This is faster, but the message may be lost.
+
+        :raises: PipelineTimeoutError if the event is not acknowledged before the timeout.
+        :raises: MessageExpiredError if the message expires before it can be sent.
         """
         if not isinstance(message, Message):
             message = Message(message)
@@ -263,13 +347,24 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
 
         logger.info("Sending message to output:" + output_name + "...")
         send_complete = Event()
+        send_error = []
 
-        def callback():
-            logger.info("Successfully sent message to output: " + output_name)
+        def callback(error=None):
+            if error:
+                send_error.append(error)
             send_complete.set()
 
-        self._transport.send_output_event(message, callback)
+        self._transport.send_output_event(
+            message,
+            callback,
+            timeout=timeout,
+            high_priority=high_priority,
+            fire_and_forget=fire_and_forget,
+        )
         send_complete.wait()
+        if send_error:
+            raise send_error[0]
+        logger.info("Successfully sent message to output: " + output_name)
 
     def receive_input_message(self, input_name, block=True, timeout=None):
         """Receive an input message that has been sent from another Module to a specific input.
@@ -59,21 +59,23 @@ class AbstractTransport:
         pass
 
     @abc.abstractmethod
-    def send_event(self, event, callback):
+    def send_event(self, event, callback, timeout=None, high_priority=False, fire_and_forget=False):
         """
         Send some telemetry, event or message.
         """
         pass
 
     @abc.abstractmethod
-    def send_output_event(self, event, callback):
+    def send_output_event(
+        self, event, callback, timeout=None, high_priority=False, fire_and_forget=False
+    ):
         """
         Send some event or message to a specific output
         """
         pass
 
     @abc.abstractmethod
-    def send_method_response(self, method_response, callback=None):
+    def send_method_response(self, method_response, callback=None, timeout=None):
         """
         Send a method response.
         """
@@ -5,9 +5,14 @@
 # --------------------------------------------------------------------------
 
 import logging
+import time
 from azure.iot.device.common.transport import pipeline_stages_base
 from azure.iot.device.common.transport import pipeline_ops_base
+from azure.iot.device.common.transport.pipeline_exceptions import PipelineError
+from azure.iot.device.common.transport.operation_pool import OperationPool
+from azure.iot.device.common.transport.token_bucket import TokenBucket
 from azure.iot.device.common.transport.mqtt import pipeline_stages_mqtt
+from azure.iot.device.common.transport.mqtt import pipeline_ops_mqtt
 from azure.iot.device.iothub.transport.abstract_transport import AbstractTransport
 from azure.iot.device.iothub.transport import pipeline_stages_iothub
 from azure.iot.device.iothub.transport import pipeline_events_iothub
@@ -16,20 +21,97 @@ from . import pipeline_stages_iothub_mqtt
 
 logger = logging.getLogger(__name__)
 
+# The operations that each rate_limits key applies to
+_RATE_LIMITED_OPS = {
+    "telemetry": pipeline_ops_iothub.SendTelemetry,
+    "output_events": pipeline_ops_iothub.SendOutputEvent,
+    "method_responses": pipeline_ops_iothub.SendMethodResponse,
+}
+
+
+def _create_rate_limit(rate_limits):
+    limits = {}
+    for name, limit in rate_limits.items():
+        if name not in _RATE_LIMITED_OPS:
+            raise ValueError("Unknown rate limit: {}".format(name))
+        (rate, burst) = limit if isinstance(limit, tuple) else (limit, None)
+        limits[_RATE_LIMITED_OPS[name]] = TokenBucket(rate, burst)
+    return pipeline_stages_base.RateLimit(limits, cost=pipeline_stages_iothub.get_billing_units)
+
 
 class MQTTTransport(AbstractTransport):
-    def __init__(self, auth_provider):
+    def __init__(
+        self,
+        auth_provider,
+        payload_codec=None,
+        aggregation_window=None,
+        deadbands=None,
+        max_silence=None,
+        conflate_property=None,
+        drop_duplicates=False,
+        rate_limits=None,
+    ):
         """
         Constructor for instantiating a transport
         :param auth_provider: The authentication provider
+        :param payload_codec: Optional codec (such as a ZlibCodec) used to compress outgoing
+          message payloads and decompress incoming ones.
+        :param float aggregation_window: If given, telemetry readings are sent as summaries over
+          tumbling windows of this many seconds instead of being sent one by one.
+        :param dict deadbands: If given, telemetry is only sent when one of these properties
+          changes by more than its deadband (see ApplyDeadbands).
+        :param float max_silence: With deadbands, the longest time in seconds to go without
+          sending telemetry.
+        :param str conflate_property: If given, telemetry that is queued while the transport is
+          connecting is replaced by newer telemetry with the same value of this custom property.
+        :param bool drop_duplicates: If True, incoming C2D and input messages with the message_id
+          of a recently received message are dropped.
+        :param dict rate_limits: If given, outgoing operations are paced to stay under IoT Hub's
+          throttling quotas.  Maps "telemetry", "output_events" or "method_responses" to the
+          number of units allowed per second, or to a (units per second, burst) tuple.  Messages
+          take one unit per 4KB of payload, and method responses take one unit each.  Operations
+          over the limit wait in a queue.
         """
         AbstractTransport.__init__(self, auth_provider)
-        self._pipeline = (
-            pipeline_stages_base.PipelineRoot()
-            .append_stage(pipeline_stages_iothub.UseSkAuthProvider())
-            .append_stage(pipeline_stages_base.EnsureConnection())
-            .append_stage(pipeline_stages_iothub_mqtt.IotHubMQTTConverter())
-            .append_stage(pipeline_stages_mqtt.Provider())
+        stages = [pipeline_stages_base.EnforceDeadlines()]
+        if drop_duplicates:
+            stages.append(pipeline_stages_iothub.DropDuplicateMessages())
+        if aggregation_window:
+            stages.append(pipeline_stages_iothub.AggregateTelemetry(window=aggregation_window))
+        if deadbands:
+            stages.append(pipeline_stages_iothub.ApplyDeadbands(deadbands, max_silence=max_silence))
+        if payload_codec:
+            stages.append(pipeline_stages_iothub.CompressPayloads(payload_codec))
+        conflation_key = None
+        if conflate_property:
+            conflation_key = pipeline_stages_iothub.conflate_by_property(conflate_property)
+        stages += [
+            pipeline_stages_iothub.UseSkAuthProvider(),
+            pipeline_stages_base.AutoReconnect(
+                conflation_key=conflation_key, expiry=pipeline_stages_iothub.get_message_expiry
+            ),
+            pipeline_stages_base.EnsureConnection(
+                conflation_key=conflation_key, expiry=pipeline_stages_iothub.get_message_expiry
+            ),
+        ]
+        if rate_limits:
+            stages.append(_create_rate_limit(rate_limits))
+        stages += [
+            pipeline_stages_base.PriorityScheduler(),
+            pipeline_stages_iothub.DropExpiredMessages(),
+            pipeline_stages_iothub_mqtt.IotHubMQTTConverter(),
+            pipeline_stages_mqtt.Provider(),
+        ]
+        self._pipeline = pipeline_stages_base.PipelineRoot()
+        for stage in stages:
+            self._pipeline.append_stage(stage)
+        # Recycle the ops that are created for every message that is sent
+        self._pipeline.op_pool = OperationPool(
+            [
+                pipeline_ops_iothub.SendTelemetry,
+                pipeline_ops_iothub.SendOutputEvent,
+                pipeline_ops_mqtt.Publish,
+            ]
         )
 
         def _handle_pipeline_event(event):
@@ -110,57 +192,79 @@ class MQTTTransport(AbstractTransport):
 
         self._pipeline.run_op(pipeline_ops_base.Disconnect(callback=pipeline_callback))
 
-    def send_event(self, message, callback=None):
+    def send_event(
+        self, message, callback=None, timeout=None, high_priority=False, fire_and_forget=False
+    ):
         """
         Send a telemetry message to the service.
 
         :param callback: callback which is called when the message publish has been acknowledged by the service.
+          The callback is passed an error keyword argument, which is a PipelineTimeoutError if the
+          publish wasn't acknowledged before the timeout, a MessageExpiredError if the message
+          expired before it could be sent, and None otherwise.
+        :param float timeout: Number of seconds to wait for the acknowledgement (optional).  By
+          default, the send never times out.
+        :param bool high_priority: If True, the message is sent ahead of other telemetry that is
+          waiting to be sent.
+        :param bool fire_and_forget: If True, the message is published at QoS 0.  The callback is
+          called once the MQTT client has written the message to the network, and the message
+          may be lost.
         """
-
-        def pipeline_callback(call):
-            if call.error:
-                # TODO we need error semantics on the client
-                exit(1)
-            if callback:
-                callback()
-
-        self._pipeline.run_op(
-            pipeline_ops_iothub.SendTelemetry(message=message, callback=pipeline_callback)
+        op = self._pipeline.acquire_op(
+            pipeline_ops_iothub.SendTelemetry,
+            message=message,
+            callback=_get_timeout_aware_callback(callback, release_op=self._pipeline.release_op),
+            fire_and_forget=fire_and_forget,
         )
+        _set_deadline(op, timeout)
+        _set_priority(op, high_priority)
+        self._pipeline.run_op(op)
 
-    def send_output_event(self, message, callback=None):
+    def send_output_event(
+        self, message, callback=None, timeout=None, high_priority=False, fire_and_forget=False
+    ):
         """
         Send an output message to the service.
 
         :param callback: callback which is called when the message publish has been acknowledged by the service.
+          The callback is passed an error keyword argument, which is a PipelineTimeoutError if the
+          publish wasn't acknowledged before the timeout, a MessageExpiredError if the message
+          expired before it could be sent, and None otherwise.
+        :param float timeout: Number of seconds to wait for the acknowledgement (optional).  By
+          default, the send never times out.
+        :param bool high_priority: If True, the message is sent ahead of other telemetry that is
+          waiting to be sent.
+        :param bool fire_and_forget: If True, the message is published at QoS 0.  The callback is
+          called once the MQTT client has written the message to the network, and the message
+          may be lost.
         """
-
-        def pipeline_callback(call):
-            if call.error:
-                # TODO we need error semantics on the client
-                exit(1)
-            if callback:
-                callback()
-
-        self._pipeline.run_op(
-            pipeline_ops_iothub.SendOutputEvent(message=message, callback=pipeline_callback)
+        op = self._pipeline.acquire_op(
+            pipeline_ops_iothub.SendOutputEvent,
+            message=message,
+            callback=_get_timeout_aware_callback(callback, release_op=self._pipeline.release_op),
+            fire_and_forget=fire_and_forget,
         )
+        _set_deadline(op, timeout)
+        _set_priority(op, high_priority)
+        self._pipeline.run_op(op)
 
-    def send_method_response(self, method_response, callback=None):
-        logger.info("Transport send_method_response called")
+    def send_method_response(self, method_response, callback=None, timeout=None):
+        """
+        Send a method response to the service.
 
-        def pipeline_callback(call):
-            if call.error:
-                # TODO we need error semantics on the client
-                exit(1)
-            if callback:
-                callback()
+        :param callback: callback which is called when the response publish has been acknowledged by the service.
+          The callback is passed an error keyword argument, which is a PipelineTimeoutError if the
+          publish wasn't acknowledged before the timeout, and None otherwise.
+        :param float timeout: Number of seconds to wait for the acknowledgement (optional).  By
+          default, the send never times out.
+        """
+        logger.info("Transport send_method_response called")
 
-        self._pipeline.run_op(
-            pipeline_ops_iothub.SendMethodResponse(
-                method_response=method_response, callback=pipeline_callback
-            )
+        op = pipeline_ops_iothub.SendMethodResponse(
+            method_response=method_response, callback=_get_timeout_aware_callback(callback)
         )
+        _set_deadline(op, timeout)
+        self._pipeline.run_op(op)
 
     def enable_feature(self, feature_name, callback=None):
         """
@@ -203,3 +307,42 @@ class MQTTTransport(AbstractTransport):
         self._pipeline.run_op(
             pipeline_ops_base.DisableFeature(feature_name=feature_name, callback=pipeline_callback)
         )
+
+    def get_pipeline_stats(self):
+        """
+        Return the counters kept by the stages of the transport pipeline, such as the number
+        of operations that timed out.  See PipelineRoot.get_pipeline_stats for the format.
+        """
+        return self._pipeline.get_pipeline_stats()
+
+
+def _set_deadline(op, timeout):
+    if timeout is not None:
+        op.deadline = time.time() + timeout
+
+
+def _set_priority(op, high_priority):
+    if high_priority:
+        op.priority = pipeline_ops_base.PRIORITY_HIGH
+
+
+def _get_timeout_aware_callback(callback, release_op=None):
+    """
+    Return a pipeline callback for an op that may time out or expire.  PipelineErrors (such as
+    a PipelineTimeoutError or MessageExpiredError) are passed to the caller's callback in the
+    error keyword argument.  If release_op is given, it is called
+    with the op once the op has completed successfully, so the op can be recycled.  Ops
+    that fail are never released since the pipeline may still be holding on to them.
+    """
+
+    def pipeline_callback(call):
+        error = call.error
+        if error and not isinstance(error, PipelineError):
+            # TODO we need error semantics on the client
+            exit(1)
+        if release_op and not error:
+            release_op(call)
+        if callback:
+            callback(error=error)
+
+    return pipeline_callback
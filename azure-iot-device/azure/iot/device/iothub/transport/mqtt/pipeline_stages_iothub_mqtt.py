@@ -4,8 +4,9 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import copy
 import logging
-import json
+from azure.iot.device.common import payload_codecs
 from azure.iot.device.common.transport import pipeline_ops_base
 from azure.iot.device.common.transport.mqtt import pipeline_ops_mqtt
 from azure.iot.device.common.transport.mqtt import pipeline_events_mqtt
@@ -14,6 +15,7 @@ from azure.iot.device.iothub.models import Message, MethodRequest
 from azure.iot.device.iothub.transport import constant
 from azure.iot.device.iothub.transport import pipeline_ops_iothub
 from azure.iot.device.iothub.transport import pipeline_events_iothub
+from azure.iot.device.iothub.transport import pipeline_stages_iothub
 from . import mqtt_topic
 
 logger = logging.getLogger(__name__)
@@ -23,11 +25,21 @@ class IotHubMQTTConverter(PipelineStage):
     """
     PipelineStage which converts other Iot and IotHub operations into Mqtt operations.  This stage also
     converts mqtt pipeline events into Iot and IotHub pipeline events.
+
+    Method payloads, and message data that isn't already text or bytes, are encoded and decoded
+    with the codecs in codec_registry.
     """
 
-    def __init__(self):
+    def __init__(self, codec_registry=None):
+        """
+        Initializer for IotHubMQTTConverter objects.
+
+        :param CodecRegistry codec_registry: The codecs used to encode and decode payloads.
+          Defaults to payload_codecs.default_registry.
+        """
         super(IotHubMQTTConverter, self).__init__()
         self.feature_to_topic = {}
+        self.codec_registry = codec_registry or payload_codecs.default_registry
 
     def _run_op(self, op):
 
@@ -61,11 +73,26 @@ class IotHubMQTTConverter(PipelineStage):
         elif isinstance(op, pipeline_ops_iothub.SendTelemetry) or isinstance(
             op, pipeline_ops_iothub.SendOutputEvent
         ):
-            # Convert SendTelementry and SendOutputEvent operations into Mqtt Publish operations
-            topic = mqtt_topic.encode_properties(op.message, self.telemetry_topic)
+            # Convert SendTelementry and SendOutputEvent operations into Mqtt Publish operations.
+            # Fire and forget messages are published at QoS 0, so the broker doesn't acknowledge them.
+            message = op.message
+            (payload, content_type) = pipeline_stages_iothub.encode_message_data(
+                op, self.codec_registry
+            )
+            if content_type != message.content_type:
+                # The data was encoded using the default content type, which the service needs
+                # to know about.  Copy the message rather than changing the caller's object.
+                message = copy.copy(message)
+                message.content_type = content_type
+            topic = mqtt_topic.encode_properties(message, self.telemetry_topic)
             self.continue_with_different_op(
                 original_op=op,
-                new_op=pipeline_ops_mqtt.Publish(topic=topic, payload=op.message.data),
+                new_op=self._acquire_op(
+                    pipeline_ops_mqtt.Publish,
+                    topic=topic,
+                    payload=payload,
+                    qos=0 if op.fire_and_forget else 1,
+                ),
             )
 
         elif isinstance(op, pipeline_ops_iothub.SendMethodResponse):
@@ -73,9 +100,12 @@ class IotHubMQTTConverter(PipelineStage):
             topic = mqtt_topic.get_method_topic_for_publish(
                 op.method_response.request_id, str(op.method_response.status)
             )
-            payload = json.dumps(op.method_response.payload)
+            payload = self.codec_registry.encode(
+                payload_codecs.CONTENT_TYPE_JSON, op.method_response.payload
+            )
             self.continue_with_different_op(
-                original_op=op, new_op=pipeline_ops_mqtt.Publish(topic=topic, payload=payload)
+                original_op=op,
+                new_op=self._acquire_op(pipeline_ops_mqtt.Publish, topic=topic, payload=payload),
             )
 
         elif isinstance(op, pipeline_ops_base.EnableFeature):
@@ -131,9 +161,10 @@ class IotHubMQTTConverter(PipelineStage):
             elif mqtt_topic.is_method_topic(topic):
                 rid = mqtt_topic.get_method_request_id_from_topic(topic)
                 method_name = mqtt_topic.get_method_name_from_topic(topic)
-                method_received = MethodRequest(
-                    request_id=rid, name=method_name, payload=json.loads(event.payload)
+                payload = self.codec_registry.decode(
+                    payload_codecs.CONTENT_TYPE_JSON, event.payload
                 )
+                method_received = MethodRequest(request_id=rid, name=method_name, payload=payload)
                 self._handle_pipeline_event(pipeline_events_iothub.MethodRequest(method_received))
 
             else:
@@ -3,7 +3,11 @@
 # Licensed under the MIT License. See License.txt in the project root for
 # license information.
 # --------------------------------------------------------------------------
-from azure.iot.device.common.transport.pipeline_ops_base import PipelineOperation
+from azure.iot.device.common.transport.pipeline_ops_base import (
+    PipelineOperation,
+    PRIORITY_BULK,
+    PRIORITY_METHOD_RESPONSE,
+)
 
 
 class SetAuthProvider(PipelineOperation):
@@ -16,6 +20,8 @@ class SetAuthProvider(PipelineOperation):
     very IotHub-specific
     """
 
+    __slots__ = ("auth_provider",)
+
     def __init__(self, auth_provider, callback=None):
         """
         Initializer for SetAuthProvider objects.
@@ -39,6 +45,8 @@ class SetAuthProviderArgs(PipelineOperation):
     IotHub connections and would not apply to other types of client connections (such as a DPS client).
     """
 
+    __slots__ = ("device_id", "module_id", "hostname", "gateway_hostname", "ca_cert")
+
     def __init__(
         self,
         device_id,
@@ -78,7 +86,9 @@ class SendTelemetry(PipelineOperation):
     This operation is in the group of IoTHub operations because it is very specific to the IotHub client
     """
 
-    def __init__(self, message, callback=None):
+    __slots__ = ("message", "fire_and_forget", "encoded_data")
+
+    def __init__(self, message, callback=None, fire_and_forget=False):
         """
         Initializer for SendTelemetry objects.
 
@@ -86,10 +96,17 @@ class SendTelemetry(PipelineOperation):
         :param Function callback: The function that gets called when this operation is complete or has failed.
          The callback function must accept A PipelineOperation object which indicates the specific operation which
          has completed or failed.
+        :param bool fire_and_forget: If True, the message is sent without waiting for the service to
+         acknowledge it, and the operation completes as soon as the message has been handed to the
+         protocol client.  The message may be lost.
         """
         super(SendTelemetry, self).__init__(callback=callback)
         self.message = message
+        self.fire_and_forget = fire_and_forget
+        # Cache of the encoded message data.  See pipeline_stages_iothub.encode_message_data
+        self.encoded_data = None
         self.needs_connection = True
+        self.priority = PRIORITY_BULK
 
 
 class SendOutputEvent(PipelineOperation):
@@ -99,7 +116,9 @@ class SendOutputEvent(PipelineOperation):
     This operation is in the group of IoTHub operations because it is very specific to the IotHub client
     """
 
-    def __init__(self, message, callback=None):
+    __slots__ = ("message", "fire_and_forget", "encoded_data")
+
+    def __init__(self, message, callback=None, fire_and_forget=False):
         """
         Initializer for SendOutputEvent objects.
 
@@ -108,10 +127,17 @@ class SendOutputEvent(PipelineOperation):
         :param Function callback: The function that gets called when this operation is complete or has failed.
          The callback function must accept A PipelineOperation object which indicates the specific operation which
          has completed or failed.
+        :param bool fire_and_forget: If True, the message is sent without waiting for the service to
+         acknowledge it, and the operation completes as soon as the message has been handed to the
+         protocol client.  The message may be lost.
         """
         super(SendOutputEvent, self).__init__(callback=callback)
         self.message = message
+        self.fire_and_forget = fire_and_forget
+        # Cache of the encoded message data.  See pipeline_stages_iothub.encode_message_data
+        self.encoded_data = None
         self.needs_connection = True
+        self.priority = PRIORITY_BULK
 
 
 class SendMethodResponse(PipelineOperation):
@@ -121,6 +147,8 @@ class SendMethodResponse(PipelineOperation):
     This operation is in the group of IoTHub operations because it is very specific to the IoTHub client.
     """
 
+    __slots__ = ("method_response",)
+
     def __init__(self, method_response, callback=None):
         """
         Initializer for SendMethodResponse objects.
@@ -135,3 +163,4 @@ class SendMethodResponse(PipelineOperation):
         super(SendMethodResponse, self).__init__(callback=callback)
         self.method_response = method_response
         self.needs_connection = True
+        self.priority = PRIORITY_METHOD_RESPONSE
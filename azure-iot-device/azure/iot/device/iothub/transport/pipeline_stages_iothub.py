@@ -4,10 +4,188 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import array
+import bisect
+import calendar
+import collections
+import copy
+import datetime
 import logging
+import math
+import numbers
+import re
+import threading
+import time
+import six
+from azure.iot.device.common import payload_codecs
+from azure.iot.device.common.compression import cpu_time
 from azure.iot.device.common.transport import pipeline_ops_base
+from azure.iot.device.common.transport.pipeline_exceptions import MessageExpiredError
 from azure.iot.device.common.transport.pipeline_stages_base import PipelineStage
+from azure.iot.device.iothub.models import Message
 from . import pipeline_ops_iothub
+from . import pipeline_events_iothub
+
+logger = logging.getLogger(__name__)
+
+# Message content encodings which describe text, rather than an encoding of the payload bytes
+_TEXT_ENCODINGS = ("utf-8", "utf-16", "utf-32")
+
+_NAN = float("nan")
+
+# IoT Hub counts device-to-cloud messages against its quotas in chunks of this many bytes
+BILLING_UNIT_SIZE = 4 * 1024
+
+# An ISO 8601 date and time, with optional fractional seconds and UTC offset
+_ISO_DATETIME = re.compile(
+    r"^(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d+))?(Z|[+-]\d\d:?\d\d)?$"
+)
+
+
+def _decode_message_data(message, codec_registry):
+    """
+    Return the data of an outgoing message as a dict, decoding it with the codec for its
+    content_type (JSON if it doesn't have one) if necessary.  Returns None if the data isn't an
+    object or can't be decoded.
+    """
+    data = message.data
+    if isinstance(data, (six.text_type, six.binary_type)):
+        content_encoding = message.content_encoding
+        if content_encoding and content_encoding.lower() != "utf-8":
+            return None
+        try:
+            data = codec_registry.decode(
+                message.content_type or payload_codecs.CONTENT_TYPE_JSON, data
+            )
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+    return data
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _parse_deadband(deadband):
+    """
+    Return a (band, relative) tuple for a deadband given as a number or a percentage string.
+    """
+    relative = False
+    if isinstance(deadband, six.string_types):
+        text = deadband.strip()
+        relative = text.endswith("%")
+        try:
+            deadband = float(text.rstrip("%"))
+        except ValueError:
+            raise ValueError("Invalid deadband: {}".format(deadband))
+    if not _is_number(deadband) or math.isnan(deadband) or deadband < 0:
+        raise ValueError("Invalid deadband: {}".format(deadband))
+    return (float(deadband), relative)
+
+
+def get_message_expiry(op):
+    """
+    Return the time (in seconds since the epoch) at which the message in a SendTelemetry or
+    SendOutputEvent operation expires, or None if the operation doesn't have a message with an
+    expiry_time_utc.  expiry_time_utc can be a datetime (naive datetimes are taken to be UTC), a
+    date, or an ISO 8601 string.  Strings that can't be parsed are treated as no expiry.
+    """
+    if not (
+        isinstance(op, pipeline_ops_iothub.SendTelemetry)
+        or isinstance(op, pipeline_ops_iothub.SendOutputEvent)
+    ):
+        return None
+    expiry = op.message.expiry_time_utc
+    if not expiry:
+        return None
+    if isinstance(expiry, datetime.datetime):
+        offset = expiry.utcoffset()
+        if offset:
+            expiry = expiry - offset
+        return calendar.timegm(expiry.timetuple()) + expiry.microsecond / 1e6
+    if isinstance(expiry, datetime.date):
+        return float(calendar.timegm(expiry.timetuple()))
+    if isinstance(expiry, six.string_types):
+        return _parse_iso_datetime(expiry.strip())
+    return None
+
+
+def _parse_iso_datetime(text):
+    match = _ISO_DATETIME.match(text)
+    if not match:
+        logger.warning("Ignoring expiry_time_utc that isn't an ISO 8601 time: {}".format(text))
+        return None
+    fields = [int(field) for field in match.group(1, 2, 3, 4, 5, 6)]
+    seconds = calendar.timegm(tuple(fields) + (0, 0, 0))
+    if match.group(7):
+        seconds += float("0." + match.group(7))
+    zone = match.group(8)
+    if zone and zone != "Z":
+        zone = zone.replace(":", "")
+        offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+        seconds -= offset if zone[0] == "+" else -offset
+    return seconds
+
+
+def encode_message_data(op, codec_registry):
+    """
+    Return the (payload, content_type) to send for the message in a SendTelemetry or
+    SendOutputEvent operation (see CodecRegistry.encode_message_data).  The result is cached on
+    the operation, so that the stages which need the encoded payload (to compress it, to count its
+    billing units and to publish it) only encode it once between them.  The cache is not used if
+    the operation's message has been replaced or a different codec registry is asked for.
+    """
+    cached = op.encoded_data
+    if cached is not None and cached[0] is op.message and cached[1] is codec_registry:
+        return cached[2]
+    encoded = codec_registry.encode_message_data(op.message)
+    op.encoded_data = (op.message, codec_registry, encoded)
+    return encoded
+
+
+def get_billing_units(op, codec_registry=None):
+    """
+    Return the number of IoT Hub billing units (BILLING_UNIT_SIZE chunks of payload, and at least
+    1) used by the message in a SendTelemetry or SendOutputEvent operation, for use as the cost
+    function of a RateLimit stage.  All other operations count as 1 unit.
+
+    :param CodecRegistry codec_registry: The codecs used to encode message data that isn't text or
+      bytes.  Defaults to payload_codecs.default_registry.
+    """
+    if not (
+        isinstance(op, pipeline_ops_iothub.SendTelemetry)
+        or isinstance(op, pipeline_ops_iothub.SendOutputEvent)
+    ):
+        return 1
+    if op.message.data is None:
+        return 1
+    (data, _) = encode_message_data(op, codec_registry or payload_codecs.default_registry)
+    if isinstance(data, six.text_type):
+        data = data.encode("utf-8")
+    return max(1, (len(data) + BILLING_UNIT_SIZE - 1) // BILLING_UNIT_SIZE)
+
+
+def conflate_by_property(property_name):
+    """
+    Return a conflation key function (see ConflatingQueue) which gives telemetry and output
+    events the same key if they have the same value for a custom property.  Messages without the
+    property, and all other operations, are never replaced.
+
+    :param str property_name: The custom property, such as a sensor id.
+    """
+
+    def conflation_key(op):
+        if isinstance(op, pipeline_ops_iothub.SendTelemetry) or isinstance(
+            op, pipeline_ops_iothub.SendOutputEvent
+        ):
+            value = op.message.custom_properties.get(property_name)
+            if value is not None:
+                return (op.name, op.message.output_name, value)
+        return None
+
+    return conflation_key
 
 
 class UseSkAuthProvider(PipelineStage):
@@ -47,3 +225,700 @@ class UseSkAuthProvider(PipelineStage):
             )
         else:
             self.continue_op(op)
+
+
+class CompressPayloads(PipelineStage):
+    """
+    PipelineStage which compresses the payloads of outgoing messages and decompresses the
+    payloads of incoming messages.
+
+    Operations Handled:
+    * SendTelemetry
+    * SendOutputEvent
+
+    Operations Produced: None
+
+    Outgoing messages with payloads of at least min_size bytes are compressed using the stage's
+    codec (such as ZlibCodec), and their content_encoding is set to the codec's content_encoding.
+    The message is copied before it is changed, so the caller's Message object is left alone.
+    Text payloads are encoded with the message's content_encoding (or utf-8) first, and other
+    data is encoded with the codec for the message's content_type (see CodecRegistry).  Smaller
+    payloads, payloads that don't get any smaller, and messages that already have a
+    content_encoding that isn't a text encoding are sent as they are.
+
+    Incoming C2D and input messages whose content_encoding matches the codec's are decompressed
+    before they are passed up, and their content_encoding is cleared.
+
+    All other operations and events are passed on.
+    """
+
+    def __init__(self, codec, min_size=64, codec_registry=None):
+        """
+        Initializer for CompressPayloads objects.
+
+        :param codec: The codec used to compress and decompress payloads.
+        :param int min_size: The smallest payload, in bytes, that is compressed.
+        :param CodecRegistry codec_registry: The codecs used to encode message data that isn't
+          text or bytes before it is compressed.  Defaults to payload_codecs.default_registry.
+        """
+        super(CompressPayloads, self).__init__()
+        self.codec = codec
+        self.min_size = min_size
+        self.codec_registry = codec_registry or payload_codecs.default_registry
+        self.compressed_count = 0
+        self.skipped_count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_cpu_time = 0.0
+        self.decompressed_count = 0
+        self.decompress_error_count = 0
+        self.decompress_cpu_time = 0.0
+
+    def _run_op(self, op):
+        if isinstance(op, pipeline_ops_iothub.SendTelemetry) or isinstance(
+            op, pipeline_ops_iothub.SendOutputEvent
+        ):
+            compressed_message = self._compress_message(op)
+            if compressed_message:
+                op.message = compressed_message
+            else:
+                self.skipped_count += 1
+        self.continue_op(op)
+
+    def _compress_message(self, op):
+        """
+        Return a compressed copy of the op's message, or None if the message shouldn't be
+        compressed.
+        """
+        message = op.message
+        content_encoding = message.content_encoding
+        if content_encoding and content_encoding.lower() not in _TEXT_ENCODINGS:
+            return None
+
+        (data, content_type) = encode_message_data(op, self.codec_registry)
+        if isinstance(data, six.text_type):
+            data = data.encode(content_encoding or "utf-8")
+        if len(data) < self.min_size:
+            return None
+
+        start = cpu_time()
+        compressed_data = self.codec.compress(data)
+        self.compress_cpu_time += cpu_time() - start
+        if len(compressed_data) >= len(data):
+            return None
+
+        self.compressed_count += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(compressed_data)
+        compressed_message = copy.copy(message)
+        compressed_message.data = compressed_data
+        compressed_message.content_encoding = self.codec.content_encoding
+        compressed_message.content_type = content_type
+        return compressed_message
+
+    def _handle_pipeline_event(self, event):
+        if isinstance(event, pipeline_events_iothub.C2DMessageEvent) or isinstance(
+            event, pipeline_events_iothub.InputMessageEvent
+        ):
+            if event.message.content_encoding == self.codec.content_encoding:
+                self._decompress_message(event.message)
+        PipelineStage._handle_pipeline_event(self, event)
+
+    def _decompress_message(self, message):
+        start = cpu_time()
+        try:
+            message.data = self.codec.decompress(message.data)
+        except ValueError:
+            logger.warning(
+                "{}: unable to decompress incoming {} message.  Passing it up as is.".format(
+                    self.name, message.content_encoding
+                )
+            )
+            self.decompress_error_count += 1
+        else:
+            message.content_encoding = None
+            self.decompressed_count += 1
+        self.decompress_cpu_time += cpu_time() - start
+
+    def get_stats(self):
+        """
+        Return the number of payloads compressed and skipped, the number of bytes before and
+        after compression, the compression ratio (bytes before divided by bytes after) and the
+        CPU seconds spent compressing and decompressing.
+        """
+        return {
+            "compressed": self.compressed_count,
+            "skipped": self.skipped_count,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "compression_ratio": float(self.bytes_in) / self.bytes_out if self.bytes_out else 0.0,
+            "compress_cpu_seconds": self.compress_cpu_time,
+            "decompressed": self.decompressed_count,
+            "decompress_errors": self.decompress_error_count,
+            "decompress_cpu_seconds": self.decompress_cpu_time,
+        }
+
+
+class DropExpiredMessages(PipelineStage):
+    """
+    PipelineStage which fails operations whose message has expired instead of sending them.
+
+    Operations Handled:
+    * SendTelemetry
+    * SendOutputEvent
+
+    Operations Produced: None
+
+    IoT Hub discards messages that arrive after their expiry_time_utc, so sending them only
+    wastes bandwidth.  This stage should be just above the stage that turns messages into
+    protocol operations, so that the check happens right before the message is sent.  Messages
+    that have expired are completed with a MessageExpiredError.  Queues higher in the pipeline
+    can also drop expired messages in bulk (see ConflatingQueue).
+
+    All other operations are passed on.
+    """
+
+    def __init__(self, clock=time.time):
+        """
+        Initializer for DropExpiredMessages objects.
+
+        :param Function clock: Function returning the current time in seconds since the epoch.
+        """
+        super(DropExpiredMessages, self).__init__()
+        self.clock = clock
+        self.expired_count = 0
+
+    def _run_op(self, op):
+        expiry = get_message_expiry(op)
+        if expiry is not None and expiry <= self.clock():
+            logger.info("{}({}): message has expired.  failing.".format(self.name, op.name))
+            self.expired_count += 1
+            op.error = MessageExpiredError("{} expired before it could be sent".format(op.name))
+            self.complete_op(op)
+        else:
+            self.continue_op(op)
+
+    def get_stats(self):
+        return {"expired": self.expired_count}
+
+
+class DropDuplicateMessages(PipelineStage):
+    """
+    PipelineStage which drops incoming C2D and input messages that have already been received.
+
+    Operations Handled: None
+
+    Operations Produced: None
+
+    Messages can be delivered more than once (for example, a QoS 1 message that is redelivered
+    after a reconnect).  This stage remembers the message_id of the last max_entries messages it
+    passed up, in a least recently used order, and drops any message whose message_id it has
+    seen.  Lookups, inserts and evictions are all O(1), and memory is capped by max_entries.  If
+    window is given, an id is also forgotten once it is more than window seconds old.  Messages
+    without a message_id are always passed up.
+
+    All other events are passed up, and all operations are passed down.
+    """
+
+    def __init__(self, max_entries=1024, window=None, clock=time.time):
+        """
+        Initializer for DropDuplicateMessages objects.
+
+        :param int max_entries: The number of message ids to remember.
+        :param float window: Optional number of seconds to remember each message id for.
+        :param Function clock: Function returning the current time in seconds.
+        """
+        super(DropDuplicateMessages, self).__init__()
+        self.max_entries = max_entries
+        self.window = window
+        self.clock = clock
+        # Maps each message id to the time it was last seen, least recently seen first
+        self._seen = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicate_count = 0
+        self.passed_count = 0
+
+    def _run_op(self, op):
+        self.continue_op(op)
+
+    def _handle_pipeline_event(self, event):
+        if isinstance(event, pipeline_events_iothub.C2DMessageEvent) or isinstance(
+            event, pipeline_events_iothub.InputMessageEvent
+        ):
+            message_id = event.message.message_id
+            if message_id is not None and self._is_duplicate(message_id):
+                logger.info(
+                    "{}({}): dropping duplicate message {}".format(
+                        self.name, event.name, message_id
+                    )
+                )
+                self.duplicate_count += 1
+                return
+            self.passed_count += 1
+        PipelineStage._handle_pipeline_event(self, event)
+
+    def _is_duplicate(self, message_id):
+        """
+        Return True if the message id has been seen (within the window), and record that it has
+        been seen now.
+        """
+        now = self.clock()
+        with self._lock:
+            if self.window is not None:
+                # The least recently seen ids are first, so stop at the first one in the window
+                while self._seen and now - next(six.itervalues(self._seen)) > self.window:
+                    self._seen.popitem(last=False)
+            seen = self._seen.pop(message_id, None)
+            self._seen[message_id] = now
+            if seen is None:
+                while len(self._seen) > self.max_entries:
+                    self._seen.popitem(last=False)
+                return False
+            return True
+
+    def get_stats(self):
+        return {
+            "duplicates": self.duplicate_count,
+            "passed": self.passed_count,
+            "entries": len(self._seen),
+        }
+
+
+class _AggregationSeries(object):
+    """
+    The readings that an AggregateTelemetry stage has collected for one key on one output.
+    Each field maps to a pair of arrays holding the time and value of each reading, in the order
+    they arrived.
+    """
+
+    __slots__ = ("output_name", "key", "fields")
+
+    def __init__(self, output_name, key):
+        self.output_name = output_name
+        self.key = key
+        self.fields = {}
+
+
+class AggregateTelemetry(PipelineStage):
+    """
+    PipelineStage which replaces raw telemetry readings with periodic summaries of them.
+
+    Operations Handled:
+    * SendTelemetry
+    * SendOutputEvent
+    * Disconnect (sends summaries of the readings collected so far)
+
+    Operations Produced:
+    * SendTelemetry
+    * SendOutputEvent
+
+    Outgoing messages whose data is a JSON object (or a dict) of numbers are treated as readings.
+    Their values are collected per key (the value of the key_property custom property) and
+    output, and the operation is completed right away.  Readings are summarized over tumbling
+    windows of window seconds, or over sliding windows of window seconds that advance every
+    slide seconds.  When a window closes, one summary message is sent for each key with readings
+    in the window.  Its data is an object like:
+
+        {"window_start": 1570000000.0, "window_end": 1570000060.0,
+         "fields": {"temperature": {"count": 60, "min": 20.5, "max": 21.5, "mean": 21.0}}}
+
+    The summary's custom_properties only contain the key.  Messages for keys in
+    pass_through_keys, and messages that aren't made up of numeric readings, are passed on as
+    they are.  Windows are closed by a timer on the pipeline's timer wheel.  A Disconnect
+    operation sends summaries of every window that is still open before it is passed on.  So
+    does an unexpected disconnection, so that readings aren't left in open windows while the
+    connection is down.  Those summaries wait in the queues of the lower stages until the
+    connection is back.
+
+    All other operations are passed on.
+    """
+
+    def __init__(
+        self,
+        window=60.0,
+        slide=None,
+        key_property="key",
+        pass_through_keys=(),
+        codec_registry=None,
+        clock=time.time,
+    ):
+        """
+        Initializer for AggregateTelemetry objects.
+
+        :param float window: The length of each window, in seconds.
+        :param float slide: For sliding windows, the number of seconds between the end of one
+          window and the end of the next.  If not given, windows are tumbling (they don't overlap).
+        :param str key_property: The custom property which identifies the series a message
+          belongs to.  Messages without it are summarized together.
+        :param pass_through_keys: Keys whose messages are sent as they are.
+        :param CodecRegistry codec_registry: The codecs used to decode message data.  Defaults to
+          payload_codecs.default_registry.
+        :param Function clock: Function returning the current time in seconds.
+
+        :raises: ValueError if window isn't positive, or slide isn't between 0 and window.
+        """
+        super(AggregateTelemetry, self).__init__()
+        if window <= 0:
+            raise ValueError("window must be greater than 0")
+        if slide is not None and not 0 < slide <= window:
+            raise ValueError("slide must be greater than 0 and no greater than window")
+        self.window = float(window)
+        self.slide = float(slide or window)
+        self.key_property = key_property
+        self.pass_through_keys = frozenset(pass_through_keys)
+        self.codec_registry = codec_registry or payload_codecs.default_registry
+        self.clock = clock
+        self._series = {}
+        self._next_close = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self.aggregated_count = 0
+        self.passed_through_count = 0
+        self.summary_count = 0
+        self.summary_error_count = 0
+
+    def _run_op(self, op):
+        if isinstance(op, pipeline_ops_iothub.SendTelemetry) or isinstance(
+            op, pipeline_ops_iothub.SendOutputEvent
+        ):
+            key = self._get_key(op.message)
+            readings = None
+            if key not in self.pass_through_keys:
+                readings = self._get_readings(op.message)
+            if readings is None:
+                self.passed_through_count += 1
+                self.continue_op(op)
+                return
+            now = self.clock()
+            with self._lock:
+                summaries = self._close_windows(now)
+                self._add_readings(op.message.output_name, key, readings, now)
+                self._schedule_close()
+                self.aggregated_count += 1
+            self._send_summaries(summaries)
+            self.complete_op(op)
+
+        elif isinstance(op, pipeline_ops_base.Disconnect):
+            with self._lock:
+                summaries = self._close_all(self.clock())
+            self._send_summaries(summaries)
+            self.continue_op(op)
+
+        else:
+            self.continue_op(op)
+
+    def _get_key(self, message):
+        if self.key_property:
+            return message.custom_properties.get(self.key_property)
+        return None
+
+    def _get_readings(self, message):
+        """
+        Return a list of (field, value) pairs for the readings in a message, or None if the
+        message should be passed on.
+        """
+        data = _decode_message_data(message, self.codec_registry)
+        if not data:
+            return None
+        for value in six.itervalues(data):
+            if not _is_number(value):
+                return None
+        return list(six.iteritems(data))
+
+    def _add_readings(self, output_name, key, readings, now):
+        series = self._series.get((output_name, key))
+        if series is None:
+            series = self._series[(output_name, key)] = _AggregationSeries(output_name, key)
+        for (field, value) in readings:
+            arrays = series.fields.get(field)
+            if arrays is None:
+                arrays = series.fields[field] = (array.array("d"), array.array("d"))
+            arrays[0].append(now)
+            arrays[1].append(value)
+        if self._next_close is None:
+            self._next_close = (math.floor(now / self.slide) + 1) * self.slide
+
+    def _close_windows(self, now):
+        """
+        Close every window that ended at or before now, and return the summaries to send.  Must be
+        called with the lock held.
+        """
+        summaries = []
+        while self._next_close is not None and now >= self._next_close:
+            end = self._next_close
+            summaries.extend(self._summarize(end - self.window, end))
+            # Drop the readings that no later window includes
+            self._discard_before(end + self.slide - self.window)
+            self._next_close = end + self.slide if self._series else None
+        return summaries
+
+    def _close_all(self, now):
+        """
+        Summarize every reading that is being held, whether or not its window has ended, and
+        return the summaries to send.  Must be called with the lock held.
+        """
+        if self._next_close is None:
+            return []
+        summaries = self._summarize(self._next_close - self.window, now, include_all=True)
+        self._series.clear()
+        self._next_close = None
+        if self._timer:
+            self.pipeline_root.timer_wheel.cancel(self._timer)
+            self._timer = None
+        return summaries
+
+    def _summarize(self, start, end, include_all=False):
+        summaries = []
+        for series in six.itervalues(self._series):
+            fields = {}
+            for (field, (times, values)) in six.iteritems(series.fields):
+                first = bisect.bisect_left(times, start)
+                last = len(times) if include_all else bisect.bisect_left(times, end)
+                if last > first:
+                    window_values = values[first:last]
+                    fields[field] = {
+                        "count": len(window_values),
+                        "min": min(window_values),
+                        "max": max(window_values),
+                        "mean": math.fsum(window_values) / len(window_values),
+                    }
+            if fields:
+                data = {"window_start": start, "window_end": end, "fields": fields}
+                summaries.append(self._create_summary(series, data))
+        return summaries
+
+    def _discard_before(self, cutoff):
+        for series_key in list(self._series):
+            series = self._series[series_key]
+            for field in list(series.fields):
+                (times, values) = series.fields[field]
+                count = bisect.bisect_left(times, cutoff)
+                del times[:count]
+                del values[:count]
+                if not times:
+                    del series.fields[field]
+            if not series.fields:
+                del self._series[series_key]
+
+    def _create_summary(self, series, data):
+        message = Message(
+            data,
+            content_encoding="utf-8",
+            content_type=payload_codecs.CONTENT_TYPE_JSON,
+        )
+        if series.key is not None:
+            message.custom_properties[self.key_property] = series.key
+        message.output_name = series.output_name
+        return message
+
+    def _schedule_close(self):
+        """
+        Make sure a timer is set for the end of the next window.  Must be called with the lock held.
+        """
+        if self._next_close is not None and self._timer is None:
+            self._timer = self.pipeline_root.timer_wheel.schedule(
+                self._next_close, self._on_close_timer
+            )
+
+    def _on_close_timer(self):
+        with self._lock:
+            self._timer = None
+            summaries = self._close_windows(self.clock())
+            self._schedule_close()
+        self._send_summaries(summaries)
+
+    def _send_summaries(self, summaries):
+        for message in summaries:
+            if message.output_name:
+                op = self._acquire_op(
+                    pipeline_ops_iothub.SendOutputEvent,
+                    message=message,
+                    callback=self._on_summary_sent,
+                )
+            else:
+                op = self._acquire_op(
+                    pipeline_ops_iothub.SendTelemetry,
+                    message=message,
+                    callback=self._on_summary_sent,
+                )
+            self.summary_count += 1
+            self.continue_op(op)
+
+    def _on_summary_sent(self, op):
+        if op.error:
+            logger.warning("{}: unable to send telemetry summary: {}".format(self.name, op.error))
+            self.summary_error_count += 1
+        else:
+            self._release_op(op)
+
+    def on_disconnected(self):
+        with self._lock:
+            summaries = self._close_all(self.clock())
+        if summaries:
+            logger.info(
+                "{}: transport disconnected.  sending {} open window summaries".format(
+                    self.name, len(summaries)
+                )
+            )
+        self._send_summaries(summaries)
+        PipelineStage.on_disconnected(self)
+
+    def get_stats(self):
+        """
+        Return the number of messages aggregated and passed through, the number of summaries sent
+        and the number that failed, and the number of readings waiting for their window to close.
+        """
+        with self._lock:
+            pending = sum(
+                len(times)
+                for series in six.itervalues(self._series)
+                for (times, values) in six.itervalues(series.fields)
+            )
+        return {
+            "aggregated": self.aggregated_count,
+            "passed_through": self.passed_through_count,
+            "summaries": self.summary_count,
+            "summary_errors": self.summary_error_count,
+            "pending_readings": pending,
+        }
+
+
+class ApplyDeadbands(PipelineStage):
+    """
+    PipelineStage which only sends telemetry when it has changed by more than a deadband
+    ("report by exception").
+
+    Operations Handled:
+    * SendTelemetry
+    * SendOutputEvent
+
+    Operations Produced: None
+
+    Each deadband applies to one property, which is looked up in the message's data (if it is a
+    JSON object or a dict) and then in its custom_properties.  The last values sent for each key
+    (the value of the key_property custom property) and output are kept in a table.  A message
+    is sent if nothing has been sent for its key yet, if any of its properties has moved outside
+    its deadband around the last value sent, or if more than max_silence seconds have passed
+    since the last message was sent for its key.  Otherwise the operation is completed without
+    sending the message.  Messages that don't have any of the properties are always sent.
+
+    All other operations are passed on.
+    """
+
+    def __init__(
+        self, deadbands, max_silence=None, key_property="key", codec_registry=None, clock=time.time
+    ):
+        """
+        Initializer for ApplyDeadbands objects.
+
+        :param dict deadbands: A dict mapping each property name to its deadband.  Numbers are
+          absolute deadbands.  Strings ending in "%" (such as "2.5%") are deadbands relative to
+          the last value sent.
+        :param float max_silence: The longest time, in seconds, to go without sending a message for
+          a key.  By default there is no limit.
+        :param str key_property: The custom property which identifies the series a message
+          belongs to.  Messages without it share one entry in the table.
+        :param CodecRegistry codec_registry: The codecs used to decode message data.  Defaults to
+          payload_codecs.default_registry.
+        :param Function clock: Function returning the current time in seconds.
+
+        :raises: ValueError if a deadband isn't a non-negative number or percentage.
+        """
+        super(ApplyDeadbands, self).__init__()
+        self.properties = sorted(deadbands)
+        self._bands = array.array("d")
+        self._relative = []
+        for name in self.properties:
+            (band, relative) = _parse_deadband(deadbands[name])
+            self._bands.append(band)
+            self._relative.append(relative)
+        self.max_silence = max_silence
+        self.key_property = key_property
+        self.codec_registry = codec_registry or payload_codecs.default_registry
+        self.clock = clock
+        # Maps (output_name, key) to (time last sent, array of the last values sent, with NaN
+        # for properties that haven't been sent)
+        self._last_sent = {}
+        self._lock = threading.Lock()
+        self.forwarded_count = 0
+        self.suppressed_count = 0
+
+    def _run_op(self, op):
+        if isinstance(op, pipeline_ops_iothub.SendTelemetry) or isinstance(
+            op, pipeline_ops_iothub.SendOutputEvent
+        ):
+            if self._should_send(op.message):
+                self.forwarded_count += 1
+                self.continue_op(op)
+            else:
+                self.suppressed_count += 1
+                self.complete_op(op)
+        else:
+            self.continue_op(op)
+
+    def _get_values(self, message):
+        """
+        Return an array with the value of each property in the message, with NaN for properties
+        that it doesn't have, or None if it doesn't have any of them.
+        """
+        data = _decode_message_data(message, self.codec_registry) or {}
+        values = array.array("d")
+        found = False
+        for name in self.properties:
+            value = data.get(name)
+            if value is None:
+                value = message.custom_properties.get(name)
+                if isinstance(value, six.string_types):
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        value = None
+            if _is_number(value):
+                values.append(value)
+                found = True
+            else:
+                values.append(_NAN)
+        return values if found else None
+
+    def _should_send(self, message):
+        values = self._get_values(message)
+        if values is None:
+            return True
+        key = message.custom_properties.get(self.key_property) if self.key_property else None
+        now = self.clock()
+        with self._lock:
+            last = self._last_sent.get((message.output_name, key))
+            if last is None or self._is_exception(last, values, now):
+                if last is not None:
+                    # Properties missing from this message keep their last sent values
+                    for (i, value) in enumerate(values):
+                        if math.isnan(value):
+                            values[i] = last[1][i]
+                self._last_sent[(message.output_name, key)] = (now, values)
+                return True
+            return False
+
+    def _is_exception(self, last, values, now):
+        (last_time, last_values) = last
+        if self.max_silence is not None and now - last_time >= self.max_silence:
+            return True
+        for (i, value) in enumerate(values):
+            if math.isnan(value):
+                continue
+            last_value = last_values[i]
+            if math.isnan(last_value):
+                return True
+            band = self._bands[i] * abs(last_value) / 100.0 if self._relative[i] else self._bands[i]
+            if abs(value - last_value) > band:
+                return True
+        return False
+
+    def get_stats(self):
+        """
+        Return the number of messages sent and suppressed, and the number of keys in the table.
+        """
+        return {
+            "forwarded": self.forwarded_count,
+            "suppressed": self.suppressed_count,
+            "keys": len(self._last_sent),
+        }
@@ -5,13 +5,19 @@ human intervention, enabling customers to provision millions of devices in a sec
 
 """
 from .sk_provisioning_device_client import SymmetricKeyProvisioningDeviceClient
-from .security import SymmetricKeySecurityClient
+from .security import SymmetricKeySecurityClient, DerivedKeyEngine, derive_device_key
 from .models import RegistrationResult
 from .provisioning_device_client_factory import create_from_security_client
+from .bulk_provisioning import register_devices
+from .registration_cache import RegistrationCache
 
 __all__ = [
     "SymmetricKeyProvisioningDeviceClient",
     "SymmetricKeySecurityClient",
+    "DerivedKeyEngine",
+    "derive_device_key",
     "RegistrationResult",
     "create_from_security_client",
+    "register_devices",
+    "RegistrationCache",
 ]
@@ -0,0 +1,12 @@
+"""Azure Provisioning Device Library - Asynchronous
+
+This library provides asynchronous functionality for registering devices with the Device
+Provisioning Service.
+"""
+
+from .async_sk_provisioning_device_client import (
+    SymmetricKeyProvisioningDeviceClient,
+    create_from_security_client,
+)
+
+__all__ = ["SymmetricKeyProvisioningDeviceClient", "create_from_security_client"]
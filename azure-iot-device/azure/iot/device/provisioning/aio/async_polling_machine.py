@@ -0,0 +1,192 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains the asynchronous equivalent of the polling machine, which sends the
+registration request and polls the provisioning service until the registration is done.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from azure.iot.device.common import asyncio_compat
+from ..transport import constant
+from ..internal.request_response_provider import RequestResponseProvider
+from ..internal.polling_machine import (
+    POS_STATUS_CODE_IN_TOPIC,
+    decode_complete_json_response,
+    decode_json_response,
+    get_polling_interval,
+    polling_scheduler,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _set_future_result(future, result):
+    # The future is gone if the coroutine waiting on it was cancelled
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_future_exception(future, exception):
+    if not future.done():
+        future.set_exception(exception)
+
+
+class AsyncPollingMachine(object):
+    """
+    Registers a device with the provisioning service, as a coroutine running on the caller's
+    event loop.  Waiting between polls is done with asyncio.sleep rather than timers or threads,
+    so any number of registrations can share one loop.
+
+    :ivar on_throttled: Event handler called with the number of seconds the service asked us to
+      wait when it throttles a request.
+    :type on_throttled: Function
+    """
+
+    def __init__(self, state_based_provider):
+        """
+        :param state_based_provider: The state machine based provider.
+        """
+        self.on_throttled = None
+        self._task = None
+        self._request_response_provider = RequestResponseProvider(
+            state_based_provider, polling_scheduler
+        )
+
+    async def register(self):
+        """
+        Register the device with the provisioning service.
+
+        :returns: The RegistrationResult, which has a status of "assigned" or "failed".
+        :raises: ValueError if the service returned an error or a request timed out.
+        :raises: asyncio.CancelledError if the registration was cancelled.
+        :raises: RuntimeError if a registration is already in progress.
+        """
+        if self._task is not None:
+            raise RuntimeError("A registration is already in progress.")
+        logger.info("register called from async polling machine")
+        # Run as a separate task so that cancel can stop it from another coroutine
+        self._task = asyncio_compat.create_task(self._register())
+        try:
+            return await self._task
+        finally:
+            self._task = None
+
+    async def cancel(self):
+        """
+        Cancel the registration in progress, and wait for it to disconnect from the service.
+
+        :raises: RuntimeError if there is no registration in progress.
+        """
+        task = self._task
+        if task is None:
+            raise RuntimeError("There is no registration process to cancel.")
+        logger.info("cancel called from async polling machine")
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _register(self):
+        provider = self._request_response_provider
+        try:
+            await self._wait_for_callback(
+                provider.subscribe, topic=constant.SUBSCRIBE_TOPIC_PROVISIONING
+            )
+            operation_id = None
+            polls_without_retry_after = 0
+            while True:
+                rid = str(uuid.uuid4())
+                if operation_id is None:
+                    logger.info("Sending registration request")
+                    topic = constant.PUBLISH_TOPIC_REGISTRATION.format(rid)
+                else:
+                    logger.info("Querying operation status from async polling machine")
+                    topic = constant.PUBLISH_TOPIC_QUERYING.format(rid, operation_id)
+                (url_portion, key_values_dict, response) = await self._send_request(rid, topic)
+
+                status_code = int(url_portion.split("/")[POS_STATUS_CODE_IN_TOPIC], 10)
+                retry_after = (
+                    None
+                    if "retry-after" not in key_values_dict
+                    else str(key_values_dict["retry-after"][0])
+                )
+                if status_code >= 429:
+                    # Try the same request again after waiting
+                    self._report_throttled(retry_after)
+                elif status_code >= 300:  # pure failure
+                    raise ValueError("Incoming message failure")
+                else:
+                    result = decode_json_response(rid, retry_after, response)
+                    if result.status == "assigned" or result.status == "failed":
+                        logger.info("Complete register from async polling machine")
+                        return decode_complete_json_response(result, response)
+                    elif result.status != "assigning":
+                        raise ValueError("Other types of failure have occurred.", response)
+                    operation_id = result.operation_id
+
+                polling_interval = get_polling_interval(retry_after, polls_without_retry_after)
+                if retry_after is None:
+                    polls_without_retry_after += 1
+                logger.info("Waiting for {} secs".format(polling_interval))
+                await asyncio.sleep(polling_interval)
+        finally:
+            await self._wait_for_callback(provider.disconnect)
+
+    async def _send_request(self, rid, topic):
+        """
+        Send a request and wait for its response, which is returned as a (url_portion,
+        key_values_dict, response) tuple.  The request's deadline is kept on the shared polling
+        scheduler, which fails the wait if the deadline passes first.
+        """
+        loop = asyncio_compat.get_running_loop()
+        future = asyncio_compat.create_future(loop)
+
+        def callback(*args):
+            loop.call_soon_threadsafe(_set_future_result, future, args)
+
+        def on_timeout(rid):
+            logger.error("Time is up for query timer")
+            loop.call_soon_threadsafe(
+                _set_future_exception, future, ValueError("Time is up for query timer")
+            )
+
+        try:
+            self._request_response_provider.send_request(
+                rid=rid,
+                topic=topic,
+                request=" ",
+                callback=callback,
+                deadline=time.time() + constant.DEFAULT_TIMEOUT_INTERVAL,
+                on_timeout=on_timeout,
+            )
+            return await future
+        finally:
+            # Forget the request if it timed out or was cancelled
+            self._request_response_provider.cancel_request(rid)
+
+    async def _wait_for_callback(self, fn, **kwargs):
+        """
+        Call a callback-based provider function and wait for the callback.  The callback can be
+        called from any thread.  Returns the arguments it was called with.
+        """
+        loop = asyncio_compat.get_running_loop()
+        future = asyncio_compat.create_future(loop)
+
+        def callback(*args):
+            loop.call_soon_threadsafe(_set_future_result, future, args)
+
+        fn(callback=callback, **kwargs)
+        return await future
+
+    def _report_throttled(self, retry_after):
+        handler = self.on_throttled
+        if handler:
+            handler(
+                constant.DEFAULT_POLLING_INTERVAL if retry_after is None else int(retry_after, 10)
+            )
@@ -0,0 +1,107 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains the asynchronous Provisioning Device Client which uses Symmetric Key
+authentication.
+"""
+
+import logging
+from ..provisioning_device_client import ProvisioningDeviceClient
+from ..provisioning_device_client_factory import create_state_based_provider
+from .async_polling_machine import AsyncPollingMachine
+
+logger = logging.getLogger(__name__)
+
+
+class SymmetricKeyProvisioningDeviceClient(ProvisioningDeviceClient):
+    """
+    Client which can be used to run the registration of a device with provisioning service
+    using Symmetric Key authentication, from a coroutine.
+    """
+
+    def __init__(self, mqtt_state_based_provider, registration_cache=None):
+        """
+        Initializer for the asynchronous Symmetric Key Registration Client
+        :param mqtt_state_based_provider: The state-based protocol provider. As of now this only supports MQTT.
+        :param registration_cache: Optional RegistrationCache used to skip the provisioning service
+        for devices that have already been assigned to a hub.
+        """
+        super().__init__(mqtt_state_based_provider)
+        self._polling_machine = AsyncPollingMachine(mqtt_state_based_provider)
+        self._registration_cache = registration_cache
+
+    async def register(self, use_cache=True):
+        """
+        Register the device with the provisioning service.
+        The coroutine completes when the registration process has completed successfully or the
+        attempt has resulted in a failure. Before returning the client will also disconnect from
+        the Hub.  Cancelling the coroutine cancels the registration.
+
+        If the client has a registration cache and it holds an assigned result for this device, that
+        result is returned straight away without contacting the provisioning service.  If connecting
+        to the cached hub then fails with an authentication or not-found error, call register again
+        with use_cache=False to re-provision the device and replace the cached result.
+
+        :param use_cache: Whether a cached result can be returned.
+        :returns: The RegistrationResult, or None if the registration process ran into an error.
+        """
+        security_client = self._transport.security_client if self._registration_cache else None
+        if security_client and use_cache:
+            result = self._registration_cache.get(
+                security_client.id_scope, security_client.registration_id
+            )
+            if result is not None:
+                logger.info("Using cached registration with Hub")
+                return result
+
+        logger.info("Registering with Hub...")
+        try:
+            result = await self._polling_machine.register()
+        except ValueError as e:
+            logger.info(e)
+            return None
+
+        if result.status == "assigned":
+            logger.info("Successfully registered with Hub")
+        else:  # There be other statuses
+            logger.error("Failed registering with Hub")
+        if security_client:
+            self._registration_cache.set(
+                security_client.id_scope, security_client.registration_id, result
+            )
+        return result
+
+    async def cancel(self):
+        """
+        Cancel the registration in progress.  The coroutine completes when the cancellation process
+        has completed.  The cancelled register call raises asyncio.CancelledError.
+
+        In case there is no registration in process it will throw an error as there is
+        no registration process to cancel.
+        """
+        logger.info("Cancelling the current registration process")
+        await self._polling_machine.cancel()
+        logger.info("Successfully cancelled the current registration process")
+
+
+def create_from_security_client(
+    provisioning_host, security_client, transport_choice, registration_cache=None
+):
+    """
+    Creates an asynchronous registration client.
+    :param provisioning_host: Host running the Device Provisioning Service. Can be found in the Azure portal in the
+    Overview tab as the string Global device endpoint
+    :param security_client: Instance of Security client object which can be either of SymmetricKeySecurityClient,  TPMSecurtiyClient or X509SecurityClient
+    :param transport_choice: A string representing the transport the user wants
+    :param registration_cache: Optional RegistrationCache used to skip the provisioning service for devices
+    that have already been assigned to a hub.
+    :return: A specific registration client based on parameters and validations.
+    """
+    mqtt_state_based_provider = create_state_based_provider(
+        provisioning_host, security_client, transport_choice
+    )
+    return SymmetricKeyProvisioningDeviceClient(
+        mqtt_state_based_provider, registration_cache=registration_cache
+    )
@@ -0,0 +1,146 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""
+This module contains an engine which registers large batches of devices with the Device
+Provisioning Service using Symmetric Key authentication.
+"""
+import itertools
+import logging
+import threading
+import time
+from six.moves import queue
+from azure.iot.device.common.transport.token_bucket import TokenBucket
+from .internal.polling_machine import PollingMachine
+from .security.sk_security_client import SymmetricKeySecurityClient
+from .transport.state_based_mqtt_provider import StateBasedMQTTProvider
+
+logger = logging.getLogger(__name__)
+
+
+def register_devices(
+    provisioning_host,
+    id_scope,
+    devices,
+    max_concurrency=32,
+    rate=None,
+    burst=None,
+    registration_cache=None,
+):
+    """
+    Register many devices with the provisioning service, several at a time.
+
+    This is a generator.  It yields a (registration_id, result, error) tuple for each device as
+    soon as its registration finishes, so results come back in the order registrations complete
+    rather than the order of devices.  result is the RegistrationResult (which can have a status
+    of "failed"), or None if the registration ran into an error, in which case error is the
+    exception.
+
+    At most max_concurrency registrations (each with its own connection) are in progress at once,
+    and devices are only read from the iterable as registrations are started, so a batch of any
+    size can be registered without holding it all in memory.  If rate is given, no more than rate
+    registrations are started per second.  Whenever the service throttles a request, no new
+    registrations are started until its retry-after time has passed (the throttled registration
+    itself waits and retries on its own).  If the generator is closed before it finishes, the
+    registrations that are still in progress are cancelled.
+
+    If registration_cache is given, devices with a cached assigned result are yielded straight
+    away without contacting the provisioning service, and new results are added to the cache.
+
+    :param str provisioning_host: Host running the Device Provisioning Service.
+    :param str id_scope: The ID scope of the provisioning service.
+    :param devices: Iterable of (registration_id, symmetric_key) tuples.  For devices in a group
+      enrollment, DerivedKeyEngine.derive_many returns these from the registration IDs.
+    :param int max_concurrency: The number of registrations in progress at the same time.
+    :param float rate: Optional number of registrations to start per second.
+    :param float burst: With rate, the number of registrations that can be started at once.
+      Defaults to rate.
+    :param registration_cache: Optional RegistrationCache.
+    """
+    devices = iter(devices)
+    bucket = TokenBucket(rate, burst) if rate else None
+    completions = queue.Queue()
+    # Maps a sequence number (registration ids in the batch might not be unique) to the
+    # registration id and polling machine of each registration in progress
+    in_flight = {}
+    sequence = itertools.count()
+    lock = threading.Lock()
+    # The time before which no new registration is started, because the service throttled us
+    throttled_until = [0.0]
+
+    def on_throttled(retry_after):
+        logger.info(
+            "Provisioning service throttled a request.  Pausing for {} secs".format(retry_after)
+        )
+        with lock:
+            throttled_until[0] = max(throttled_until[0], time.time() + retry_after)
+
+    def start(registration_id, symmetric_key):
+        number = next(sequence)
+
+        def on_register_complete(result=None, error=None):
+            completions.put((number, result, error))
+
+        try:
+            security_client = SymmetricKeySecurityClient(registration_id, symmetric_key, id_scope)
+            polling_machine = PollingMachine(
+                StateBasedMQTTProvider(provisioning_host, security_client)
+            )
+            polling_machine.on_throttled = on_throttled
+            in_flight[number] = (registration_id, polling_machine)
+            polling_machine.register(callback=on_register_complete)
+        except Exception as e:
+            logger.error("Error starting registration for {}".format(registration_id))
+            in_flight[number] = (registration_id, None)
+            completions.put((number, None, e))
+
+    pending = None
+    exhausted = False
+    try:
+        while True:
+            wait = None
+            while len(in_flight) < max_concurrency:
+                if pending is None:
+                    pending = next(devices, None)
+                    if pending is None:
+                        exhausted = True
+                        break
+                    cached = (
+                        registration_cache.get(id_scope, pending[0]) if registration_cache else None
+                    )
+                    if cached is not None:
+                        registration_id = pending[0]
+                        pending = None
+                        yield (registration_id, cached, None)
+                        continue
+                with lock:
+                    wait = throttled_until[0] - time.time()
+                if wait <= 0:
+                    wait = bucket.try_take() if bucket else 0
+                if wait > 0:
+                    break
+                start(*pending)
+                pending = None
+                wait = None
+
+            if exhausted and not in_flight:
+                return
+            try:
+                (number, result, error) = completions.get(timeout=wait)
+            except queue.Empty:
+                continue
+            (registration_id, _) = in_flight.pop(number)
+            if registration_cache and result is not None:
+                registration_cache.set(id_scope, registration_id, result)
+            yield (registration_id, result, error)
+    finally:
+        for (registration_id, polling_machine) in list(in_flight.values()):
+            if polling_machine is None:
+                continue
+            logger.info("Cancelling registration for {}".format(registration_id))
+            try:
+                polling_machine.cancel()
+            except Exception:
+                logger.warning("Error cancelling registration for {}".format(registration_id))
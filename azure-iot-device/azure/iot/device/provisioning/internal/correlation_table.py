@@ -0,0 +1,124 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""
+This module contains the table used to match responses from the provisioning service to the
+requests that are waiting for them.
+"""
+import logging
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingRequest(object):
+    __slots__ = ("callback", "timer", "on_timeout")
+
+    def __init__(self, callback, timer, on_timeout):
+        self.callback = callback
+        self.timer = timer
+        self.on_timeout = on_timeout
+
+
+class CorrelationTable(object):
+    """
+    The requests waiting for a response, keyed by request id (rid).
+
+    Adding a request and taking it out when its response arrives are both O(1), so any number of
+    requests can be outstanding at once.  A request can be given a timeout, in which case it is
+    evicted from the table if no response has arrived by its deadline, and its on_timeout
+    callback is called.  Deadlines are kept on a timer wheel, so they cost nothing to track and
+    are cancelled in O(1) when the response arrives.
+
+    The table can be used from any thread: requests are usually added from the thread sending
+    them and responses arrive on the transport's thread.
+    """
+
+    def __init__(self, timer_wheel=None):
+        """
+        Initializer for CorrelationTable objects.
+
+        :param timer_wheel: The TimerWheel used for request deadlines.  Required to add requests
+          with a timeout.
+        """
+        self._timer_wheel = timer_wheel
+        self._requests = {}
+        self._lock = threading.Lock()
+        self.completed_count = 0
+        self.expired_count = 0
+
+    def __len__(self):
+        return len(self._requests)
+
+    def __contains__(self, rid):
+        return rid in self._requests
+
+    def add(self, rid, callback, deadline=None, on_timeout=None):
+        """
+        Add a request to the table.
+
+        :param str rid: The request id.
+        :param callback: The function to call with the response.  It is returned by pop.
+        :param float deadline: Optional time (as returned by the timer wheel's clock) after which
+          the request is evicted.
+        :param on_timeout: Optional function called with the rid when the request is evicted.  It
+          is called on the timer wheel's thread.
+
+        :raises: ValueError if a request with the same rid is already waiting, or a deadline is
+          given and the table has no timer wheel.
+        """
+        if deadline is not None and self._timer_wheel is None:
+            raise ValueError("A timer wheel is needed for requests with a deadline")
+        with self._lock:
+            if rid in self._requests:
+                raise ValueError("A request with rid {} is already waiting".format(rid))
+            request = _PendingRequest(callback, None, on_timeout)
+            self._requests[rid] = request
+        if deadline is not None:
+            # Scheduled outside of the lock, since the timer can fire (and take the lock) straight
+            # away if the deadline has passed
+            request.timer = self._timer_wheel.schedule(deadline, lambda: self._expire(rid, request))
+
+    def pop(self, rid):
+        """
+        Remove a request from the table, cancelling its deadline.
+
+        :returns: The request's callback, or None if there is no request with that rid (because
+          it never existed, already had its response, or was evicted).
+        """
+        with self._lock:
+            request = self._requests.pop(rid, None)
+            if request is None:
+                return None
+            self.completed_count += 1
+        if request.timer is not None:
+            self._timer_wheel.cancel(request.timer)
+        return request.callback
+
+    def _expire(self, rid, request):
+        with self._lock:
+            # The rid may have been reused by a later request since this timer was set
+            if self._requests.get(rid) is not request:
+                return
+            del self._requests[rid]
+            self.expired_count += 1
+        logger.info("No response to request {} before its deadline".format(rid))
+        if request.on_timeout:
+            try:
+                request.on_timeout(rid)
+            except Exception:
+                logger.error("Unexpected error calling on_timeout for request {}".format(rid))
+                logger.error(traceback.format_exc())
+
+    def get_stats(self):
+        """
+        Return the number of requests waiting, completed, and evicted because they timed out.
+        """
+        return {
+            "outstanding": len(self._requests),
+            "completed": self.completed_count,
+            "expired": self.expired_count,
+        }
@@ -4,16 +4,19 @@
 # license information.
 # --------------------------------------------------------------------------
 import logging
+import random
+import threading
+import time
 import uuid
-import json
 import traceback
-from threading import Timer
-from transitions import Machine
+from azure.iot.device.common import payload_codecs
+from azure.iot.device.common.transport.timer_wheel import TimerWheel
 from ..transport import constant
 import six.moves.urllib as urllib
 from .request_response_provider import RequestResponseProvider
 from ..models.registration_result import RegistrationResult, RegistrationState
 from .registration_query_status_result import RegistrationQueryStatusResult
+from .state_machine import TransitionTable
 
 
 logger = logging.getLogger(__name__)
@@ -21,6 +24,186 @@ logger = logging.getLogger(__name__)
 POS_STATUS_CODE_IN_TOPIC = 3
 POS_QUERY_PARAM_PORTION = 2
 
+# The timers of every PollingMachine, and the deadlines of the requests they send, run on this
+# one timer wheel (and so on one thread), so registrations in progress don't each need threads of
+# their own.
+polling_scheduler = TimerWheel()
+
+_in_flight_lock = threading.Lock()
+_in_flight_count = [0]
+
+
+def get_polling_stats():
+    """
+    Return a dict with the number of registrations in progress on the polling scheduler's thread,
+    and the scheduler's timer counters.
+    """
+    stats = polling_scheduler.get_stats()
+    stats["registrations_in_flight"] = _in_flight_count[0]
+    return stats
+
+
+def get_polling_interval(retry_after, polls_without_retry_after):
+    """
+    Return the number of seconds to wait before the next request.  This is the service's
+    retry-after if it sent one.  Otherwise the ceiling starts at DEFAULT_POLLING_INTERVAL and
+    doubles for every wait without a retry-after so far (up to MAX_POLLING_INTERVAL), and the
+    actual interval is picked at random from the upper half of that ceiling so that many devices
+    polling at once spread out.
+    :param retry_after: The retry-after the service sent (a string), or None.
+    :param polls_without_retry_after: The number of waits so far that had no retry-after.
+    """
+    if retry_after is not None:
+        return int(retry_after, 10)
+    ceiling = min(
+        constant.MAX_POLLING_INTERVAL,
+        constant.DEFAULT_POLLING_INTERVAL * (2 ** polls_without_retry_after),
+    )
+    return ceiling / 2.0 + random.uniform(0, ceiling / 2.0)
+
+
+def decode_complete_json_response(query_result, response):
+    """
+    Decodes the complete json response for details regarding the registration process.
+    :param query_result: The partially formed result.
+    :param response: The complete response from the service
+    """
+    decoded_result = payload_codecs.default_registry.decode(
+        payload_codecs.CONTENT_TYPE_JSON, response
+    )
+
+    decoded_state = (
+        None if "registrationState" not in decoded_result else decoded_result["registrationState"]
+    )
+    registration_state = None
+    if decoded_state is not None:
+        # Everything needs to be converted to string explicitly for python 2
+        # as everything is by default a unicode character
+        registration_state = RegistrationState(
+            None if "deviceId" not in decoded_state else str(decoded_state["deviceId"]),
+            None if "assignedHub" not in decoded_state else str(decoded_state["assignedHub"]),
+            None if "substatus" not in decoded_state else str(decoded_state["substatus"]),
+            None
+            if "createdDateTimeUtc" not in decoded_state
+            else str(decoded_state["createdDateTimeUtc"]),
+            None
+            if "lastUpdatedDateTimeUtc" not in decoded_state
+            else str(decoded_state["lastUpdatedDateTimeUtc"]),
+            None if "etag" not in decoded_state else str(decoded_state["etag"]),
+        )
+
+    registration_result = RegistrationResult(
+        rid=query_result.rid,
+        operation_id=query_result.operation_id,
+        status=query_result.status,
+        registration_state=registration_state,
+    )
+    return registration_result
+
+
+def decode_json_response(rid, retry_after, response):
+    """
+    Decodes the json response for operation id and status
+    :param rid: The request id.
+    :param retry_after: The time in secs after which to retry.
+    :param response: The complete response from the service.
+    """
+    decoded_result = payload_codecs.default_registry.decode(
+        payload_codecs.CONTENT_TYPE_JSON, response
+    )
+
+    operation_id = (
+        None if "operationId" not in decoded_result else str(decoded_result["operationId"])
+    )
+    status = None if "status" not in decoded_result else str(decoded_result["status"])
+
+    return RegistrationQueryStatusResult(rid, retry_after, operation_id, status)
+
+
+_STATES = [
+    "disconnected",
+    "initializing",
+    "registering",
+    "waiting_to_poll",
+    "polling",
+    "completed",
+    "error",
+    "cancelling",
+]
+
+_TRANSITIONS = [
+    {
+        "trigger": "_trig_register",
+        "source": "disconnected",
+        "before": "_initialize_register",
+        "dest": "initializing",
+    },
+    {
+        "trigger": "_trig_register",
+        "source": "error",
+        "before": "_initialize_register",
+        "dest": "initializing",
+    },
+    {"trigger": "_trig_register", "source": "registering", "dest": None},
+    {
+        "trigger": "_trig_send_register_request",
+        "source": "initializing",
+        "before": "_send_register_request",
+        "dest": "registering",
+    },
+    {
+        "trigger": "_trig_send_register_request",
+        "source": "waiting_to_poll",
+        "before": "_send_register_request",
+        "dest": "registering",
+    },
+    {
+        "trigger": "_trig_wait",
+        "source": "registering",
+        "dest": "waiting_to_poll",
+        "after": "_wait_for_interval",
+    },
+    {"trigger": "_trig_wait", "source": "cancelling", "dest": None},
+    {
+        "trigger": "_trig_wait",
+        "source": "polling",
+        "dest": "waiting_to_poll",
+        "after": "_wait_for_interval",
+    },
+    {
+        "trigger": "_trig_poll",
+        "source": "waiting_to_poll",
+        "dest": "polling",
+        "after": "_query_operation_status",
+    },
+    {"trigger": "_trig_poll", "source": "cancelling", "dest": None},
+    {
+        "trigger": "_trig_complete",
+        "source": ["registering", "waiting_to_poll", "polling"],
+        "dest": "completed",
+        "after": "_call_complete",
+    },
+    {
+        "trigger": "_trig_error",
+        "source": ["registering", "waiting_to_poll", "polling"],
+        "dest": "error",
+        "after": "_call_error",
+    },
+    {"trigger": "_trig_error", "source": "cancelling", "dest": None},
+    {
+        "trigger": "_trig_cancel",
+        "source": ["disconnected", "completed"],
+        "dest": None,
+        "after": "_inform_no_process",
+    },
+    {
+        "trigger": "_trig_cancel",
+        "source": ["initializing", "registering", "waiting_to_poll", "polling"],
+        "dest": "cancelling",
+        "after": "_call_cancel",
+    },
+]
+
 
 class PollingMachine(object):
     """
@@ -28,136 +211,46 @@ class PollingMachine(object):
     registration process for constant updates.
     ivar:on_registration_complete: Event handler called upon status update of registration process
     :type on_registration_complete: Function
+    :ivar on_throttled: Event handler called with the number of seconds the service asked us to
+      wait when it throttles a request.
+    :type on_throttled: Function
     """
 
+    # The transition table is built once and shared by every PollingMachine
+    _transition_table = TransitionTable(_STATES, _TRANSITIONS)
+    _trig_register = _transition_table.trigger("_trig_register")
+    _trig_send_register_request = _transition_table.trigger("_trig_send_register_request")
+    _trig_wait = _transition_table.trigger("_trig_wait")
+    _trig_poll = _transition_table.trigger("_trig_poll")
+    _trig_complete = _transition_table.trigger("_trig_complete")
+    _trig_error = _transition_table.trigger("_trig_error")
+    _trig_cancel = _transition_table.trigger("_trig_cancel")
+
     def __init__(self, state_based_provider):
         """
         :param state_based_provider: The state machine based provider.
         """
         self._polling_timer = None
-        self._query_timer = None
+        self._in_flight = False
+        self._polls_without_retry_after = 0
 
         self._register_callback = None
         self._cancel_callback = None
 
         # self.on_registration_complete = None
+        self.on_throttled = None
 
         self._registration_error = None
         self._registration_result = None
 
         self._operations = {}
 
-        self._request_response_provider = RequestResponseProvider(state_based_provider)
-
-        states = [
-            "disconnected",
-            "initializing",
-            "registering",
-            "waiting_to_poll",
-            "polling",
-            "completed",
-            "error",
-            "cancelling",
-        ]
-
-        transitions = [
-            {
-                "trigger": "_trig_register",
-                "source": "disconnected",
-                "before": "_initialize_register",
-                "dest": "initializing",
-            },
-            {
-                "trigger": "_trig_register",
-                "source": "error",
-                "before": "_initialize_register",
-                "dest": "initializing",
-            },
-            {"trigger": "_trig_register", "source": "registering", "dest": None},
-            {
-                "trigger": "_trig_send_register_request",
-                "source": "initializing",
-                "before": "_send_register_request",
-                "dest": "registering",
-            },
-            {
-                "trigger": "_trig_send_register_request",
-                "source": "waiting_to_poll",
-                "before": "_send_register_request",
-                "dest": "registering",
-            },
-            {
-                "trigger": "_trig_wait",
-                "source": "registering",
-                "dest": "waiting_to_poll",
-                "after": "_wait_for_interval",
-            },
-            {"trigger": "_trig_wait", "source": "cancelling", "dest": None},
-            {
-                "trigger": "_trig_wait",
-                "source": "polling",
-                "dest": "waiting_to_poll",
-                "after": "_wait_for_interval",
-            },
-            {
-                "trigger": "_trig_poll",
-                "source": "waiting_to_poll",
-                "dest": "polling",
-                "after": "_query_operation_status",
-            },
-            {"trigger": "_trig_poll", "source": "cancelling", "dest": None},
-            {
-                "trigger": "_trig_complete",
-                "source": ["registering", "waiting_to_poll", "polling"],
-                "dest": "completed",
-                "after": "_call_complete",
-            },
-            {
-                "trigger": "_trig_error",
-                "source": ["registering", "waiting_to_poll", "polling"],
-                "dest": "error",
-                "after": "_call_error",
-            },
-            {"trigger": "_trig_error", "source": "cancelling", "dest": None},
-            {
-                "trigger": "_trig_cancel",
-                "source": ["disconnected", "completed"],
-                "dest": None,
-                "after": "_inform_no_process",
-            },
-            {
-                "trigger": "_trig_cancel",
-                "source": ["initializing", "registering", "waiting_to_poll", "polling"],
-                "dest": "cancelling",
-                "after": "_call_cancel",
-            },
-        ]
-
-        def _on_transition_complete(event_data):
-            if not event_data.transition:
-                dest = "[no transition]"
-            else:
-                dest = event_data.transition.dest
-            logger.info(
-                "Transition complete.  Trigger={}, Src={}, Dest={}, result={}, error{}".format(
-                    event_data.event.name,
-                    event_data.transition.source,
-                    dest,
-                    str(event_data.result),
-                    str(event_data.error),
-                )
-            )
-
-        self._state_machine = Machine(
-            model=self,
-            states=states,
-            transitions=transitions,
-            initial="disconnected",
-            send_event=True,  # Use event_data structures to pass transition arguments
-            finalize_event=_on_transition_complete,
-            queued=True,
+        self._request_response_provider = RequestResponseProvider(
+            state_based_provider, polling_scheduler
         )
 
+        self._transition_table.initialize(self, "disconnected")
+
     def register(self, callback=None):
         """
         Register the device with the provisioning service.
@@ -178,6 +271,11 @@ class PollingMachine(object):
 
     def _initialize_register(self, event_data):
         logger.info("Initializing the registration process.")
+        self._polls_without_retry_after = 0
+        if not self._in_flight:
+            self._in_flight = True
+            with _in_flight_lock:
+                _in_flight_count[0] += 1
         self._request_response_provider.subscribe(
             topic=constant.SUBSCRIBE_TOPIC_PROVISIONING, callback=self._on_subscribe_completed
         )
@@ -187,8 +285,6 @@ class PollingMachine(object):
         Send the registration request.
         """
         logger.info("Sending registration request")
-        self._set_query_timer()
-
         rid = str(uuid.uuid4())
 
         self._operations[rid] = constant.PUBLISH_TOPIC_REGISTRATION.format(rid)
@@ -197,6 +293,8 @@ class PollingMachine(object):
             topic=constant.PUBLISH_TOPIC_REGISTRATION.format(rid),
             request=" ",
             callback=self._on_register_response_received,
+            deadline=time.time() + constant.DEFAULT_TIMEOUT_INTERVAL,
+            on_timeout=self._on_request_timeout,
         )
 
     def _query_operation_status(self, event_data):
@@ -204,8 +302,6 @@ class PollingMachine(object):
         Poll the service for operation status.
         """
         logger.info("Querying operation status from polling machine")
-        self._set_query_timer()
-
         rid = str(uuid.uuid4())
         result = event_data.args[0].args[0]
 
@@ -216,6 +312,8 @@ class PollingMachine(object):
             topic=constant.PUBLISH_TOPIC_QUERYING.format(rid, operation_id),
             request=" ",
             callback=self._on_query_response_received,
+            deadline=time.time() + constant.DEFAULT_TIMEOUT_INTERVAL,
+            on_timeout=self._on_request_timeout,
         )
 
     def _on_register_response_received(self, url_portion, key_values_dict, response):
@@ -225,8 +323,6 @@ class PollingMachine(object):
         :param key_values_dict: The dictionary containing the query parameters of the returned topic.
         :param response: The complete response from the service.
         """
-        self._query_timer.cancel()
-
         url_parts = url_portion.split("/")
         status_code = url_parts[POS_STATUS_CODE_IN_TOPIC]
         rid = str(key_values_dict["rid"][0])
@@ -237,6 +333,7 @@ class PollingMachine(object):
 
         if int(status_code, 10) >= 429:
             del self._operations[rid]
+            self._report_throttled(retry_after)
             self._trig_wait(intermediate_registration_result)
         elif int(status_code, 10) >= 300:  # pure failure
             self._registration_error = ValueError("Incoming message failure")
@@ -251,8 +348,8 @@ class PollingMachine(object):
         :param key_values_dict: The dictionary containing the query parameters of the returned topic.
         :param response: The complete response from the service.
         """
-        self._query_timer.cancel()
-        self._polling_timer.cancel()
+        if self._polling_timer is not None:
+            polling_scheduler.cancel(self._polling_timer)
 
         url_parts = url_portion.split("/")
         status_code = url_parts[POS_STATUS_CODE_IN_TOPIC]
@@ -263,6 +360,7 @@ class PollingMachine(object):
         intermediate_registration_result = RegistrationQueryStatusResult(rid, retry_after)
 
         if int(status_code, 10) >= 429:
+            self._report_throttled(retry_after)
             if rid in self._operations:
                 publish_query_topic = self._operations[rid]
                 del self._operations[rid]
@@ -282,6 +380,13 @@ class PollingMachine(object):
         else:  # successful status code case, transition into complete or another poll status
             self._process_successful_response(rid, retry_after, response)
 
+    def _report_throttled(self, retry_after):
+        handler = self.on_throttled
+        if handler:
+            handler(
+                constant.DEFAULT_POLLING_INTERVAL if retry_after is None else int(retry_after, 10)
+            )
+
     def _process_successful_response(self, rid, retry_after, response):
         """
         Fucntion to call in case of 200 response from the service
@@ -327,27 +432,38 @@ class PollingMachine(object):
 
     def _clear_timers(self):
         """
-        Clears all the timers and disconnects from the service
+        Clears all the timers and outstanding requests
         """
-        if self._query_timer is not None:
-            self._query_timer.cancel()
         if self._polling_timer is not None:
-            self._polling_timer.cancel()
-
-    def _set_query_timer(self):
-        def time_up_query():
-            logger.error("Time is up for query timer")
-            self._query_timer.cancel()
-            # TimeoutError no defined in python 2
-            self._registration_error = ValueError("Time is up for query timer")
-            self._trig_error()
-
-        self._query_timer = Timer(constant.DEFAULT_TIMEOUT_INTERVAL, time_up_query)
-        self._query_timer.start()
+            polling_scheduler.cancel(self._polling_timer)
+        # Forget requests that will never get a response we care about
+        for rid in self._operations:
+            self._request_response_provider.cancel_request(rid)
+        self._operations.clear()
+        if self._in_flight:
+            self._in_flight = False
+            with _in_flight_lock:
+                _in_flight_count[0] -= 1
+
+    def _on_request_timeout(self, rid):
+        """
+        Called on the polling scheduler's thread when a request gets no response before its
+        deadline.  The request provider has already forgotten the request.
+        """
+        logger.error("Time is up for query timer")
+        self._operations.pop(rid, None)
+        # TimeoutError no defined in python 2
+        self._registration_error = ValueError("Time is up for query timer")
+        self._trig_error()
+
+    def _get_polling_interval(self, retry_after):
+        interval = get_polling_interval(retry_after, self._polls_without_retry_after)
+        if retry_after is None:
+            self._polls_without_retry_after += 1
+        return interval
 
     def _wait_for_interval(self, event_data):
         def time_up_polling():
-            self._polling_timer.cancel()
             logger.info("Done waiting for polling interval of {} secs".format(polling_interval))
             if result.operation_id is None:
                 self._trig_send_register_request(event_data)
@@ -355,69 +471,19 @@ class PollingMachine(object):
                 self._trig_poll(event_data)
 
         result = event_data.args[0]
-        polling_interval = (
-            constant.DEFAULT_POLLING_INTERVAL
-            if result.retry_after is None
-            else int(result.retry_after, 10)
-        )
-
-        self._polling_timer = Timer(polling_interval, time_up_polling)
-        logger.info("Waiting for " + str(constant.DEFAULT_POLLING_INTERVAL) + " secs")
-        self._polling_timer.start()  # This is waiting for that polling interval
+        polling_interval = self._get_polling_interval(result.retry_after)
 
-    def _decode_complete_json_response(self, query_result, response):
-        """
-        Decodes the complete json response for details regarding the registration process.
-        :param query_result: The partially formed result.
-        :param response: The complete response from the service
-        """
-        decoded_result = json.loads(response)
-
-        decoded_state = (
-            None
-            if "registrationState" not in decoded_result
-            else decoded_result["registrationState"]
+        logger.info("Waiting for {} secs".format(polling_interval))
+        # This is waiting for that polling interval
+        self._polling_timer = polling_scheduler.schedule(
+            time.time() + polling_interval, time_up_polling
         )
-        registration_state = None
-        if decoded_state is not None:
-            # Everything needs to be converted to string explicitly for python 2
-            # as everything is by default a unicode character
-            registration_state = RegistrationState(
-                None if "deviceId" not in decoded_state else str(decoded_state["deviceId"]),
-                None if "assignedHub" not in decoded_state else str(decoded_state["assignedHub"]),
-                None if "substatus" not in decoded_state else str(decoded_state["substatus"]),
-                None
-                if "createdDateTimeUtc" not in decoded_state
-                else str(decoded_state["createdDateTimeUtc"]),
-                None
-                if "lastUpdatedDateTimeUtc" not in decoded_state
-                else str(decoded_state["lastUpdatedDateTimeUtc"]),
-                None if "etag" not in decoded_state else str(decoded_state["etag"]),
-            )
 
-        registration_result = RegistrationResult(
-            rid=query_result.rid,
-            operation_id=query_result.operation_id,
-            status=query_result.status,
-            registration_state=registration_state,
-        )
-        return registration_result
+    def _decode_complete_json_response(self, query_result, response):
+        return decode_complete_json_response(query_result, response)
 
     def _decode_json_response(self, rid, retry_after, response):
-        """
-        Decodes the json response for operation id and status
-        :param rid: The request id.
-        :param retry_after: The time in secs after which to retry.
-        :param response: The complete response from the service.
-        """
-        decoded_result = json.loads(response)
-
-        operation_id = (
-            None if "operationId" not in decoded_result else str(decoded_result["operationId"])
-        )
-        status = None if "status" not in decoded_result else str(decoded_result["status"])
-
-        return RegistrationQueryStatusResult(rid, retry_after, operation_id, status)
+        return decode_json_response(rid, retry_after, response)
 
     def _on_disconnect_completed_error(self):
         logger.info("on_disconnect_completed for Device Provisioning Service")
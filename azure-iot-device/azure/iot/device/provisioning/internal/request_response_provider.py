@@ -6,6 +6,7 @@
 
 import logging
 import six.moves.urllib as urllib
+from .correlation_table import CorrelationTable
 
 logger = logging.getLogger(__name__)
 
@@ -13,24 +14,82 @@ POS_STATUS_CODE_IN_TOPIC = 3
 POS_URL_PORTION = 1
 POS_QUERY_PARAM_PORTION = 2
 
+RESPONSE_TOPIC_PREFIX = "$dps/registrations/res/"
+# The service puts the rid first in the query of a response topic
+_RID_MARKER = "/?$rid="
+
+
+def parse_response_topic(topic):
+    """
+    Split a response topic of the form $dps/registrations/res/<status>/?$rid=<rid>[&<params>]
+    into its rid, the portion of the url containing the status code, and the query.  The rid is
+    found with a single search, without parsing the query.
+
+    :returns: A (rid, url_portion, query) tuple, or None if the topic isn't a response topic.
+    """
+    if not topic.startswith(RESPONSE_TOPIC_PREFIX):
+        return None
+    marker = topic.find(_RID_MARKER, len(RESPONSE_TOPIC_PREFIX))
+    if marker != -1:
+        rid_start = marker + len(_RID_MARKER)
+        rid_end = topic.find("&", rid_start)
+        rid = topic[rid_start:] if rid_end == -1 else topic[rid_start:rid_end]
+    else:
+        # Not the shape the service uses, so fall back to parsing the whole query
+        marker = topic.find("/?$")
+        if marker == -1:
+            return None
+        rid = urllib.parse.parse_qs(topic[marker + 3 :]).get("rid", [None])[0]
+        if rid is None:
+            return None
+    return (rid, topic[1 : marker + 2], topic[marker + 3 :])
+
 
 class RequestResponseProvider(object):
     """
     Class that processes requests sent from device and responses received at device.
     """
 
-    def __init__(self, state_based_provider):
-
+    def __init__(self, state_based_provider, timer_wheel=None):
+        """
+        :param state_based_provider: The state machine based provider.
+        :param timer_wheel: Optional TimerWheel used for the deadlines of requests sent with a
+          timeout.
+        """
         self._state_based_provider = state_based_provider
 
         self._state_based_provider.on_state_based_provider_message_received = self._receive_response
 
-        self._pending_requests = {}
+        self._pending_requests = CorrelationTable(timer_wheel)
 
-    def send_request(self, rid, topic, request, callback):
-        self._pending_requests[rid] = callback
+    def send_request(self, rid, topic, request, callback, deadline=None, on_timeout=None):
+        """
+        Send a request and call callback with the response.
+        :param rid: The request id, which the service returns in the topic of the response.
+        :param topic: The topic to publish the request on.
+        :param request: The request payload.
+        :param callback: Called with the portion of the response topic containing the status
+        code, the dictionary of the query parameters of the response topic, and the response.
+        :param deadline: Optional time after which the request is forgotten if there has been no
+        response.  Needs a timer wheel.
+        :param on_timeout: Optional function called with the rid if the deadline passes.
+        """
+        self._pending_requests.add(rid, callback, deadline, on_timeout)
         self.publish(topic=topic, request=request)
 
+    def cancel_request(self, rid):
+        """
+        Forget a request, so that a response that arrives for it later is ignored.
+        :returns: True if the request was still waiting for a response.
+        """
+        return self._pending_requests.pop(rid) is not None
+
+    def get_stats(self):
+        """
+        Return statistics about the requests sent with this provider.
+        """
+        return self._pending_requests.get_stats()
+
     def connect(self, callback=None):
         if callback is None:
             callback = self._on_connection_state_change
@@ -66,30 +125,34 @@ class RequestResponseProvider(object):
         # $dps/registrations/res/200/?$rid=28c32371-608c-4390-8da7-c712353c1c3b
         # {"operationId":"4.550cb20c3349a409.390d2957-7b58-4701-b4f9-7fe848348f4a","status":"assigning"}
         # """
-        logger.info("Received payload:")
-        logger.info(payload)
-        # topic_str = topic.decode("utf-8")
+        response = None
         if payload is not None:  # In cases of empty erroneous response from service
             response = payload.decode("utf-8")
 
         # There may be no response when status code is >= 300
         logger.info("Received response:{} on topic:{}".format(response, topic))
 
-        if topic.startswith("$dps/registrations/res/"):
-            topic_parts = topic.split("$")
-            key_value_dict = urllib.parse.parse_qs(topic_parts[POS_QUERY_PARAM_PORTION])
-            rid = key_value_dict["rid"][0]
-        # TODO Not DPS may have other ways to retrieve rid
-
-        if rid in self._pending_requests:
-            callback = self._pending_requests[rid]
-            # Only send the status code and the portion of the topic containing query parameters
-            callback(topic_parts[POS_URL_PORTION], key_value_dict, response)
-            del self._pending_requests[rid]
-
-    def _on_connection_state_change(self, new_state):
-        """Handler to be called by the transport upon a connection state change."""
-        logger.info("Connection State - {}".format(new_state))
+        parsed_topic = parse_response_topic(topic)
+        if parsed_topic is None:
+            # TODO Not DPS may have other ways to retrieve rid
+            logger.warning("Ignoring message on unexpected topic {}".format(topic))
+            return
+        (rid, url_portion, query) = parsed_topic
+
+        callback = self._pending_requests.pop(rid)
+        if callback is None:
+            logger.info("Ignoring response to unknown or expired request {}".format(rid))
+            return
+        if "&" in query:
+            key_value_dict = urllib.parse.parse_qs(query)
+        else:
+            key_value_dict = {"rid": [rid]}
+        # Only send the status code and the portion of the topic containing query parameters
+        callback(url_portion, key_value_dict, response)
+
+    def _on_connection_state_change(self):
+        """Handler to be called by the transport when a connect or disconnect completes."""
+        logger.info("connection state changed for request response provider")
 
     def _on_publish_completed(self):
         logger.info("publish completed for request response provider")
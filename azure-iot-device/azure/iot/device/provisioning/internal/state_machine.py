@@ -0,0 +1,144 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""
+This module contains a small table-driven state machine, used in place of a general-purpose state
+machine library for the provisioning polling machine.
+"""
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventData(object):
+    """
+    The details of a trigger, passed to the callbacks of the transition it causes.
+
+    :ivar trigger: The name of the trigger.
+    :ivar source: The state the model was in when the trigger was processed.
+    :ivar dest: The state the transition goes to, or None for an internal transition.
+    :ivar args: The positional arguments the trigger was called with.
+    :ivar kwargs: The keyword arguments the trigger was called with.
+    """
+
+    __slots__ = ("trigger", "source", "dest", "args", "kwargs")
+
+    def __init__(self, trigger, source, dest, args, kwargs):
+        self.trigger = trigger
+        self.source = source
+        self.dest = dest
+        self.args = args
+        self.kwargs = kwargs
+
+
+class TransitionTable(object):
+    """
+    A precomputed table of the transitions between a set of states, shared by every model that
+    uses it.  The table is built once (normally when the model's class is defined), so creating a
+    model only costs setting its state and an empty trigger queue (see initialize).
+
+    Transitions are given in the same form as the transitions library uses: dicts with a
+    "trigger", a "source" (a state or a list of states), a "dest" (a state, or None for an
+    internal transition that doesn't change state), and optional "before" and "after" callbacks,
+    which are the names of model methods that are called with an EventData.  "before" is called
+    before the state changes and "after" is called after it changes.
+
+    Triggers are queued: a trigger that is fired while another trigger of the same model is
+    being processed (for example, from one of its callbacks) is processed once that one is done.
+    Firing a trigger that has no transition from the model's current state raises a RuntimeError.
+    If a callback raises, the model's queued triggers are dropped and the exception propagates.
+    """
+
+    def __init__(self, states, transitions):
+        """
+        Initializer for TransitionTable objects.
+
+        :param list states: The names of the states.
+        :param list transitions: The transitions, as dicts (see above).
+
+        :raises: ValueError if a transition refers to an unknown state, or two transitions have
+          the same trigger and source.
+        """
+        self.states = frozenset(states)
+        self._table = {}
+        for transition in transitions:
+            trigger = transition["trigger"]
+            dest = transition.get("dest")
+            if dest is not None and dest not in self.states:
+                raise ValueError("Unknown state: {}".format(dest))
+            sources = transition["source"]
+            if not isinstance(sources, (list, tuple)):
+                sources = [sources]
+            for source in sources:
+                if source not in self.states:
+                    raise ValueError("Unknown state: {}".format(source))
+                if (trigger, source) in self._table:
+                    raise ValueError(
+                        "More than one transition for {} from {}".format(trigger, source)
+                    )
+                self._table[(trigger, source)] = (
+                    dest,
+                    transition.get("before"),
+                    transition.get("after"),
+                )
+
+    def initialize(self, model, initial):
+        """
+        Put a model in its initial state.  This must be called before any trigger is fired.
+        """
+        if initial not in self.states:
+            raise ValueError("Unknown state: {}".format(initial))
+        model.state = initial
+        model._trigger_queue = collections.deque()
+
+    def trigger(self, name):
+        """
+        Return a function which fires the named trigger on the model it is called with, for use
+        as a method of the model's class.
+        """
+
+        def fire(model, *args, **kwargs):
+            self.fire(model, name, args, kwargs)
+
+        fire.__name__ = str(name)
+        return fire
+
+    def fire(self, model, trigger, args=(), kwargs=None):
+        """
+        Fire a trigger on a model, or queue it if the model is already processing a trigger.
+        """
+        queue = model._trigger_queue
+        queue.append((trigger, args, kwargs or {}))
+        if len(queue) > 1:
+            return
+        try:
+            while queue:
+                (trigger, args, kwargs) = queue[0]
+                self._run(model, trigger, args, kwargs)
+                queue.popleft()
+        except Exception:
+            queue.clear()
+            raise
+
+    def _run(self, model, trigger, args, kwargs):
+        source = model.state
+        transition = self._table.get((trigger, source))
+        if transition is None:
+            raise RuntimeError("Can't trigger event {} from state {}!".format(trigger, source))
+        (dest, before, after) = transition
+        event_data = EventData(trigger, source, dest, args, kwargs)
+        if before:
+            getattr(model, before)(event_data)
+        if dest is not None:
+            model.state = dest
+        if after:
+            getattr(model, after)(event_data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Transition complete.  Trigger={}, Src={}, Dest={}".format(
+                    trigger, source, "[no transition]" if dest is None else dest
+                )
+            )
@@ -13,7 +13,9 @@ from .sk_provisioning_device_client import SymmetricKeyProvisioningDeviceClient
 from .transport.state_based_mqtt_provider import StateBasedMQTTProvider
 
 
-def create_from_security_client(provisioning_host, security_client, transport_choice):
+def create_from_security_client(
+    provisioning_host, security_client, transport_choice, registration_cache=None
+):
     """
     Creates different types of registration clients which can enable devices to communicate with Device Provisioning
     Service based on parameters passed.
@@ -21,13 +23,31 @@ def create_from_security_client(provisioning_host, security_client, transport_ch
     Overview tab as the string Global device endpoint
     :param security_client: Instance of Security client object which can be either of SymmetricKeySecurityClient,  TPMSecurtiyClient or X509SecurityClient
     :param transport_choice: A string representing the transport the user wants
+    :param registration_cache: Optional RegistrationCache used to skip the provisioning service for devices
+    that have already been assigned to a hub.
     :return: A specific registration client based on parameters and validations.
     """
+    mqtt_state_based_provider = create_state_based_provider(
+        provisioning_host, security_client, transport_choice
+    )
+    return SymmetricKeyProvisioningDeviceClient(
+        mqtt_state_based_provider, registration_cache=registration_cache
+    )
+
+
+def create_state_based_provider(provisioning_host, security_client, transport_choice):
+    """
+    Creates the state based provider for a security client and transport, for use by a registration
+    client.
+    :param provisioning_host: Host running the Device Provisioning Service.
+    :param security_client: Instance of Security client object.
+    :param transport_choice: A string representing the transport the user wants
+    :return: The state based provider.
+    """
     transport_choice = transport_choice.lower()
     if transport_choice == "mqtt":
         if isinstance(security_client, SymmetricKeySecurityClient):
-            mqtt_state_based_provider = StateBasedMQTTProvider(provisioning_host, security_client)
-            return SymmetricKeyProvisioningDeviceClient(mqtt_state_based_provider)
+            return StateBasedMQTTProvider(provisioning_host, security_client)
             # TODO : other instances of security provider can also be checked before creating mqtt and client
         else:
             raise ValueError("A symmetric key security provider must be provided for MQTT")
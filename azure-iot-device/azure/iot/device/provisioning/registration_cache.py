@@ -0,0 +1,121 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""
+This module contains an on-disk cache of registration results, so that devices which have already
+been provisioned can connect to their IoT Hub without going through the provisioning service again.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from .models.registration_result import RegistrationResult, RegistrationState
+
+logger = logging.getLogger(__name__)
+
+# os.replace doesn't exist on Python 2.  os.rename does the same thing there except on Windows.
+_replace = getattr(os, "replace", os.rename)
+
+_STATE_FIELDS = (
+    "device_id",
+    "assigned_hub",
+    "sub_status",
+    "created_date_time",
+    "last_update_date_time",
+    "etag",
+)
+
+
+class RegistrationCache(object):
+    """
+    A cache of successful (assigned) registration results, stored on disk and keyed by ID scope
+    and registration ID.
+
+    Each result is kept in its own small JSON file in the cache directory, so looking up or
+    storing one device's result takes the same time no matter how many devices are cached, and
+    several processes can share a directory.  Files are written to a temporary file first and
+    then renamed, so a crash never leaves a half-written result behind.  Entries that can't be
+    read are treated as missing.
+    """
+
+    def __init__(self, directory):
+        """
+        Initializer for RegistrationCache objects.
+
+        :param str directory: The directory to keep cached results in.  It is created if it
+          doesn't exist.
+        """
+        self.directory = directory
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, id_scope, registration_id):
+        key = "{}/{}".format(id_scope, registration_id).encode("utf-8")
+        return os.path.join(self.directory, hashlib.sha256(key).hexdigest() + ".json")
+
+    def get(self, id_scope, registration_id):
+        """
+        Return the cached RegistrationResult for a device, or None if there isn't one.
+        """
+        try:
+            with open(self._path(id_scope, registration_id), "r") as f:
+                entry = json.load(f)
+            if entry["id_scope"] != id_scope or entry["registration_id"] != registration_id:
+                return None
+            state = entry["registration_state"]
+            return RegistrationResult(
+                rid=entry["request_id"],
+                operation_id=entry["operation_id"],
+                status=entry["status"],
+                registration_state=RegistrationState(
+                    *[state.get(field) for field in _STATE_FIELDS]
+                ),
+            )
+        except (IOError, OSError):
+            return None
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.warning("Ignoring unreadable cached registration for {}".format(registration_id))
+            return None
+
+    def set(self, id_scope, registration_id, result):
+        """
+        Store the RegistrationResult for a device.  Only results with a status of "assigned" are
+        stored.  Any other result removes the device's cached result.
+        """
+        if result is None or result.status != "assigned" or result.registration_state is None:
+            self.remove(id_scope, registration_id)
+            return
+        state = result.registration_state
+        entry = {
+            "id_scope": id_scope,
+            "registration_id": registration_id,
+            "request_id": result.request_id,
+            "operation_id": result.operation_id,
+            "status": result.status,
+            "registration_state": dict((field, getattr(state, field)) for field in _STATE_FIELDS),
+        }
+        (fd, temp_path) = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            _replace(temp_path, self._path(id_scope, registration_id))
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def remove(self, id_scope, registration_id):
+        """
+        Remove the cached result for a device, if there is one.
+        """
+        try:
+            os.remove(self._path(id_scope, registration_id))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -5,3 +5,4 @@ Azure Provisioning Device SDK.
 """
 
 from .sk_security_client import SymmetricKeySecurityClient
+from .derived_key import DerivedKeyEngine, derive_device_key
@@ -0,0 +1,119 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains tools for deriving the symmetric keys of devices registering through a
+group enrollment from the enrollment group's key.
+"""
+
+import itertools
+import multiprocessing
+from azure.iot.device.common.sastoken import SigningEngine, SasTokenError
+
+
+class DerivedKeyEngine(object):
+    """
+    Derives device keys from the key of an enrollment group.
+
+    A device registering through a symmetric key group enrollment authenticates with a key of its
+    own, which is the HMAC-SHA256 of its registration ID keyed with the group key (both keys are
+    base64 encoded).  That is the signature a SigningEngine for the group key gives the
+    registration ID, so the engine is built on one: the group key is decoded and the HMAC is keyed
+    once, when the engine is created, and deriving a key only copies that keyed HMAC and hashes the
+    registration ID.  Keys for large batches of devices are therefore cheap to derive.
+
+    The (registration_id, device_key) tuples returned by derive_many are in the form that
+    register_devices takes, so a batch of devices in a group enrollment can be registered with
+    register_devices(provisioning_host, id_scope, engine.derive_many(registration_ids)).
+    """
+
+    def __init__(self, group_key):
+        """
+        Initializer for DerivedKeyEngine objects.
+
+        :param str group_key: The primary or secondary key of the enrollment group (base64 encoded).
+
+        :raises: ValueError if the group key isn't valid base64.
+        """
+        self._group_key = group_key
+        try:
+            self._signing_engine = SigningEngine(group_key)
+        except SasTokenError as e:
+            raise ValueError("Invalid group key: {}".format(e.cause))
+
+    def derive(self, registration_id):
+        """
+        Return the device key (base64 encoded) for a registration ID.
+        """
+        return self._signing_engine.sign_string(registration_id)
+
+    def derive_many(self, registration_ids, processes=None, chunk_size=1024):
+        """
+        Derive the device keys for many registration IDs.
+
+        This is a generator, which yields a (registration_id, device_key) tuple for each
+        registration ID, in order.  Registration IDs are read from the iterable as they are
+        needed, so batches of any size can be derived without holding them in memory.
+
+        :param registration_ids: Iterable of registration IDs.
+        :param int processes: If given, keys are derived in a pool of this many processes, which
+          is worth it for batches of hundreds of thousands of devices or more.  Otherwise keys are
+          derived in the calling thread.
+        :param int chunk_size: With processes, the number of registration IDs handed to a process
+          at a time.
+        """
+        if not processes:
+            for registration_id in registration_ids:
+                yield (registration_id, self.derive(registration_id))
+            return
+
+        pool = multiprocessing.Pool(
+            processes, initializer=_initialize_worker, initargs=(self._group_key,)
+        )
+        try:
+            for chunk in pool.imap(_derive_chunk, _chunks(registration_ids, chunk_size)):
+                for pair in chunk:
+                    yield pair
+            pool.close()
+        except BaseException:
+            # Includes GeneratorExit, when the caller stops early
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+
+def derive_device_key(group_key, registration_id):
+    """
+    Return the device key (base64 encoded) for a registration ID in a group enrollment.  To derive
+    keys for more than one device, use a DerivedKeyEngine.
+
+    :param str group_key: The key of the enrollment group (base64 encoded).
+    :param str registration_id: The registration ID of the device.
+    """
+    return DerivedKeyEngine(group_key).derive(registration_id)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# The engine of each worker process in a derive_many pool.  Keyed HMAC objects can't be pickled,
+# so each worker builds its own from the group key.
+_worker_engine = None
+
+
+def _initialize_worker(group_key):
+    global _worker_engine
+    _worker_engine = DerivedKeyEngine(group_key)
+
+
+def _derive_chunk(registration_ids):
+    derive = _worker_engine.derive
+    return [(registration_id, derive(registration_id)) for registration_id in registration_ids]
@@ -21,24 +21,45 @@ class SymmetricKeyProvisioningDeviceClient(ProvisioningDeviceClient):
     using Symmetric Key authentication.
     """
 
-    def __init__(self, mqtt_state_based_provider):
+    def __init__(self, mqtt_state_based_provider, registration_cache=None):
         """
         Initializer for the Symmetric Key Registration Client
         :param mqtt_state_based_provider: The state-based protocol provider. As of now this only supports MQTT.
+        :param registration_cache: Optional RegistrationCache used to skip the provisioning service
+        for devices that have already been assigned to a hub.
         """
         super(SymmetricKeyProvisioningDeviceClient, self).__init__(mqtt_state_based_provider)
         self._polling_machine = PollingMachine(mqtt_state_based_provider)
+        self._registration_cache = registration_cache
 
-    def register(self):
+    def register(self, use_cache=True):
         """
         Register the device with the provisioning service.
         This is a synchronous call, meaning that this function will not return until the registration
         process has completed successfully or the attempt has resulted in a failure. Before returning
         the client will also disconnect from the Hub.
         If a registration attempt is made while a previous registration is in progress it may throw an error.
+
+        If the client has a registration cache and it holds an assigned result for this device, that
+        result is returned straight away without contacting the provisioning service.  If connecting
+        to the cached hub then fails with an authentication or not-found error, call register again
+        with use_cache=False to re-provision the device and replace the cached result.
+
+        :param use_cache: Whether a cached result can be returned.
+        :returns: The RegistrationResult, or None if the registration process ran into an error.
         """
+        security_client = self._transport.security_client if self._registration_cache else None
+        if security_client and use_cache:
+            result = self._registration_cache.get(
+                security_client.id_scope, security_client.registration_id
+            )
+            if result is not None:
+                logger.info("Using cached registration with Hub")
+                return result
+
         logger.info("Registering with Hub...")
         register_complete = Event()
+        registration = {}
 
         def on_register_complete(result=None, error=None):
             # This could be a failed/successful registration result from the HUB
@@ -51,11 +72,18 @@ class SymmetricKeyProvisioningDeviceClient(ProvisioningDeviceClient):
             if error is not None:  # This can only happen when the polling machine runs into error
                 logger.info(error)
 
+            registration["result"] = result
             register_complete.set()
 
         self._polling_machine.register(callback=on_register_complete)
 
         register_complete.wait()
+        result = registration.get("result")
+        if security_client and result is not None:
+            self._registration_cache.set(
+                security_client.id_scope, security_client.registration_id, result
+            )
+        return result
 
     def cancel(self):
         """
@@ -14,6 +14,12 @@ Default interval for polling, to use in case service doesn't provide it to us.
 """
 DEFAULT_POLLING_INTERVAL = 2
 
+"""
+Largest interval for polling when the service doesn't provide one.  The interval starts at
+DEFAULT_POLLING_INTERVAL and backs off exponentially up to this.
+"""
+MAX_POLLING_INTERVAL = 30
+
 """
 api version to use while communicating with service.
 """
@@ -0,0 +1,28 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+from azure.iot.device.common.transport.pipeline_events_base import PipelineEvent
+
+
+class RegistrationResponseEvent(PipelineEvent):
+    """
+    A PipelineEvent object which represents a response from the Device Provisioning Service to a
+    registration or query request.  This object is probably created by some converter stage based
+    on a transport-specific event
+    """
+
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        """
+        Initializer for RegistrationResponseEvent objects.
+
+        :param str topic: The topic the response arrived on, which holds the status code and the
+          request id of the request it responds to.
+        :param bytes payload: The body of the response.
+        """
+        super(RegistrationResponseEvent, self).__init__()
+        self.topic = topic
+        self.payload = payload
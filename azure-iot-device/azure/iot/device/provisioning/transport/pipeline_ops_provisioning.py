@@ -0,0 +1,60 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+from azure.iot.device.common.transport.pipeline_ops_base import PipelineOperation
+
+
+class SetSymmetricKeySecurityClient(PipelineOperation):
+    """
+    A PipelineOperation object which tells the pipeline to use a particular symmetric key security client.
+    Some pipeline stage is expected to extract arguments out of the security client and pass them
+    on so an even lower stage can use those arguments to connect.
+
+    This operation is in the group of Provisioning operations because security clients are
+    specific to the Device Provisioning Service.
+    """
+
+    __slots__ = ("security_client",)
+
+    def __init__(self, security_client, callback=None):
+        """
+        Initializer for SetSymmetricKeySecurityClient objects.
+
+        :param object security_client: The security client object to use to retrieve connection parameters
+          which can be used to connect to the service.
+        :param Function callback: The function that gets called when this operation is complete or has failed.
+         The callback function must accept A PipelineOperation object which indicates the specific operation which
+         has completed or failed.
+        """
+        super(SetSymmetricKeySecurityClient, self).__init__(callback=callback)
+        self.security_client = security_client
+
+
+class SetSymmetricKeySecurityClientArgs(PipelineOperation):
+    """
+    A PipelineOperation object which contains connection arguments which were retrieved from a security client,
+    likely by a pipeline stage which handles the SetSymmetricKeySecurityClient operation.
+
+    This operation is in the group of Provisioning operations because the arguments which it accepts are very
+    specific to Device Provisioning Service connections.
+    """
+
+    __slots__ = ("provisioning_host", "registration_id", "id_scope")
+
+    def __init__(self, provisioning_host, registration_id, id_scope, callback=None):
+        """
+        Initializer for SetSymmetricKeySecurityClientArgs objects.
+
+        :param str provisioning_host: The host running the Device Provisioning Service.
+        :param str registration_id: The registration ID of the device that we are registering.
+        :param str id_scope: The ID scope of the provisioning service.
+        :param Function callback: The function that gets called when this operation is complete or has failed.
+         The callback function must accept A PipelineOperation object which indicates the specific operation which
+         has completed or failed.
+        """
+        super(SetSymmetricKeySecurityClientArgs, self).__init__(callback=callback)
+        self.provisioning_host = provisioning_host
+        self.registration_id = registration_id
+        self.id_scope = id_scope
@@ -0,0 +1,55 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+from azure.iot.device.common.transport import pipeline_ops_base
+from azure.iot.device.common.transport.pipeline_stages_base import PipelineStage
+from . import pipeline_ops_provisioning
+
+logger = logging.getLogger(__name__)
+
+
+class UseSymmetricKeySecurityClient(PipelineStage):
+    """
+    PipelineStage which handles operations on a Symmetric Key Security Client.
+
+    Operations Handled:
+    * SetSymmetricKeySecurityClient
+
+    Operations Produced:
+    * SetSymmetricKeySecurityClientArgs
+    * SetSasToken
+
+    This stage handles SetSymmetricKeySecurityClient operations.  It retrieves the registration
+    arguments from the security client and generates a sas token to pass down.  After passing down
+    the args and the sas token, this stage completes the SetSymmetricKeySecurityClient operation.
+
+    All other operations are passed down.
+    """
+
+    def __init__(self, provisioning_host):
+        """
+        Initializer for UseSymmetricKeySecurityClient objects.
+
+        :param str provisioning_host: The host running the Device Provisioning Service.
+        """
+        super(UseSymmetricKeySecurityClient, self).__init__()
+        self.provisioning_host = provisioning_host
+
+    def _run_op(self, op):
+        if isinstance(op, pipeline_ops_provisioning.SetSymmetricKeySecurityClient):
+            security_client = op.security_client
+            self.run_ops_serial(
+                pipeline_ops_provisioning.SetSymmetricKeySecurityClientArgs(
+                    provisioning_host=self.provisioning_host,
+                    registration_id=security_client.registration_id,
+                    id_scope=security_client.id_scope,
+                ),
+                pipeline_ops_base.SetSasToken(sas_token=security_client.get_current_sas_token()),
+                callback=op.callback,
+            )
+        else:
+            self.continue_op(op)
@@ -0,0 +1,75 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+import six.moves.urllib as urllib
+from azure.iot.device.common.transport.mqtt import pipeline_ops_mqtt
+from azure.iot.device.common.transport.mqtt import pipeline_events_mqtt
+from azure.iot.device.common.transport.pipeline_stages_base import PipelineStage
+from ..internal.request_response_provider import RESPONSE_TOPIC_PREFIX
+from . import constant
+from . import pipeline_ops_provisioning
+from . import pipeline_events_provisioning
+
+logger = logging.getLogger(__name__)
+
+
+class ProvisioningMQTTConverter(PipelineStage):
+    """
+    PipelineStage which converts Provisioning operations into Mqtt operations.  This stage also
+    converts mqtt pipeline events into Provisioning pipeline events.
+
+    Operations Handled:
+    * SetSymmetricKeySecurityClientArgs
+
+    Operations Produced:
+    * SetConnectionArgs
+
+    Registration and query requests are already Mqtt publishes on the provisioning service's
+    topics, so they (and all other operations) are passed down.  Incoming messages on the
+    registration response topics are passed up as RegistrationResponseEvents, and other incoming
+    messages are dropped.
+    """
+
+    def _run_op(self, op):
+        if isinstance(op, pipeline_ops_provisioning.SetSymmetricKeySecurityClientArgs):
+            # The registration id is used as the client id, and the username tells the service
+            # which registration in which provisioning service this connection is for.
+            client_id = op.registration_id
+            username = "{}/registrations/{}/api-version={}&ClientVersion={}".format(
+                op.id_scope,
+                op.registration_id,
+                constant.API_VERSION,
+                urllib.parse.quote_plus(constant.USER_AGENT),
+            )
+            self.continue_with_different_op(
+                original_op=op,
+                new_op=pipeline_ops_mqtt.SetConnectionArgs(
+                    client_id=client_id, hostname=op.provisioning_host, username=username
+                ),
+            )
+        else:
+            # All other operations get passed down
+            self.continue_op(op)
+
+    def _handle_pipeline_event(self, event):
+        """
+        Pipeline Event handler function to convert incoming Mqtt messages into the appropriate
+        Provisioning events, based on the topic of the message
+        """
+        if isinstance(event, pipeline_events_mqtt.IncomingMessage):
+            if event.topic.startswith(RESPONSE_TOPIC_PREFIX):
+                self.handle_pipeline_event(
+                    pipeline_events_provisioning.RegistrationResponseEvent(
+                        event.topic, event.payload
+                    )
+                )
+            else:
+                logger.warning("Warning: dropping message with topic {}".format(event.topic))
+
+        else:
+            # all other messages get passed up
+            PipelineStage._handle_pipeline_event(self, event)
@@ -3,24 +3,154 @@
 # Licensed under the MIT License. See License.txt in the project root for
 # license information.
 # --------------------------------------------------------------------------
-# TODO : This class is empty to later incorporate pipeline changes
 
+import logging
+from azure.iot.device.common.transport import pipeline_stages_base
+from azure.iot.device.common.transport import pipeline_ops_base
+from azure.iot.device.common.transport.mqtt import pipeline_stages_mqtt
+from azure.iot.device.common.transport.mqtt import pipeline_ops_mqtt
+from . import pipeline_ops_provisioning
+from . import pipeline_events_provisioning
+from . import pipeline_stages_provisioning
+from . import pipeline_stages_provisioning_mqtt
+
+logger = logging.getLogger(__name__)
+
+
+class StateBasedMQTTProvider(object):
+    """
+    Transport used to talk to the Device Provisioning Service over MQTT.
+
+    Requests go through the same kind of pipeline as the IoT Hub transport: subscribing or
+    publishing while disconnected connects first, and requests made while connecting are queued
+    until the connection is up.  The time taken to connect, subscribe and publish (including the
+    first publish) can be read with get_pipeline_stats.
+
+    The callbacks passed to connect, disconnect, publish, subscribe and unsubscribe are called
+    with no arguments once the operation is done.  They are also called if the operation fails
+    (the error is logged), since a request that was never sent just gets no response, which the
+    caller has to allow for anyway.
+
+    :ivar on_state_based_provider_message_received: Event handler called with the topic and
+      payload of every response from the service.
+    :type on_state_based_provider_message_received: Function
+    """
 
-class StateBasedMQTTProvider:
     def __init__(self, provisioning_host, security_client):
-        pass
+        """
+        Constructor for instantiating a state based provider
+        :param provisioning_host: Host running the Device Provisioning Service.
+        :param security_client: The SymmetricKeySecurityClient of the device to register.
+        """
+        self.provisioning_host = provisioning_host
+        self.security_client = security_client
+        self.on_state_based_provider_message_received = None
+
+        self._pipeline = (
+            pipeline_stages_base.PipelineRoot()
+            .append_stage(
+                pipeline_stages_provisioning.UseSymmetricKeySecurityClient(provisioning_host)
+            )
+            .append_stage(pipeline_stages_base.EnsureConnection())
+            .append_stage(
+                pipeline_stages_base.MeasureLatency(
+                    [
+                        pipeline_ops_base.Connect,
+                        pipeline_ops_mqtt.Subscribe,
+                        pipeline_ops_mqtt.Publish,
+                    ]
+                )
+            )
+            .append_stage(pipeline_stages_provisioning_mqtt.ProvisioningMQTTConverter())
+            .append_stage(pipeline_stages_mqtt.Provider())
+        )
+
+        def _handle_pipeline_event(event):
+            if isinstance(event, pipeline_events_provisioning.RegistrationResponseEvent):
+                if self.on_state_based_provider_message_received:
+                    self.on_state_based_provider_message_received(event.topic, event.payload)
+                else:
+                    logger.warning("Registration response received with no handler.  dropping.")
+            else:
+                logger.warning("Dropping unknown pipeline event {}".format(event.name))
+
+        self._pipeline.on_pipeline_event = _handle_pipeline_event
+
+        def on_security_client_set(call):
+            if call.error:
+                raise call.error
+
+        self._pipeline.run_op(
+            pipeline_ops_provisioning.SetSymmetricKeySecurityClient(
+                security_client=security_client, callback=on_security_client_set
+            )
+        )
 
     def connect(self, callback=None):
-        pass
+        """
+        Connect to the service.
+        :param callback: callback which is called when the connection to the service is complete.
+        """
+        logger.info("connect called")
+        self._pipeline.run_op(pipeline_ops_base.Connect(callback=_get_pipeline_callback(callback)))
 
     def disconnect(self, callback=None):
-        pass
+        """
+        Disconnect from the service.
+        :param callback: callback which is called when the connection to the service has been disconnected
+        """
+        logger.info("disconnect called")
+        self._pipeline.run_op(
+            pipeline_ops_base.Disconnect(callback=_get_pipeline_callback(callback))
+        )
 
     def publish(self, topic, message, callback=None):
-        pass
+        """
+        Publish a request to the service, connecting first if necessary.
+        :param topic: The topic to publish on.
+        :param message: The payload of the request.
+        :param callback: callback which is called when the publish has been acknowledged by the service.
+        """
+        op = pipeline_ops_mqtt.Publish(
+            topic=topic, payload=message, callback=_get_pipeline_callback(callback)
+        )
+        op.needs_connection = True
+        self._pipeline.run_op(op)
 
     def subscribe(self, topic, callback=None):
-        pass
+        """
+        Subscribe to a topic, connecting first if necessary.
+        :param topic: The topic to subscribe to.
+        :param callback: callback which is called when the subscription has been acknowledged by the service.
+        """
+        op = pipeline_ops_mqtt.Subscribe(topic=topic, callback=_get_pipeline_callback(callback))
+        op.needs_connection = True
+        self._pipeline.run_op(op)
 
     def unsubscribe(self, topic, callback=None):
-        pass
+        """
+        Unsubscribe from a topic.
+        :param topic: The topic to unsubscribe from.
+        :param callback: callback which is called when the unsubscribe has been acknowledged by the service.
+        """
+        op = pipeline_ops_mqtt.Unsubscribe(topic=topic, callback=_get_pipeline_callback(callback))
+        op.needs_connection = True
+        self._pipeline.run_op(op)
+
+    def get_pipeline_stats(self):
+        """
+        Return the counters kept by the stages of the transport pipeline, including the latencies
+        of the Connect, Subscribe and Publish operations under the "MeasureLatency" key.  See
+        PipelineRoot.get_pipeline_stats for the format.
+        """
+        return self._pipeline.get_pipeline_stats()
+
+
+def _get_pipeline_callback(callback):
+    def pipeline_callback(call):
+        if call.error:
+            logger.error("{} failed: {}".format(call.name, call.error))
+        if callback:
+            callback()
+
+    return pipeline_callback
@@ -0,0 +1,150 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Measure the memory and garbage collector work done for each telemetry message sent.
+
+Messages are sent through a real MQTTTransport pipeline.  The MQTT provider is replaced with a
+fake one that acknowledges every publish immediately, so nothing goes over the network and the
+numbers only reflect the pipeline.  Each run is done with the transport's op pool enabled (the
+normal behavior) and disabled.
+
+For each run this reports:
+  * the size of the op objects created for each message
+  * the memory allocated per message that reference counting alone doesn't free (with the
+    garbage collector disabled), and the number of objects the collector then has to clean up
+  * the number of generation 0 collections triggered per 10000 messages (collector enabled)
+  * the time taken per message
+
+Usage: python alloc_per_message.py [number_of_messages]
+
+Requires Python 3.4 or later (for tracemalloc).  The azure-iot-device package must be importable
+(for example, installed with pip install -e).
+"""
+
+from __future__ import print_function
+import gc
+import logging
+import sys
+import time
+import tracemalloc
+from azure.iot.device.common.transport.mqtt import pipeline_ops_mqtt
+from azure.iot.device.common.transport.mqtt import pipeline_stages_mqtt
+from azure.iot.device.iothub.auth import authentication_provider_factory
+from azure.iot.device.iothub.models import Message
+from azure.iot.device.iothub.transport.mqtt.mqtt_transport import MQTTTransport
+from azure.iot.device.iothub.transport import pipeline_ops_iothub
+
+FAKE_CONNECTION_STRING = (
+    "HostName=bench.azure-devices.net;DeviceId=bench-device;SharedAccessKey=Zm9vYmFy"
+)
+
+
+class FakeMQTTProvider(object):
+    """Stands in for MQTTProvider and acknowledges everything immediately"""
+
+    def __init__(self, client_id, hostname, username, ca_cert=None):
+        self.on_mqtt_connected = None
+        self.on_mqtt_disconnected = None
+        self.on_mqtt_message_received = None
+        self.mid = 0
+
+    def connect(self, password):
+        self.on_mqtt_connected()
+
+    def publish(self, topic, payload, qos=1, callback=None):
+        self.mid = self.mid % 65535 + 1
+        callback()
+        return self.mid
+
+    def get_operation_stats(self):
+        return {}
+
+
+def connected_transport(use_pool):
+    transport = MQTTTransport(
+        authentication_provider_factory.from_connection_string(FAKE_CONNECTION_STRING)
+    )
+    if not use_pool:
+        transport._pipeline.op_pool = None
+    transport.connect()
+    return transport
+
+
+def send(transport, message_count):
+    def on_sent(error=None):
+        pass
+
+    for i in range(message_count):
+        transport.send_event(Message("payload {}".format(i)), on_sent)
+
+
+def measure_uncollected(use_pool, message_count):
+    """
+    With the collector disabled, return the bytes per message that are still allocated after
+    sending, and the number of objects per message that the collector then cleans up.
+    """
+    transport = connected_transport(use_pool)
+    send(transport, 100)
+    gc.collect()
+    gc.disable()
+    try:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        send(transport, message_count)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        collected = gc.collect()
+    finally:
+        gc.enable()
+    return (float(after - before) / message_count, float(collected) / message_count)
+
+
+def measure_collections(use_pool, message_count):
+    """
+    With the collector enabled, return the number of generation 0 collections per 10000
+    messages and the time per message in microseconds.
+    """
+    transport = connected_transport(use_pool)
+    send(transport, 100)
+    gc.collect()
+    before = gc.get_stats()[0]["collections"]
+    start = time.time()
+    send(transport, message_count)
+    elapsed = time.time() - start
+    collections = gc.get_stats()[0]["collections"] - before
+    return (collections * 10000.0 / message_count, elapsed * 1e6 / message_count)
+
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    logging.disable(logging.CRITICAL)
+
+    print("op sizes (bytes):")
+    for op in (
+        pipeline_ops_iothub.SendTelemetry(message=None),
+        pipeline_ops_mqtt.Publish(topic=None, payload=None),
+    ):
+        print("  {:<16} {}".format(op.name, sys.getsizeof(op)))
+    print()
+
+    print("{} messages".format(message_count))
+    print(
+        "{:<10} {:>18} {:>18} {:>18} {:>12}".format(
+            "op pool", "uncollected B/msg", "gc objects/msg", "gen0 gcs/10k msg", "us/msg"
+        )
+    )
+    for use_pool in (True, False):
+        (uncollected, collected) = measure_uncollected(use_pool, message_count)
+        (collections, per_message) = measure_collections(use_pool, message_count)
+        print(
+            "{:<10} {:>18.1f} {:>18.2f} {:>18.1f} {:>12.1f}".format(
+                "on" if use_pool else "off", uncollected, collected, collections, per_message
+            )
+        )
+
+
+if __name__ == "__main__":
+    pipeline_stages_mqtt.MQTTProvider = FakeMQTTProvider
+    main()
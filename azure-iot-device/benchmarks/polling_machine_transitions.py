@@ -0,0 +1,139 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Measure the cost of creating provisioning polling machines and of moving them between states.
+
+Two things are timed:
+  * creating a PollingMachine (with a fake provider, so nothing goes over the network), which is
+    done once for every device registered
+  * running the polling machine's transitions (register, send request, wait, poll, error) over
+    and over on a bare model, so only the state machine itself is measured
+
+If the transitions library is installed, the same measurements are made with a
+transitions.Machine built from the same states and transitions, for comparison.
+
+Usage: python polling_machine_transitions.py [number_of_iterations]
+
+The azure-iot-device package must be importable (for example, installed with pip install -e).
+"""
+
+from __future__ import print_function
+import logging
+import sys
+import time
+from azure.iot.device.provisioning.internal import polling_machine
+from azure.iot.device.provisioning.internal.state_machine import TransitionTable
+
+try:
+    import transitions
+except ImportError:
+    transitions = None
+
+# One trip around the polling machine's states, ending back where it started
+CYCLE = ["_trig_register", "_trig_send_register_request", "_trig_wait", "_trig_poll", "_trig_error"]
+
+
+class FakeProvider(object):
+    """Stands in for the state based provider, which the polling machine only stores"""
+
+    on_state_based_provider_message_received = None
+
+
+def bare_transitions():
+    """The polling machine's transitions without callbacks, so that no provider work is done"""
+    return [
+        {"trigger": t["trigger"], "source": t["source"], "dest": t["dest"]}
+        for t in polling_machine._TRANSITIONS
+    ]
+
+
+class TableModel(object):
+    table = TransitionTable(polling_machine._STATES, bare_transitions())
+
+    def __init__(self):
+        self.table.initialize(self, "error")
+
+
+class BareModel(object):
+    pass
+
+
+def time_construction(iterations):
+    provider = FakeProvider()
+    start = time.time()
+    for _ in range(iterations):
+        polling_machine.PollingMachine(provider)
+    return time.time() - start
+
+
+def time_table_transitions(iterations):
+    model = TableModel()
+    fire = TableModel.table.fire
+    start = time.time()
+    for _ in range(iterations):
+        for trigger in CYCLE:
+            fire(model, trigger)
+    return time.time() - start
+
+
+def time_transitions_construction(iterations):
+    start = time.time()
+    for _ in range(iterations):
+        transitions.Machine(
+            model=BareModel(),
+            states=polling_machine._STATES,
+            transitions=bare_transitions(),
+            initial="disconnected",
+            send_event=True,
+            queued=True,
+        )
+    return time.time() - start
+
+
+def time_transitions_transitions(iterations):
+    model = BareModel()
+    transitions.Machine(
+        model=model,
+        states=polling_machine._STATES,
+        transitions=bare_transitions(),
+        initial="error",
+        send_event=True,
+        queued=True,
+    )
+    triggers = [getattr(model, trigger) for trigger in CYCLE]
+    start = time.time()
+    for _ in range(iterations):
+        for trigger in triggers:
+            trigger()
+    return time.time() - start
+
+
+def report(name, elapsed, count, unit):
+    print(
+        "  {:<14}{:.3f}s, {:.2f}us per {}, {:.0f} per sec".format(
+            name, elapsed, elapsed * 1e6 / count, unit, count / elapsed
+        )
+    )
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    # Leave logging out of the measurement
+    logging.disable(logging.CRITICAL)
+
+    print("construction ({} machines):".format(iterations))
+    report("table", time_construction(iterations), iterations, "machine")
+    if transitions:
+        report("transitions", time_transitions_construction(iterations), iterations, "machine")
+
+    count = iterations * len(CYCLE)
+    print("transitions ({} triggers):".format(count))
+    report("table", time_table_transitions(iterations), count, "trigger")
+    if transitions:
+        report("transitions", time_transitions_transitions(iterations), count, "trigger")
+
+
+if __name__ == "__main__":
+    main()
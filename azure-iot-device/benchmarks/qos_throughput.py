@@ -0,0 +1,147 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Compare telemetry throughput and CPU cost of QoS 1 sends and fire and forget (QoS 0) sends.
+
+Messages are sent through a real MQTTTransport and MQTTProvider.  Only the paho client is
+replaced, with a fake one that has its own network thread.  The network thread reports every
+publish as written, and acknowledges QoS 1 publishes after a simulated round trip time, so
+QoS 1 sends are limited by the number of publishes the pipeline allows in flight.
+
+All messages are sent without waiting for the previous ones to complete, and the run ends when
+every send has completed.
+
+Usage: python qos_throughput.py [number_of_messages] [round_trip_ms]
+
+The azure-iot-device package must be importable (for example, installed with pip install -e).
+"""
+
+from __future__ import print_function
+import logging
+import sys
+import threading
+import time
+from six.moves import queue
+import paho.mqtt.client as mqtt
+from azure.iot.device.common.transport.mqtt import mqtt_provider
+from azure.iot.device.iothub.auth import authentication_provider_factory
+from azure.iot.device.iothub.models import Message
+from azure.iot.device.iothub.transport.mqtt.mqtt_transport import MQTTTransport
+
+FAKE_CONNECTION_STRING = (
+    "HostName=bench.azure-devices.net;DeviceId=bench-device;SharedAccessKey=Zm9vYmFy"
+)
+
+if hasattr(time, "process_time"):
+    cpu_time = time.process_time
+else:
+    cpu_time = time.clock
+
+
+class FakePahoClient(object):
+    """Stands in for paho's Client.  Publishes are 'sent' by a background network thread."""
+
+    round_trip = 0.0
+
+    def __init__(self, *args, **kwargs):
+        self.on_connect = None
+        self.on_publish = None
+        self._mid = 0
+        self._lock = threading.Lock()
+        self._outgoing = queue.Queue()
+        self._acks = queue.Queue()
+
+    def tls_set_context(self, context):
+        pass
+
+    def tls_insecure_set(self, value):
+        pass
+
+    def username_pw_set(self, username, password):
+        pass
+
+    def connect(self, host, port):
+        pass
+
+    def loop_start(self):
+        for target in (self._network_loop, self._ack_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        self.on_connect(self, None, None, 0)
+
+    def publish(self, topic, payload, qos):
+        with self._lock:
+            self._mid = self._mid % 65535 + 1
+            mid = self._mid
+        self._outgoing.put((mid, qos))
+        return mqtt.MQTTMessageInfo(mid)
+
+    def _network_loop(self):
+        while True:
+            mid, qos = self._outgoing.get()
+            if qos == 0:
+                # paho reports a QoS 0 publish once it has been written to the socket
+                self.on_publish(self, None, mid)
+            else:
+                self._acks.put((time.time() + self.round_trip, mid))
+
+    def _ack_loop(self):
+        while True:
+            due, mid = self._acks.get()
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.on_publish(self, None, mid)
+
+
+def run(message_count, fire_and_forget):
+    transport = MQTTTransport(
+        authentication_provider_factory.from_connection_string(FAKE_CONNECTION_STRING)
+    )
+    transport.connect()
+
+    done = threading.Event()
+    completed = [0]
+    lock = threading.Lock()
+
+    def on_sent(error=None):
+        with lock:
+            completed[0] += 1
+            if completed[0] == message_count:
+                done.set()
+
+    messages = [Message("payload {}".format(i)) for i in range(message_count)]
+    start_cpu = cpu_time()
+    start = time.time()
+    for message in messages:
+        transport.send_event(message, on_sent, fire_and_forget=fire_and_forget)
+    done.wait()
+    elapsed = time.time() - start
+    cpu = cpu_time() - start_cpu
+    stats = transport.get_pipeline_stats()["Provider"]
+    return (message_count / elapsed, cpu * 1e6 / message_count, stats)
+
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    round_trip_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    logging.disable(logging.CRITICAL)
+    FakePahoClient.round_trip = round_trip_ms / 1000.0
+
+    print("{} messages, {} ms simulated round trip".format(message_count, round_trip_ms))
+    print("{:<6} {:>12} {:>12} {:>12}".format("QoS", "msgs/s", "cpu us/msg", "completed"))
+    for label, fire_and_forget in (("1", False), ("0", True)):
+        rate, cpu_per_message, stats = run(message_count, fire_and_forget)
+        print(
+            "{:<6} {:>12.0f} {:>12.1f} {:>12}".format(
+                label, rate, cpu_per_message, stats["completed"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    mqtt_provider.mqtt.Client = FakePahoClient
+    main()
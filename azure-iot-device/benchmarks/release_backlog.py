@@ -0,0 +1,144 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Measure how long the pipeline takes to release a backlog of ops queued behind a connect.
+
+Every op is queued in EnsureConnection while the connect is pending, and is completed as soon as
+it reaches the bottom of the pipeline.  The release is measured with the trampoline (the normal
+behavior) and with ops and callbacks called directly, which is how the pipeline used to work.
+It also measures a chain of ops where each op is started by the completion of the previous one.
+
+Usage: python release_backlog.py [number_of_ops]
+
+The azure-iot-device package must be importable (for example, installed with pip install -e).
+"""
+
+from __future__ import print_function
+import logging
+import sys
+import time
+from azure.iot.device.common.transport import pipeline_stages_base
+from azure.iot.device.common.transport import pipeline_ops_base
+
+
+class BottomStage(pipeline_stages_base.PipelineStage):
+    """Holds on to the connect op and completes everything else immediately"""
+
+    def __init__(self):
+        super(BottomStage, self).__init__()
+        self.pending_connect = None
+        self.max_depth = 0
+
+    def _run_op(self, op):
+        self.max_depth = max(self.max_depth, stack_depth())
+        if isinstance(op, pipeline_ops_base.Connect):
+            self.pending_connect = op
+        else:
+            self.complete_op(op)
+
+    def finish_connect(self):
+        self.on_connected()
+        self.complete_op(self.pending_connect)
+
+
+def stack_depth():
+    frame = sys._getframe()
+    depth = 0
+    while frame:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+def build_pipeline():
+    bottom = BottomStage()
+    root = (
+        pipeline_stages_base.PipelineRoot()
+        .append_stage(pipeline_stages_base.EnsureConnection())
+        .append_stage(bottom)
+    )
+    return (root, bottom)
+
+
+def make_op(callback):
+    op = pipeline_ops_base.PipelineOperation(callback=callback)
+    op.needs_connection = True
+    return op
+
+
+def release_backlog(op_count):
+    """
+    Queue op_count ops behind a connect and time how long it takes to release them all.
+    """
+    (root, bottom) = build_pipeline()
+    completed = [0]
+
+    def on_complete(op):
+        completed[0] += 1
+
+    # the first op triggers the connect, and the rest wait behind it
+    for _ in range(op_count):
+        root.run_op(make_op(on_complete))
+
+    start = time.time()
+    bottom.finish_connect()
+    elapsed = time.time() - start
+    assert completed[0] == op_count, "only {} of {} ops completed".format(completed[0], op_count)
+    return (elapsed, bottom.max_depth)
+
+
+def run_chain(op_count):
+    """
+    Time op_count ops where each op is started by the completion of the one before it, the
+    way run_ops_serial works.
+    """
+    (root, bottom) = build_pipeline()
+    bottom.on_connected()
+    remaining = [op_count]
+
+    def on_complete(op):
+        remaining[0] -= 1
+        if remaining[0]:
+            root.run_op(make_op(on_complete))
+
+    start = time.time()
+    root.run_op(make_op(on_complete))
+    elapsed = time.time() - start
+    assert remaining[0] == 0, "{} of {} ops did not run".format(remaining[0], op_count)
+    return (elapsed, bottom.max_depth)
+
+
+def run_direct(fn, *args):
+    fn(*args)
+
+
+def measure(name, fn, op_count):
+    try:
+        (elapsed, depth) = fn(op_count)
+        print("  {:<12}{:.3f}s, max stack depth {}".format(name, elapsed, depth))
+    except (AssertionError, RuntimeError) as e:
+        # The pipeline catches the RecursionError (a RuntimeError) and fails the op, so running
+        # out of stack usually shows up as ops that never completed.
+        print("  {:<12}did not finish: {}".format(name, e))
+
+
+def main():
+    op_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # Leave logging out of the measurement, and keep the tracebacks from the failing runs quiet
+    logging.disable(logging.CRITICAL)
+    trampoline = pipeline_stages_base._run_on_trampoline
+
+    for (title, fn) in [("release backlog", release_backlog), ("chained ops", run_chain)]:
+        print("{} ({} ops):".format(title, op_count))
+        measure("trampoline", fn, op_count)
+        pipeline_stages_base._run_on_trampoline = run_direct
+        try:
+            measure("direct", fn, op_count)
+        finally:
+            pipeline_stages_base._run_on_trampoline = trampoline
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import gzip
+import io
+import zlib
+import pytest
+import six
+from azure.iot.device.common.compression import ZlibCodec
+
+payload = b'{"temperature": 21.5, "humidity": 40.25, "pressure": 1013.1}' * 4
+
+
+@pytest.mark.describe("ZlibCodec")
+class TestZlibCodec(object):
+    @pytest.mark.it("Produces zlib streams with a 'deflate' content encoding by default")
+    def test_zlib(self):
+        codec = ZlibCodec()
+        compressed = codec.compress(payload)
+        assert codec.content_encoding == "deflate"
+        assert zlib.decompress(compressed) == payload
+        assert codec.decompress(compressed) == payload
+
+    @pytest.mark.it("Produces gzip streams with a 'gzip' content encoding if use_gzip is True")
+    def test_gzip(self):
+        codec = ZlibCodec(use_gzip=True)
+        compressed = codec.compress(payload)
+        assert codec.content_encoding == "gzip"
+        assert gzip.GzipFile(fileobj=io.BytesIO(compressed)).read() == payload
+        assert codec.decompress(compressed) == payload
+
+    @pytest.mark.it("Uses the given content encoding instead of the default one")
+    def test_custom_content_encoding(self):
+        assert ZlibCodec(content_encoding="x-telemetry").content_encoding == "x-telemetry"
+
+    @pytest.mark.skipif(six.PY2, reason="zlib preset dictionaries require Python 3.3 or later")
+    @pytest.mark.it("Compresses small payloads better with a preset dictionary")
+    def test_zdict(self):
+        small_payload = b'{"temperature": 21.5, "humidity": 40.25}'
+        codec = ZlibCodec(zdict=b'{"temperature": , "humidity": , "pressure": }')
+        compressed = codec.compress(small_payload)
+        assert len(compressed) < len(ZlibCodec().compress(small_payload))
+        assert codec.decompress(compressed) == small_payload
+
+    @pytest.mark.it("Raises ValueError if a preset dictionary is given for gzip streams")
+    def test_zdict_with_gzip(self):
+        with pytest.raises(ValueError):
+            ZlibCodec(zdict=b"abc", use_gzip=True)
+
+    @pytest.mark.it("Raises ValueError when decompressing an invalid payload")
+    def test_invalid_payload(self):
+        with pytest.raises(ValueError):
+            ZlibCodec().decompress(b"not compressed")
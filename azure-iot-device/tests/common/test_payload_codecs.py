@@ -0,0 +1,102 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import json
+import pytest
+from azure.iot.device.common import payload_codecs
+from azure.iot.device.common.payload_codecs import CodecRegistry, JsonCodec, RawCodec
+from azure.iot.device.iothub.models import Message
+
+fake_value = {"temperature": 21.5, "tags": ["a", "b"], "ok": True}
+
+
+@pytest.mark.describe("JsonCodec")
+class TestJsonCodec(object):
+    @pytest.mark.it("Round trips JSON values")
+    @pytest.mark.parametrize("use_fast_backend", [True, False], ids=["Fast backend", "json module"])
+    def test_round_trip(self, use_fast_backend):
+        codec = JsonCodec(use_fast_backend=use_fast_backend)
+        encoded = codec.encode(fake_value)
+        assert json.loads(encoded.decode("utf-8")) == fake_value
+        assert codec.decode(encoded) == fake_value
+
+    @pytest.mark.it("Encodes to utf-8 bytes with either backend")
+    @pytest.mark.parametrize("use_fast_backend", [True, False], ids=["Fast backend", "json module"])
+    @pytest.mark.parametrize(
+        "value", [fake_value, {1: "one"}], ids=["Any value", "Value the fast backend can't encode"]
+    )
+    def test_encodes_bytes(self, use_fast_backend, value):
+        encoded = JsonCodec(use_fast_backend=use_fast_backend).encode(value)
+        assert isinstance(encoded, bytes)
+        assert json.loads(encoded.decode("utf-8")) == json.loads(json.dumps(value))
+
+    @pytest.mark.it("Uses the json module if use_fast_backend is False")
+    def test_json_backend(self):
+        assert JsonCodec(use_fast_backend=False).backend == "json"
+
+    @pytest.mark.it("Falls back to the json module for values the fast backend can't encode")
+    def test_fallback(self):
+        codec = JsonCodec()
+        assert json.loads(codec.encode({1: "one"}).decode("utf-8")) == {"1": "one"}
+
+    @pytest.mark.it("Decodes bytes and text")
+    @pytest.mark.parametrize("data", [b'{"a": 1}', u'{"a": 1}'], ids=["bytes", "text"])
+    def test_decode_types(self, data):
+        assert JsonCodec(use_fast_backend=False).decode(data) == {"a": 1}
+        assert JsonCodec().decode(data) == {"a": 1}
+
+
+@pytest.mark.describe("RawCodec")
+class TestRawCodec(object):
+    @pytest.mark.it("Passes bytes through and encodes text as utf-8")
+    def test_encode(self):
+        codec = RawCodec()
+        assert codec.encode(b"\x00\x01") == b"\x00\x01"
+        assert codec.encode(u"caf\u00e9") == u"caf\u00e9".encode("utf-8")
+        assert codec.decode(b"\x00\x01") == b"\x00\x01"
+
+    @pytest.mark.it("Raises TypeError for values that aren't bytes or text")
+    def test_encode_invalid(self):
+        with pytest.raises(TypeError):
+            RawCodec().encode(fake_value)
+
+
+@pytest.mark.describe("CodecRegistry")
+class TestCodecRegistry(object):
+    @pytest.mark.it("Finds codecs by content type, ignoring case and parameters")
+    def test_get(self):
+        registry = CodecRegistry()
+        codec = RawCodec()
+        registry.register("application/x-custom", codec)
+        assert registry.get("Application/X-Custom; charset=utf-8") is codec
+
+    @pytest.mark.it("Raises ValueError for an unknown content type")
+    def test_unknown_content_type(self):
+        with pytest.raises(ValueError):
+            CodecRegistry().encode("application/unknown", fake_value)
+
+    @pytest.mark.it("Sends text and bytes message data as it is")
+    @pytest.mark.parametrize("data", [b"raw", u"text"], ids=["bytes", "text"])
+    def test_encode_message_data_passthrough(self, data):
+        message = Message(data)
+        assert payload_codecs.default_registry.encode_message_data(message) == (data, None)
+
+    @pytest.mark.it("Encodes other message data as JSON if the message has no content type")
+    def test_encode_message_data_default_json(self):
+        (payload, content_type) = payload_codecs.default_registry.encode_message_data(
+            Message(fake_value)
+        )
+        assert content_type == payload_codecs.CONTENT_TYPE_JSON
+        assert payload_codecs.default_registry.decode(content_type, payload) == fake_value
+
+    @pytest.mark.it("Encodes other message data with the codec for the message's content type")
+    def test_encode_message_data_content_type(self, mocker):
+        registry = CodecRegistry()
+        codec = mocker.MagicMock()
+        codec.encode.return_value = b"encoded"
+        registry.register("application/x-custom", codec)
+        message = Message(fake_value, content_type="application/x-custom")
+        assert registry.encode_message_data(message) == (b"encoded", "application/x-custom")
+        assert codec.encode.call_args == mocker.call(fake_value)
@@ -12,7 +12,7 @@ import hmac
 import hashlib
 import copy
 import six.moves.urllib as urllib
-from azure.iot.device.common.sastoken import SasToken, SasTokenError
+from azure.iot.device.common.sastoken import SasToken, SasTokenError, SigningEngine
 
 uri = "my.host.name"
 key = "Zm9vYmFy"
@@ -130,4 +130,35 @@ class TestSasToken(object):
         assert old_token_string != new_token_string
 
 
+class TestSigningEngine(object):
+    def test_sign_returns_expected_signature(self):
+        engine = SigningEngine(key)
+        assert engine.sign("my.host.name", 1539043658) == generate_signature(
+            "my.host.name", key, 1539043658
+        )
+
+    def test_sign_can_be_called_repeatedly(self):
+        engine = SigningEngine(key)
+        engine.sign("some.other.host", 1000)
+        assert engine.sign(uri, 2000) == generate_signature(uri, key, 2000)
+
+    def test_sign_many_returns_signatures_in_order(self):
+        engine = SigningEngine(key)
+        pairs = [(uri, 1000), ("my+ch%C3%A2teu.host.name", 2000), (uri, 3000)]
+        assert engine.sign_many(iter(pairs)) == [
+            generate_signature(quoted_uri, key, expiry) for (quoted_uri, expiry) in pairs
+        ]
+
+    def test_sign_string_returns_base64_hmac(self):
+        engine = SigningEngine(key)
+        signed_hmac = hmac.HMAC(base64.b64decode(key), b"my+ch%C3%A2teu", hashlib.sha256)
+        assert engine.sign_string("my+ch%C3%A2teu") == base64.b64encode(
+            signed_hmac.digest()
+        ).decode("utf-8")
+
+    def test_raises_sastoken_error_if_key_is_not_base64(self):
+        with pytest.raises(SasTokenError):
+            SigningEngine("this is not base64")
+
+
 pytest.main()
@@ -4,12 +4,12 @@
 # license information.
 # --------------------------------------------------------------------------
 
-from azure.iot.device.common.transport.mqtt.mqtt_provider import MQTTProvider
+from azure.iot.device.common.transport.mqtt.mqtt_provider import MQTTProvider, PublishError
+from azure.iot.device.common.transport.mqtt import operation_tracker
 import paho.mqtt.client as mqtt
 import ssl
 import pytest
 
-
 fake_hostname = "beauxbatons.academy-net"
 fake_device_id = "MyFirebolt"
 fake_password = "Fortuna Major"
@@ -26,12 +26,26 @@ class DummyException(Exception):
     pass
 
 
+def mids_in_state(provider, state):
+    states = provider._operation_tracker._states
+    return [mid for mid in range(len(states)) if states[mid] == state]
+
+
+def pending_mids(provider):
+    return mids_in_state(provider, operation_tracker.PENDING)
+
+
+def early_mids(provider):
+    return mids_in_state(provider, operation_tracker.EARLY)
+
+
 @pytest.fixture
 def mock_mqtt_client(mocker):
     mock = mocker.patch.object(mqtt, "Client")
     mock_mqtt_client = mock.return_value
     mock_mqtt_client.subscribe = mocker.MagicMock(return_value=(fake_rc, fake_mid))
     mock_mqtt_client.unsubscribe = mocker.MagicMock(return_value=(fake_rc, fake_mid))
+    mock_mqtt_client.publish = mocker.MagicMock(return_value=mqtt.MQTTMessageInfo(fake_mid))
     return mock_mqtt_client
 
 
@@ -85,8 +99,8 @@ class TestInstantiation(object):
             client_id=fake_device_id, hostname=fake_hostname, username=fake_username
         )
 
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
 
 @pytest.mark.describe("MQTT Provider - Connect")
@@ -282,6 +296,79 @@ class TestReconnect(object):
         # Callback was called, but exception did not propagate
         assert event_cb.call_count == 1
 
+    @pytest.mark.it("Stops the MQTT Network Loop while reconnecting and restarts it afterwards")
+    def test_stops_loop_around_paho_reconnect(self, mocker, mock_mqtt_client, provider):
+        provider.reconnect(fake_password)
+
+        calls = [
+            name
+            for (name, args, kwargs) in mock_mqtt_client.mock_calls
+            if name in ("loop_stop", "reconnect", "loop_start")
+        ]
+        assert calls == ["loop_stop", "reconnect", "loop_start"]
+
+    @pytest.mark.it("Triggers callback upon completion of the reconnect")
+    def test_triggers_callback(self, mocker, mock_mqtt_client, provider):
+        calls = []
+        provider.on_mqtt_connected = lambda: calls.append("on_mqtt_connected")
+
+        provider.reconnect(fake_password, callback=lambda: calls.append("callback"))
+        assert calls == []
+
+        mock_mqtt_client.on_connect(client=mock_mqtt_client, userdata=None, flags=None, rc=fake_rc)
+        assert calls == ["on_mqtt_connected", "callback"]
+
+        # Later connections are only reported to on_mqtt_connected
+        mock_mqtt_client.on_connect(client=mock_mqtt_client, userdata=None, flags=None, rc=fake_rc)
+        assert calls == ["on_mqtt_connected", "callback", "on_mqtt_connected"]
+
+    @pytest.mark.it(
+        "Does not trigger callback for a connection Paho started on its own before the reconnect"
+    )
+    def test_ignores_overlapping_paho_connect(self, mocker, mock_mqtt_client, provider):
+        event_cb = mocker.MagicMock()
+        provider.on_mqtt_connected = event_cb
+        callback = mocker.MagicMock()
+
+        def finish_paho_connect():
+            # Paho's own reconnect completes while its network thread is being stopped
+            mock_mqtt_client.on_connect(
+                client=mock_mqtt_client, userdata=None, flags=None, rc=fake_rc
+            )
+
+        mock_mqtt_client.loop_stop.side_effect = finish_paho_connect
+
+        provider.reconnect(fake_password, callback=callback)
+        assert event_cb.call_count == 1
+        assert callback.call_count == 0
+
+        # Only the connection started by the reconnect triggers the callback
+        mock_mqtt_client.on_connect(client=mock_mqtt_client, userdata=None, flags=None, rc=fake_rc)
+        assert event_cb.call_count == 2
+        assert callback.call_count == 1
+
+    @pytest.mark.it("Leaves the MQTT Network Loop stopped if Paho fails to reconnect")
+    def test_paho_reconnect_fails(self, mocker, mock_mqtt_client, provider):
+        callback = mocker.MagicMock()
+        mock_mqtt_client.reconnect.side_effect = DummyException
+
+        with pytest.raises(DummyException):
+            provider.reconnect(fake_password, callback=callback)
+
+        assert mock_mqtt_client.loop_start.call_count == 0
+        mock_mqtt_client.on_connect(client=mock_mqtt_client, userdata=None, flags=None, rc=fake_rc)
+        assert callback.call_count == 0
+
+    @pytest.mark.it("Recovers from exception in callback")
+    def test_callback_raises_exception(self, mocker, mock_mqtt_client, provider):
+        callback = mocker.MagicMock(side_effect=DummyException)
+
+        provider.reconnect(fake_password, callback=callback)
+        mock_mqtt_client.on_connect(client=mock_mqtt_client, userdata=None, flags=None, rc=fake_rc)
+
+        # Callback was called, but exception did not propagate
+        assert callback.call_count == 1
+
 
 @pytest.mark.describe("MQTT Provider - Disconnect")
 class TestDisconnect(object):
@@ -405,8 +492,8 @@ class TestSubscribe(object):
 
         # Check callback is stored as pending, but not called
         assert callback.call_count == 0
-        assert provider._pending_operation_callbacks == {fake_mid: callback}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == [fake_mid]
+        assert early_mids(provider) == []
 
         # Manually trigger Paho on_subscribe event handler
         mock_mqtt_client.on_subscribe(
@@ -415,8 +502,8 @@ class TestSubscribe(object):
 
         # Check callback has now been called, and stored values cleared
         assert callback.call_count == 1
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Triggers callback upon subscribe completion when Paho event handler triggered early"
@@ -435,8 +522,8 @@ class TestSubscribe(object):
 
             # Check mid has been stored as an unknown response, callback not yet called
             assert callback.call_count == 0
-            assert provider._pending_operation_callbacks == {}
-            assert provider._unknown_operation_responses == {fake_mid: fake_mid}
+            assert pending_mids(provider) == []
+            assert early_mids(provider) == [fake_mid]
 
             return (fake_rc, fake_mid)
 
@@ -447,8 +534,8 @@ class TestSubscribe(object):
 
         # Check callback has now been called, and stored values cleared
         assert callback.call_count == 1
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it("Skips callback that is set to 'None' upon subscribe completion")
     def test_none_callback_upon_paho_on_subscribe_event(self, mocker, mock_mqtt_client, provider):
@@ -459,8 +546,8 @@ class TestSubscribe(object):
         provider.subscribe(topic=fake_topic, qos=fake_qos, callback=callback)
 
         # Check that callback (None) has been stored
-        assert provider._pending_operation_callbacks == {fake_mid: callback}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == [fake_mid]
+        assert early_mids(provider) == []
 
         # Manually trigger Paho on_subscribe event handler
         mock_mqtt_client.on_subscribe(
@@ -468,8 +555,8 @@ class TestSubscribe(object):
         )
 
         # Check that callback (None) has now been cleared
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Skips callback that is set to 'None' upon subscribe completion when Paho event handler triggered early"
@@ -487,8 +574,8 @@ class TestSubscribe(object):
             )
 
             # Check mid has been stored as an unknown response, callback not yet called
-            assert provider._pending_operation_callbacks == {}
-            assert provider._unknown_operation_responses == {fake_mid: fake_mid}
+            assert pending_mids(provider) == []
+            assert early_mids(provider) == [fake_mid]
 
             return (fake_rc, fake_mid)
 
@@ -498,8 +585,8 @@ class TestSubscribe(object):
         provider.subscribe(topic=fake_topic, qos=fake_qos, callback=callback)
 
         # Check callback (None) has now been cleared
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Handles multiple callbacks from multiple subscribe operations that complete out of order"
@@ -616,16 +703,16 @@ class TestUnsubscribe(object):
 
         # Check callback is stored as pending, but not called
         assert callback.call_count == 0
-        assert provider._pending_operation_callbacks == {fake_mid: callback}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == [fake_mid]
+        assert early_mids(provider) == []
 
         # Manually trigger Paho on_unsubscribe event handler
         mock_mqtt_client.on_unsubscribe(client=mock_mqtt_client, userdata=None, mid=fake_mid)
 
         # Check callback has now been called, and stored values cleared
         assert callback.call_count == 1
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Triggers callback upon unsubscribe completion when Paho event handler triggered early"
@@ -642,8 +729,8 @@ class TestUnsubscribe(object):
 
             # Check mid has been stored as an unknown response, callback not yet called
             assert callback.call_count == 0
-            assert provider._pending_operation_callbacks == {}
-            assert provider._unknown_operation_responses == {fake_mid: fake_mid}
+            assert pending_mids(provider) == []
+            assert early_mids(provider) == [fake_mid]
 
             return (fake_rc, fake_mid)
 
@@ -654,8 +741,8 @@ class TestUnsubscribe(object):
 
         # Check callback has now been called, and stored values cleared
         assert callback.call_count == 1
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it("Skips callback that is set to 'None' upon unsubscribe completion")
     def test_none_callback_upon_paho_on_unsubscribe_event(self, mocker, mock_mqtt_client, provider):
@@ -666,15 +753,15 @@ class TestUnsubscribe(object):
         provider.unsubscribe(topic=fake_topic, callback=callback)
 
         # Check that callback (None) has been stored
-        assert provider._pending_operation_callbacks == {fake_mid: callback}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == [fake_mid]
+        assert early_mids(provider) == []
 
         # Manually trigger Paho on_unsubscribe event handler
         mock_mqtt_client.on_unsubscribe(client=mock_mqtt_client, userdata=None, mid=fake_mid)
 
         # Check that callback (None) has now been cleared
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Skips callback that is set to 'None' upon unsubscribe completion when Paho event handler triggered early"
@@ -690,8 +777,8 @@ class TestUnsubscribe(object):
             mock_mqtt_client.on_unsubscribe(client=mock_mqtt_client, userdata=None, mid=fake_mid)
 
             # Check mid has been stored as an unknown response, callback not yet called
-            assert provider._pending_operation_callbacks == {}
-            assert provider._unknown_operation_responses == {fake_mid: fake_mid}
+            assert pending_mids(provider) == []
+            assert early_mids(provider) == [fake_mid]
 
             return (fake_rc, fake_mid)
 
@@ -701,8 +788,8 @@ class TestUnsubscribe(object):
         provider.unsubscribe(topic=fake_topic, callback=callback)
 
         # Check callback (None) has now been cleared
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Handles multiple callbacks from multiple unsubscribe operations that complete out of order"
@@ -852,16 +939,16 @@ class TestPublish(object):
 
         # Check callback is stored as pending, but not called
         assert callback.call_count == 0
-        assert provider._pending_operation_callbacks == {message_info.mid: callback}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == [message_info.mid]
+        assert early_mids(provider) == []
 
         # Manually trigger Paho on_publish event handler
         mock_mqtt_client.on_publish(client=mock_mqtt_client, userdata=None, mid=message_info.mid)
 
         # Check callback has now been called, and stored values cleared
         assert callback.call_count == 1
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Triggers callback upon publish completion when Paho event handler triggered early"
@@ -880,8 +967,8 @@ class TestPublish(object):
 
             # Check mid has been stored as an unknown response, callback not yet called
             assert callback.call_count == 0
-            assert provider._pending_operation_callbacks == {}
-            assert provider._unknown_operation_responses == {message_info.mid: message_info.mid}
+            assert pending_mids(provider) == []
+            assert early_mids(provider) == [message_info.mid]
 
             return message_info
 
@@ -892,8 +979,91 @@ class TestPublish(object):
 
         # Check callback has now been called, and stored values cleared
         assert callback.call_count == 1
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
+
+    @pytest.mark.it("Triggers callback for a QoS 0 publish once Paho reports it as written")
+    def test_triggers_callback_upon_paho_on_publish_event_for_qos_0(
+        self, mocker, mock_mqtt_client, provider, message_info
+    ):
+        callback = mocker.MagicMock()
+        mock_mqtt_client.publish.return_value = message_info
+
+        provider.publish(topic=fake_topic, payload=fake_payload, qos=0, callback=callback)
+
+        # Callback waits for Paho to write the message
+        assert callback.call_count == 0
+        assert pending_mids(provider) == [message_info.mid]
+
+        mock_mqtt_client.on_publish(client=mock_mqtt_client, userdata=None, mid=message_info.mid)
+
+        assert callback.call_count == 1
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
+
+    @pytest.mark.it("Triggers callback for a QoS 0 publish when Paho event handler triggered early")
+    def test_triggers_callback_when_paho_on_publish_event_called_early_for_qos_0(
+        self, mocker, mock_mqtt_client, provider, message_info
+    ):
+        callback = mocker.MagicMock()
+
+        def trigger_early_on_publish(topic, payload, qos):
+            mock_mqtt_client.on_publish(
+                client=mock_mqtt_client, userdata=None, mid=message_info.mid
+            )
+            assert callback.call_count == 0
+            return message_info
+
+        mock_mqtt_client.publish.side_effect = trigger_early_on_publish
+
+        provider.publish(topic=fake_topic, payload=fake_payload, qos=0, callback=callback)
+
+        assert callback.call_count == 1
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
+
+    @pytest.mark.it("Does not track a QoS 0 publish that has no callback")
+    def test_ignores_paho_on_publish_for_qos_0_without_callback(
+        self, mocker, mock_mqtt_client, provider, message_info
+    ):
+        mock_mqtt_client.publish.return_value = message_info
+
+        provider.publish(topic=fake_topic, payload=fake_payload, qos=0)
+
+        assert pending_mids(provider) == []
+        assert mids_in_state(provider, operation_tracker.UNTRACKED) == [message_info.mid]
+
+        # When Paho reports the publish, it is dropped without leaving anything behind
+        mock_mqtt_client.on_publish(client=mock_mqtt_client, userdata=None, mid=message_info.mid)
+        assert mids_in_state(provider, operation_tracker.UNTRACKED) == []
+        assert early_mids(provider) == []
+
+    @pytest.mark.it("Raises PublishError if Paho refuses a QoS 0 publish")
+    def test_raises_publish_error_for_qos_0(self, mocker, mock_mqtt_client, provider, message_info):
+        callback = mocker.MagicMock()
+        message_info.rc = mqtt.MQTT_ERR_NO_CONN
+        mock_mqtt_client.publish.return_value = message_info
+
+        with pytest.raises(PublishError) as e_info:
+            provider.publish(topic=fake_topic, payload=fake_payload, qos=0, callback=callback)
+
+        assert e_info.value.rc == mqtt.MQTT_ERR_NO_CONN
+        assert callback.call_count == 0
+        assert pending_mids(provider) == []
+        assert mids_in_state(provider, operation_tracker.UNTRACKED) == []
+
+    @pytest.mark.it("Waits for Paho to send a QoS 1 publish that it has queued")
+    def test_queued_qos_1_publish_still_pending(
+        self, mocker, mock_mqtt_client, provider, message_info
+    ):
+        callback = mocker.MagicMock()
+        message_info.rc = mqtt.MQTT_ERR_NO_CONN
+        mock_mqtt_client.publish.return_value = message_info
+
+        provider.publish(topic=fake_topic, payload=fake_payload, qos=1, callback=callback)
+
+        assert callback.call_count == 0
+        assert pending_mids(provider) == [message_info.mid]
 
     @pytest.mark.it("Skips callback that is set to 'None' upon publish completion")
     def test_none_callback_upon_paho_on_publish_event(
@@ -906,15 +1076,15 @@ class TestPublish(object):
         provider.publish(topic=fake_topic, payload=fake_payload, callback=callback)
 
         # Check that callback (None) has been stored
-        assert provider._pending_operation_callbacks == {message_info.mid: callback}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == [message_info.mid]
+        assert early_mids(provider) == []
 
         # Manually trigger Paho on_publish event handler
         mock_mqtt_client.on_publish(client=mock_mqtt_client, userdata=None, mid=message_info.mid)
 
         # Check that callback (None) has now been cleared
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Skips callback that is set to 'None' upon publish completion when Paho event handler triggered early"
@@ -932,8 +1102,8 @@ class TestPublish(object):
             )
 
             # Check mid has been stored as an unknown response, callback not yet called
-            assert provider._pending_operation_callbacks == {}
-            assert provider._unknown_operation_responses == {message_info.mid: message_info.mid}
+            assert pending_mids(provider) == []
+            assert early_mids(provider) == [message_info.mid]
 
             return message_info
 
@@ -943,8 +1113,8 @@ class TestPublish(object):
         provider.publish(topic=fake_topic, payload=fake_payload, callback=callback)
 
         # Check callback (None) has now been cleared
-        assert provider._pending_operation_callbacks == {}
-        assert provider._unknown_operation_responses == {}
+        assert pending_mids(provider) == []
+        assert early_mids(provider) == []
 
     @pytest.mark.it(
         "Handles multiple callbacks from multiple publish operations that complete out of order"
@@ -1026,6 +1196,52 @@ class TestPublish(object):
         assert callback.call_count == 1
 
 
+@pytest.mark.describe("MQTT Provider - Discard Operation")
+class TestDiscardOperation(object):
+    @pytest.fixture
+    def message_info(self, mocker):
+        mi = mqtt.MQTTMessageInfo(fake_mid)
+        mi.rc = fake_rc
+        return mi
+
+    @pytest.mark.it("Forgets the callback for a pending operation without calling it")
+    def test_discards_pending_callback(self, mocker, mock_mqtt_client, provider, message_info):
+        callback = mocker.MagicMock()
+        mock_mqtt_client.publish.return_value = message_info
+
+        mid, generation = provider.publish(
+            topic=fake_topic, payload=fake_payload, callback=callback
+        )
+        assert mid == message_info.mid
+        assert provider.discard_operation(mid, generation)
+        assert pending_mids(provider) == []
+        assert provider.get_operation_stats()["evicted"] == 1
+
+        # A response arriving after the discard does not call the callback, and is not kept
+        # around to complete a later operation that reuses the MID
+        mock_mqtt_client.on_publish(client=mock_mqtt_client, userdata=None, mid=mid)
+        assert callback.call_count == 0
+        assert early_mids(provider) == []
+        assert provider.get_operation_stats()["orphaned_responses"] == 1
+
+    @pytest.mark.it("Does nothing if a newer operation has been started on the same MID")
+    def test_stale_generation(self, mocker, mock_mqtt_client, provider, message_info):
+        mock_mqtt_client.publish.return_value = message_info
+        mid, old_generation = provider.publish(topic=fake_topic, payload=fake_payload, qos=0)
+        callback = mocker.MagicMock()
+        provider.publish(topic=fake_topic, payload=fake_payload, callback=callback)
+        assert not provider.discard_operation(mid, old_generation)
+        assert pending_mids(provider) == [mid]
+
+        mock_mqtt_client.on_publish(client=mock_mqtt_client, userdata=None, mid=mid)
+        assert callback.call_count == 1
+
+    @pytest.mark.it("Does nothing if the operation is not pending")
+    def test_unknown_mid(self, provider):
+        assert not provider.discard_operation(fake_mid)
+        assert provider.get_operation_stats()["evicted"] == 0
+
+
 @pytest.mark.describe("MQTT Provider - Message Received")
 class TestMessageReceived(object):
     @pytest.fixture()
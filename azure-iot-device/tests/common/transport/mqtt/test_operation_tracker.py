@@ -0,0 +1,171 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import logging
+import threading
+import pytest
+from azure.iot.device.common.transport.mqtt import operation_tracker
+from azure.iot.device.common.transport.mqtt.operation_tracker import OperationTracker
+
+logging.basicConfig(level=logging.INFO)
+
+fake_mid = 52
+
+
+@pytest.fixture
+def tracker(clock):
+    return OperationTracker(max_response_age=30, clock=clock)
+
+
+@pytest.mark.describe("OperationTracker")
+class TestOperationTracker(object):
+    @pytest.mark.it("Returns the callback when the response for a pending operation arrives")
+    def test_register_then_resolve(self, mocker, tracker):
+        callback = mocker.MagicMock()
+        (_, completed) = tracker.register(fake_mid, callback)
+        assert not completed
+        assert tracker.get_state(fake_mid) == operation_tracker.PENDING
+        assert tracker.resolve(fake_mid) == (True, callback)
+        assert tracker.get_state(fake_mid) == operation_tracker.EMPTY
+        assert tracker.get_stats()["outstanding"] == 0
+
+    @pytest.mark.it("Completes an operation whose response arrived before it was registered")
+    def test_early_response(self, mocker, tracker):
+        assert tracker.resolve(fake_mid) == (False, None)
+        assert tracker.get_state(fake_mid) == operation_tracker.EARLY
+        (_, completed) = tracker.register(fake_mid, mocker.MagicMock())
+        assert completed
+        assert tracker.get_state(fake_mid) == operation_tracker.EMPTY
+        assert tracker.get_stats()["early_responses"] == 1
+
+    @pytest.mark.it("Does not match an operation to an early response older than max_response_age")
+    def test_stale_early_response(self, mocker, tracker, clock):
+        tracker.resolve(fake_mid)
+        clock.now += 31
+        (_, completed) = tracker.register(fake_mid, mocker.MagicMock())
+        assert not completed
+        assert tracker.get_state(fake_mid) == operation_tracker.PENDING
+        assert tracker.get_stats()["orphaned_responses"] == 1
+
+    @pytest.mark.it("Sweeps away unmatched responses once they are older than max_response_age")
+    def test_sweep(self, tracker, clock):
+        tracker.resolve(1)
+        tracker.resolve(2)
+        assert tracker.get_stats()["unmatched"] == 2
+        clock.now += 31
+        stats = tracker.get_stats()
+        assert stats["unmatched"] == 0
+        assert stats["orphaned_responses"] == 2
+        assert tracker.get_state(1) == operation_tracker.EMPTY
+
+    @pytest.mark.it("Swallows the response for an evicted operation")
+    def test_evict(self, mocker, tracker):
+        tracker.register(fake_mid, mocker.MagicMock())
+        assert tracker.evict(fake_mid)
+        assert tracker.get_state(fake_mid) == operation_tracker.EVICTED
+        assert tracker.resolve(fake_mid) == (False, None)
+        assert tracker.get_state(fake_mid) == operation_tracker.EMPTY
+        stats = tracker.get_stats()
+        assert stats["evicted"] == 1
+        assert stats["orphaned_responses"] == 1
+        assert stats["early_responses"] == 0
+
+    @pytest.mark.it("Quietly drops the response for an untracked operation")
+    def test_ignore_response(self, tracker):
+        tracker.ignore_response(fake_mid)
+        assert tracker.get_state(fake_mid) == operation_tracker.UNTRACKED
+        assert tracker.resolve(fake_mid) == (False, None)
+        assert tracker.get_state(fake_mid) == operation_tracker.EMPTY
+        stats = tracker.get_stats()
+        assert stats["untracked"] == 1
+        assert stats["unmatched"] == 0
+        assert stats["early_responses"] == 0
+        assert stats["orphaned_responses"] == 0
+
+    @pytest.mark.it("Clears an early response for an untracked operation")
+    def test_ignore_early_response(self, tracker):
+        tracker.resolve(fake_mid)
+        tracker.ignore_response(fake_mid)
+        assert tracker.get_state(fake_mid) == operation_tracker.EMPTY
+        assert tracker.get_stats()["unmatched"] == 0
+
+    @pytest.mark.it("Sweeps away untracked operations that never got a response")
+    def test_sweep_untracked(self, tracker, clock):
+        tracker.ignore_response(fake_mid)
+        clock.now += 31
+        stats = tracker.get_stats()
+        assert stats["unmatched"] == 0
+        assert stats["orphaned_responses"] == 0
+        assert tracker.get_state(fake_mid) == operation_tracker.EMPTY
+
+    @pytest.mark.it("Does not sweep away a MID that was reused after it became unmatched")
+    def test_sweep_reused_mid(self, mocker, tracker, clock):
+        tracker.resolve(fake_mid)
+        clock.now += 31
+        callback = mocker.MagicMock()
+        tracker.register(fake_mid, callback)
+        tracker.evict(fake_mid)
+        clock.now += 20
+        assert tracker.get_stats()["unmatched"] == 1
+        assert tracker.get_state(fake_mid) == operation_tracker.EVICTED
+        clock.now += 11
+        assert tracker.get_stats()["unmatched"] == 0
+        assert tracker.get_state(fake_mid) == operation_tracker.EMPTY
+
+    @pytest.mark.it("Only keeps the unmatched MIDs that are waiting to be swept")
+    def test_sweep_is_bounded(self, tracker, clock):
+        for mid in range(1, 1001):
+            tracker.ignore_response(mid)
+            tracker.resolve(mid)
+        clock.now += 31
+        tracker.get_stats()
+        assert len(tracker._unmatched_queue) == 0
+
+    @pytest.mark.it("Does not evict an operation registered after the given generation")
+    def test_evict_stale_generation(self, mocker, tracker):
+        (old_generation, _) = tracker.register(fake_mid, mocker.MagicMock())
+        tracker.resolve(fake_mid)
+        callback = mocker.MagicMock()
+        (new_generation, _) = tracker.register(fake_mid, callback)
+        assert new_generation != old_generation
+        assert not tracker.evict(fake_mid, old_generation)
+        assert tracker.resolve(fake_mid) == (True, callback)
+
+    @pytest.mark.it("Replaces an operation whose MID is reused while it is still pending")
+    def test_replace(self, mocker, tracker):
+        tracker.register(fake_mid, mocker.MagicMock())
+        callback = mocker.MagicMock()
+        tracker.register(fake_mid, callback)
+        assert tracker.resolve(fake_mid) == (True, callback)
+        stats = tracker.get_stats()
+        assert stats["replaced"] == 1
+        assert stats["outstanding"] == 0
+
+    @pytest.mark.it("Raises ValueError for a MID that doesn't fit in 16 bits")
+    @pytest.mark.parametrize("mid", [-1, 65536])
+    def test_mid_out_of_range(self, mocker, tracker, mid):
+        with pytest.raises(ValueError):
+            tracker.register(mid, mocker.MagicMock())
+
+    @pytest.mark.it("Keeps consistent counts when used from several threads at once")
+    def test_concurrent_access(self, tracker):
+        def worker(first_mid):
+            for mid in range(first_mid, first_mid + 1000):
+                if mid % 2:
+                    tracker.register(mid, None)
+                    tracker.resolve(mid)
+                else:
+                    tracker.resolve(mid)
+                    tracker.register(mid, None)
+
+        threads = [threading.Thread(target=worker, args=(i * 1000 + 1,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = tracker.get_stats()
+        assert stats["outstanding"] == 0
+        assert stats["unmatched"] == 0
+        assert stats["completed"] == 8000
@@ -0,0 +1,98 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import logging
+import pytest
+from six.moves import queue
+from azure.iot.device.common.transport.conflating_queue import ConflatingQueue
+
+logging.basicConfig(level=logging.INFO)
+
+
+class KeyedOp(object):
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+
+@pytest.fixture
+def conflating_queue():
+    return ConflatingQueue(lambda op: op.key)
+
+
+def drain(q):
+    ops = []
+    while not q.empty():
+        ops.append(q.get_nowait())
+    return ops
+
+
+@pytest.mark.describe("ConflatingQueue")
+class TestConflatingQueue(object):
+    @pytest.mark.it("returns ops in the order they were added")
+    def test_fifo(self, conflating_queue):
+        ops = [KeyedOp(None, 1), KeyedOp("a", 2), KeyedOp(None, 3), KeyedOp("b", 4)]
+        for op in ops:
+            assert conflating_queue.put_nowait(op) is None
+        assert conflating_queue.qsize() == 4
+        assert drain(conflating_queue) == ops
+
+    @pytest.mark.it("replaces a queued op with a newer op with the same key, at the back")
+    def test_replaces(self, conflating_queue):
+        first_a = KeyedOp("a", 1)
+        b = KeyedOp("b", 2)
+        second_a = KeyedOp("a", 3)
+        conflating_queue.put_nowait(first_a)
+        conflating_queue.put_nowait(b)
+        assert conflating_queue.put_nowait(second_a) is first_a
+        assert drain(conflating_queue) == [b, second_a]
+
+    @pytest.mark.it("is bounded by the number of distinct keys")
+    def test_bounded(self, conflating_queue):
+        for value in range(1000):
+            conflating_queue.put_nowait(KeyedOp(value % 3, value))
+        assert conflating_queue.qsize() == 3
+        assert [op.value for op in drain(conflating_queue)] == [997, 998, 999]
+
+    @pytest.mark.it("never replaces ops whose key is None")
+    def test_unkeyed(self, conflating_queue):
+        for value in range(3):
+            conflating_queue.put_nowait(KeyedOp(None, value))
+        assert conflating_queue.qsize() == 3
+
+    @pytest.mark.it("raises queue.Empty when getting from an empty queue")
+    def test_empty(self, conflating_queue):
+        assert conflating_queue.empty()
+        with pytest.raises(queue.Empty):
+            conflating_queue.get_nowait()
+
+
+@pytest.mark.describe("ConflatingQueue - expiry")
+class TestConflatingQueueExpiry(object):
+    @pytest.mark.it("removes every op that has expired, in expiry order")
+    def test_pop_expired(self):
+        q = ConflatingQueue(expiry_function=lambda op: op.value)
+        ops = [KeyedOp(None, expiry) for expiry in (30, 10, None, 20, 40)]
+        for op in ops:
+            q.put_nowait(op)
+        assert [op.value for op in q.pop_expired(25)] == [10, 20]
+        assert [op.value for op in drain(q)] == [30, None, 40]
+
+    @pytest.mark.it("skips ops that have already left the queue")
+    def test_pop_expired_skips_removed_ops(self):
+        q = ConflatingQueue(key_function=lambda op: op.key, expiry_function=lambda op: op.value)
+        q.put_nowait(KeyedOp(None, 1))
+        q.put_nowait(KeyedOp("a", 2))
+        q.put_nowait(KeyedOp("a", 100))
+        q.get_nowait()
+        assert q.pop_expired(50) == []
+        assert q.qsize() == 1
+
+    @pytest.mark.it("doesn't let the expiry index grow without bound")
+    def test_compacts(self):
+        q = ConflatingQueue(key_function=lambda op: op.key, expiry_function=lambda op: op.value)
+        for value in range(1000):
+            q.put_nowait(KeyedOp("a", 1000 + value))
+        assert len(q._expiry_heap) < 100
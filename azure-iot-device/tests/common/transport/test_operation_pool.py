@@ -0,0 +1,108 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import logging
+import threading
+import pytest
+from azure.iot.device.common.transport import pipeline_ops_base
+from azure.iot.device.common.transport.mqtt import pipeline_ops_mqtt
+from azure.iot.device.common.transport.operation_pool import OperationPool
+
+logging.basicConfig(level=logging.INFO)
+
+
+@pytest.fixture
+def pool():
+    return OperationPool([pipeline_ops_mqtt.Publish], max_size=2)
+
+
+@pytest.mark.describe("OperationPool")
+class TestOperationPool(object):
+    @pytest.mark.it("creates a new op when there are no free ops")
+    def test_creates_new_op(self, pool):
+        op = pool.acquire(pipeline_ops_mqtt.Publish, topic="t", payload="p")
+        assert isinstance(op, pipeline_ops_mqtt.Publish)
+        assert op.topic == "t"
+        assert op.payload == "p"
+        assert pool.get_stats()["created"] == 1
+
+    @pytest.mark.it("reuses a released op and re-initializes it")
+    def test_reuses_released_op(self, pool):
+        callback = lambda op: None  # noqa: E731
+        op = pool.acquire(pipeline_ops_mqtt.Publish, topic="t", payload="p")
+        op.error = Exception()
+        op.deadline = 12.0
+        assert pool.release(op)
+
+        reused = pool.acquire(
+            pipeline_ops_mqtt.Publish, topic="t2", payload="p2", callback=callback
+        )
+        assert reused is op
+        assert reused.name == "Publish"
+        assert reused.topic == "t2"
+        assert reused.payload == "p2"
+        assert reused.callback is callback
+        assert reused.error is None
+        assert reused.deadline is None
+        assert reused.priority == pipeline_ops_base.PRIORITY_CONTROL
+        assert pool.get_stats()["reused"] == 1
+
+    @pytest.mark.it("clears the attributes of released ops")
+    def test_clears_released_op(self, pool):
+        op = pool.acquire(pipeline_ops_mqtt.Publish, topic="t", payload="p", callback=id)
+        pool.release(op)
+        assert op.name is None
+        assert op.topic is None
+        assert op.payload is None
+        assert op.callback is None
+
+    @pytest.mark.it("ignores an op that is released twice")
+    def test_ignores_double_release(self, pool):
+        op = pool.acquire(pipeline_ops_mqtt.Publish, topic="t", payload="p")
+        assert pool.release(op)
+        assert not pool.release(op)
+        assert pool.get_stats()["free"] == 1
+
+    @pytest.mark.it("adds an op released by two threads at once to the pool only once")
+    def test_concurrent_double_release(self, pool):
+        op = pool.acquire(pipeline_ops_mqtt.Publish, topic="t", payload="p")
+        results = []
+
+        def release():
+            results.append(pool.release(op))
+
+        threads = [threading.Thread(target=release) for _ in range(2)]
+        # Hold the lock while the threads start, so that they contend for it
+        with pool._lock:
+            for thread in threads:
+                thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(results) == [False, True]
+        assert pool.get_stats()["free"] == 1
+
+    @pytest.mark.it("does not keep ops of classes it wasn't created with")
+    def test_ignores_other_classes(self, pool):
+        op = pool.acquire(pipeline_ops_mqtt.Subscribe, topic="t")
+        assert isinstance(op, pipeline_ops_mqtt.Subscribe)
+        assert not pool.release(op)
+        assert op.topic == "t"
+
+    @pytest.mark.it("keeps at most max_size free ops of each class")
+    def test_max_size(self, pool):
+        ops = [pool.acquire(pipeline_ops_mqtt.Publish, topic="t", payload="p") for _ in range(3)]
+        assert [pool.release(op) for op in ops] == [True, True, False]
+        assert pool.get_stats()["free"] == 2
+
+
+@pytest.mark.describe("PipelineOperation __slots__")
+class TestOperationSlots(object):
+    @pytest.mark.it("does not give ops a per-instance __dict__")
+    def test_no_dict(self):
+        op = pipeline_ops_mqtt.Publish(topic="t", payload="p")
+        assert not hasattr(op, "__dict__")
+        with pytest.raises(AttributeError):
+            op.unknown_attribute = 1
@@ -6,9 +6,15 @@
 import logging
 import pytest
 import functools
+import sys
+import time
 from azure.iot.device.common.transport import pipeline_stages_base
 from azure.iot.device.common.transport import pipeline_ops_base
 from azure.iot.device.common.transport import pipeline_events_base
+from azure.iot.device.common.transport import pipeline_exceptions
+from azure.iot.device.common.transport import timer_wheel
+from azure.iot.device.common.transport.operation_pool import OperationPool
+from azure.iot.device.common.transport.token_bucket import TokenBucket
 
 logging.basicConfig(level=logging.INFO)
 
@@ -26,8 +32,14 @@ class PipelineStage(pipeline_stages_base.PipelineStage):
         pass
 
 
+# PipelineOperation uses __slots__.  The tests tag ops with extra attributes (such as "action"),
+# so they use a subclass that has a __dict__.
+class FakeOp(pipeline_ops_base.PipelineOperation):
+    pass
+
+
 def Op():
-    return pipeline_ops_base.PipelineOperation()
+    return FakeOp()
 
 
 def get_fake_error():
@@ -129,6 +141,29 @@ def assert_callback_failed(callback, op, error=None):
         assert op.error is not None
 
 
+def make_stage_pipeline(mocker, stage, complete_ops=True, timer_wheel=None):
+    """
+    Build a pipeline of a root, the stage under test and a stage below it, and return the stage
+    under test.  The stage below completes every op whose action isn't "pend", unless
+    complete_ops is False, in which case ops stay pending until the test completes them.  Its
+    _run_op is spied on so that tests can see which ops were passed down.
+    """
+
+    def next_stage_run_op(self, op):
+        if complete_ops and getattr(op, "action", None) != "pend":
+            self.complete_op(op)
+
+    root = pipeline_stages_base.PipelineRoot()
+    root.unhandled_error_handler = mocker.Mock()
+    if timer_wheel is not None:
+        root.timer_wheel = timer_wheel
+    next_stage = PipelineStage()
+    next_stage._run_op = functools.partial(next_stage_run_op, next_stage)
+    mocker.spy(next_stage, "_run_op")
+    root.append_stage(stage).append_stage(next_stage)
+    return stage
+
+
 @pytest.mark.describe("PipelineStage initializer")
 class TestPipelineStageInitializer(object):
     @pytest.mark.it("Sets name attribute on instantiation")
@@ -632,6 +667,60 @@ class TestPipelineStageCompleteOp(object):
         assert stage.unhandled_error_handler.call_args == mocker.call(fake_error)
 
 
+def current_stack_depth():
+    frame = sys._getframe()
+    depth = 0
+    while frame:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+@pytest.mark.describe("PipelineStage trampoline")
+class TestPipelineStageTrampoline(object):
+    @pytest.mark.it("passes an op through more stages than the recursion limit")
+    def test_deep_pipeline(self, callback):
+        depths = []
+
+        def complete_and_record(self, op):
+            depths.append(current_stack_depth())
+            self.complete_op(op)
+
+        root = pipeline_stages_base.PipelineRoot()
+        stage = root
+        for _ in range(sys.getrecursionlimit() + 100):
+            next_stage = pipeline_stages_base.PipelineRoot()
+            stage.append_stage(next_stage)
+            stage = next_stage
+        last_stage = PipelineStage()
+        last_stage._run_op = functools.partial(complete_and_record, last_stage)
+        stage.append_stage(last_stage)
+
+        op = Op()
+        op.callback = callback
+        root.run_op(op)
+        assert_callback_succeeded(callback, op)
+        assert depths[0] < current_stack_depth() + 20
+
+    @pytest.mark.it("runs a long chain of ops that complete immediately without recursing")
+    def test_long_serial_chain(self, stage, callback):
+        ops = [Op() for _ in range(sys.getrecursionlimit() * 2)]
+        stage.run_ops_serial(*ops, callback=callback)
+        assert_callback_succeeded(callback, ops[-1])
+        assert stage.next._run_op.call_count == len(ops)
+
+    @pytest.mark.it("runs work queued by a stage in the order it was queued")
+    def test_preserves_order(self, stage):
+        ops = [Op() for _ in range(3)]
+
+        def run_all():
+            for op in ops:
+                stage.continue_op(op)
+
+        pipeline_stages_base._run_on_trampoline(run_all)
+        assert [call[0][0] for call in stage.next._run_op.call_args_list] == ops
+
+
 @pytest.mark.describe("PipelineStage continue_with_different_op function")
 class TestPipelineStageContineWithDifferntOp(object):
     @pytest.mark.it("does not continue running the original op")
@@ -661,3 +750,598 @@ class TestPipelineStageContineWithDifferntOp(object):
         new_op.action = "fail"
         stage.continue_with_different_op(original_op=op, new_op=new_op)
         assert_callback_failed(callback, op, new_op.error)
+
+    @pytest.mark.it("returns the new op to the pipeline's op pool after it succeeds")
+    def test_releases_new_op_on_success(self, stage, op, callback):
+        stage.op_pool = OperationPool([FakeOp])
+        op.callback = callback
+        new_op = Op()
+        stage.continue_with_different_op(original_op=op, new_op=new_op)
+        assert_callback_succeeded(callback, op)
+        assert stage.op_pool.get_stats()["released"] == 1
+        assert stage.op_pool.acquire(FakeOp) is new_op
+
+    @pytest.mark.it("does not return the new op to the pipeline's op pool if it fails")
+    def test_does_not_release_new_op_on_failure(self, stage, op, callback):
+        stage.op_pool = OperationPool([FakeOp])
+        op.callback = callback
+        new_op = Op()
+        new_op.action = "fail"
+        stage.continue_with_different_op(original_op=op, new_op=new_op)
+        assert stage.op_pool.get_stats()["released"] == 0
+        assert new_op.error is not None
+
+
+@pytest.fixture
+def reconnect_stage(mocker):
+    mocker.patch.object(timer_wheel.threading, "Thread")
+    stage = make_stage_pipeline(mocker, pipeline_stages_base.AutoReconnect())
+    mocker.spy(stage.pipeline_root.timer_wheel, "schedule")
+    mocker.spy(stage.pipeline_root.timer_wheel, "cancel")
+    return stage
+
+
+def reconnects_scheduled(stage):
+    return [
+        call[0][1]
+        for call in stage.pipeline_root.timer_wheel.schedule.call_args_list
+        if call[0][1] == stage._reconnect
+    ]
+
+
+def ops_passed_down(stage):
+    return [call[0][0] for call in stage.next._run_op.call_args_list]
+
+
+@pytest.mark.describe("AutoReconnect stage")
+class TestAutoReconnect(object):
+    @pytest.mark.it("does not reconnect if the disconnection follows a Disconnect op")
+    def test_no_reconnect_after_requested_disconnect(self, reconnect_stage):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.run_op(pipeline_ops_base.Disconnect())
+        reconnect_stage.on_disconnected()
+        assert not reconnect_stage.reconnecting
+        assert reconnects_scheduled(reconnect_stage) == []
+
+    @pytest.mark.it(
+        "schedules a reconnect on the timer wheel with a jittered backoff on an unexpected disconnection"
+    )
+    def test_schedules_reconnect(self, reconnect_stage):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        before = time.time()
+        reconnect_stage.on_disconnected()
+        after = time.time()
+        assert reconnect_stage.reconnecting
+        assert len(reconnects_scheduled(reconnect_stage)) == 1
+        deadline = reconnect_stage.pipeline_root.timer_wheel.schedule.call_args[0][0]
+        assert before + reconnect_stage.initial_backoff / 2.0 <= deadline
+        assert deadline <= after + reconnect_stage.initial_backoff
+
+    @pytest.mark.it("sends the Reconnect op when the backoff expires on the timer wheel")
+    def test_reconnect_on_wheel(self, reconnect_stage):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        reconnect_stage.pipeline_root.timer_wheel.advance(
+            time.time() + reconnect_stage.initial_backoff + 1
+        )
+        assert isinstance(ops_passed_down(reconnect_stage)[-1], pipeline_ops_base.Reconnect)
+
+    @pytest.mark.it("grows the backoff after each failed attempt up to max_backoff")
+    def test_backoff_grows(self, reconnect_stage):
+        reconnect_stage.max_backoff = 4
+        for attempts, ceiling in [(0, 1), (1, 2), (2, 4), (5, 4)]:
+            reconnect_stage.reconnect_attempts = attempts
+            assert ceiling / 2.0 <= reconnect_stage._get_backoff() <= ceiling
+
+    @pytest.mark.it("queues ops while reconnecting")
+    def test_queues_ops(self, reconnect_stage, op):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        reconnect_stage.run_op(op)
+        assert op not in ops_passed_down(reconnect_stage)
+        assert reconnect_stage.queue.qsize() == 1
+
+    @pytest.mark.it("sends a Reconnect op when the backoff timer fires")
+    def test_sends_reconnect(self, reconnect_stage):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        reconnect_stage._reconnect()
+        assert isinstance(ops_passed_down(reconnect_stage)[-1], pipeline_ops_base.Reconnect)
+
+    @pytest.mark.it("puts a deadline of reconnect_timeout on the Reconnect op")
+    def test_reconnect_deadline(self, reconnect_stage):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        before = time.time()
+        reconnect_stage._reconnect()
+        reconnect_op = ops_passed_down(reconnect_stage)[-1]
+        assert reconnect_op.deadline >= before + reconnect_stage.reconnect_timeout
+        assert reconnect_op.deadline <= time.time() + reconnect_stage.reconnect_timeout
+
+    @pytest.mark.it("schedules another attempt if the Reconnect op misses its deadline")
+    def test_retries_after_timeout(self, reconnect_stage):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        pending = []
+        reconnect_stage.next._run_op = pending.append
+        reconnect_stage._reconnect()
+        reconnect_op = pending[0]
+        reconnect_stage.pipeline_root.timer_wheel.advance(reconnect_op.deadline + 1)
+        assert reconnect_stage.reconnecting
+        assert not reconnect_stage._reconnect_op_in_flight
+        assert len(reconnects_scheduled(reconnect_stage)) == 2
+
+        # The abandoned op completing late doesn't start yet another attempt
+        reconnect_stage.next.complete_op(reconnect_op)
+        assert reconnect_stage.reconnecting
+        assert len(reconnects_scheduled(reconnect_stage)) == 2
+
+    @pytest.mark.it("schedules another attempt if the Reconnect op fails")
+    def test_retries_after_failure(self, reconnect_stage, fake_error):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+
+        def fail_reconnect(op):
+            op.error = fake_error
+            reconnect_stage.next.complete_op(op)
+
+        reconnect_stage.next._run_op = fail_reconnect
+        reconnect_stage._reconnect()
+        assert reconnect_stage.reconnecting
+        assert reconnect_stage.reconnect_attempts == 1
+        assert len(reconnects_scheduled(reconnect_stage)) == 2
+
+    @pytest.mark.it("restores all enabled features in one batch before releasing queued ops")
+    def test_restores_features_then_releases(self, reconnect_stage, op):
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.run_op(pipeline_ops_base.EnableFeature(feature_name="c2d"))
+        reconnect_stage.run_op(pipeline_ops_base.EnableFeature(feature_name="methods"))
+        reconnect_stage.run_op(pipeline_ops_base.EnableFeature(feature_name="input"))
+        reconnect_stage.run_op(pipeline_ops_base.DisableFeature(feature_name="input"))
+        reconnect_stage.on_disconnected()
+        reconnect_stage.run_op(op)
+
+        pending = []
+        original_run_op = reconnect_stage.next._run_op
+
+        def pend_enable(enable_op):
+            if isinstance(enable_op, pipeline_ops_base.EnableFeature):
+                pending.append(enable_op)
+            else:
+                original_run_op(enable_op)
+
+        reconnect_stage.next._run_op = pend_enable
+        reconnect_stage._reconnect()
+
+        # both subscriptions went out without waiting on each other
+        assert [p.feature_name for p in pending] == ["c2d", "methods"]
+        assert reconnect_stage.reconnecting
+
+        reconnect_stage.next.complete_op(pending[0])
+        assert reconnect_stage.reconnecting
+        reconnect_stage.next.complete_op(pending[1])
+        assert not reconnect_stage.reconnecting
+        assert reconnect_stage.queue.empty()
+        assert reconnect_stage.reconnect_attempts == 0
+
+    @pytest.mark.it("skips its own attempt if the connection comes back by itself")
+    def test_connection_restored_externally(self, reconnect_stage, op, callback):
+        op.callback = callback
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        reconnect_stage.run_op(op)
+        reconnect_stage.on_connected()
+        wheel = reconnect_stage.pipeline_root.timer_wheel
+        assert wheel.cancel.call_count == 1
+        assert wheel.get_stats()["pending"] == 0
+        assert not reconnect_stage.reconnecting
+        assert_callback_succeeded(callback, op)
+
+    @pytest.mark.it("cancels reconnecting and releases queued ops on Disconnect")
+    def test_disconnect_cancels_reconnect(self, reconnect_stage, op, callback):
+        op.callback = callback
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        reconnect_stage.run_op(op)
+        disconnect = pipeline_ops_base.Disconnect()
+        reconnect_stage.run_op(disconnect)
+        assert not reconnect_stage.reconnecting
+        assert ops_passed_down(reconnect_stage)[-2:] == [op, disconnect]
+        assert_callback_succeeded(callback, op)
+
+    @pytest.mark.it("replaces queued ops with newer ops with the same conflation key")
+    def test_conflation(self, reconnect_stage, mocker):
+        reconnect_stage.queue = pipeline_stages_base.ConflatingQueue(lambda op: op.feature_name)
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        old_callback = mocker.MagicMock()
+        old_op = pipeline_ops_base.DisableFeature(feature_name="c2d", callback=old_callback)
+        new_op = pipeline_ops_base.DisableFeature(feature_name="c2d", callback=mocker.MagicMock())
+        reconnect_stage.run_op(old_op)
+        reconnect_stage.run_op(new_op)
+        assert_callback_succeeded(old_callback, old_op)
+        assert reconnect_stage.queue.qsize() == 1
+        assert reconnect_stage.get_stats()["conflated"] == 1
+        reconnect_stage.run_op(pipeline_ops_base.Disconnect())
+        assert old_op not in ops_passed_down(reconnect_stage)
+        assert new_op in ops_passed_down(reconnect_stage)
+
+    @pytest.mark.it("fails queued ops that have expired instead of releasing them")
+    def test_expiry(self, reconnect_stage, mocker):
+        reconnect_stage.expiry = lambda op: getattr(op, "expiry", None)
+        reconnect_stage.queue = pipeline_stages_base.ConflatingQueue(
+            expiry_function=reconnect_stage.expiry
+        )
+        reconnect_stage.run_op(pipeline_ops_base.Connect())
+        reconnect_stage.on_disconnected()
+        expired_callback = mocker.MagicMock()
+        expiring_op = FakeOp(callback=expired_callback)
+        expiring_op.expiry = time.time() - 1
+        fresh_op = FakeOp(callback=mocker.MagicMock())
+        fresh_op.expiry = time.time() + 3600
+        reconnect_stage.run_op(expiring_op)
+        reconnect_stage.run_op(fresh_op)
+        assert_callback_failed(expired_callback, expiring_op)
+        reconnect_stage.run_op(pipeline_ops_base.Disconnect())
+        assert isinstance(expiring_op.error, pipeline_exceptions.MessageExpiredError)
+        assert expiring_op not in ops_passed_down(reconnect_stage)
+        assert fresh_op in ops_passed_down(reconnect_stage)
+        assert reconnect_stage.get_stats()["expired"] == 1
+
+
+@pytest.fixture
+def deadline_stage(mocker):
+    return make_stage_pipeline(
+        mocker, pipeline_stages_base.EnforceDeadlines(), timer_wheel=mocker.MagicMock()
+    )
+
+
+def fire_deadline(stage):
+    stage.pipeline_root.timer_wheel.schedule.call_args[0][1]()
+
+
+@pytest.mark.describe("EnforceDeadlines stage")
+class TestEnforceDeadlines(object):
+    @pytest.mark.it("passes ops without a deadline straight through")
+    def test_no_deadline(self, deadline_stage, op, callback):
+        op.callback = callback
+        deadline_stage.run_op(op)
+        assert deadline_stage.pipeline_root.timer_wheel.schedule.call_count == 0
+        assert_callback_succeeded(callback, op)
+
+    @pytest.mark.it("cancels the deadline timer when the op completes in time")
+    def test_completes_in_time(self, deadline_stage, op, callback):
+        op.callback = callback
+        op.deadline = 1234
+        deadline_stage.run_op(op)
+        wheel = deadline_stage.pipeline_root.timer_wheel
+        assert wheel.schedule.call_args[0][0] == 1234
+        assert wheel.cancel.call_args[0][0] is wheel.schedule.return_value
+        assert_callback_succeeded(callback, op)
+
+    @pytest.mark.it("fails the op with a PipelineTimeoutError when the deadline passes")
+    def test_times_out(self, deadline_stage, op, callback):
+        op.callback = callback
+        op.deadline = 1234
+        op.action = "pend"
+        deadline_stage.run_op(op)
+        assert callback.call_count == 0
+        fire_deadline(deadline_stage)
+        assert_callback_failed(callback, op)
+        assert isinstance(op.error, pipeline_stages_base.PipelineTimeoutError)
+        assert deadline_stage.get_stats() == {"timeouts": 1, "late_completions": 0}
+
+    @pytest.mark.it("drops a completion that arrives after the deadline")
+    def test_late_completion(self, deadline_stage, op, callback):
+        op.callback = callback
+        op.deadline = 1234
+        op.action = "pend"
+        deadline_stage.run_op(op)
+        fire_deadline(deadline_stage)
+        deadline_stage.next.complete_op(op)
+        assert callback.call_count == 1
+        assert deadline_stage.get_stats() == {"timeouts": 1, "late_completions": 1}
+
+    @pytest.mark.it("completes a timed-out op without calling the callbacks of lower stages")
+    def test_timeout_bypasses_lower_callbacks(self, deadline_stage, op, callback, mocker):
+        op.callback = callback
+        op.deadline = 1234
+        op.action = "pend"
+        deadline_stage.run_op(op)
+        lower_callback = op.callback
+        op.callback = mocker.Mock(side_effect=lower_callback)
+        fire_deadline(deadline_stage)
+        assert op.callback.call_count == 0
+        deadline_stage.next.complete_op(op)
+        assert op.callback.call_count == 1
+        assert callback.call_count == 1
+        assert deadline_stage.get_stats() == {"timeouts": 1, "late_completions": 1}
+
+    @pytest.mark.it("doesn't send an op that timed out while queued for a connection")
+    def test_timed_out_op_dropped_from_queue(self, op, callback, mocker):
+        root = pipeline_stages_base.PipelineRoot()
+        root.timer_wheel = mocker.MagicMock()
+        deadline_stage = pipeline_stages_base.EnforceDeadlines()
+        ensure_connection = pipeline_stages_base.EnsureConnection()
+        lowest_stage = PipelineStage()
+        connects = []
+        lowest_stage._run_op = mocker.Mock(side_effect=connects.append)
+        root.append_stage(deadline_stage).append_stage(ensure_connection).append_stage(lowest_stage)
+
+        op.callback = callback
+        op.deadline = 1234
+        op.needs_connection = True
+        deadline_stage.run_op(op)
+        fire_deadline(deadline_stage)
+        assert_callback_failed(callback, op)
+
+        lowest_stage.complete_op(connects[0])
+        assert lowest_stage._run_op.call_count == 1
+        assert ensure_connection.queue.empty()
+        assert callback.call_count == 1
+        assert deadline_stage.get_stats() == {"timeouts": 1, "late_completions": 0}
+
+    @pytest.mark.it("passes the deadline on to ops produced by continue_with_different_op")
+    def test_deadline_propagates(self, stage, op):
+        op.deadline = 1234
+        new_op = Op()
+        stage.continue_with_different_op(original_op=op, new_op=new_op)
+        assert new_op.deadline == 1234
+
+
+@pytest.fixture
+def scheduler_stage(mocker):
+    stage = pipeline_stages_base.PriorityScheduler(max_in_flight=1, starvation_limit=3)
+    return make_stage_pipeline(mocker, stage, complete_ops=False)
+
+
+def make_priority_op(name, priority):
+    op = Op()
+    op.name = name
+    op.priority = priority
+    op.callback = lambda op: None
+    return op
+
+
+def complete_oldest_in_flight(stage, sent_count):
+    stage.next.complete_op(ops_passed_down(stage)[sent_count])
+
+
+@pytest.mark.describe("PriorityScheduler stage")
+class TestPriorityScheduler(object):
+    @pytest.mark.it("passes control ops down without counting them against the window")
+    def test_control_ops_bypass(self, scheduler_stage):
+        bulk = make_priority_op("bulk", pipeline_ops_base.PRIORITY_BULK)
+        control = make_priority_op("control", pipeline_ops_base.PRIORITY_CONTROL)
+        scheduler_stage.run_op(bulk)
+        scheduler_stage.run_op(control)
+        assert ops_passed_down(scheduler_stage) == [bulk, control]
+        assert scheduler_stage.in_flight == 1
+
+    @pytest.mark.it("holds ops back once max_in_flight ops are pending below it")
+    def test_window(self, scheduler_stage):
+        ops = [make_priority_op("bulk", pipeline_ops_base.PRIORITY_BULK) for _ in range(3)]
+        for op in ops:
+            scheduler_stage.run_op(op)
+        assert ops_passed_down(scheduler_stage) == ops[:1]
+        assert scheduler_stage.get_stats()["bulk"]["depth"] == 2
+
+    @pytest.mark.it("releases a method response ahead of queued telemetry")
+    def test_method_response_overtakes_telemetry(self, scheduler_stage, callback):
+        first = make_priority_op("first", pipeline_ops_base.PRIORITY_BULK)
+        first.callback = callback
+        scheduler_stage.run_op(first)
+        for _ in range(5):
+            scheduler_stage.run_op(make_priority_op("bulk", pipeline_ops_base.PRIORITY_BULK))
+        response = make_priority_op("response", pipeline_ops_base.PRIORITY_METHOD_RESPONSE)
+        scheduler_stage.run_op(response)
+
+        complete_oldest_in_flight(scheduler_stage, 0)
+        assert_callback_succeeded(callback, first)
+        assert ops_passed_down(scheduler_stage)[1] is response
+
+    @pytest.mark.it("lets the longest-waiting lane go first every starvation_limit picks")
+    def test_starvation_protection(self, scheduler_stage):
+        scheduler_stage.run_op(make_priority_op("first", pipeline_ops_base.PRIORITY_HIGH))
+        bulk = make_priority_op("bulk", pipeline_ops_base.PRIORITY_BULK)
+        scheduler_stage.run_op(bulk)
+        for _ in range(5):
+            scheduler_stage.run_op(make_priority_op("high", pipeline_ops_base.PRIORITY_HIGH))
+
+        for sent in range(3):
+            complete_oldest_in_flight(scheduler_stage, sent)
+        names = [op.name for op in ops_passed_down(scheduler_stage)]
+        assert names == ["first", "high", "high", "bulk"]
+
+    @pytest.mark.it("fails a queued op whose deadline passed instead of sending it")
+    def test_expired_op_not_sent(self, scheduler_stage, callback):
+        scheduler_stage.run_op(make_priority_op("first", pipeline_ops_base.PRIORITY_BULK))
+        expired = make_priority_op("expired", pipeline_ops_base.PRIORITY_BULK)
+        expired.deadline = 1
+        expired.callback = callback
+        scheduler_stage.run_op(expired)
+        complete_oldest_in_flight(scheduler_stage, 0)
+        assert expired not in ops_passed_down(scheduler_stage)
+        assert_callback_failed(callback, expired)
+        assert isinstance(expired.error, pipeline_stages_base.PipelineTimeoutError)
+        assert scheduler_stage.in_flight == 0
+
+    @pytest.mark.it("frees an op's slot only once if the op is completed twice")
+    def test_completed_twice(self, scheduler_stage):
+        first = make_priority_op("first", pipeline_ops_base.PRIORITY_BULK)
+        second = make_priority_op("second", pipeline_ops_base.PRIORITY_BULK)
+        scheduler_stage.run_op(first)
+        scheduler_stage.run_op(second)
+        complete_oldest_in_flight(scheduler_stage, 0)
+        complete_oldest_in_flight(scheduler_stage, 0)
+        assert ops_passed_down(scheduler_stage) == [first, second]
+        assert scheduler_stage.in_flight == 1
+
+    @pytest.mark.it("frees the slots of ops that time out without being completed below it")
+    def test_timed_out_ops_free_slots(self, mocker):
+        mocker.patch.object(timer_wheel.threading, "Thread")
+        root = pipeline_stages_base.PipelineRoot()
+        root.unhandled_error_handler = mocker.Mock()
+        scheduler = pipeline_stages_base.PriorityScheduler(max_in_flight=2)
+        lowest_stage = PipelineStage()
+        sent = []
+        # Ops are never completed, as when the provider evicts them at their deadline
+        lowest_stage._run_op = sent.append
+        root.append_stage(pipeline_stages_base.EnforceDeadlines()).append_stage(
+            scheduler
+        ).append_stage(lowest_stage)
+
+        deadline = time.time() + 5
+        timed_out = []
+        for name in ("first", "second"):
+            op = make_priority_op(name, pipeline_ops_base.PRIORITY_BULK)
+            op.deadline = deadline
+            op.callback = timed_out.append
+            root.run_op(op)
+        queued = make_priority_op("queued", pipeline_ops_base.PRIORITY_METHOD_RESPONSE)
+        root.run_op(queued)
+        assert [op.name for op in sent] == ["first", "second"]
+
+        root.timer_wheel.advance(deadline + 1)
+        assert sorted(op.name for op in timed_out) == ["first", "second"]
+        for op in timed_out:
+            assert isinstance(op.error, pipeline_exceptions.PipelineTimeoutError)
+        assert [op.name for op in sent] == ["first", "second", "queued"]
+        assert scheduler.in_flight == 1
+
+    @pytest.mark.it("releases a large backlog of ops that complete synchronously")
+    def test_large_backlog(self, scheduler_stage):
+        scheduler_stage.next._run_op = functools.partial(
+            lambda self, op: self.complete_op(op), scheduler_stage.next
+        )
+        with scheduler_stage._lock:
+            for _ in range(5000):
+                op = make_priority_op("bulk", pipeline_ops_base.PRIORITY_BULK)
+                scheduler_stage.lanes[pipeline_ops_base.PRIORITY_BULK].append((0, op))
+        scheduler_stage.run_op(make_priority_op("bulk", pipeline_ops_base.PRIORITY_BULK))
+        stats = scheduler_stage.get_stats()
+        assert stats["bulk"]["depth"] == 0
+        assert stats["bulk"]["dispatched"] == 5001
+        assert stats["in_flight"] == 0
+
+
+class LimitedOp(pipeline_ops_base.PipelineOperation):
+    pass
+
+
+@pytest.fixture
+def rate_limit_stage(mocker, clock, wheel):
+    bucket = TokenBucket(2, capacity=2, clock=clock)
+    stage = pipeline_stages_base.RateLimit(
+        {LimitedOp: bucket}, cost=lambda op: getattr(op, "cost", 1), clock=clock
+    )
+    return make_stage_pipeline(mocker, stage, timer_wheel=wheel)
+
+
+def make_limited_op(name, cost=1):
+    op = LimitedOp()
+    op.name = name
+    op.cost = cost
+    op.callback = lambda op: None
+    return op
+
+
+def advance_clock(stage, clock, seconds):
+    clock.now += seconds
+    stage.pipeline_root.timer_wheel.advance(clock.now)
+
+
+@pytest.mark.describe("RateLimit stage")
+class TestRateLimit(object):
+    @pytest.mark.it("passes ops without a bucket straight through")
+    def test_unlimited_op(self, rate_limit_stage, op, callback):
+        op.callback = callback
+        for _ in range(5):
+            rate_limit_stage.run_op(op)
+        assert rate_limit_stage.next._run_op.call_count == 5
+
+    @pytest.mark.it("queues ops over the limit and releases them as the bucket refills")
+    def test_paces_ops(self, rate_limit_stage, clock):
+        ops = [make_limited_op(str(i)) for i in range(5)]
+        for op in ops:
+            rate_limit_stage.run_op(op)
+        assert ops_passed_down(rate_limit_stage) == ops[:2]
+        advance_clock(rate_limit_stage, clock, 0.5)
+        assert ops_passed_down(rate_limit_stage) == ops[:3]
+        advance_clock(rate_limit_stage, clock, 1)
+        assert ops_passed_down(rate_limit_stage) == ops
+        assert rate_limit_stage.pipeline_root.timer_wheel.get_stats()["pending"] == 0
+
+    @pytest.mark.it("charges each op its cost and keeps ops in order")
+    def test_cost(self, rate_limit_stage, clock):
+        big = make_limited_op("big", cost=2)
+        small = make_limited_op("small")
+        rate_limit_stage.run_op(make_limited_op("first"))
+        rate_limit_stage.run_op(big)
+        rate_limit_stage.run_op(small)
+        assert [op.name for op in ops_passed_down(rate_limit_stage)] == ["first"]
+        advance_clock(rate_limit_stage, clock, 0.5)
+        assert [op.name for op in ops_passed_down(rate_limit_stage)] == ["first", "big"]
+        advance_clock(rate_limit_stage, clock, 0.5)
+        assert ops_passed_down(rate_limit_stage)[-1] is small
+
+    @pytest.mark.it("fails a queued op whose deadline passed instead of sending it")
+    def test_expired_op_not_sent(self, rate_limit_stage, clock, callback):
+        rate_limit_stage.run_op(make_limited_op("first", cost=2))
+        expired = make_limited_op("expired")
+        expired.deadline = clock.now + 0.2
+        expired.callback = callback
+        rate_limit_stage.run_op(expired)
+        advance_clock(rate_limit_stage, clock, 0.5)
+        assert expired not in ops_passed_down(rate_limit_stage)
+        assert_callback_failed(callback, expired)
+        assert isinstance(expired.error, pipeline_stages_base.PipelineTimeoutError)
+
+    @pytest.mark.it("reports the fill level and queue depth of each bucket")
+    def test_stats(self, rate_limit_stage, clock):
+        for i in range(3):
+            rate_limit_stage.run_op(make_limited_op(str(i)))
+        assert rate_limit_stage.get_stats() == {
+            "delayed": 1,
+            "passed": 2,
+            "LimitedOp": {"fill_level": 0, "queued": 1},
+        }
+
+
+@pytest.fixture
+def latency_stage(mocker, clock):
+    # Ops are completed by the tests
+    stage = pipeline_stages_base.MeasureLatency([LimitedOp], clock=clock)
+    return make_stage_pipeline(mocker, stage, complete_ops=False)
+
+
+@pytest.mark.describe("MeasureLatency stage")
+class TestMeasureLatency(object):
+    @pytest.mark.it("reports the first, last, mean and max latency of the measured ops")
+    def test_latencies(self, latency_stage, clock):
+        for latency in [0.5, 2.0, 1.0]:
+            op = make_limited_op(str(latency))
+            latency_stage.run_op(op)
+            clock.now += latency
+            latency_stage.next.complete_op(op)
+        assert latency_stage.get_stats() == {
+            "LimitedOp": {"count": 3, "first": 0.5, "last": 1.0, "mean": 3.5 / 3, "max": 2.0}
+        }
+
+    @pytest.mark.it("still calls the op's callback, including for ops that fail")
+    def test_callback(self, latency_stage, callback, fake_error):
+        op = make_limited_op("failed")
+        op.callback = callback
+        latency_stage.run_op(op)
+        op.error = fake_error
+        latency_stage.next.complete_op(op)
+        assert_callback_failed(callback, op, fake_error)
+        assert latency_stage.get_stats()["LimitedOp"]["count"] == 1
+
+    @pytest.mark.it("passes other ops down without timing them")
+    def test_other_ops(self, latency_stage, op):
+        latency_stage.run_op(op)
+        assert latency_stage.next._run_op.call_args[0][0] is op
+        assert latency_stage.get_stats() == {
+            "LimitedOp": {"count": 0, "first": None, "last": None, "mean": 0.0, "max": 0.0}
+        }
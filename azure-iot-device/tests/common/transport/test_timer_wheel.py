@@ -0,0 +1,82 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import logging
+import pytest
+from azure.iot.device.common.transport import timer_wheel
+
+logging.basicConfig(level=logging.INFO)
+
+
+@pytest.mark.describe("TimerWheel")
+class TestTimerWheel(object):
+    @pytest.mark.it("calls the callback once the deadline has passed")
+    def test_fires_after_deadline(self, mocker, wheel, clock):
+        callback = mocker.MagicMock()
+        wheel.schedule(clock.now + 0.5, callback)
+        wheel.advance(clock.now + 0.4)
+        assert callback.call_count == 0
+        wheel.advance(clock.now + 0.5)
+        assert callback.call_count == 1
+
+    @pytest.mark.it("does not call the callback for a cancelled timer")
+    def test_cancel(self, mocker, wheel, clock):
+        callback = mocker.MagicMock()
+        timer = wheel.schedule(clock.now + 0.5, callback)
+        assert wheel.cancel(timer)
+        wheel.advance(clock.now + 1)
+        assert callback.call_count == 0
+        assert not wheel.cancel(timer)
+
+    @pytest.mark.it("fires a deadline that is already in the past on the next tick")
+    def test_past_deadline(self, mocker, wheel, clock):
+        callback = mocker.MagicMock()
+        wheel.schedule(clock.now - 5, callback)
+        wheel.advance(clock.now + 0.1)
+        assert callback.call_count == 1
+
+    @pytest.mark.it("keeps timers more than a full turn away until their own tick")
+    def test_timer_beyond_one_turn(self, mocker, wheel, clock):
+        near = mocker.MagicMock()
+        far = mocker.MagicMock()
+        # 8 slots of 0.1 seconds, so these two timers share a slot
+        wheel.schedule(clock.now + 0.2, near)
+        wheel.schedule(clock.now + 1.0, far)
+        wheel.advance(clock.now + 0.2)
+        assert near.call_count == 1
+        assert far.call_count == 0
+        wheel.advance(clock.now + 1.0)
+        assert far.call_count == 1
+
+    @pytest.mark.it("fires every expired timer when advanced more than a full turn at once")
+    def test_large_jump(self, mocker, wheel, clock):
+        callbacks = [mocker.MagicMock() for _ in range(20)]
+        for i, callback in enumerate(callbacks):
+            wheel.schedule(clock.now + 0.1 * (i + 1), callback)
+        wheel.advance(clock.now + 10)
+        assert all(callback.call_count == 1 for callback in callbacks)
+
+    @pytest.mark.it("keeps going if a callback raises")
+    def test_callback_raises(self, mocker, wheel, clock):
+        bad = mocker.MagicMock(side_effect=ValueError())
+        good = mocker.MagicMock()
+        wheel.schedule(clock.now + 0.1, bad)
+        wheel.schedule(clock.now + 0.1, good)
+        wheel.advance(clock.now + 0.1)
+        assert good.call_count == 1
+
+    @pytest.mark.it("reports pending, scheduled, expired and cancelled counts")
+    def test_stats(self, mocker, wheel, clock):
+        wheel.schedule(clock.now + 0.1, mocker.MagicMock())
+        wheel.schedule(clock.now + 0.5, mocker.MagicMock())
+        wheel.cancel(wheel.schedule(clock.now + 0.5, mocker.MagicMock()))
+        wheel.advance(clock.now + 0.1)
+        assert wheel.get_stats() == {"pending": 1, "scheduled": 3, "expired": 1, "cancelled": 1}
+
+    @pytest.mark.it("starts a single thread to service all of its timers")
+    def test_single_thread(self, mocker, wheel, clock):
+        wheel.schedule(clock.now + 0.1, mocker.MagicMock())
+        wheel.schedule(clock.now + 0.2, mocker.MagicMock())
+        assert timer_wheel.threading.Thread.call_count == 1
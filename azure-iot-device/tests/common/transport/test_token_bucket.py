@@ -0,0 +1,56 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import logging
+import pytest
+from azure.iot.device.common.transport.token_bucket import TokenBucket
+
+logging.basicConfig(level=logging.INFO)
+
+
+@pytest.mark.describe("TokenBucket")
+class TestTokenBucket(object):
+    @pytest.mark.it("starts full and lets a burst of up to capacity tokens through")
+    def test_burst(self, clock):
+        bucket = TokenBucket(2, capacity=5, clock=clock)
+        assert bucket.fill_level == 5
+        for _ in range(5):
+            assert bucket.try_take() == 0
+        assert bucket.try_take() == pytest.approx(0.5)
+        assert bucket.fill_level == 0
+
+    @pytest.mark.it("refills at rate tokens per second, up to capacity")
+    def test_refill(self, clock):
+        bucket = TokenBucket(2, capacity=5, clock=clock)
+        assert bucket.try_take(5) == 0
+        clock.now += 1
+        assert bucket.fill_level == pytest.approx(2)
+        clock.now += 100
+        assert bucket.fill_level == 5
+
+    @pytest.mark.it("returns how long to wait until there are enough tokens")
+    def test_wait(self, clock):
+        bucket = TokenBucket(4, capacity=4, clock=clock)
+        assert bucket.try_take(3) == 0
+        assert bucket.try_take(3) == pytest.approx(0.5)
+        clock.now += 0.5
+        assert bucket.try_take(3) == 0
+
+    @pytest.mark.it("lets an op larger than capacity through once the bucket is full")
+    def test_debt(self, clock):
+        bucket = TokenBucket(1, capacity=2, clock=clock)
+        assert bucket.try_take(5) == 0
+        assert bucket.fill_level == -3
+        assert bucket.try_take(5) == pytest.approx(5)
+
+    @pytest.mark.it("defaults capacity to one second of tokens")
+    def test_default_capacity(self, clock):
+        assert TokenBucket(10, clock=clock).capacity == 10
+
+    @pytest.mark.it("raises a ValueError if rate or capacity isn't positive")
+    @pytest.mark.parametrize("rate, capacity", [(0, None), (-1, None), (1, 0)])
+    def test_invalid(self, rate, capacity):
+        with pytest.raises(ValueError):
+            TokenBucket(rate, capacity=capacity)
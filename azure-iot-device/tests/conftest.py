@@ -0,0 +1,33 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+from azure.iot.device.common.transport import timer_wheel
+from azure.iot.device.common.transport.timer_wheel import TimerWheel
+
+
+class FakeClock(object):
+    """
+    Clock for code that takes a clock function.  Time only moves when a test changes now.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def wheel(mocker, clock):
+    # The wheel thread is not started so the tests can advance the wheel by hand
+    mocker.patch.object(timer_wheel.threading, "Thread")
+    return TimerWheel(tick_interval=0.1, wheel_size=8, clock=clock)
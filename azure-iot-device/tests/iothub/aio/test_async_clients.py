@@ -13,6 +13,7 @@ from azure.iot.device.iothub.transport.mqtt import MQTTTransport
 from azure.iot.device.iothub.models import Message, MethodRequest, MethodResponse
 from azure.iot.device.iothub.aio.async_inbox import AsyncClientInbox
 from azure.iot.device.iothub.transport import constant
+from azure.iot.device.iothub import columnar
 
 # auth_provider and transport fixtures are implicitly included
 
@@ -111,6 +112,15 @@ class ClientSharedTests(object):
         assert isinstance(sent_message, Message)
         assert sent_message.data == naked_string
 
+    async def test_send_event_columns_sends_every_packed_message(self, client, transport, mocker):
+        mocker.patch.object(columnar, "DEFAULT_MAX_PAYLOAD_SIZE", 1024)
+        await client.send_event_columns(
+            list(range(1000)), {"temperature": [20.5] * 1000}, encoding="json"
+        )
+        assert transport.send_event.call_count > 1
+        for call in transport.send_event.call_args_list:
+            assert call[0][0].content_type == "application/json"
+
     @pytest.mark.parametrize(
         "method_name",
         [pytest.param(None, id="Generic Method"), pytest.param("method_x", id="Named Method")],
@@ -125,6 +125,16 @@ def test_module_generate_new_sas_token_calls_sign_with_correct_default_args(
     assert expiry == fake_current_time + DEFAULT_TOKEN_VALIDITY_PERIOD
 
 
+def test_generate_new_sas_token_quotes_new_resource_uri_when_hostname_changes(
+    device_auth_provider, fake_get_current_time_function
+):
+    device_auth_provider.generate_new_sas_token()
+    device_auth_provider.hostname = "__OTHER/HOSTNAME__"
+    device_auth_provider.generate_new_sas_token()
+    resource_uri = device_auth_provider._sign.call_args[0][0]
+    assert resource_uri == "__OTHER%2FHOSTNAME__%2Fdevices%2F{}".format(fake_device_id)
+
+
 def test_generate_new_sas_token_calls_sign_with_correct_modified_expiry(
     device_auth_provider, fake_get_current_time_function
 ):
@@ -145,3 +145,25 @@ def test_raises_when_auth_provider_created_from_connection_string_with_bad_keys(
     with pytest.raises(ValueError, match="Invalid Connection String - Invalid Key"):
         connection_string = "BadHostName=beauxbatons.academy-net;BadDeviceId=TheDeluminator;SharedAccessKey=Zm9vYmFy"
         SymmetricKeyAuthenticationProvider.parse(connection_string)
+
+
+def test_signs_with_new_key_when_shared_access_key_changes():
+    connection_string = connection_string_device_sk_format.format(
+        hostname, device_id, shared_access_key
+    )
+    sym_key_auth_provider = SymmetricKeyAuthenticationProvider.parse(connection_string)
+
+    old_signature = sym_key_auth_provider._sign("resource", 1000)
+    assert sym_key_auth_provider._sign("resource", 1000) == old_signature
+    sym_key_auth_provider.shared_access_key = "YmFyZm9v"
+    assert sym_key_auth_provider._sign("resource", 1000) != old_signature
+
+
+def test_raises_type_error_when_signing_with_key_that_is_not_base64():
+    connection_string = connection_string_device_sk_format.format(
+        hostname, device_id, "this is not base64"
+    )
+    sym_key_auth_provider = SymmetricKeyAuthenticationProvider.parse(connection_string)
+
+    with pytest.raises(TypeError):
+        sym_key_auth_provider._sign("resource", 1000)
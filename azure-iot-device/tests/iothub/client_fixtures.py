@@ -53,14 +53,16 @@ class FakeTransport(AbstractTransport):
     def disable_feature(self, feature_name, callback=None):
         callback()
 
-    def send_event(self, event, callback):
-        callback()
+    def send_event(self, event, callback, timeout=None, high_priority=False, fire_and_forget=False):
+        callback(error=None)
 
-    def send_output_event(self, event, callback):
-        callback()
+    def send_output_event(
+        self, event, callback, timeout=None, high_priority=False, fire_and_forget=False
+    ):
+        callback(error=None)
 
-    def send_method_response(self, method_response, callback=None):
-        callback()
+    def send_method_response(self, method_response, callback=None, timeout=None):
+        callback(error=None)
 
 
 @pytest.fixture
@@ -0,0 +1,132 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import json
+import struct
+import pytest
+from azure.iot.device.iothub import columnar
+
+requires_numpy = pytest.mark.skipif(columnar.numpy is None, reason="NumPy is not installed")
+
+
+def unpack_binary(payload):
+    """Decode a binary columnar payload into a dict of NumPy arrays"""
+    numpy = columnar.numpy
+    (magic, version, header_length) = struct.unpack_from("<4sBI", payload)
+    assert magic == b"IOTC"
+    assert version == 1
+    offset = struct.calcsize("<4sBI")
+    header = json.loads(payload[offset : offset + header_length].decode("utf-8"))
+    offset += header_length
+    result = {}
+    for column in header["columns"]:
+        dtype = numpy.dtype(column["dtype"])
+        result[column["name"]] = numpy.frombuffer(
+            payload, dtype=dtype, count=header["rows"], offset=offset
+        )
+        offset += dtype.itemsize * header["rows"]
+    assert offset == len(payload)
+    return result
+
+
+@pytest.mark.describe("pack_columns() - JSON encoding")
+class TestPackColumnsJson(object):
+    @pytest.mark.it("Packs the timestamps and each column into one JSON object")
+    def test_packs_json(self):
+        messages = columnar.pack_columns(
+            [1, 2, 3], {"temperature": [20.5, 21.0, 21.5], "door": [0, 1, 0]}, encoding="json"
+        )
+        assert len(messages) == 1
+        assert messages[0].content_type == "application/json"
+        assert messages[0].content_encoding == "utf-8"
+        assert json.loads(messages[0].data) == {
+            "timestamp": [1, 2, 3],
+            "temperature": [20.5, 21.0, 21.5],
+            "door": [0, 1, 0],
+        }
+
+    @pytest.mark.it("Splits the rows across messages so no payload is larger than the limit")
+    def test_splits_json(self):
+        timestamps = list(range(5000))
+        messages = columnar.pack_columns(
+            timestamps, {"temperature": [20.5] * 5000}, encoding="json", max_payload_size=4096
+        )
+        assert len(messages) > 1
+        unpacked = []
+        for message in messages:
+            assert len(message.data) <= 4096
+            unpacked.extend(json.loads(message.data)["timestamp"])
+        assert unpacked == timestamps
+
+    @pytest.mark.it("Raises a ValueError if a single row is larger than the limit")
+    def test_row_too_large(self):
+        with pytest.raises(ValueError):
+            columnar.pack_columns([1], {"name": ["x" * 100]}, encoding="json", max_payload_size=50)
+
+    @pytest.mark.it("Raises a ValueError if a column doesn't have one value per timestamp")
+    def test_mismatched_lengths(self):
+        with pytest.raises(ValueError):
+            columnar.pack_columns([1, 2], {"temperature": [20.5]}, encoding="json")
+
+    @pytest.mark.it("Raises a ValueError if a column is named 'timestamp'")
+    def test_reserved_name(self):
+        with pytest.raises(ValueError):
+            columnar.pack_columns([1], {"timestamp": [1]}, encoding="json")
+
+    @pytest.mark.it("Raises a ValueError for unknown encodings")
+    def test_unknown_encoding(self):
+        with pytest.raises(ValueError):
+            columnar.pack_columns([1], {"temperature": [1]}, encoding="xml")
+
+
+@pytest.mark.describe("pack_columns() - binary encoding")
+class TestPackColumnsBinary(object):
+    @pytest.mark.it("Raises a ValueError if NumPy is not installed")
+    def test_requires_numpy(self, mocker):
+        mocker.patch.object(columnar, "numpy", None)
+        with pytest.raises(ValueError):
+            columnar.pack_columns([1], {"temperature": [1.0]}, encoding="binary")
+
+    @pytest.mark.it("Uses JSON by default if NumPy is not installed")
+    def test_default_without_numpy(self, mocker):
+        mocker.patch.object(columnar, "numpy", None)
+        messages = columnar.pack_columns([1], {"temperature": [1.0]})
+        assert messages[0].content_type == "application/json"
+
+    @requires_numpy
+    @pytest.mark.it("Uses the binary encoding by default if NumPy is installed")
+    def test_default_with_numpy(self):
+        messages = columnar.pack_columns([1], {"temperature": [1.0]})
+        assert messages[0].content_type == "application/x-iot-columnar"
+
+    @requires_numpy
+    @pytest.mark.it("Packs each column as a little-endian array, keeping its dtype")
+    def test_packs_binary(self):
+        numpy = columnar.numpy
+        timestamps = numpy.arange(10, dtype=">i8")
+        temperature = numpy.linspace(20.0, 25.0, 10, dtype=numpy.float32)
+        messages = columnar.pack_columns(
+            timestamps, {"temperature": temperature}, encoding="binary"
+        )
+        assert len(messages) == 1
+        unpacked = unpack_binary(messages[0].data)
+        assert unpacked["timestamp"].dtype.str == "<i8"
+        assert unpacked["temperature"].dtype.str == "<f4"
+        assert (unpacked["timestamp"] == timestamps).all()
+        assert (unpacked["temperature"] == temperature).all()
+
+    @requires_numpy
+    @pytest.mark.it("Splits the rows across messages so no payload is larger than the limit")
+    def test_splits_binary(self):
+        numpy = columnar.numpy
+        timestamps = numpy.arange(100000, dtype=numpy.float64)
+        messages = columnar.pack_columns(
+            timestamps, {"temperature": timestamps * 2}, encoding="binary"
+        )
+        assert len(messages) > 1
+        for message in messages:
+            assert len(message.data) <= columnar.DEFAULT_MAX_PAYLOAD_SIZE
+        unpacked = numpy.concatenate([unpack_binary(m.data)["timestamp"] for m in messages])
+        assert (unpacked == timestamps).all()
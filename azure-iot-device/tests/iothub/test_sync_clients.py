@@ -10,6 +10,7 @@ from azure.iot.device.iothub.transport.mqtt import MQTTTransport
 from azure.iot.device.iothub.models import Message, MethodRequest, MethodResponse
 from azure.iot.device.iothub.sync_inbox import SyncClientInbox
 from azure.iot.device.iothub.transport import constant
+from azure.iot.device.iothub import columnar
 
 # auth_provider and transport fixtures are implicitly included
 
@@ -97,6 +98,24 @@ class ClientSharedTests(object):
         assert isinstance(sent_message, Message)
         assert sent_message.data == naked_string
 
+    def test_send_event_columns_sends_every_packed_message(self, client, transport):
+        client.send_event_columns(list(range(100)), {"temperature": [20.5] * 100}, encoding="json")
+        assert transport.send_event.call_count == 1
+        sent_message = transport.send_event.call_args[0][0]
+        assert sent_message.content_type == "application/json"
+
+    def test_send_event_columns_splits_large_windows(self, client, transport, mocker):
+        mocker.patch.object(columnar, "DEFAULT_MAX_PAYLOAD_SIZE", 1024)
+        client.send_event_columns(
+            list(range(1000)), {"temperature": [20.5] * 1000}, encoding="json"
+        )
+        assert transport.send_event.call_count > 1
+
+    def test_send_event_columns_raises_if_columns_are_different_lengths(self, client, transport):
+        with pytest.raises(ValueError):
+            client.send_event_columns([1, 2, 3], {"temperature": [20.5]}, encoding="json")
+        assert transport.send_event.call_count == 0
+
     @pytest.mark.parametrize(
         "method_name",
         [pytest.param(None, id="Generic Method"), pytest.param("method_x", id="Named Method")],
@@ -5,12 +5,16 @@
 # --------------------------------------------------------------------------
 
 import pytest
+import json
 import logging
+import time
 import six.moves.urllib as urllib
 from azure.iot.device.iothub import Message
+from azure.iot.device.common.compression import ZlibCodec
 from azure.iot.device.iothub.transport.mqtt.mqtt_transport import MQTTTransport
 from azure.iot.device.iothub.transport import constant
 from azure.iot.device.iothub.auth.authentication_provider_factory import from_connection_string
+from azure.iot.device.common.transport.pipeline_exceptions import MessageExpiredError
 from mock import MagicMock, patch, ANY
 from datetime import date
 
@@ -177,7 +181,7 @@ class TestSendEvent:
             device_transport._auth_provider.get_current_sas_token()
         )
         mock_mqtt_provider.publish.assert_called_once_with(
-            topic=fake_topic, payload=fake_msg.data, callback=ANY
+            topic=fake_topic, payload=fake_msg.data, qos=1, callback=ANY
         )
 
     def test_send_message_with_output_name(self, module_transport):
@@ -211,7 +215,7 @@ class TestSendEvent:
             module_transport._auth_provider.get_current_sas_token()
         )
         mock_mqtt_provider.publish.assert_called_once_with(
-            topic=fake_output_topic, payload=fake_msg.data, callback=ANY
+            topic=fake_output_topic, payload=fake_msg.data, qos=1, callback=ANY
         )
 
     def test_sendevent_calls_publish_on_provider(self, device_transport):
@@ -227,9 +231,109 @@ class TestSendEvent:
             device_transport._auth_provider.get_current_sas_token()
         )
         mock_mqtt_provider.publish.assert_called_once_with(
-            topic=encoded_fake_topic, payload=fake_msg.data, callback=ANY
+            topic=encoded_fake_topic, payload=fake_msg.data, qos=1, callback=ANY
         )
 
+    def test_send_event_fire_and_forget_publishes_at_qos_0(self, device_transport):
+        fake_msg = create_fake_message()
+
+        mock_mqtt_provider = device_transport._pipeline.provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(fake_msg, fire_and_forget=True)
+
+        mock_mqtt_provider.publish.assert_called_once_with(
+            topic=encoded_fake_topic, payload=fake_msg.data, qos=0, callback=ANY
+        )
+
+    def test_send_event_compresses_payload_with_codec(self, authentication_provider):
+        codec = ZlibCodec()
+        with patch(
+            "azure.iot.device.iothub.transport.mqtt.mqtt_transport.pipeline_stages_mqtt.MQTTProvider"
+        ):
+            transport = MQTTTransport(authentication_provider, payload_codec=codec)
+        mock_mqtt_provider = transport._pipeline.provider
+        fake_msg = Message(fake_event * 10)
+
+        transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        transport.send_event(fake_msg)
+
+        publish_kwargs = mock_mqtt_provider.publish.call_args[1]
+        assert codec.decompress(publish_kwargs["payload"]) == (fake_event * 10).encode("utf-8")
+        assert before_sys_key + "ce" + after_sys_key + "deflate" in publish_kwargs["topic"]
+        transport.disconnect()
+
+    def test_send_event_aggregates_readings_with_aggregation_window(self, authentication_provider):
+        with patch(
+            "azure.iot.device.iothub.transport.mqtt.mqtt_transport.pipeline_stages_mqtt.MQTTProvider"
+        ):
+            transport = MQTTTransport(authentication_provider, aggregation_window=60)
+        mock_mqtt_provider = transport._pipeline.provider
+
+        transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        transport.send_event(Message('{"temperature": 20}'))
+        transport.send_event(Message('{"temperature": 22}'))
+        assert mock_mqtt_provider.publish.call_count == 0
+
+        transport.disconnect()
+        assert mock_mqtt_provider.publish.call_count == 1
+        payload = bytes(mock_mqtt_provider.publish.call_args[1]["payload"]).decode("utf-8")
+        assert json.loads(payload)["fields"]["temperature"]["mean"] == 21
+
+    def test_send_event_suppresses_readings_inside_deadbands(self, authentication_provider):
+        with patch(
+            "azure.iot.device.iothub.transport.mqtt.mqtt_transport.pipeline_stages_mqtt.MQTTProvider"
+        ):
+            transport = MQTTTransport(authentication_provider, deadbands={"temperature": 1})
+        mock_mqtt_provider = transport._pipeline.provider
+
+        transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        for value in (20, 20.5, 22):
+            transport.send_event(Message('{"temperature": %s}' % value))
+        assert mock_mqtt_provider.publish.call_count == 2
+        transport.disconnect()
+
+    def test_send_event_holds_telemetry_over_rate_limit(self, authentication_provider):
+        with patch(
+            "azure.iot.device.iothub.transport.mqtt.mqtt_transport.pipeline_stages_mqtt.MQTTProvider"
+        ):
+            transport = MQTTTransport(authentication_provider, rate_limits={"telemetry": (1, 2)})
+        mock_mqtt_provider = transport._pipeline.provider
+
+        transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        for value in range(3):
+            transport.send_event(Message(str(value)))
+        assert mock_mqtt_provider.publish.call_count == 2
+        stats = transport.get_pipeline_stats()["RateLimit"]
+        assert stats["SendTelemetry"]["queued"] == 1
+        assert stats["SendTelemetry"]["fill_level"] < 1
+        transport.disconnect()
+
+    def test_rejects_unknown_rate_limit(self, authentication_provider):
+        with pytest.raises(ValueError):
+            MQTTTransport(authentication_provider, rate_limits={"twin_updates": 1})
+
+    def test_send_event_encodes_data_with_codec_for_content_type(self, device_transport):
+        fake_msg = Message({"temperature": 21.5})
+
+        mock_mqtt_provider = device_transport._pipeline.provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(fake_msg)
+
+        publish_kwargs = mock_mqtt_provider.publish.call_args[1]
+        assert json.loads(bytes(publish_kwargs["payload"]).decode("utf-8")) == fake_msg.data
+        assert before_sys_key + "ct" + after_sys_key + "application%2Fjson" in (
+            publish_kwargs["topic"]
+        )
+        assert fake_msg.content_type is None
+
     def test_send_event_queues_and_connects_before_sending(self, device_transport):
         fake_msg = create_fake_message()
         mock_mqtt_provider = device_transport._pipeline.provider
@@ -252,7 +356,7 @@ class TestSendEvent:
         # verify that our connected callback was called and verify that we published the event
         device_transport.on_transport_connected.assert_called_once_with("connected")
         mock_mqtt_provider.publish.assert_called_once_with(
-            topic=encoded_fake_topic, payload=fake_msg.data, callback=ANY
+            topic=encoded_fake_topic, payload=fake_msg.data, qos=1, callback=ANY
         )
 
     def test_send_event_queues_if_waiting_for_connect_complete(self, device_transport):
@@ -279,9 +383,40 @@ class TestSendEvent:
         # verify that our connected callback was called and verify that we published the event
         device_transport.on_transport_connected.assert_called_once_with("connected")
         mock_mqtt_provider.publish.assert_called_once_with(
-            topic=encoded_fake_topic, payload=fake_msg.data, callback=ANY
+            topic=encoded_fake_topic, payload=fake_msg.data, qos=1, callback=ANY
         )
 
+    def test_send_event_fails_expired_message(self, device_transport):
+        fake_msg = create_fake_message()
+        fake_msg.expiry_time_utc = "2000-01-01T00:00:00Z"
+
+        mock_mqtt_provider = device_transport._pipeline.provider
+
+        # queue the event while connecting, then finish the connection
+        callback = MagicMock()
+        device_transport.send_event(fake_msg, callback)
+        mock_mqtt_provider.on_mqtt_connected()
+
+        # verify that the caller is told the message expired instead of being left waiting
+        assert callback.call_count == 1
+        assert isinstance(callback.call_args[1]["error"], MessageExpiredError)
+        mock_mqtt_provider.publish.assert_not_called()
+
+    def test_send_event_discards_only_its_own_operation_at_deadline(self, device_transport):
+        mock_mqtt_provider = device_transport._pipeline.provider
+        mock_mqtt_provider.publish.return_value = (12, 3)
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        callback = MagicMock()
+        device_transport.send_event(create_fake_message(), callback, timeout=5)
+        device_transport._pipeline.timer_wheel.advance(time.time() + 10)
+
+        # the eviction names the generation of the publish, so it can't discard a newer
+        # operation that reuses the MID
+        mock_mqtt_provider.discard_operation.assert_called_once_with(12, 3)
+        assert callback.call_count == 1
+
     def test_send_event_sends_overlapped_events(self, device_transport):
         fake_msg_1 = create_fake_message()
         fake_msg_2 = Message(fake_event_2)
@@ -296,7 +431,7 @@ class TestSendEvent:
         callback_1 = MagicMock()
         device_transport.send_event(fake_msg_1, callback_1)
         mock_mqtt_provider.publish.assert_called_once_with(
-            topic=encoded_fake_topic, payload=fake_msg_1.data, callback=ANY
+            topic=encoded_fake_topic, payload=fake_msg_1.data, qos=1, callback=ANY
         )
 
         # while we're waiting for that send to complete, send another event
@@ -356,6 +491,30 @@ class TestDisconnect:
         device_transport.on_transport_disconnected.assert_called_once_with("disconnected")
 
 
+class TestReconnect:
+    def test_reconnect_completes_on_its_own_connection(self, device_transport):
+        mock_mqtt_provider = device_transport._pipeline.provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+
+        # the connection drops, and the reconnect attempt starts after the backoff
+        mock_mqtt_provider.on_mqtt_disconnected()
+        device_transport._pipeline.timer_wheel.advance(time.time() + 10)
+        assert mock_mqtt_provider.reconnect.call_count == 1
+        reconnect_callback = mock_mqtt_provider.reconnect.call_args[1]["callback"]
+
+        # a connection that paho started on its own completes while the Reconnect op is in
+        # flight.  It doesn't complete the Reconnect op, so sends stay queued.
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(create_fake_message())
+        mock_mqtt_provider.publish.assert_not_called()
+
+        # the connection started by the reconnect completes it
+        reconnect_callback()
+        assert mock_mqtt_provider.publish.call_count == 1
+
+
 class TestEnableInputMessage:
     def test_subscribe_calls_subscribe_on_provider(self, module_transport):
         mock_mqtt_provider = module_transport._pipeline.provider
@@ -0,0 +1,572 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import datetime
+import logging
+import pytest
+from azure.iot.device.common import payload_codecs
+from azure.iot.device.common.compression import ZlibCodec
+from azure.iot.device.common.transport import pipeline_ops_base
+from azure.iot.device.common.transport import pipeline_stages_base
+from azure.iot.device.common.transport.pipeline_exceptions import MessageExpiredError
+from azure.iot.device.iothub.models import Message
+from azure.iot.device.iothub.transport import pipeline_events_iothub
+from azure.iot.device.iothub.transport import pipeline_ops_iothub
+from azure.iot.device.iothub.transport import pipeline_stages_iothub
+from azure.iot.device.iothub.transport.pipeline_stages_iothub import get_message_expiry
+
+logging.basicConfig(level=logging.INFO)
+
+json_payload = '{"temperature": 21.5, "humidity": 40.25, "pressure": 1013.1}' * 4
+
+
+class BottomStage(pipeline_stages_base.PipelineStage):
+    def __init__(self):
+        super(BottomStage, self).__init__()
+        self.ops = []
+
+    def _run_op(self, op):
+        self.ops.append(op)
+        self.complete_op(op)
+
+
+@pytest.fixture
+def codec():
+    return ZlibCodec()
+
+
+@pytest.fixture
+def pipeline(mocker, codec):
+    root = (
+        pipeline_stages_base.PipelineRoot()
+        .append_stage(pipeline_stages_iothub.CompressPayloads(codec, min_size=64))
+        .append_stage(BottomStage())
+    )
+    root.on_pipeline_event = mocker.MagicMock()
+    return root
+
+
+def send(pipeline, message):
+    pipeline.run_op(pipeline_ops_iothub.SendTelemetry(message=message, callback=lambda op: None))
+    return pipeline.next.next.ops[-1].message
+
+
+@pytest.mark.describe("CompressPayloads stage")
+class TestCompressPayloads(object):
+    @pytest.mark.it("Compresses payloads of at least min_size bytes and sets content_encoding")
+    def test_compresses(self, pipeline, codec):
+        message = Message(json_payload)
+        sent = send(pipeline, message)
+        assert sent.content_encoding == "deflate"
+        assert codec.decompress(sent.data) == json_payload.encode("utf-8")
+
+    @pytest.mark.it("Does not change the caller's Message object")
+    def test_copies_message(self, pipeline):
+        message = Message(json_payload, message_id="abc")
+        sent = send(pipeline, message)
+        assert sent is not message
+        assert sent.message_id == "abc"
+        assert message.data == json_payload
+        assert message.content_encoding is None
+
+    @pytest.mark.it("Encodes text payloads with the message's text content_encoding")
+    def test_text_content_encoding(self, pipeline, codec):
+        sent = send(pipeline, Message(json_payload, content_encoding="utf-16"))
+        assert codec.decompress(sent.data) == json_payload.encode("utf-16")
+
+    @pytest.mark.it("Sends payloads smaller than min_size as they are")
+    def test_skips_small_payloads(self, pipeline):
+        message = Message("tiny")
+        assert send(pipeline, message) is message
+        assert pipeline.next.get_stats()["skipped"] == 1
+
+    @pytest.mark.it("Does not compress messages that already have a non-text content_encoding")
+    def test_skips_encoded_payloads(self, pipeline):
+        message = Message(json_payload.encode("utf-8"), content_encoding="gzip")
+        assert send(pipeline, message) is message
+
+    @pytest.mark.it("Decompresses incoming messages with the codec's content_encoding")
+    def test_decompresses_incoming(self, pipeline, codec):
+        message = Message(codec.compress(b"hello " * 20), content_encoding="deflate")
+        pipeline.next.next.handle_pipeline_event(pipeline_events_iothub.C2DMessageEvent(message))
+        event = pipeline.on_pipeline_event.call_args[0][0]
+        assert event.message.data == b"hello " * 20
+        assert event.message.content_encoding is None
+        assert pipeline.next.get_stats()["decompressed"] == 1
+
+    @pytest.mark.it("Passes up incoming messages that can't be decompressed as they are")
+    def test_decompress_error(self, pipeline):
+        message = Message(b"garbage", content_encoding="deflate")
+        pipeline.next.next.handle_pipeline_event(
+            pipeline_events_iothub.InputMessageEvent("input", message)
+        )
+        event = pipeline.on_pipeline_event.call_args[0][0]
+        assert event.message.data == b"garbage"
+        assert event.message.content_encoding == "deflate"
+        assert pipeline.next.get_stats()["decompress_errors"] == 1
+
+    @pytest.mark.it("Reports the compression ratio and CPU time")
+    def test_stats(self, pipeline):
+        send(pipeline, Message(json_payload))
+        stats = pipeline.get_pipeline_stats()["CompressPayloads"]
+        assert stats["compressed"] == 1
+        assert stats["bytes_in"] == len(json_payload)
+        assert stats["compression_ratio"] == float(stats["bytes_in"]) / stats["bytes_out"]
+        assert stats["compression_ratio"] > 1
+        assert stats["compress_cpu_seconds"] >= 0
+
+
+def make_aggregate_pipeline(wheel, clock, **kwargs):
+    pipeline = pipeline_stages_base.PipelineRoot()
+    pipeline.timer_wheel = wheel
+    return pipeline.append_stage(
+        pipeline_stages_iothub.AggregateTelemetry(clock=clock, **kwargs)
+    ).append_stage(BottomStage())
+
+
+def send_reading(pipeline, data, key=None, output_name=None):
+    message = Message(data)
+    if key is not None:
+        message.custom_properties["key"] = key
+    if output_name:
+        message.output_name = output_name
+        op = pipeline_ops_iothub.SendOutputEvent(message=message, callback=lambda op: None)
+    else:
+        op = pipeline_ops_iothub.SendTelemetry(message=message, callback=lambda op: None)
+    pipeline.run_op(op)
+    return op
+
+
+def advance(pipeline, clock, seconds):
+    clock.now += seconds
+    pipeline.timer_wheel.advance(clock.now)
+
+
+def sent_data(pipeline):
+    return [op.message.data for op in pipeline.next.next.ops]
+
+
+@pytest.mark.describe("AggregateTelemetry stage")
+class TestAggregateTelemetry(object):
+    @pytest.mark.it("Completes reading messages without sending them")
+    def test_absorbs_readings(self, wheel, clock):
+        pipeline = make_aggregate_pipeline(wheel, clock)
+        completed = []
+        op = pipeline_ops_iothub.SendTelemetry(
+            message=Message('{"temperature": 20.5}'), callback=completed.append
+        )
+        pipeline.run_op(op)
+        assert completed == [op]
+        assert op.error is None
+        assert pipeline.next.next.ops == []
+
+    @pytest.mark.it("Sends the min, max, mean and count of each field when a window closes")
+    def test_tumbling(self, wheel, clock):
+        pipeline = make_aggregate_pipeline(wheel, clock, window=50)
+        start = clock.now
+        for value in (20.0, 22.0, 24.0):
+            send_reading(pipeline, {"temperature": value, "humidity": 40})
+            clock.now += 10
+        assert pipeline.next.next.ops == []
+        advance(pipeline, clock, 31)
+        summaries = sent_data(pipeline)
+        assert summaries == [
+            {
+                "window_start": start,
+                "window_end": start + 50,
+                "fields": {
+                    "temperature": {"count": 3, "min": 20.0, "max": 24.0, "mean": 22.0},
+                    "humidity": {"count": 3, "min": 40.0, "max": 40.0, "mean": 40.0},
+                },
+            }
+        ]
+        assert pipeline.next.next.ops[0].message.content_type == "application/json"
+
+    @pytest.mark.it("Sends one summary per key and output")
+    def test_keys(self, wheel, clock):
+        pipeline = make_aggregate_pipeline(wheel, clock, window=60)
+        send_reading(pipeline, '{"temperature": 1}', key="a")
+        send_reading(pipeline, '{"temperature": 2}', key="b")
+        send_reading(pipeline, '{"temperature": 3}', key="a", output_name="out")
+        advance(pipeline, clock, 60)
+        ops = pipeline.next.next.ops
+        assert len(ops) == 3
+        by_series = dict(
+            ((op.message.output_name, op.message.custom_properties["key"]), op) for op in ops
+        )
+        assert by_series[(None, "a")].message.data["fields"]["temperature"]["mean"] == 1
+        assert by_series[(None, "b")].message.data["fields"]["temperature"]["mean"] == 2
+        assert isinstance(by_series[("out", "a")], pipeline_ops_iothub.SendOutputEvent)
+
+    @pytest.mark.it("Sends a summary of the last window seconds every slide seconds")
+    def test_sliding(self, wheel, clock):
+        pipeline = make_aggregate_pipeline(wheel, clock, window=30, slide=10)
+        start = clock.now
+        send_reading(pipeline, {"temperature": 10})
+        advance(pipeline, clock, 10)
+        send_reading(pipeline, {"temperature": 20})
+        advance(pipeline, clock, 10)
+        advance(pipeline, clock, 10)
+        advance(pipeline, clock, 10)
+        advance(pipeline, clock, 10)
+        summaries = [
+            (data["window_end"] - start, data["fields"]["temperature"]["count"])
+            for data in sent_data(pipeline)
+        ]
+        assert summaries == [(10, 1), (20, 2), (30, 2), (40, 1)]
+        assert pipeline.next.get_stats()["pending_readings"] == 0
+
+    @pytest.mark.it("Passes on messages for pass-through keys and messages that aren't readings")
+    def test_pass_through(self, wheel, clock):
+        pipeline = make_aggregate_pipeline(wheel, clock, pass_through_keys=["raw"])
+        send_reading(pipeline, {"temperature": 1}, key="raw")
+        send_reading(pipeline, {"status": "ok"})
+        send_reading(pipeline, "not json")
+        send_reading(pipeline, b"\x00\x01")
+        assert len(pipeline.next.next.ops) == 4
+        assert pipeline.next.get_stats()["passed_through"] == 4
+
+    @pytest.mark.it("Sends summaries of open windows before passing on a Disconnect")
+    def test_disconnect_flush(self, wheel, clock):
+        pipeline = make_aggregate_pipeline(wheel, clock, window=60)
+        send_reading(pipeline, {"temperature": 1})
+        send_reading(pipeline, {"temperature": 3})
+        pipeline.run_op(pipeline_ops_base.Disconnect(callback=lambda op: None))
+        ops = pipeline.next.next.ops
+        assert len(ops) == 2
+        assert ops[0].message.data["fields"]["temperature"]["mean"] == 2
+        assert isinstance(ops[1], pipeline_ops_base.Disconnect)
+        assert pipeline.timer_wheel.get_stats()["pending"] == 0
+
+    @pytest.mark.it("Sends summaries of open windows when the transport disconnects unexpectedly")
+    def test_unexpected_disconnect_flush(self, wheel, clock, mocker):
+        pipeline = make_aggregate_pipeline(wheel, clock, window=60)
+        pipeline.on_disconnected = mocker.MagicMock()
+        send_reading(pipeline, {"temperature": 1})
+        send_reading(pipeline, {"temperature": 3})
+        pipeline.next.next.on_disconnected()
+        ops = pipeline.next.next.ops
+        assert len(ops) == 1
+        assert ops[0].message.data["fields"]["temperature"]["mean"] == 2
+        assert pipeline.timer_wheel.get_stats()["pending"] == 0
+        assert pipeline.on_disconnected.call_count == 1
+
+    @pytest.mark.it("Reports aggregated, passed through and summary counts")
+    def test_stats(self, wheel, clock):
+        pipeline = make_aggregate_pipeline(wheel, clock, window=60)
+        send_reading(pipeline, {"temperature": 1})
+        send_reading(pipeline, {"temperature": 2, "humidity": 3})
+        assert pipeline.get_pipeline_stats()["AggregateTelemetry"] == {
+            "aggregated": 2,
+            "passed_through": 0,
+            "summaries": 0,
+            "summary_errors": 0,
+            "pending_readings": 3,
+        }
+        advance(pipeline, clock, 60)
+        assert pipeline.next.get_stats()["summaries"] == 1
+
+    @pytest.mark.it("Rejects invalid window and slide lengths")
+    def test_invalid_windows(self):
+        with pytest.raises(ValueError):
+            pipeline_stages_iothub.AggregateTelemetry(window=0)
+        with pytest.raises(ValueError):
+            pipeline_stages_iothub.AggregateTelemetry(window=10, slide=20)
+
+
+def make_deadband_pipeline(clock, deadbands, **kwargs):
+    return (
+        pipeline_stages_base.PipelineRoot()
+        .append_stage(pipeline_stages_iothub.ApplyDeadbands(deadbands, clock=clock, **kwargs))
+        .append_stage(BottomStage())
+    )
+
+
+def sent_count(pipeline):
+    return len(pipeline.next.next.ops)
+
+
+@pytest.mark.describe("ApplyDeadbands stage")
+class TestApplyDeadbands(object):
+    @pytest.mark.it("Suppresses values inside an absolute deadband around the last value sent")
+    def test_absolute(self, clock):
+        pipeline = make_deadband_pipeline(clock, {"temperature": 0.5})
+        for value in (20.0, 20.3, 20.5, 19.6, 20.6):
+            send_reading(pipeline, '{"temperature": %s}' % value)
+        # 20.0 is sent, 20.3, 20.5 and 19.6 are within 0.5 of it, and 20.6 is not
+        assert [op.message.data for op in pipeline.next.next.ops] == [
+            '{"temperature": 20.0}',
+            '{"temperature": 20.6}',
+        ]
+
+    @pytest.mark.it("Supports deadbands that are a percentage of the last value sent")
+    def test_percent(self, clock):
+        pipeline = make_deadband_pipeline(clock, {"pressure": "1%"})
+        for value in (1000, 1009, 1011):
+            send_reading(pipeline, {"pressure": value})
+        assert sent_count(pipeline) == 2
+
+    @pytest.mark.it("Completes suppressed operations without an error")
+    def test_completes_suppressed(self, clock):
+        pipeline = make_deadband_pipeline(clock, {"temperature": 1})
+        send_reading(pipeline, {"temperature": 1})
+        op = send_reading(pipeline, {"temperature": 1})
+        assert op.error is None
+        assert sent_count(pipeline) == 1
+
+    @pytest.mark.it("Sends a message after max_silence seconds even if nothing changed")
+    def test_max_silence(self, clock):
+        pipeline = make_deadband_pipeline(clock, {"temperature": 1}, max_silence=60)
+        send_reading(pipeline, {"temperature": 1})
+        clock.now += 59
+        send_reading(pipeline, {"temperature": 1})
+        clock.now += 1
+        send_reading(pipeline, {"temperature": 1})
+        assert sent_count(pipeline) == 2
+
+    @pytest.mark.it("Keeps the last values sent per key and output")
+    def test_keys(self, clock):
+        pipeline = make_deadband_pipeline(clock, {"temperature": 1})
+        send_reading(pipeline, {"temperature": 1}, key="a")
+        send_reading(pipeline, {"temperature": 1}, key="b")
+        send_reading(pipeline, {"temperature": 1}, key="a", output_name="out")
+        send_reading(pipeline, {"temperature": 1}, key="a")
+        assert sent_count(pipeline) == 3
+        assert pipeline.next.get_stats() == {"forwarded": 3, "suppressed": 1, "keys": 3}
+
+    @pytest.mark.it("Reads properties from custom_properties")
+    def test_custom_properties(self, clock):
+        pipeline = make_deadband_pipeline(clock, {"level": 5})
+        for level in ("10", "12", "16"):
+            message = Message("payload")
+            message.custom_properties["level"] = level
+            pipeline.run_op(
+                pipeline_ops_iothub.SendTelemetry(message=message, callback=lambda op: None)
+            )
+        assert sent_count(pipeline) == 2
+
+    @pytest.mark.it("Always sends messages that don't have any of the properties")
+    def test_unrelated_messages(self, clock):
+        pipeline = make_deadband_pipeline(clock, {"temperature": 1})
+        send_reading(pipeline, "not json")
+        send_reading(pipeline, "not json")
+        send_reading(pipeline, {"humidity": 1})
+        assert sent_count(pipeline) == 3
+
+    @pytest.mark.it("Rejects invalid deadbands")
+    @pytest.mark.parametrize("deadband", [-1, "x%", "nan", None])
+    def test_invalid_deadband(self, deadband):
+        with pytest.raises(ValueError):
+            pipeline_stages_iothub.ApplyDeadbands({"temperature": deadband})
+
+
+@pytest.mark.describe("conflate_by_property()")
+class TestConflateByProperty(object):
+    @pytest.mark.it("Keys telemetry and output events by the value of the custom property")
+    def test_keys(self):
+        key = pipeline_stages_iothub.conflate_by_property("sensor")
+        a = Message("1")
+        a.custom_properties["sensor"] = "a"
+        out = Message("2")
+        out.custom_properties["sensor"] = "a"
+        out.output_name = "out"
+        b = Message("3")
+        b.custom_properties["sensor"] = "a"
+        telemetry_key = key(pipeline_ops_iothub.SendTelemetry(message=a))
+        assert telemetry_key is not None
+        assert telemetry_key == key(pipeline_ops_iothub.SendTelemetry(message=b))
+        assert telemetry_key != key(pipeline_ops_iothub.SendOutputEvent(message=out))
+
+    @pytest.mark.it("Doesn't key messages without the property or other operations")
+    def test_no_key(self):
+        key = pipeline_stages_iothub.conflate_by_property("sensor")
+        assert key(pipeline_ops_iothub.SendTelemetry(message=Message("1"))) is None
+        assert key(pipeline_ops_base.Connect()) is None
+
+    @pytest.mark.it("Lets EnsureConnection keep only the newest queued message per key")
+    def test_ensure_connection(self):
+        stage = pipeline_stages_base.EnsureConnection(
+            conflation_key=pipeline_stages_iothub.conflate_by_property("sensor")
+        )
+        pipeline = pipeline_stages_base.PipelineRoot().append_stage(stage)
+        stage.blocked = True
+        completed = []
+        for value in range(5):
+            message = Message(str(value))
+            message.custom_properties["sensor"] = "a"
+            stage.run_op(
+                pipeline_ops_iothub.SendTelemetry(message=message, callback=completed.append)
+            )
+        assert stage.get_stats() == {"queued": 1, "conflated": 4, "expired": 0}
+        assert [op.message.data for op in completed] == ["0", "1", "2", "3"]
+        assert stage.queue.get_nowait().message.data == "4"
+        assert pipeline.get_pipeline_stats()["EnsureConnection"]["conflated"] == 4
+
+
+@pytest.mark.describe("get_billing_units()")
+class TestGetBillingUnits(object):
+    @pytest.mark.it("Counts each started 4KB of message payload as a unit")
+    @pytest.mark.parametrize(
+        "data,expected",
+        [
+            pytest.param(b"", 1, id="empty"),
+            pytest.param(b"x" * 4096, 1, id="4KB"),
+            pytest.param(b"x" * 4097, 2, id="just over 4KB"),
+            pytest.param(u"\u00e9" * 2049, 2, id="text counted in UTF-8 bytes"),
+            pytest.param({"values": [1.5] * 3000}, 3, id="encoded as JSON"),
+        ],
+    )
+    def test_units(self, data, expected):
+        op = pipeline_ops_iothub.SendOutputEvent(message=Message(data))
+        assert pipeline_stages_iothub.get_billing_units(op) == expected
+
+    @pytest.mark.it("Counts other operations as one unit")
+    def test_other_ops(self):
+        assert pipeline_stages_iothub.get_billing_units(pipeline_ops_base.Connect()) == 1
+
+
+@pytest.mark.describe("encode_message_data()")
+class TestEncodeMessageData(object):
+    @pytest.mark.it("Encodes the message once and reuses the payload for later callers")
+    def test_cached(self, mocker):
+        op = pipeline_ops_iothub.SendTelemetry(message=Message({"values": [1.5] * 3000}))
+        registry = payload_codecs.default_registry
+        spy = mocker.spy(registry, "encode_message_data")
+        assert pipeline_stages_iothub.get_billing_units(op) == 3
+        (payload, content_type) = pipeline_stages_iothub.encode_message_data(op, registry)
+        assert spy.call_count == 1
+        assert content_type == payload_codecs.CONTENT_TYPE_JSON
+        assert payload == registry.encode(content_type, op.message.data)
+
+    @pytest.mark.it("Encodes the message again if the op's message or the registry changes")
+    def test_invalidated(self, mocker):
+        op = pipeline_ops_iothub.SendTelemetry(message=Message({"temperature": 1}))
+        registry = payload_codecs.default_registry
+        pipeline_stages_iothub.encode_message_data(op, registry)
+        op.message = Message({"temperature": 2})
+        (payload, _) = pipeline_stages_iothub.encode_message_data(op, registry)
+        assert payload == registry.encode(payload_codecs.CONTENT_TYPE_JSON, {"temperature": 2})
+        other_registry = mocker.MagicMock()
+        other_registry.encode_message_data.return_value = (b"other", None)
+        assert pipeline_stages_iothub.encode_message_data(op, other_registry) == (b"other", None)
+
+
+def telemetry_expiring_at(expiry):
+    message = Message("payload")
+    message.expiry_time_utc = expiry
+    return pipeline_ops_iothub.SendTelemetry(message=message, callback=lambda op: None)
+
+
+@pytest.mark.describe("get_message_expiry()")
+class TestGetMessageExpiry(object):
+    @pytest.mark.it("Converts expiry_time_utc to seconds since the epoch")
+    @pytest.mark.parametrize(
+        "expiry,expected",
+        [
+            pytest.param(
+                datetime.datetime(2019, 6, 1, 12, 0, 0, 500000), 1559390400.5, id="datetime"
+            ),
+            pytest.param(datetime.date(2019, 6, 1), 1559347200.0, id="date"),
+            pytest.param("2019-06-01T12:00:00.5Z", 1559390400.5, id="ISO string with Z"),
+            pytest.param("2019-06-01T12:00:00", 1559390400.0, id="ISO string"),
+            pytest.param("2019-06-01T14:00:00+02:00", 1559390400.0, id="ISO string with offset"),
+        ],
+    )
+    def test_converts(self, expiry, expected):
+        assert get_message_expiry(telemetry_expiring_at(expiry)) == pytest.approx(expected)
+
+    @pytest.mark.it("Returns None for messages without an expiry, bad expiries and other ops")
+    def test_none(self):
+        assert get_message_expiry(telemetry_expiring_at(None)) is None
+        assert get_message_expiry(telemetry_expiring_at("next tuesday")) is None
+        assert get_message_expiry(pipeline_ops_base.Connect()) is None
+
+
+@pytest.mark.describe("DropExpiredMessages stage")
+class TestDropExpiredMessages(object):
+    @pytest.fixture
+    def pipeline(self, clock):
+        return (
+            pipeline_stages_base.PipelineRoot()
+            .append_stage(pipeline_stages_iothub.DropExpiredMessages(clock=clock))
+            .append_stage(BottomStage())
+        )
+
+    @pytest.mark.it("Fails expired messages with a MessageExpiredError instead of sending them")
+    def test_expired(self, pipeline, clock):
+        op = telemetry_expiring_at(datetime.datetime.utcfromtimestamp(clock.now - 1))
+        pipeline.run_op(op)
+        assert isinstance(op.error, MessageExpiredError)
+        assert pipeline.next.next.ops == []
+        assert pipeline.get_pipeline_stats()["DropExpiredMessages"] == {"expired": 1}
+
+    @pytest.mark.it("Sends messages that haven't expired or don't expire")
+    def test_not_expired(self, pipeline, clock):
+        pipeline.run_op(telemetry_expiring_at(datetime.datetime.utcfromtimestamp(clock.now + 1)))
+        pipeline.run_op(telemetry_expiring_at(None))
+        assert len(pipeline.next.next.ops) == 2
+
+
+@pytest.mark.describe("DropDuplicateMessages stage")
+class TestDropDuplicateMessages(object):
+    def make_pipeline(self, mocker, clock, **kwargs):
+        root = (
+            pipeline_stages_base.PipelineRoot()
+            .append_stage(pipeline_stages_iothub.DropDuplicateMessages(clock=clock, **kwargs))
+            .append_stage(BottomStage())
+        )
+        root.on_pipeline_event = mocker.MagicMock()
+        return root
+
+    def receive(self, pipeline, message_id, input_name=None):
+        message = Message("payload", message_id=message_id)
+        if input_name:
+            event = pipeline_events_iothub.InputMessageEvent(input_name, message)
+        else:
+            event = pipeline_events_iothub.C2DMessageEvent(message)
+        pipeline.next.next.handle_pipeline_event(event)
+
+    def received_ids(self, pipeline):
+        return [c[0][0].message.message_id for c in pipeline.on_pipeline_event.call_args_list]
+
+    @pytest.mark.it("Drops C2D and input messages with a message_id that was already received")
+    def test_drops_duplicates(self, mocker, clock):
+        pipeline = self.make_pipeline(mocker, clock)
+        for message_id in ("a", "b", "a", "c", "b"):
+            self.receive(pipeline, message_id)
+        self.receive(pipeline, "c", input_name="input1")
+        assert self.received_ids(pipeline) == ["a", "b", "c"]
+        assert pipeline.get_pipeline_stats()["DropDuplicateMessages"] == {
+            "duplicates": 3,
+            "passed": 3,
+            "entries": 3,
+        }
+
+    @pytest.mark.it("Always passes up messages without a message_id")
+    def test_no_message_id(self, mocker, clock):
+        pipeline = self.make_pipeline(mocker, clock)
+        self.receive(pipeline, None)
+        self.receive(pipeline, None)
+        assert pipeline.on_pipeline_event.call_count == 2
+
+    @pytest.mark.it("Forgets the least recently seen ids beyond max_entries")
+    def test_max_entries(self, mocker, clock):
+        pipeline = self.make_pipeline(mocker, clock, max_entries=2)
+        for message_id in ("a", "b", "a", "c", "b", "a"):
+            self.receive(pipeline, message_id)
+        # "b" is evicted when "c" arrives because "a" was seen more recently, and then "a" is
+        # evicted when "b" comes back
+        assert self.received_ids(pipeline) == ["a", "b", "c", "b", "a"]
+        assert pipeline.next.get_stats()["entries"] == 2
+
+    @pytest.mark.it("Forgets ids older than the window")
+    def test_window(self, mocker, clock):
+        pipeline = self.make_pipeline(mocker, clock, window=60)
+        self.receive(pipeline, "a")
+        clock.now += 30
+        self.receive(pipeline, "a")
+        clock.now += 61
+        self.receive(pipeline, "a")
+        assert self.received_ids(pipeline) == ["a", "a"]
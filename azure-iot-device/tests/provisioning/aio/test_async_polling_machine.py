@@ -0,0 +1,177 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import asyncio
+import json
+import pytest
+from azure.iot.device.provisioning.aio.async_polling_machine import AsyncPollingMachine
+from azure.iot.device.provisioning.transport import constant
+
+pytestmark = pytest.mark.asyncio
+
+fake_operation_id = "Operation4567"
+fake_device_id = "MyNimbus2000"
+fake_assigned_hub = "Dumbledore'sArmy"
+
+
+def assigning():
+    return (200, "0", {"operationId": fake_operation_id, "status": "assigning"})
+
+
+def assigned():
+    return (
+        200,
+        None,
+        {
+            "operationId": fake_operation_id,
+            "status": "assigned",
+            "registrationState": {"deviceId": fake_device_id, "assignedHub": fake_assigned_hub},
+        },
+    )
+
+
+class FakeProvider(object):
+    """
+    Completes subscribes and disconnects straight away, and answers each publish with the next of
+    the given (status code, retry-after, body) responses from the event loop.  Once the responses
+    run out, publishes are never answered.
+    """
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.published_topics = []
+        self.disconnected = False
+        self.on_state_based_provider_message_received = None
+
+    def subscribe(self, topic, callback):
+        callback()
+
+    def disconnect(self, callback):
+        self.disconnected = True
+        callback()
+
+    def publish(self, topic, message, callback):
+        self.published_topics.append(topic)
+        callback()
+        if self.responses:
+            (status, retry_after, body) = self.responses.pop(0)
+            rid = topic.split("$rid=")[1].split("&")[0]
+            response_topic = "$dps/registrations/res/{}/?$rid={}".format(status, rid)
+            if retry_after is not None:
+                response_topic += "&retry-after={}".format(retry_after)
+            asyncio.get_event_loop().call_soon(
+                self.on_state_based_provider_message_received,
+                response_topic,
+                json.dumps(body).encode("utf-8"),
+            )
+
+
+async def wait_for_publish(provider):
+    while not provider.published_topics:
+        await asyncio.sleep(0)
+
+
+@pytest.mark.describe("AsyncPollingMachine - Register")
+class TestRegister(object):
+    @pytest.mark.it("polls with the operation id until the device is assigned")
+    async def test_register_and_poll(self):
+        provider = FakeProvider([assigning(), assigning(), assigned()])
+        result = await AsyncPollingMachine(provider).register()
+
+        assert result.status == "assigned"
+        assert result.operation_id == fake_operation_id
+        assert result.registration_state.device_id == fake_device_id
+        assert result.registration_state.assigned_hub == fake_assigned_hub
+        assert "iotdps-register" in provider.published_topics[0]
+        for topic in provider.published_topics[1:]:
+            assert "operationId=" + fake_operation_id in topic
+        assert provider.disconnected
+
+    @pytest.mark.it("waits and sends the same request again when throttled")
+    async def test_throttled(self):
+        provider = FakeProvider([(429, "0", {}), assigned()])
+        polling_machine = AsyncPollingMachine(provider)
+        throttled = []
+        polling_machine.on_throttled = throttled.append
+
+        result = await polling_machine.register()
+
+        assert result.status == "assigned"
+        assert throttled == [0]
+        assert len(provider.published_topics) == 2
+        assert all("iotdps-register" in topic for topic in provider.published_topics)
+
+    @pytest.mark.it("raises a ValueError and disconnects when the service returns an error")
+    async def test_failure_status(self):
+        provider = FakeProvider([(400, None, {})])
+        with pytest.raises(ValueError):
+            await AsyncPollingMachine(provider).register()
+        assert provider.disconnected
+
+    @pytest.mark.it("raises a ValueError when a request gets no response in time")
+    async def test_timeout(self, mocker):
+        mocker.patch.object(constant, "DEFAULT_TIMEOUT_INTERVAL", 0.01)
+        provider = FakeProvider()
+        polling_machine = AsyncPollingMachine(provider)
+        with pytest.raises(ValueError):
+            await polling_machine.register()
+        assert provider.disconnected
+        assert polling_machine._request_response_provider.get_stats() == {
+            "outstanding": 0,
+            "completed": 0,
+            "expired": 1,
+        }
+
+    @pytest.mark.it("raises a RuntimeError if a registration is already in progress")
+    async def test_register_twice(self):
+        provider = FakeProvider()
+        polling_machine = AsyncPollingMachine(provider)
+        task = asyncio.ensure_future(polling_machine.register())
+        await wait_for_publish(provider)
+        with pytest.raises(RuntimeError):
+            await polling_machine.register()
+        await polling_machine.cancel()
+        assert task.cancelled()
+
+    @pytest.mark.it("runs many registrations on one loop")
+    async def test_many_registrations(self):
+        providers = [FakeProvider([assigning(), assigned()]) for _ in range(500)]
+        results = await asyncio.gather(
+            *[AsyncPollingMachine(provider).register() for provider in providers]
+        )
+        assert [result.status for result in results] == ["assigned"] * 500
+
+
+@pytest.mark.describe("AsyncPollingMachine - Cancel")
+class TestCancel(object):
+    @pytest.mark.it("cancels the registration in progress and disconnects")
+    async def test_cancel(self):
+        provider = FakeProvider()
+        polling_machine = AsyncPollingMachine(provider)
+        task = asyncio.ensure_future(polling_machine.register())
+        await wait_for_publish(provider)
+
+        await polling_machine.cancel()
+
+        assert provider.disconnected
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    @pytest.mark.it("cancels the registration when the register coroutine is cancelled")
+    async def test_cancel_register_coroutine(self):
+        provider = FakeProvider()
+        task = asyncio.ensure_future(AsyncPollingMachine(provider).register())
+        await wait_for_publish(provider)
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert provider.disconnected
+
+    @pytest.mark.it("raises a RuntimeError if there is no registration in progress")
+    async def test_cancel_without_registration(self):
+        with pytest.raises(RuntimeError):
+            await AsyncPollingMachine(FakeProvider()).cancel()
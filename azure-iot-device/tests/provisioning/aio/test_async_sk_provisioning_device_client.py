@@ -0,0 +1,102 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+from azure.iot.device.provisioning.aio import (
+    SymmetricKeyProvisioningDeviceClient,
+    create_from_security_client,
+)
+from azure.iot.device.provisioning.models import RegistrationResult
+from azure.iot.device.provisioning.models.registration_result import RegistrationState
+from azure.iot.device.provisioning.registration_cache import RegistrationCache
+from azure.iot.device.provisioning.security.sk_security_client import SymmetricKeySecurityClient
+from azure.iot.device.provisioning.transport.state_based_mqtt_provider import StateBasedMQTTProvider
+
+pytestmark = pytest.mark.asyncio
+
+fake_symmetric_key = "Zm9vYmFy"
+fake_registration_id = "MyPensieve"
+fake_id_scope = "Enchanted0000Ceiling7898"
+fake_provisioning_host = "hogwarts.com"
+
+
+def create_assigned_result():
+    state = RegistrationState("MyNimbus2000", "Dumbledore'sArmy", None, None, None, None)
+    return RegistrationResult("R1234", "Oper1234", "assigned", state)
+
+
+@pytest.fixture
+def security_client():
+    return SymmetricKeySecurityClient(fake_registration_id, fake_symmetric_key, fake_id_scope)
+
+
+@pytest.fixture
+def client(security_client, tmpdir):
+    return create_from_security_client(
+        fake_provisioning_host,
+        security_client,
+        "mqtt",
+        registration_cache=RegistrationCache(str(tmpdir)),
+    )
+
+
+class FakeCoroutineFunction(object):
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.call_count = 0
+
+    async def __call__(self):
+        self.call_count += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture
+def polling_machine_register(client, mocker):
+    register = FakeCoroutineFunction()
+    mocker.patch.object(client._polling_machine, "register", new=register)
+    return register
+
+
+@pytest.mark.describe("SymmetricKeyProvisioningDeviceClient (Async)")
+class TestClient(object):
+    @pytest.mark.it("is created by create_from_security_client")
+    async def test_create(self, client):
+        assert isinstance(client, SymmetricKeyProvisioningDeviceClient)
+        assert isinstance(client._transport, StateBasedMQTTProvider)
+
+    @pytest.mark.it("returns the result of the registration and caches it")
+    async def test_register(self, client, polling_machine_register):
+        result = create_assigned_result()
+        polling_machine_register.result = result
+
+        assert await client.register() is result
+        assert client._registration_cache.get(fake_id_scope, fake_registration_id) is not None
+
+    @pytest.mark.it("returns the cached result without registering")
+    async def test_register_uses_cache(self, client, polling_machine_register):
+        client._registration_cache.set(
+            fake_id_scope, fake_registration_id, create_assigned_result()
+        )
+
+        result = await client.register()
+
+        assert result.status == "assigned"
+        assert polling_machine_register.call_count == 0
+
+    @pytest.mark.it("returns None if the registration runs into an error")
+    async def test_register_error(self, client, polling_machine_register):
+        polling_machine_register.error = ValueError("Incoming message failure")
+        assert await client.register() is None
+
+    @pytest.mark.it("cancels the registration in progress")
+    async def test_cancel(self, client, mocker):
+        cancel = FakeCoroutineFunction()
+        mocker.patch.object(client._polling_machine, "cancel", new=cancel)
+        await client.cancel()
+        assert cancel.call_count == 1
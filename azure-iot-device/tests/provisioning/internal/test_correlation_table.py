@@ -0,0 +1,81 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import pytest
+from azure.iot.device.provisioning.internal.correlation_table import CorrelationTable
+
+fake_rid = "Request1234"
+
+
+@pytest.fixture
+def table(wheel):
+    return CorrelationTable(wheel)
+
+
+@pytest.mark.describe("CorrelationTable")
+class TestCorrelationTable(object):
+    @pytest.mark.it("returns the callback of a request once and then forgets it")
+    def test_pop(self, mocker, table):
+        callback = mocker.MagicMock()
+        table.add(fake_rid, callback)
+        assert fake_rid in table
+        assert table.pop(fake_rid) is callback
+        assert table.pop(fake_rid) is None
+        assert len(table) == 0
+
+    @pytest.mark.it("returns None for a rid it has never seen")
+    def test_pop_unknown(self, table):
+        assert table.pop(fake_rid) is None
+
+    @pytest.mark.it("refuses a second request with the same rid")
+    def test_duplicate_rid(self, mocker, table):
+        table.add(fake_rid, mocker.MagicMock())
+        with pytest.raises(ValueError):
+            table.add(fake_rid, mocker.MagicMock())
+
+    @pytest.mark.it("evicts a request when its deadline passes and calls on_timeout")
+    def test_expire(self, mocker, table, wheel, clock):
+        on_timeout = mocker.MagicMock()
+        table.add(fake_rid, mocker.MagicMock(), clock.now + 1, on_timeout)
+        wheel.advance(clock.now + 0.5)
+        assert fake_rid in table
+        wheel.advance(clock.now + 1)
+        assert fake_rid not in table
+        on_timeout.assert_called_once_with(fake_rid)
+        assert table.get_stats() == {"outstanding": 0, "completed": 0, "expired": 1}
+
+    @pytest.mark.it("cancels the deadline of a request that gets its response")
+    def test_pop_cancels_deadline(self, mocker, table, wheel, clock):
+        on_timeout = mocker.MagicMock()
+        table.add(fake_rid, mocker.MagicMock(), clock.now + 1, on_timeout)
+        table.pop(fake_rid)
+        wheel.advance(clock.now + 2)
+        assert on_timeout.call_count == 0
+        assert wheel.get_stats()["pending"] == 0
+
+    @pytest.mark.it("does not evict a later request that reuses the rid of an expired one")
+    def test_reused_rid(self, mocker, table, wheel, clock):
+        table.add(fake_rid, mocker.MagicMock(), clock.now + 1)
+        table.pop(fake_rid)
+        callback = mocker.MagicMock()
+        table.add(fake_rid, callback, clock.now + 5)
+        wheel.advance(clock.now + 2)
+        assert table.pop(fake_rid) is callback
+
+    @pytest.mark.it("keeps thousands of requests outstanding")
+    def test_many_requests(self, mocker, table, wheel, clock):
+        on_timeout = mocker.MagicMock()
+        for i in range(5000):
+            table.add(str(i), i, clock.now + 1 + (i % 2), on_timeout)
+        assert len(table) == 5000
+        assert [table.pop(str(i)) for i in range(0, 5000, 4)] == list(range(0, 5000, 4))
+        wheel.advance(clock.now + 1.5)
+        assert table.get_stats() == {"outstanding": 2500, "completed": 1250, "expired": 1250}
+        assert on_timeout.call_count == 1250
+
+    @pytest.mark.it("needs a timer wheel for requests with a deadline")
+    def test_deadline_without_wheel(self, mocker, clock):
+        with pytest.raises(ValueError):
+            CorrelationTable().add(fake_rid, mocker.MagicMock(), clock.now + 1)
@@ -9,6 +9,7 @@ import datetime
 from mock import MagicMock
 from azure.iot.device.provisioning.internal.request_response_provider import RequestResponseProvider
 from azure.iot.device.provisioning.internal.polling_machine import PollingMachine
+from azure.iot.device.provisioning.internal import polling_machine as polling_machine_module
 from azure.iot.device.provisioning.models.registration_result import RegistrationResult
 from azure.iot.device.provisioning.transport import constant
 import time
@@ -74,11 +75,7 @@ class TestRegister:
             "azure.iot.device.provisioning.internal.polling_machine.uuid.uuid4"
         )
         mock_init_uuid.return_value = fake_request_id
-        mock_init_query_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
-        )
-        mock_query_timer = mock_init_query_timer.return_value
-        mocker.patch.object(mock_query_timer, "start")
+        mocker.patch("azure.iot.device.provisioning.internal.polling_machine.polling_scheduler")
 
         mock_polling_machine.state = "initializing"
         mock_request_response_provider = mock_polling_machine._request_response_provider
@@ -90,6 +87,8 @@ class TestRegister:
             topic=constant.PUBLISH_TOPIC_REGISTRATION.format(fake_request_id),
             request=" ",
             callback=mock_polling_machine._on_register_response_received,
+            deadline=mocker.ANY,
+            on_timeout=mock_polling_machine._on_request_timeout,
         )
 
 
@@ -102,7 +101,9 @@ class TestRegisterResponse:
     @pytest.mark.it("response from register with a status of assigning starts querying")
     def test_receive_register_response_assigning_does_query_with_operation_id(self, mocker):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
 
         polling_machine._request_response_provider = mock_request_response_provider
@@ -133,7 +134,7 @@ class TestRegisterResponse:
         )
 
         mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
+            "azure.iot.device.provisioning.internal.polling_machine.polling_scheduler"
         )
 
         # Complete string pre-fixed by a b is the one that works for all versions of python
@@ -144,7 +145,7 @@ class TestRegisterResponse:
         )
 
         # call polling timer's time up call to simulate polling
-        time_up_call = mock_init_polling_timer.call_args[0][1]
+        time_up_call = mock_init_polling_timer.schedule.call_args[0][1]
         time_up_call()
 
         assert mock_request_response_provider.publish.call_count == 2
@@ -158,7 +159,9 @@ class TestRegisterResponse:
     )
     def test_receive_register_response_assigned_completes_registration(self, mocker):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
 
         polling_machine._request_response_provider = mock_request_response_provider
@@ -227,7 +230,9 @@ class TestRegisterResponse:
     )
     def test_receive_register_response_failure_calls_callback_of_register_error(self, mocker):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
 
@@ -267,7 +272,9 @@ class TestRegisterResponse:
         self, mocker
     ):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
 
@@ -307,7 +314,9 @@ class TestRegisterResponse:
     @pytest.mark.it("response from register with status code > 429 calls register again")
     def test_receive_register_response_greater_than_429_does_register_again(self, mocker):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
         mocker.patch.object(mock_request_response_provider, "subscribe")
@@ -336,7 +345,7 @@ class TestRegisterResponse:
         fake_payload_result = "HelloHogwarts"
 
         mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
+            "azure.iot.device.provisioning.internal.polling_machine.polling_scheduler"
         )
 
         mock_request_response_provider.receive_response(
@@ -344,7 +353,7 @@ class TestRegisterResponse:
         )
 
         # call polling timer's time up call to simulate polling
-        time_up_call = mock_init_polling_timer.call_args[0][1]
+        time_up_call = mock_init_polling_timer.schedule.call_args[0][1]
         time_up_call()
 
         assert mock_request_response_provider.publish.call_count == 2
@@ -352,12 +361,40 @@ class TestRegisterResponse:
             topic=constant.PUBLISH_TOPIC_REGISTRATION.format(fake_request_id_2), request=" "
         )
 
+    @pytest.mark.it("response from register with status code > 429 calls on_throttled")
+    def test_receive_register_response_greater_than_429_calls_on_throttled(self, mocker):
+        state_based_mqtt = MagicMock()
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
+        polling_machine = PollingMachine(state_based_mqtt)
+        polling_machine._request_response_provider = mock_request_response_provider
+        polling_machine.on_throttled = MagicMock()
+        mocker.patch.object(mock_request_response_provider, "subscribe")
+        mocker.patch.object(mock_request_response_provider, "publish")
+        mocker.patch("azure.iot.device.provisioning.internal.polling_machine.polling_scheduler")
+        mock_init_uuid = mocker.patch(
+            "azure.iot.device.provisioning.internal.polling_machine.uuid.uuid4"
+        )
+        mock_init_uuid.return_value = fake_request_id
+
+        polling_machine.register(callback=MagicMock())
+        polling_machine._on_subscribe_completed()
+        fake_topic = fake_greater_429_response_topic + "$rid={}&retry-after={}".format(
+            fake_request_id, fake_retry_after
+        )
+        mock_request_response_provider.receive_response(fake_topic, b"HelloHogwarts")
+
+        polling_machine.on_throttled.assert_called_once_with(int(fake_retry_after))
+
     @pytest.mark.it("timeout leads to callback of registration process with error")
     def test_receive_register_response_after_query_time_passes_calls_callback_with_error(
         self, mocker
     ):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
 
@@ -397,7 +434,9 @@ class TestQueryResponse:
     @pytest.mark.it("response from query with a status of assigning does querying again")
     def test_receive_query_response_assigning_does_query_again_with_same_operation_id(self, mocker):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
 
@@ -426,7 +465,7 @@ class TestQueryResponse:
         )
 
         mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
+            "azure.iot.device.provisioning.internal.polling_machine.polling_scheduler"
         )
 
         # Response for register to transition to waiting polling
@@ -435,7 +474,7 @@ class TestQueryResponse:
         )
 
         # call polling timer's time up call to simulate polling
-        time_up_call = mock_init_polling_timer.call_args[0][1]
+        time_up_call = mock_init_polling_timer.schedule.call_args[0][1]
         time_up_call()
 
         # reset mock to generate different request id for second query
@@ -455,7 +494,7 @@ class TestQueryResponse:
         )
 
         # call polling timer's time up call to simulate polling
-        time_up_call = mock_init_polling_timer.call_args[0][1]
+        time_up_call = mock_init_polling_timer.schedule.call_args[0][1]
         time_up_call()
 
         assert mock_request_response_provider.publish.call_count == 3
@@ -469,7 +508,9 @@ class TestQueryResponse:
     @pytest.mark.it("response from register with a status of assigned completes registration")
     def test_receive_query_response_assigned_completes_registration(self, mocker):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
 
@@ -500,7 +541,7 @@ class TestQueryResponse:
         )
 
         mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
+            "azure.iot.device.provisioning.internal.polling_machine.polling_scheduler"
         )
 
         # Response for register to transition to waiting and polling
@@ -509,7 +550,7 @@ class TestQueryResponse:
         )
 
         # call polling timer's time up call to simulate polling
-        time_up_call = mock_init_polling_timer.call_args[0][1]
+        time_up_call = mock_init_polling_timer.schedule.call_args[0][1]
         time_up_call()
 
         fake_query_topic_1 = fake_success_response_topic + "$rid={}".format(fake_request_id_query)
@@ -552,7 +593,9 @@ class TestQueryResponse:
     )
     def test_receive_query_response_failure_calls_callback_of_register_error(self, mocker):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
 
@@ -583,7 +626,7 @@ class TestQueryResponse:
         )
 
         mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
+            "azure.iot.device.provisioning.internal.polling_machine.polling_scheduler"
         )
 
         # Response for register to transition to waiting and polling
@@ -592,7 +635,7 @@ class TestQueryResponse:
         )
 
         # call polling timer's time up call to simulate polling
-        time_up_call = mock_init_polling_timer.call_args[0][1]
+        time_up_call = mock_init_polling_timer.schedule.call_args[0][1]
         time_up_call()
 
         fake_query_topic_1 = fake_failure_response_topic + "$rid={}".format(fake_request_id_query)
@@ -614,7 +657,9 @@ class TestQueryResponse:
         self, mocker
     ):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
 
@@ -643,7 +688,7 @@ class TestQueryResponse:
         )
 
         mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
+            "azure.iot.device.provisioning.internal.polling_machine.polling_scheduler"
         )
 
         # Response for register to transition to waiting polling
@@ -652,7 +697,7 @@ class TestQueryResponse:
         )
 
         # call polling timer's time up call to simulate polling
-        time_up_call = mock_init_polling_timer.call_args[0][1]
+        time_up_call = mock_init_polling_timer.schedule.call_args[0][1]
         time_up_call()
 
         # reset mock to generate different request id for second query
@@ -673,7 +718,7 @@ class TestQueryResponse:
         )
 
         # call polling timer's time up call to simulate polling
-        time_up_call = mock_init_polling_timer.call_args[0][1]
+        time_up_call = mock_init_polling_timer.schedule.call_args[0][1]
         time_up_call()
 
         assert mock_request_response_provider.publish.call_count == 3
@@ -717,7 +762,9 @@ class TestCancel:
     )
     def test_register_and_cancel_clears_timers_and_disconnects(self, mocker):
         state_based_mqtt = MagicMock()
-        mock_request_response_provider = TestRequestResponseProvider(state_based_mqtt)
+        mock_request_response_provider = TestRequestResponseProvider(
+            state_based_mqtt, polling_machine_module.polling_scheduler
+        )
         polling_machine = PollingMachine(state_based_mqtt)
         polling_machine._request_response_provider = mock_request_response_provider
 
@@ -753,15 +800,14 @@ class TestCancel:
         )
 
         polling_timer = polling_machine._polling_timer
-        query_timer = polling_machine._query_timer
-        poling_timer_cancel = mocker.patch.object(polling_timer, "cancel")
-        query_timer_cancel = mocker.patch.object(query_timer, "cancel")
+        scheduler_cancel = mocker.patch(
+            "azure.iot.device.provisioning.internal.polling_machine.polling_scheduler.cancel"
+        )
 
         mock_cancel_callback = MagicMock()
         polling_machine.cancel(mock_cancel_callback)
 
-        assert poling_timer_cancel.call_count == 1
-        assert query_timer_cancel.call_count == 1
+        scheduler_cancel.assert_any_call(polling_timer)
 
         mock_request_response_provider.disconnect.assert_called_once_with(
             callback=polling_machine._on_disconnect_completed_cancel
@@ -769,3 +815,70 @@ class TestCancel:
         polling_machine._on_disconnect_completed_cancel()
 
         assert mock_cancel_callback.call_count == 1
+
+
+@pytest.mark.describe("PollingMachine - Polling interval")
+class TestPollingInterval:
+    @pytest.mark.it("uses the retry-after from the service when there is one")
+    def test_uses_retry_after(self, mock_polling_machine):
+        assert mock_polling_machine._get_polling_interval("7") == 7
+
+    @pytest.mark.it("backs off exponentially with jitter when there is no retry-after")
+    def test_backs_off(self, mock_polling_machine, mocker):
+        mocker.patch.object(constant, "DEFAULT_POLLING_INTERVAL", 2)
+        mocker.patch.object(constant, "MAX_POLLING_INTERVAL", 16)
+        intervals = [mock_polling_machine._get_polling_interval(None) for _ in range(5)]
+        for (interval, ceiling) in zip(intervals, [2, 4, 8, 16, 16]):
+            assert ceiling / 2.0 <= interval <= ceiling
+
+    @pytest.mark.it("gives its request provider the shared polling scheduler for request deadlines")
+    def test_uses_shared_scheduler(self, mock_polling_machine):
+        (_, timer_wheel) = polling_machine_module.RequestResponseProvider.call_args[0]
+        assert timer_wheel is polling_machine_module.polling_scheduler
+
+    @pytest.mark.it("sends each request with a deadline DEFAULT_TIMEOUT_INTERVAL from now")
+    def test_request_deadline(self, mock_polling_machine, mocker):
+        mocker.patch("azure.iot.device.provisioning.internal.polling_machine.polling_scheduler")
+        mock_polling_machine.register()
+        mock_polling_machine._on_subscribe_completed()
+        mock_request_response_provider = mock_polling_machine._request_response_provider
+        deadline = mock_request_response_provider.send_request.call_args[1]["deadline"]
+        assert deadline == pytest.approx(time.time() + constant.DEFAULT_TIMEOUT_INTERVAL, abs=1)
+
+    @pytest.mark.it("fails the registration when a request gets no response before its deadline")
+    def test_request_timeout(self, mock_polling_machine, mocker):
+        mocker.patch("azure.iot.device.provisioning.internal.polling_machine.polling_scheduler")
+        mock_callback = MagicMock()
+        mock_polling_machine.register(callback=mock_callback)
+        mock_polling_machine._on_subscribe_completed()
+        mock_request_response_provider = mock_polling_machine._request_response_provider
+        on_timeout = mock_request_response_provider.send_request.call_args[1]["on_timeout"]
+        on_timeout(mock_request_response_provider.send_request.call_args[1]["rid"])
+
+        mock_request_response_provider.disconnect.assert_called_once_with(
+            callback=mock_polling_machine._on_disconnect_completed_error
+        )
+        mock_polling_machine._on_disconnect_completed_error()
+        assert mock_callback.call_args[0][1].args[0] == "Time is up for query timer"
+        assert mock_polling_machine._operations == {}
+
+    @pytest.mark.it("reports the number of registrations in progress")
+    def test_in_flight_stats(self, mock_polling_machine):
+        before = polling_machine_module.get_polling_stats()["registrations_in_flight"]
+        mock_polling_machine.register()
+        assert polling_machine_module.get_polling_stats()["registrations_in_flight"] == before + 1
+        mock_polling_machine._clear_timers()
+        assert polling_machine_module.get_polling_stats()["registrations_in_flight"] == before
+
+    @pytest.mark.it("forgets its outstanding requests when it stops")
+    def test_clear_timers_cancels_requests(self, mock_polling_machine, mocker):
+        mocker.patch("azure.iot.device.provisioning.internal.polling_machine.polling_scheduler")
+        mock_polling_machine.register()
+        mock_polling_machine._on_subscribe_completed()
+        (rid,) = list(mock_polling_machine._operations)
+
+        mock_polling_machine._clear_timers()
+
+        mock_request_response_provider = mock_polling_machine._request_response_provider
+        mock_request_response_provider.cancel_request.assert_called_once_with(rid)
+        assert mock_polling_machine._operations == {}
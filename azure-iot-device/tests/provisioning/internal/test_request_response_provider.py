@@ -7,7 +7,10 @@
 import pytest
 import six.moves.urllib as urllib
 from mock import MagicMock
-from azure.iot.device.provisioning.internal.request_response_provider import RequestResponseProvider
+from azure.iot.device.provisioning.internal.request_response_provider import (
+    RequestResponseProvider,
+    parse_response_topic,
+)
 
 
 fake_rid = "Request1234"
@@ -45,6 +48,8 @@ def test_connect_calls_connect_on_state_based_provider(request_response_provider
     mock_mqtt_state_based_provider.connect.assert_called_once_with(
         callback=request_response_provider._on_connection_state_change
     )
+    # The transport calls the callback without arguments
+    mock_mqtt_state_based_provider.connect.call_args[1]["callback"]()
 
 
 @pytest.mark.it("disconnect calls disconnect on state based provider with given callback")
@@ -64,6 +69,8 @@ def test_disconnect_calls_disconnect_on_state_based_provider(request_response_pr
     mock_mqtt_state_based_provider.disconnect.assert_called_once_with(
         callback=request_response_provider._on_connection_state_change
     )
+    # The transport calls the callback without arguments
+    mock_mqtt_state_based_provider.disconnect.call_args[1]["callback"]()
 
 
 @pytest.mark.it("send request calls publish on state based provider with message")
@@ -163,3 +170,67 @@ def test_on_provider_message_received_receives_response_and_calls_callback(
     topic_parts = fake_success_response_topic.split("$")
     key_value_dict = urllib.parse.parse_qs(topic_parts[POS_QUERY_PARAM_PORTION])
     mock_callback.assert_called_once_with(topic_parts[POS_URL_PORTION], key_value_dict, payload)
+
+
+@pytest.mark.it("message received passes the retry-after along with the rid")
+def test_on_provider_message_received_parses_query(request_response_provider):
+    mock_mqtt_state_based_provider = request_response_provider._state_based_provider
+    mock_callback = MagicMock()
+    request_response_provider.send_request(
+        rid=fake_rid, topic=fake_request_topic.format(fake_rid), request=" ", callback=mock_callback
+    )
+    topic = "$dps/registrations/res/429/?$rid={}&retry-after=3".format(fake_rid)
+    mock_mqtt_state_based_provider.on_state_based_provider_message_received(topic, b"")
+
+    mock_callback.assert_called_once_with(
+        "dps/registrations/res/429/?", {"rid": [fake_rid], "retry-after": ["3"]}, ""
+    )
+
+
+@pytest.mark.it("message received ignores responses to unknown or cancelled requests")
+def test_on_provider_message_received_ignores_unknown_rid(request_response_provider):
+    mock_mqtt_state_based_provider = request_response_provider._state_based_provider
+    mock_callback = MagicMock()
+    request_response_provider.send_request(
+        rid=fake_rid, topic=fake_request_topic.format(fake_rid), request=" ", callback=mock_callback
+    )
+    assert request_response_provider.cancel_request(fake_rid)
+    assert not request_response_provider.cancel_request(fake_rid)
+
+    mock_mqtt_state_based_provider.on_state_based_provider_message_received(
+        fake_success_response_topic, b"{}"
+    )
+    assert mock_callback.call_count == 0
+    assert request_response_provider.get_stats()["outstanding"] == 0
+
+
+@pytest.mark.it("message received ignores messages on unexpected topics")
+@pytest.mark.parametrize(
+    "topic", ["$dps/something/else", "$dps/registrations/res/200/", "$dps/registrations/res/200/?"]
+)
+def test_on_provider_message_received_ignores_unexpected_topic(request_response_provider, topic):
+    mock_mqtt_state_based_provider = request_response_provider._state_based_provider
+    mock_mqtt_state_based_provider.on_state_based_provider_message_received(topic, None)
+
+
+@pytest.mark.it("parse_response_topic finds the rid wherever it is in the query")
+@pytest.mark.parametrize(
+    "topic,expected",
+    [
+        (
+            fake_success_response_topic,
+            (fake_rid, "dps/registrations/res/9999/?", "rid=" + fake_rid),
+        ),
+        (
+            "$dps/registrations/res/200/?$rid=1&retry-after=3",
+            ("1", "dps/registrations/res/200/?", "rid=1&retry-after=3"),
+        ),
+        (
+            "$dps/registrations/res/200/?$retry-after=3&rid=1",
+            ("1", "dps/registrations/res/200/?", "retry-after=3&rid=1"),
+        ),
+        ("$iothub/twin/res/200/?$rid=1", None),
+    ],
+)
+def test_parse_response_topic(topic, expected):
+    assert parse_response_topic(topic) == expected
@@ -0,0 +1,109 @@
+# --------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+from azure.iot.device.provisioning.internal.state_machine import TransitionTable
+
+states = ["idle", "running", "done"]
+
+transitions = [
+    {"trigger": "start", "source": "idle", "before": "on_before", "dest": "running"},
+    {"trigger": "finish", "source": "running", "dest": "done", "after": "on_after"},
+    {"trigger": "poke", "source": ["idle", "running"], "dest": None, "after": "on_poke"},
+    {"trigger": "explode", "source": "idle", "dest": "done", "before": "on_explode"},
+]
+
+
+class Model(object):
+    table = TransitionTable(states, transitions)
+    start = table.trigger("start")
+    finish = table.trigger("finish")
+    poke = table.trigger("poke")
+    explode = table.trigger("explode")
+
+    def __init__(self):
+        self.calls = []
+        self.table.initialize(self, "idle")
+
+    def on_before(self, event_data):
+        self.calls.append(("before", self.state, event_data.args, event_data.kwargs))
+        # Fired from inside a callback, so this is queued until start has finished
+        self.finish()
+        self.calls.append(("after finish was fired", self.state))
+
+    def on_after(self, event_data):
+        self.calls.append(("after", event_data.source, self.state))
+
+    def on_poke(self, event_data):
+        self.calls.append(("poke", self.state, event_data.dest))
+
+    def on_explode(self, event_data):
+        self.poke()
+        raise ValueError("boom")
+
+
+@pytest.mark.describe("TransitionTable")
+class TestTransitionTable(object):
+    @pytest.mark.it("starts the model in its initial state")
+    def test_initial_state(self):
+        assert Model().state == "idle"
+
+    @pytest.mark.it("calls before callbacks before and after callbacks after the state changes")
+    def test_callback_order(self):
+        model = Model()
+        model.start(1, key="value")
+        assert model.calls == [
+            ("before", "idle", (1,), {"key": "value"}),
+            ("after finish was fired", "idle"),
+            ("after", "running", "done"),
+        ]
+        assert model.state == "done"
+
+    @pytest.mark.it("runs internal transitions without changing state")
+    def test_internal_transition(self):
+        model = Model()
+        model.poke()
+        assert model.calls == [("poke", "idle", None)]
+        assert model.state == "idle"
+
+    @pytest.mark.it("raises a RuntimeError for a trigger with no transition from the state")
+    def test_invalid_trigger(self):
+        model = Model()
+        with pytest.raises(RuntimeError):
+            model.finish()
+        assert model.state == "idle"
+
+    @pytest.mark.it("drops queued triggers and re-raises when a callback raises")
+    def test_callback_raises(self):
+        model = Model()
+        with pytest.raises(ValueError):
+            model.explode()
+        assert model.state == "idle"
+        assert model.calls == []
+        model.poke()
+        assert model.calls == [("poke", "idle", None)]
+
+    @pytest.mark.it("keeps the state of each model separate")
+    def test_separate_models(self):
+        (first, second) = (Model(), Model())
+        first.start()
+        assert (first.state, second.state) == ("done", "idle")
+
+    @pytest.mark.it("rejects transitions to unknown states and duplicate transitions")
+    @pytest.mark.parametrize(
+        "bad_transitions",
+        [
+            [{"trigger": "go", "source": "idle", "dest": "nowhere"}],
+            [{"trigger": "go", "source": "nowhere", "dest": "idle"}],
+            [
+                {"trigger": "go", "source": "idle", "dest": "done"},
+                {"trigger": "go", "source": ["running", "idle"], "dest": "done"},
+            ],
+        ],
+    )
+    def test_invalid_table(self, bad_transitions):
+        with pytest.raises(ValueError):
+            TransitionTable(states, bad_transitions)
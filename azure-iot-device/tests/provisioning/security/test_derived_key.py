@@ -0,0 +1,73 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import base64
+import hashlib
+import hmac
+import pytest
+from azure.iot.device.provisioning.security.derived_key import (
+    DerivedKeyEngine,
+    derive_device_key,
+)
+
+fake_group_key = base64.b64encode(b"SecretKeeperOfTheChamber").decode("utf-8")
+fake_registration_ids = ["MyPensieve", "MyNimbus2000", "WhompingWillow", "MyPensieve"]
+
+
+def expected_key(group_key, registration_id):
+    signed_hmac = hmac.new(
+        base64.b64decode(group_key), registration_id.encode("utf-8"), hashlib.sha256
+    )
+    return base64.b64encode(signed_hmac.digest()).decode("utf-8")
+
+
+@pytest.mark.describe("DerivedKeyEngine")
+class TestDerivedKeyEngine(object):
+    @pytest.mark.it("Derives the device key as the HMAC-SHA256 of the registration id")
+    def test_derive(self):
+        engine = DerivedKeyEngine(fake_group_key)
+        for registration_id in fake_registration_ids:
+            assert engine.derive(registration_id) == expected_key(fake_group_key, registration_id)
+
+    @pytest.mark.it("Raises ValueError if the group key is not valid base64")
+    def test_invalid_group_key(self):
+        with pytest.raises(ValueError):
+            DerivedKeyEngine("Zm9vYmF")
+
+    @pytest.mark.it("Yields (registration_id, device_key) tuples in order from derive_many")
+    def test_derive_many(self):
+        engine = DerivedKeyEngine(fake_group_key)
+        assert list(engine.derive_many(iter(fake_registration_ids))) == [
+            (registration_id, expected_key(fake_group_key, registration_id))
+            for registration_id in fake_registration_ids
+        ]
+
+    @pytest.mark.it("Derives the same keys in order with a process pool")
+    def test_derive_many_with_processes(self):
+        engine = DerivedKeyEngine(fake_group_key)
+        registration_ids = ["device{}".format(i) for i in range(50)]
+        assert list(engine.derive_many(registration_ids, processes=2, chunk_size=7)) == list(
+            engine.derive_many(registration_ids)
+        )
+
+    @pytest.mark.it("Stops the process pool if the caller stops early")
+    def test_derive_many_closed_early(self):
+        engine = DerivedKeyEngine(fake_group_key)
+        registration_ids = ["device{}".format(i) for i in range(50)]
+        pairs = engine.derive_many(registration_ids, processes=2, chunk_size=7)
+        assert next(pairs) == ("device0", expected_key(fake_group_key, "device0"))
+        pairs.close()
+        with pytest.raises(StopIteration):
+            next(pairs)
+
+
+@pytest.mark.describe("derive_device_key")
+class TestDeriveDeviceKey(object):
+    @pytest.mark.it("Derives the device key for a single registration id")
+    def test_derive_device_key(self):
+        assert derive_device_key(fake_group_key, "MyPensieve") == expected_key(
+            fake_group_key, "MyPensieve"
+        )
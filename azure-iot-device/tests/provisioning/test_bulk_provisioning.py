@@ -0,0 +1,166 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import threading
+import time
+from azure.iot.device.provisioning import register_devices, RegistrationCache
+from azure.iot.device.provisioning.models.registration_result import (
+    RegistrationResult,
+    RegistrationState,
+)
+
+fake_provisioning_host = "hogwarts.azure-devices-provisioning.net"
+fake_id_scope = "Enchanted0000Ceiling7898"
+fake_symmetric_key = "Zm9vYmFy"
+
+
+class FakePollingMachine(object):
+    """Polling machine which finishes registering on another thread after a short delay"""
+
+    active = 0
+    max_active = 0
+    started = []
+    instances = []
+    lock = threading.Lock()
+
+    def __init__(self, state_based_provider):
+        self.registration_id = state_based_provider.registration_id
+        self.on_throttled = None
+        self.cancelled = False
+        FakePollingMachine.instances.append(self)
+
+    def register(self, callback):
+        cls = FakePollingMachine
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            cls.started.append((self.registration_id, time.time()))
+        if self.registration_id == "throttled":
+            self.on_throttled(0.3)
+
+        def finish():
+            with cls.lock:
+                cls.active -= 1
+            if self.registration_id == "broken":
+                callback(None, RuntimeError("Incoming Failure"))
+            else:
+                state = RegistrationState(device_id=self.registration_id, assigned_hub="hub")
+                callback(
+                    RegistrationResult(self.registration_id, "Oper1234", "assigned", state), None
+                )
+
+        if self.registration_id != "slow":
+            threading.Timer(0.01, finish).start()
+
+    def cancel(self, callback=None):
+        self.cancelled = True
+
+
+class FakeProvider(object):
+    def __init__(self, provisioning_host, security_client):
+        self.registration_id = security_client.registration_id
+
+
+@pytest.fixture(autouse=True)
+def fake_polling_machine(mocker):
+    FakePollingMachine.active = 0
+    FakePollingMachine.max_active = 0
+    FakePollingMachine.started = []
+    FakePollingMachine.instances = []
+    mocker.patch(
+        "azure.iot.device.provisioning.bulk_provisioning.StateBasedMQTTProvider", FakeProvider
+    )
+    mocker.patch(
+        "azure.iot.device.provisioning.bulk_provisioning.PollingMachine", FakePollingMachine
+    )
+
+
+def make_devices(count):
+    return [("device{}".format(i), fake_symmetric_key) for i in range(count)]
+
+
+@pytest.mark.describe("register_devices()")
+class TestRegisterDevices(object):
+    @pytest.mark.it("yields a result for every device")
+    def test_results(self):
+        results = list(register_devices(fake_provisioning_host, fake_id_scope, make_devices(50)))
+        assert sorted(r[0] for r in results) == sorted(d[0] for d in make_devices(50))
+        for (registration_id, result, error) in results:
+            assert result.status == "assigned"
+            assert result.request_id == registration_id
+            assert error is None
+
+    @pytest.mark.it("yields the error for registrations that fail")
+    def test_error(self):
+        devices = [("broken", fake_symmetric_key), ("fine", fake_symmetric_key)]
+        results = dict(
+            (r[0], r) for r in register_devices(fake_provisioning_host, fake_id_scope, devices)
+        )
+        assert results["broken"][1] is None
+        assert isinstance(results["broken"][2], RuntimeError)
+        assert results["fine"][1].status == "assigned"
+
+    @pytest.mark.it("has no more than max_concurrency registrations in progress at once")
+    def test_max_concurrency(self):
+        results = list(
+            register_devices(
+                fake_provisioning_host, fake_id_scope, make_devices(40), max_concurrency=4
+            )
+        )
+        assert len(results) == 40
+        assert FakePollingMachine.max_active <= 4
+
+    @pytest.mark.it("starts no more than rate registrations per second")
+    def test_rate(self):
+        list(
+            register_devices(
+                fake_provisioning_host, fake_id_scope, make_devices(6), rate=20, burst=1
+            )
+        )
+        start_times = [t for (_, t) in FakePollingMachine.started]
+        assert start_times[-1] - start_times[0] >= 0.2
+
+    @pytest.mark.it("starts no new registrations until the throttling retry-after has passed")
+    def test_throttled(self):
+        devices = [("throttled", fake_symmetric_key), ("next", fake_symmetric_key)]
+        list(register_devices(fake_provisioning_host, fake_id_scope, devices))
+        start_times = [t for (_, t) in FakePollingMachine.started]
+        assert start_times[1] - start_times[0] >= 0.3
+
+    @pytest.mark.it("cancels registrations still in progress when closed early")
+    def test_close_cancels(self):
+        devices = [("slow", fake_symmetric_key), ("fast", fake_symmetric_key)]
+        results = register_devices(fake_provisioning_host, fake_id_scope, devices)
+        assert next(results)[0] == "fast"
+        results.close()
+        (slow, fast) = FakePollingMachine.instances
+        assert slow.cancelled
+        assert not fast.cancelled
+
+    @pytest.mark.it("yields cached results without registering, and caches new results")
+    def test_cache(self, tmpdir):
+        cache = RegistrationCache(str(tmpdir))
+        list(
+            register_devices(
+                fake_provisioning_host,
+                fake_id_scope,
+                make_devices(3),
+                registration_cache=cache,
+            )
+        )
+        assert len(FakePollingMachine.instances) == 3
+        results = list(
+            register_devices(
+                fake_provisioning_host,
+                fake_id_scope,
+                make_devices(4),
+                registration_cache=cache,
+            )
+        )
+        assert len(FakePollingMachine.instances) == 4
+        assert sorted(r[0] for r in results) == sorted(d[0] for d in make_devices(4))
+        assert cache.get(fake_id_scope, "device0").registration_state.assigned_hub == "hub"
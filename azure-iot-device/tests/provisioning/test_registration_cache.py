@@ -0,0 +1,75 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import os
+import pytest
+from azure.iot.device.provisioning import RegistrationCache
+from azure.iot.device.provisioning.models.registration_result import (
+    RegistrationResult,
+    RegistrationState,
+)
+
+fake_id_scope = "Enchanted0000Ceiling7898"
+fake_registration_id = "MyPensieve"
+fake_device_id = "MyNimbus2000"
+fake_assigned_hub = "Dumbledore'sArmy"
+fake_etag = "HighQualityFlyingBroom"
+
+
+def create_result(status="assigned"):
+    state = RegistrationState(
+        fake_device_id, fake_assigned_hub, "initialAssignment", etag=fake_etag
+    )
+    return RegistrationResult("R1234", "Oper1234", status, registration_state=state)
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return RegistrationCache(str(tmpdir.join("cache")))
+
+
+@pytest.mark.describe("RegistrationCache")
+class TestRegistrationCache(object):
+    @pytest.mark.it("returns None for devices that aren't cached")
+    def test_miss(self, cache):
+        assert cache.get(fake_id_scope, fake_registration_id) is None
+
+    @pytest.mark.it("returns a stored result, including in a new cache on the same directory")
+    def test_round_trip(self, cache):
+        cache.set(fake_id_scope, fake_registration_id, create_result())
+        for c in (cache, RegistrationCache(cache.directory)):
+            result = c.get(fake_id_scope, fake_registration_id)
+            assert result.status == "assigned"
+            assert result.operation_id == "Oper1234"
+            assert result.registration_state.device_id == fake_device_id
+            assert result.registration_state.assigned_hub == fake_assigned_hub
+            assert result.registration_state.etag == fake_etag
+
+    @pytest.mark.it("keys results by ID scope as well as registration ID")
+    def test_keyed_by_scope(self, cache):
+        cache.set(fake_id_scope, fake_registration_id, create_result())
+        assert cache.get("OtherScope", fake_registration_id) is None
+
+    @pytest.mark.it("removes the cached result when a result that isn't assigned is stored")
+    def test_not_assigned(self, cache):
+        cache.set(fake_id_scope, fake_registration_id, create_result())
+        cache.set(fake_id_scope, fake_registration_id, create_result(status="failed"))
+        assert cache.get(fake_id_scope, fake_registration_id) is None
+
+    @pytest.mark.it("removes cached results")
+    def test_remove(self, cache):
+        cache.set(fake_id_scope, fake_registration_id, create_result())
+        cache.remove(fake_id_scope, fake_registration_id)
+        cache.remove(fake_id_scope, fake_registration_id)
+        assert cache.get(fake_id_scope, fake_registration_id) is None
+
+    @pytest.mark.it("treats unreadable entries as missing and leaves no temporary files")
+    def test_corrupt_entry(self, cache):
+        cache.set(fake_id_scope, fake_registration_id, create_result())
+        (entry,) = os.listdir(cache.directory)
+        with open(os.path.join(cache.directory, entry), "w") as f:
+            f.write("{not json")
+        assert cache.get(fake_id_scope, fake_registration_id) is None
@@ -11,6 +11,9 @@ from azure.iot.device.provisioning.sk_provisioning_device_client import (
     SymmetricKeyProvisioningDeviceClient,
 )
 from azure.iot.device.provisioning.models import RegistrationResult
+from azure.iot.device.provisioning.models.registration_result import RegistrationState
+from azure.iot.device.provisioning.registration_cache import RegistrationCache
+from azure.iot.device.provisioning.security.sk_security_client import SymmetricKeySecurityClient
 from azure.iot.device.provisioning.transport.state_based_mqtt_provider import StateBasedMQTTProvider
 
 fake_request_id = "Request1234"
@@ -96,3 +99,57 @@ def test_client_cancel_calls_polling_machine_cancel_with_callback(
     assert isinstance(
         mock_polling_machine_success.cancel.call_args[1]["callback"], types.FunctionType
     )
+
+
+@pytest.mark.it("register returns the result from the polling machine")
+def test_client_register_returns_result(mocker, state_based_mqtt, mock_polling_machine_success):
+    mock_polling_machine_init = mocker.patch(
+        "azure.iot.device.provisioning.sk_provisioning_device_client.PollingMachine"
+    )
+    mock_polling_machine_init.return_value = mock_polling_machine_success
+
+    client = SymmetricKeyProvisioningDeviceClient(state_based_mqtt)
+    assert client.register().operation_id == "Oper1234"
+
+
+class FakePollingMachineAssigned(PollingMachine):
+    def register(self, callback):
+        state = RegistrationState(
+            fake_device_id, fake_assigned_hub, fake_sub_status, etag=fake_etag
+        )
+        callback(RegistrationResult("R1234", "Oper1234", "assigned", state), error=None)
+
+
+@pytest.fixture
+def mock_polling_machine_assigned(mocker):
+    return mocker.MagicMock(wraps=FakePollingMachineAssigned(mocker.MagicMock()))
+
+
+@pytest.fixture
+def cached_client(mocker, tmpdir, mock_polling_machine_assigned):
+    mock_polling_machine_init = mocker.patch(
+        "azure.iot.device.provisioning.sk_provisioning_device_client.PollingMachine"
+    )
+    mock_polling_machine_init.return_value = mock_polling_machine_assigned
+    provider = StateBasedMQTTProvider(
+        "fakehost.com",
+        SymmetricKeySecurityClient(fake_registration_id, fake_symmetric_key, fake_id_scope),
+    )
+    cache = RegistrationCache(str(tmpdir))
+    return SymmetricKeyProvisioningDeviceClient(provider, registration_cache=cache)
+
+
+@pytest.mark.it("register caches the result and returns it without polling next time")
+def test_client_register_uses_cache(cached_client, mock_polling_machine_assigned):
+    cached_client.register()
+    result = cached_client.register()
+    assert mock_polling_machine_assigned.register.call_count == 1
+    assert result.registration_state.assigned_hub == fake_assigned_hub
+    assert result.registration_state.etag == fake_etag
+
+
+@pytest.mark.it("register with use_cache=False re-provisions even if a result is cached")
+def test_client_register_bypasses_cache(cached_client, mock_polling_machine_assigned):
+    cached_client.register()
+    cached_client.register(use_cache=False)
+    assert mock_polling_machine_assigned.register.call_count == 2
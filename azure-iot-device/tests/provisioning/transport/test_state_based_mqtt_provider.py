@@ -0,0 +1,138 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+from mock import MagicMock, patch
+from azure.iot.device.common import sastoken
+from azure.iot.device.common.transport import timer_wheel
+from azure.iot.device.common.transport.mqtt import pipeline_stages_mqtt
+from azure.iot.device.provisioning.security.sk_security_client import SymmetricKeySecurityClient
+from azure.iot.device.provisioning.transport.state_based_mqtt_provider import StateBasedMQTTProvider
+from azure.iot.device.provisioning.transport import constant
+
+fake_symmetric_key = "Zm9vYmFy"
+fake_registration_id = "MyPensieve"
+fake_id_scope = "Enchanted0000Ceiling7898"
+fake_provisioning_host = "hogwarts.com"
+fake_response_topic = "$dps/registrations/res/200/?$rid=Request1234"
+fake_request_topic = constant.PUBLISH_TOPIC_REGISTRATION.format("Request1234")
+
+
+@pytest.fixture
+def security_client():
+    return SymmetricKeySecurityClient(fake_registration_id, fake_symmetric_key, fake_id_scope)
+
+
+@pytest.fixture
+def provider(mocker, security_client):
+    # The tests compare sas tokens, which are renewed with a new expiry time on every request for
+    # one, so the time seen by the tokens is frozen.  The timer wheel thread isn't started, so
+    # nothing runs in the background while the tests drive the pipeline.
+    mocker.patch.object(sastoken, "time").time.return_value = 1000000.0
+    mocker.patch.object(timer_wheel.threading, "Thread")
+    with patch.object(pipeline_stages_mqtt, "MQTTProvider") as mqtt_provider_class:
+        provider = StateBasedMQTTProvider(fake_provisioning_host, security_client)
+    provider.mqtt_provider_class = mqtt_provider_class
+    provider.on_state_based_provider_message_received = MagicMock()
+    return provider
+
+
+def mqtt_provider(provider):
+    return provider._pipeline.provider
+
+
+def connect(provider):
+    mqtt_provider(provider).on_mqtt_connected()
+
+
+def complete(mock_method):
+    mock_method.call_args[1]["callback"]()
+
+
+@pytest.mark.describe("StateBasedMQTTProvider - Instantiation")
+class TestInstantiation(object):
+    @pytest.mark.it("creates an MQTT client for the registration of the security client")
+    def test_connection_args(self, provider):
+        kwargs = provider.mqtt_provider_class.call_args[1]
+        assert kwargs["client_id"] == fake_registration_id
+        assert kwargs["hostname"] == fake_provisioning_host
+        assert kwargs["username"] == (
+            "{}/registrations/{}/api-version={}&ClientVersion={}".format(
+                fake_id_scope,
+                fake_registration_id,
+                constant.API_VERSION,
+                "azure-iot-provisioning-devicesdk%2F0.0.1",
+            )
+        )
+
+
+@pytest.mark.describe("StateBasedMQTTProvider - Requests")
+class TestRequests(object):
+    @pytest.mark.it("connects with the security client's sas token before subscribing")
+    def test_subscribe_connects(self, provider, security_client):
+        callback = MagicMock()
+        provider.subscribe(topic=constant.SUBSCRIBE_TOPIC_PROVISIONING, callback=callback)
+
+        mqtt_provider(provider).connect.assert_called_once_with(
+            security_client.get_current_sas_token()
+        )
+        assert mqtt_provider(provider).subscribe.call_count == 0
+
+        connect(provider)
+        subscribe = mqtt_provider(provider).subscribe
+        assert subscribe.call_args[1]["topic"] == constant.SUBSCRIBE_TOPIC_PROVISIONING
+        assert callback.call_count == 0
+        complete(subscribe)
+        callback.assert_called_once_with()
+
+    @pytest.mark.it("publishes requests and calls the callback once they are acknowledged")
+    def test_publish(self, provider):
+        callback = MagicMock()
+        provider.publish(topic=fake_request_topic, message=" ", callback=callback)
+        connect(provider)
+
+        publish = mqtt_provider(provider).publish
+        assert publish.call_args[1]["topic"] == fake_request_topic
+        assert publish.call_args[1]["payload"] == " "
+        complete(publish)
+        callback.assert_called_once_with()
+
+    @pytest.mark.it("disconnects and calls the callback")
+    def test_disconnect(self, provider):
+        provider.connect()
+        connect(provider)
+        callback = MagicMock()
+        provider.disconnect(callback=callback)
+        mqtt_provider(provider).on_mqtt_disconnected()
+        callback.assert_called_once_with()
+
+    @pytest.mark.it("reports the latency of connect, subscribe and publish")
+    def test_latency_stats(self, provider):
+        provider.subscribe(topic=constant.SUBSCRIBE_TOPIC_PROVISIONING)
+        connect(provider)
+        complete(mqtt_provider(provider).subscribe)
+        provider.publish(topic=fake_request_topic, message=" ")
+        complete(mqtt_provider(provider).publish)
+
+        latencies = provider.get_pipeline_stats()["MeasureLatency"]
+        for op_name in ["Connect", "Subscribe", "Publish"]:
+            assert latencies[op_name]["count"] == 1
+            assert latencies[op_name]["first"] >= 0
+
+
+@pytest.mark.describe("StateBasedMQTTProvider - Responses")
+class TestResponses(object):
+    @pytest.mark.it("passes registration responses to the handler")
+    def test_response(self, provider):
+        mqtt_provider(provider).on_mqtt_message_received(fake_response_topic, b"{}")
+        provider.on_state_based_provider_message_received.assert_called_once_with(
+            fake_response_topic, b"{}"
+        )
+
+    @pytest.mark.it("drops messages on other topics")
+    def test_other_topic(self, provider):
+        mqtt_provider(provider).on_mqtt_message_received("$iothub/methods/POST/x", b"{}")
+        assert provider.on_state_based_provider_message_received.call_count == 0